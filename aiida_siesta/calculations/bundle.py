@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Plugin running many independent siesta runs in a single scheduler job.
+
+Small siesta calculations waste most of their time in the queue of the scheduler. The `SiestaBundleCalculation`
+submits a single job for N runs, each defined by the same inputs of a `SiestaCalculation` (in the namespace
+`runs.<label>`). Each run is prepared in its own subdirectory and the runs are launched by a small bash
+runner (`bundle_runner.sh`) that keeps busy the cores of the allocation, running at the same time as many runs
+as fit in it (`procs_per_run` cores each). Each run is then parsed into its own outputs `runs.<label>`.
+"""
+import shlex
+
+from aiida import orm
+from aiida.common import AttributeDict, CalcInfo
+from aiida.orm import Dict
+
+from aiida_siesta.calculations.siesta import SiestaCalculation
+
+# Inputs of the `SiestaCalculation` that can not be passed to the single runs of a bundle
+BUNDLE_EXCLUDED_INPUTS = ('code', 'metadata', 'parent_calc_folder', 'restart_policy', 'postprocess')
+
+
+def validate_runs(value, _):
+    """
+    Validate the `runs` input namespace: the labels and the inputs of each run.
+    """
+    if not value:
+        return "At least one run must be specified in the `runs` namespace"
+    for label, run_inputs in value.items():
+        if not label.isidentifier() or '__' in label:
+            return f"The label `{label}` of a run is not a valid identifier"
+        excluded = set(BUNDLE_EXCLUDED_INPUTS).intersection(run_inputs)
+        if excluded:
+            return f"The inputs {', '.join(sorted(excluded))} are not allowed for the run `{label}` of a bundle"
+
+
+def validate_inputs(value, _):
+    """
+    Validate the inputs of each run against the specifications of the `SiestaCalculation`.
+    """
+    if 'runs' in value and 'code' in value:
+        spec_inputs = SiestaCalculation.spec().inputs
+        for label, run_inputs in value['runs'].items():
+            error = spec_inputs.validate({**run_inputs, 'code': value['code']})
+            if error is not None:
+                return f"Invalid inputs for the run `{label}`: {error.message}"
+
+
+def get_bundle_runner(tasks, max_parallel):
+    """
+    Return the bash script launching the runs of a bundle, at most `max_parallel` at the same time.
+
+    A new run is launched as soon as a running one ends (with `wait -n`, with a polling fallback for bash
+    versions older than 4.3), therefore runs of different length are packed on the available cores.
+    :param tasks: list of tuples (subdirectory, list of bash lines to execute in the subdirectory).
+    :param max_parallel: the maximum number of runs executed at the same time.
+    """
+    lines = [
+        '#!/bin/bash',
+        f'# Run the {len(tasks)} siesta runs of the bundle, at most {max_parallel} at the same time',
+        '',
+        'wait_for_slot() {',
+        f'    while [ "$(jobs -pr | wc -l)" -ge {max_parallel} ]; do',
+        '        wait -n 2> /dev/null || sleep 1',
+        '    done',
+        '}',
+    ]
+    for subdirectory, commands in tasks:
+        lines += ['', 'wait_for_slot', '(', f'    cd {shlex.quote(subdirectory)} || exit 1']
+        for command in commands:
+            lines += ['    ' + line for line in command.splitlines()]
+        lines.append(') &')
+    lines += ['', 'wait', '']
+
+    return '\n'.join(lines)
+
+
+class SiestaBundleCalculation(SiestaCalculation):
+    """
+    Run many independent siesta calculations, defined by the `runs` namespace, in a single scheduler job.
+
+    The inputs of each run are the ones of a `SiestaCalculation`, except `code` and `metadata` (shared by all
+    the runs), the restart inputs (`parent_calc_folder` and `restart_policy`) and the `postprocess` codes.
+    Only installed codes are supported. The runs are executed in the subdirectories `<label>` of the working directory.
+    """
+
+    # Name of the bash script that launches the runs
+    _BUNDLE_RUNNER = 'bundle_runner.sh'
+
+    @classmethod
+    def define(cls, spec):
+        """
+        Define the process specifications.
+        """
+        # The inputs and outputs of `SiestaCalculation` are not inherited, only its methods
+        super(SiestaCalculation, cls).define(spec)  # pylint: disable=bad-super-call
+
+        spec.input('code', valid_type=orm.Code, help='Input code, shared by all the runs')
+        spec.input_namespace(
+            'runs',
+            valid_type=orm.Data,
+            dynamic=True,
+            validator=validate_runs,
+            help='The inputs of each run, in a namespace named after the label of the run'
+        )
+
+        spec.input('metadata.options.prefix', valid_type=str, default=cls._DEFAULT_PREFIX)
+        spec.input(
+            'metadata.options.procs_per_run',
+            valid_type=int,
+            default=1,
+            help='Number of cores (MPI processes if with MPI) of each run'
+        )
+        spec.inputs['metadata']['options']['input_filename'].default = cls._DEFAULT_INPUT_FILE
+        spec.inputs['metadata']['options']['output_filename'].default = cls._DEFAULT_OUTPUT_FILE
+        spec.inputs['metadata']['options']['parser_name'].default = 'siesta.bundle'
+
+        spec.inputs.validator = validate_inputs
+
+        spec.output_namespace('runs', valid_type=orm.Data, dynamic=True, help='The outputs of each run')
+        spec.output('exit_statuses', valid_type=Dict, help='The exit status of each run (0 if successful)')
+
+        # The exit codes of the single runs, plus the failure of the bundle
+        for label, exit_code in SiestaCalculation.spec().exit_codes.items():
+            spec.exit_code(exit_code.status, label, message=exit_code.message)
+        spec.exit_code(444, 'RUNS_FAILED', message='At least one run of the bundle failed: {labels}')
+
+    def get_run_inputs(self, label):
+        """
+        Return the inputs of the run `label`, with the defaults and the `code` and `metadata` of the bundle.
+        """
+        run_inputs = SiestaCalculation.spec().inputs.pre_process(dict(self.inputs.runs[label]))
+        return AttributeDict({**run_inputs, 'code': self.inputs.code, 'metadata': self.inputs.metadata})
+
+    def get_launcher(self):
+        """
+        Return the list with the command line launching siesta in each run, without the command line parameters.
+
+        It mimics the run line of the job script, with the MPI command of the computer (if with MPI) for
+        `procs_per_run` processes.
+        """
+        code = self.inputs.code
+        computer = self.node.computer
+        options = self.inputs.metadata.options
+
+        with_mpi = getattr(code, 'with_mpi', None)
+        if with_mpi is None:
+            with_mpi = options.withmpi
+        if not with_mpi:
+            return code.get_prepend_cmdline_params() + [str(code.get_executable())]
+
+        scheduler = computer.get_scheduler()
+        resources = dict(options.resources)
+        scheduler.preprocess_resources(resources, computer.get_default_mpiprocs_per_machine())
+        subst_dict = dict(scheduler.create_job_resource(**resources).items())
+        subst_dict['tot_num_mpiprocs'] = options.procs_per_run
+        mpi_args = [arg.format(**subst_dict) for arg in computer.get_mpirun_command()]
+
+        return code.get_prepend_cmdline_params(mpi_args, options.mpirun_extra_params) + [str(code.get_executable())]
+
+    def get_max_parallel(self):
+        """
+        Return the number of runs that fit at the same time in the allocation.
+        """
+        computer = self.node.computer
+        scheduler = computer.get_scheduler()
+        resources = dict(self.inputs.metadata.options.resources)
+        scheduler.preprocess_resources(resources, computer.get_default_mpiprocs_per_machine())
+        tot_num_mpiprocs = scheduler.create_job_resource(**resources).get_tot_num_mpiprocs()
+
+        return max(1, tot_num_mpiprocs // self.inputs.metadata.options.procs_per_run)
+
+    def prepare_for_submission(self, folder):
+        """
+        Create the input files of each run in its subdirectory and the runner launching them.
+
+        :param folder: an `aiida.common.folders.Folder` to temporarily write files on disk
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        code = self.inputs.code
+        launcher = ' '.join(shlex.quote(arg) for arg in self.get_launcher())
+
+        calcinfo = CalcInfo()
+        calcinfo.uuid = str(self.uuid)
+        calcinfo.local_copy_list = []
+        calcinfo.remote_copy_list = []
+        calcinfo.remote_symlink_list = []
+        calcinfo.retrieve_list = []
+        calcinfo.retrieve_temporary_list = []
+        # The runs are launched by the runner, not by the run line of the job script
+        calcinfo.codes_info = []
+
+        tasks = []
+        for label in sorted(self.inputs.runs):
+            run_info = self.prepare_siesta_run(folder.get_subfolder(label, create=True), self.get_run_inputs(label))
+
+            # All the paths of the run are moved in its subdirectory
+            calcinfo.local_copy_list += [
+                (uuid, name, f'{label}/{dest}') for uuid, name, dest in run_info.local_copy_list
+            ]
+            for attribute in ['remote_copy_list', 'remote_symlink_list']:
+                getattr(calcinfo, attribute).extend((computer_uuid, source, f'{label}/{dest}')
+                                                    for computer_uuid, source, dest in getattr(run_info, attribute))
+            for attribute in ['retrieve_list', 'retrieve_temporary_list']:
+                for item in getattr(run_info, attribute):
+                    if isinstance(item, str):
+                        getattr(calcinfo, attribute).append(f'{label}/{item}')
+                    else:
+                        # Keep the subdirectory in the retrieved folder
+                        getattr(calcinfo, attribute).append((f'{label}/{item[0]}', f'{label}/{item[1]}', item[2]))
+
+            code_info = run_info.codes_info[0]
+            run_line = ' '.join([launcher] + [shlex.quote(param) for param in code_info.cmdline_params])
+            commands = [f'{run_line} < {shlex.quote(code_info.stdin_name)} > {shlex.quote(code_info.stdout_name)}']
+            if run_info.append_text:
+                # The compression of the outputs (see the `retrieve_policy` in settings)
+                commands.append(run_info.append_text)
+            tasks.append((label, commands))
+
+        with folder.open(self._BUNDLE_RUNNER, 'w', encoding='utf8') as handle:
+            handle.write(get_bundle_runner(tasks, self.get_max_parallel()))
+
+        # The prepend and append texts of the code are not added by the engine, since no code is in `codes_info`
+        calcinfo.prepend_text = code.prepend_text
+        calcinfo.append_text = '\n\n'.join(
+            text for text in [f'bash {shlex.quote(self._BUNDLE_RUNNER)}', code.append_text] if text
+        )
+
+        return calcinfo
+
+
+class BundleRun:
+    """
+    A run of a finished `SiestaBundleCalculation`, exposing the `outputs` and the exit status as a process node.
+    """
+
+    def __init__(self, node, label):
+        """
+        Construct the run.
+
+        :param node: the `CalcJobNode` of the bundle.
+        :param label: the label of the run.
+        """
+        self.node = node
+        self.label = label
+
+    @property
+    def outputs(self):
+        """
+        The outputs of the run, as an `AttributeDict`.
+        """
+        return AttributeDict(self.node.base.links.get_outgoing().nested().get('runs', {}).get(self.label, {}))
+
+    @property
+    def exit_status(self):
+        """
+        The exit status of the run, the one of the bundle if the run was not parsed.
+        """
+        if 'exit_statuses' in self.node.outputs:
+            return self.node.outputs.exit_statuses.get_dict().get(self.label, self.node.exit_status)
+        return self.node.exit_status
+
+    @property
+    def is_finished_ok(self):
+        """
+        Whether the run finished successfully.
+        """
+        return self.exit_status == 0
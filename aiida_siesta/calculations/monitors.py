@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Monitors of running siesta calculations.
+
+The monitors (available with aiida-core >= 2.3) are called periodically by the engine while a
+`SiestaCalculation` runs. They read the last SCF lines of the .out file in the remote working directory
+and kill the job if the SCF is diverging or stagnating, or if the relaxation is oscillating.
+The files are then retrieved and parsed as usual and the `SiestaParser`, applying the same checks
+to the retrieved .out file, returns a specific exit code (`SCF_DIVERGED` or `GEOM_OSCILLATING`).
+"""
+import shlex
+
+from aiida_siesta.utils.scf_history import check_geometry_oscillation, check_scf_divergence, parse_scf_history
+
+# The header of the SCF lines of modern siesta versions, used if the header is not in the last lines read.
+_DEFAULT_HEADER = 'Eharris(eV) E_KS(eV) FreeEng(eV) dDmax Ef(eV) dHmax(eV)'
+
+# Checks performed by each monitor (identified by the entry point) and exit code returned by the parser
+MONITOR_CHECKS = {
+    'siesta.scf_divergence': (check_scf_divergence, 'SCF_DIVERGED'),
+    'siesta.geometry_oscillation': (check_geometry_oscillation, 'GEOM_OSCILLATING'),
+}
+
+
+def _run_remote(node, transport, command):
+    """
+    Run a command in the remote working directory of `node`, return the stdout or None in case of failure.
+    """
+    workdir = node.get_remote_workdir()
+    if workdir is None:
+        return None
+    retval, stdout, _ = transport.exec_command_wait(f'cd {shlex.quote(workdir)} && {command}')
+    if retval != 0:
+        return None
+    return stdout
+
+
+def _get_remote_history(node, transport, max_lines):
+    """
+    Return the SCF history (see `parse_scf_history`) from the last `max_lines` SCF lines of the remote .out file.
+
+    An empty dictionary is returned if the job already ended (either successfully or with a FATAL message).
+    """
+    from aiida_siesta.calculations.siesta import SiestaCalculation
+
+    messages = _run_remote(node, transport, f'tail -n 5 {SiestaCalculation._MESSAGES_FILE}')  # pylint: disable=protected-access
+    if messages is not None and ('Job completed' in messages or 'FATAL' in messages):
+        return {}
+
+    out_name = node.get_option('output_filename')
+    lines = _run_remote(node, transport, f"grep -E '^ *(iscf|scf:) ' {shlex.quote(out_name)} | tail -n {max_lines}")
+    if not lines:
+        return {}
+
+    return parse_scf_history(lines.encode(), header=_DEFAULT_HEADER)
+
+
+def monitor_scf_divergence(node, transport, min_iterations=20, window=10, max_lines=200):
+    """
+    Kill the job if the SCF cycle is diverging or stagnating.
+
+    The job is killed if, after at least `min_iterations` of the current SCF cycle, the dDmax did not decrease
+    in the last `window` iterations (see `check_scf_divergence`).
+    :param max_lines: the maximum number of SCF lines read from the remote .out file.
+    :return: a `CalcJobMonitorResult` if the job must be killed, None otherwise.
+    """
+    from aiida.engine.processes.calcjobs.monitors import CalcJobMonitorResult
+
+    history = _get_remote_history(node, transport, max(max_lines, min_iterations))
+    message = check_scf_divergence(history, min_iterations=min_iterations, window=window)
+    if message is None:
+        return None
+
+    # The exit code is set by the parser, that repeats the check on the retrieved .out file
+    return CalcJobMonitorResult(message=f'SCF diverging: {message}', override_exit_code=False)
+
+
+def monitor_geometry_oscillation(node, transport, window=8, energy_tolerance=1.e-3, max_lines=5000):
+    """
+    Kill the job if the geometry relaxation is oscillating without lowering the energy.
+
+    See `check_geometry_oscillation` for the meaning of `window` and `energy_tolerance`.
+    :param max_lines: the maximum number of SCF lines read from the remote .out file. It must be large enough
+        to include more than `window` geometry steps.
+    :return: a `CalcJobMonitorResult` if the job must be killed, None otherwise.
+    """
+    from aiida.engine.processes.calcjobs.monitors import CalcJobMonitorResult
+
+    history = _get_remote_history(node, transport, max_lines)
+    message = check_geometry_oscillation(history, window=window, energy_tolerance=energy_tolerance)
+    if message is None:
+        return None
+
+    # The exit code is set by the parser, that repeats the check on the retrieved .out file
+    return CalcJobMonitorResult(message=f'Geometry oscillating: {message}', override_exit_code=False)
+
+
+def get_monitor_failure(node, history):
+    """
+    Return the failure detected by the first siesta monitor of `node` whose check fails on `history`.
+
+    The checks are performed with the same parameters passed to the monitors.
+    :param node: the `CalcJobNode`.
+    :param history: the dictionary returned by `parse_scf_history`.
+    :return: a tuple with the label of the exit code and the message of the check, None if no siesta
+        monitor is used or all the checks pass.
+    """
+    for link in node.base.links.get_incoming(link_label_filter='monitors__%').all():
+        monitor = link.node.get_dict()
+        if monitor.get('entry_point') not in MONITOR_CHECKS:
+            continue
+        check, label = MONITOR_CHECKS[monitor['entry_point']]
+        kwargs = {key: value for key, value in monitor.get('kwargs', {}).items() if key != 'max_lines'}
+        message = check(history, **kwargs)
+        if message is not None:
+            return label, message
+
+    return None
@@ -11,8 +11,23 @@ from aiida.engine import CalcJob
 from aiida.orm import ArrayData, BandsData, Dict, StructureData
 from aiida_pseudo.data.pseudo.psf import PsfData
 from aiida_pseudo.data.pseudo.psml import PsmlData
-
+import numpy as np
+
+from aiida_siesta.calculations.stm import (
+    get_stm_postprocess_command,
+    validate_mode,
+    validate_postprocess,
+    validate_spin,
+)
 from aiida_siesta.data.ion import IonData
+from aiida_siesta.utils.pseudo_cache import get_cache_filename, get_cached_md5s
+from aiida_siesta.utils.retrieve_policy import (
+    COMPRESSED_LABELS,
+    COMPRESSORS,
+    get_compress_command,
+    get_temporary_labels,
+    validate_retrieve_policy,
+)
 from aiida_siesta.utils.tkdict import FDFDict
 
 # See the LICENSE.txt and AUTHORS.txt files.
@@ -24,6 +39,32 @@ from aiida_siesta.utils.tkdict import FDFDict
 ###################################################################################
 
 
+def append_floating_sites(structure, floating):
+    """
+    Append the floating sites to an unstored structure.
+
+    All the sites are appended at once, instead of calling `append_atom` for each of them.
+    :param structure: an unstored StructureData, it is modified in place.
+    :param floating: the list of floating sites, as in the `floating_sites` of the basis input.
+    :raise ValueError: if a floating site has the same name of a kind with different symbols.
+    """
+    from aiida.orm.nodes.data.structure import Kind
+
+    kinds = {kind.name: kind for kind in structure.kinds}
+    new_sites = []
+    for item in floating:
+        kind = Kind(symbols=item["symbols"], name=item["name"])
+        if item["name"] not in kinds:
+            kinds[item["name"]] = kind
+            structure.append_kind(kind)
+        elif not kinds[item["name"]].compare_with(kind)[0]:
+            raise ValueError(f'Floating sites with the same name {item["name"]} but different properties')
+        new_sites.append({'position': [float(coord) for coord in item["position"]], 'kind_name': item["name"]})
+
+    # A single update of the attribute, that is validated only once
+    structure.base.attributes.set('sites', structure.base.attributes.get('sites', []) + new_sites)
+
+
 def internal_structure(structure, basis_dict=None):
     """
     Add the floating sites to the structure if necessary.
@@ -44,14 +85,36 @@ def internal_structure(structure, basis_dict=None):
         floating = basis_dict.get('floating_sites', None)
         if floating is not None:
             original_kind_names = [kind.name for kind in structure.kinds]
-            for item in floating:
-                if item["name"] in original_kind_names:
-                    return None
-                tweaked.append_atom(position=item["position"], symbols=item["symbols"], name=item["name"])
+            if any(item["name"] in original_kind_names for item in floating):
+                return None
+            append_floating_sites(tweaked, floating)
 
     return tweaked
 
 
+def get_atomic_positions_card(structure, species_index):
+    """
+    Return the atomiccoordinatesandatomicspecies block for the structure.
+
+    Positions and kind names are read directly from the attributes of the structure (no `Site` object
+    is created) and each line is produced with a single %-formatting operation.
+    :param structure: a StructureData.
+    :param species_index: a dictionary with the index of the species (value) for each kind name (key).
+    """
+    raw_sites = structure.base.attributes.get('sites', [])
+    kind_names = [site['kind_name'] for site in raw_sites]
+    # Columns of the block
+    coordinates = np.array([site['position'] for site in raw_sites], dtype=float).reshape(-1, 3).T.tolist()
+    indices = [species_index[name] for name in kind_names]
+    labels = [name.rjust(6) for name in kind_names]
+    line_format = "%18.10f %18.10f %18.10f %4d %6s %6d\n"
+    lines = map(line_format.__mod__, zip(*coordinates, indices, labels, range(1, len(raw_sites) + 1)))
+
+    return "%block atomiccoordinatesandatomicspecies\n" + "".join(
+        lines
+    ) + "%endblock atomiccoordinatesandatomicspecies\n"
+
+
 def validate_optical(value, _):
     """
     Validate the optical input.
@@ -184,6 +247,44 @@ def bandskpoints_warnings(value):
                         break
 
 
+def validate_settings(value, _):
+    """
+    Validate the settings input, in particular the options of the parsing pool, the pseudo cache and retrieval.
+    """
+    if value:
+        settings_dict = {str(k).upper(): v for (k, v) in value.get_dict().items()}
+        if "PARSER_WORKERS" in settings_dict:
+            workers = settings_dict["PARSER_WORKERS"]
+            if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+                return "The `parser_workers` in settings must be a positive integer"
+        if "PARSER_POOL" in settings_dict:
+            if settings_dict["PARSER_POOL"] not in ["thread", "process"]:
+                return "The `parser_pool` in settings must be `thread` or `process`"
+        if "PSEUDO_CACHE" in settings_dict:
+            if not isinstance(settings_dict["PSEUDO_CACHE"], str) or not os.path.isabs(settings_dict["PSEUDO_CACHE"]):
+                return "The `pseudo_cache` in settings must be an absolute path"
+        if "RETRIEVE_POLICY" in settings_dict:
+            return validate_retrieve_policy(settings_dict["RETRIEVE_POLICY"])
+
+
+def validate_restart_policy(value, _):
+    """
+    Validate the restart_policy input.
+    """
+    if value:
+        policy = value.get_dict()
+        unknown = set(policy) - {'symlink', 'extra_files', 'skip_other_computer'}
+        if unknown:
+            return f"Unknown keys in `restart_policy`: {', '.join(sorted(unknown))}"
+        for key in ['symlink', 'skip_other_computer']:
+            if key in policy and not isinstance(policy[key], bool):
+                return f"The `{key}` of the `restart_policy` must be a boolean"
+        extra_files = policy.get('extra_files', [])
+        allowed = SiestaCalculation._restart_extra_files  # pylint: disable=protected-access
+        if not isinstance(extra_files, list) or not set(extra_files).issubset(allowed):
+            return f"The `extra_files` of the `restart_policy` must be a list of extensions among {', '.join(allowed)}"
+
+
 def validate_inputs(value, _):
     """
     Validate the entire input namespace.
@@ -222,6 +323,21 @@ def validate_inputs(value, _):
             )
             return string_out
 
+    error = validate_postprocess(value)
+    if error is not None:
+        return error
+
+    # The pseudo cache is a directory of the computer of the code, that portable codes do not have
+    if 'settings' in value and 'code' in value and value['code'].computer is None:
+        if any(str(key).upper() == 'PSEUDO_CACHE' for key in value['settings'].get_dict()):
+            return "The `pseudo_cache` in settings requires a code installed on a computer (`InstalledCode`)"
+
+    if 'parent_calc_folder' in value and 'restart_policy' in value:
+        computer = value['code'].computer
+        if not value['restart_policy'].get_dict().get('skip_other_computer', True) and computer is not None:
+            if value['parent_calc_folder'].computer.uuid != computer.uuid:
+                return "The `parent_calc_folder` is on a different computer and `skip_other_computer` is False"
+
 
 class SiestaCalculation(CalcJob):
     """
@@ -233,6 +349,8 @@ class SiestaCalculation(CalcJob):
     _MESSAGES_FILE = 'MESSAGES'
     _BASIS_ENTHALPY_FILE = 'BASIS_ENTHALPY'
     _HARRIS_ENTHALPY_FILE = 'BASIS_HARRIS_ENTHALPY'
+    _STM_INPUT_FILE = 'stm.in'
+    _STM_OUTPUT_FILE = 'stm.out'
 
     # Class attributes: default of the input.spec...just default, but user could change the name
     _DEFAULT_PREFIX = 'aiida'
@@ -245,6 +363,10 @@ class SiestaCalculation(CalcJob):
     # Class attribute: in restarts, it will copy the previous elements in the following folder
     _restart_copy_to = './'
 
+    # Class attribute: additional files that can be transferred from the parent (see the `restart_policy` input)
+    # and the fdf flag, if any, that instructs siesta to read them
+    _restart_extra_files = {'XV': 'md-use-save-xv', 'CG': 'md-use-save-cg', 'LBFGS': None, 'HSX': None}
+
     # Class attribute: blocked keywords
     _readable_blocked = [
         'system-name',
@@ -264,7 +386,7 @@ class SiestaCalculation(CalcJob):
     _aiida_blocked_keywords = [FDFDict.translate_key(key) for key in _readable_blocked]
 
     @classmethod
-    def define(cls, spec):
+    def define(cls, spec):  # pylint: disable=too-many-statements
         """
         Define the process specifications.
         """
@@ -291,9 +413,16 @@ class SiestaCalculation(CalcJob):
             validator=validate_bandskpoints
         )
         spec.input('basis', valid_type=orm.Dict, help='Input basis', required=False, validator=validate_basis)
-        spec.input('settings', valid_type=orm.Dict, help='Input settings', required=False)
+        spec.input('settings', valid_type=orm.Dict, help='Input settings', required=False, validator=validate_settings)
         spec.input('parameters', valid_type=orm.Dict, help='Input parameters', validator=validate_parameters)
         spec.input('parent_calc_folder', valid_type=orm.RemoteData, required=False, help='Parent folder')
+        spec.input(
+            'restart_policy',
+            valid_type=orm.Dict,
+            required=False,
+            validator=validate_restart_policy,
+            help='How the files of the `parent_calc_folder` are transferred'
+        )
         spec.input_namespace(
             'pseudos',
             valid_type=(PsfData, PsmlData),
@@ -314,6 +443,34 @@ class SiestaCalculation(CalcJob):
         spec.input('lua.retrieve_list', valid_type=orm.List, required=False)
         spec.input('lua.md_run', valid_type=orm.Bool, default=lambda: orm.Bool(True), required=False)
 
+        # Input namespace for the post-processing codes of the siesta distribution, run in the same job after siesta.
+        # For the moment only plstm is supported, it produces a simulated STM image from the .LDOS file.
+        spec.input_namespace(
+            'postprocess', help='Post-processing codes run after siesta in the same job', required=False
+        )
+        spec.input_namespace('postprocess.stm', help='The plstm run, on the .LDOS file', required=False)
+        spec.input('postprocess.stm.code', valid_type=orm.Code, required=False, help='The plstm code')
+        spec.input(
+            'postprocess.stm.mode',
+            valid_type=orm.Str,
+            required=False,
+            help='Allowed values are "constant-height" or "constant-current"',
+            validator=validate_mode
+        )
+        spec.input(
+            'postprocess.stm.value',
+            valid_type=orm.Float,
+            required=False,
+            help='Value of height in Ang or value of current in e/bohr**3'
+        )
+        spec.input(
+            'postprocess.stm.spin_option',
+            valid_type=orm.Str,
+            required=False,
+            help='Spin option follows plstm sintax: "q" no spin, "s" total spin, "x","y","z" the three spin components',
+            validator=validate_spin
+        )
+
         # Metadada.options host the inputs that are not stored as a separate node, but attached to `CalcJobNode`
         # as attributes. They are optional, since a default is specified, but they might be changed by the user.
         # The first one is siesta specific. The others are defined in the CalcJob, here we change the default.
@@ -331,7 +488,10 @@ class SiestaCalculation(CalcJob):
         spec.output('bands', valid_type=BandsData, required=False, help='Optional band structure')
         spec.output('forces_and_stress', valid_type=ArrayData, required=False, help='Optional forces and stress')
         spec.output('optical_eps2', valid_type=ArrayData, required=False, help='Optional eps2 optical data')
+        spec.output('timing_profile', valid_type=ArrayData, required=False, help='Optional complete timing profile')
+        spec.output('scf_history', valid_type=ArrayData, required=False, help='Optional history of the scf cycles')
         spec.output_namespace('ion_files', valid_type=IonData, dynamic=True, required=False)
+        spec.output('stm_array', valid_type=ArrayData, required=False, help='Optional STM image of `postprocess.stm`')
 
         # Option that allows access through node.res should be existing output node and a Dict
         spec.default_output_node = 'output_parameters'
@@ -340,13 +500,22 @@ class SiestaCalculation(CalcJob):
         spec.exit_code(453, 'BANDS_PARSE_FAIL', message='Failure while parsing the bands file')
         spec.exit_code(452, 'BANDS_FILE_NOT_PRODUCED', message='Bands analysis was requested, but file is not present')
         spec.exit_code(454, 'EPS2_FILE_NOT_PRODUCED', message='Optical calculation requested, but file is not present')
+        spec.exit_code(
+            455, 'STM_FILE_NOT_PRODUCED', message='The plstm run was requested, but .STM file is not present'
+        )
+        spec.exit_code(456, 'STM_PARSE_FAIL', message='Failure while parsing the .STM file of the plstm run')
         spec.exit_code(450, 'SCF_NOT_CONV', message='Calculation did not reach scf convergence!')
         spec.exit_code(451, 'GEOM_NOT_CONV', message='Calculation did not reach geometry convergence!')
         spec.exit_code(350, 'UNEXPECTED_TERMINATION', message='Statement "Job completed" not detected, unknown error')
         spec.exit_code(449, 'SPLIT_NORM', message='Split_norm parameter too small')
         spec.exit_code(448, 'BASIS_POLARIZ', message='Problems in the polarization of a basis element')
+        spec.exit_code(447, 'MEMORY_ALLOCATION_FAIL', message='Siesta failed to allocate memory')
+        spec.exit_code(446, 'SCF_DIVERGED', message='The job was stopped by a monitor because the scf was diverging')
+        spec.exit_code(
+            445, 'GEOM_OSCILLATING', message='The job was stopped by a monitor because the relaxation was oscillating'
+        )
 
-    def initialize(self):
+    def initialize(self, inputs=None):
         """
         Apply some initialization (called at the beginning of `prepare_for_submission`).
 
@@ -356,7 +525,7 @@ class SiestaCalculation(CalcJob):
         4) Checks whether info on basis and pseudos are passed directly as ion files,
            in that case, cancel any info passed in the basis input.
         """
-        value = self.inputs
+        value = self.inputs if inputs is None else inputs
 
         structure = internal_structure(value["structure"])
         floating_species_names = []
@@ -366,9 +535,8 @@ class SiestaCalculation(CalcJob):
             basis_dict = value["basis"].get_dict()
             floating = basis_dict.pop('floating_sites', None)
             if floating is not None:
-                for item in floating:
-                    structure.append_atom(position=item["position"], symbols=item["symbols"], name=item["name"])
-                    floating_species_names.append(item["name"])
+                append_floating_sites(structure, floating)
+                floating_species_names = [item["name"] for item in floating]
 
         if 'ions' in value:
             basis_dict = None
@@ -378,54 +546,66 @@ class SiestaCalculation(CalcJob):
 
         return structure, basis_dict, floating_species_names, ion_or_pseudo
 
-    def prepare_for_submission(self, folder):  # pylint: disable=too-many-statements,too-many-locals,too-many-branches
+    def prepare_for_submission(self, folder):
         """
         Create the input files from the input nodes passed to this instance of the `CalcJob`.
 
         :param folder: an `aiida.common.folders.Folder` to temporarily write files on disk
         :return: `aiida.common.datastructures.CalcInfo` instance
         """
+        return self.prepare_siesta_run(folder, self.inputs)
+
+    def prepare_siesta_run(self, folder, inputs):  # pylint: disable=too-many-statements,too-many-locals,too-many-branches
+        """
+        Write in `folder` the input files of a siesta run defined by `inputs`.
+
+        The `inputs` are those of a `SiestaCalculation`, they are the inputs of this instance except
+        for the runs of a `SiestaBundleCalculation`.
+        :param folder: an `aiida.common.folders.Folder` to temporarily write files on disk
+        :param inputs: the mapping with the (validated) inputs of the run
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
 
         # ============================ Initializations =============================
         # All input ports are validated, here asses their presence in case optional.
 
-        code = self.inputs.code
+        code = inputs.code
 
         # self.initialize preprocess structure and basis. Decides whether use ions or pseudos
-        structure, basis_dict, floating_species_names, ion_or_pseudo_str = self.initialize()
+        structure, basis_dict, floating_species_names, ion_or_pseudo_str = self.initialize(inputs)
 
-        ion_or_pseudo = self.inputs[ion_or_pseudo_str]
+        ion_or_pseudo = inputs[ion_or_pseudo_str]
 
-        parameters = self.inputs.parameters
+        parameters = inputs.parameters
 
-        if 'kpoints' in self.inputs:
-            kpoints = self.inputs.kpoints
+        if 'kpoints' in inputs:
+            kpoints = inputs.kpoints
         else:
             kpoints = None
 
         # As internal convention, the keys of the settings dict are uppercase
-        if 'settings' in self.inputs:
-            settings = self.inputs.settings.get_dict()
+        if 'settings' in inputs:
+            settings = inputs.settings.get_dict()
             settings_dict = {str(k).upper(): v for (k, v) in settings.items()}
         else:
             settings_dict = {}
 
-        if 'bandskpoints' in self.inputs:
-            bandskpoints = self.inputs.bandskpoints
+        if 'bandskpoints' in inputs:
+            bandskpoints = inputs.bandskpoints
         else:
             bandskpoints = None
 
-        if 'optical' in self.inputs:
-            optical = self.inputs.optical
+        if 'optical' in inputs:
+            optical = inputs.optical
         else:
             optical = None
 
-        if 'parent_calc_folder' in self.inputs:
-            parent_calc_folder = self.inputs.parent_calc_folder
+        if 'parent_calc_folder' in inputs:
+            parent_calc_folder = inputs.parent_calc_folder
         else:
             parent_calc_folder = None
 
-        lua_inputs = self.inputs.lua
+        lua_inputs = inputs.lua
 
         if 'script' in lua_inputs:
             lua_script = lua_inputs.script
@@ -455,15 +635,18 @@ class SiestaCalculation(CalcJob):
         # List of files for restart
         remote_copy_list = []
 
+        # List of files to symlink from the remote computer, e.g. cached pseudo files
+        remote_symlink_list = []
+
         # ================ Preprocess of input parameters =================
 
         input_params = FDFDict(parameters.get_dict())
-        input_params.update({'system-name': self.inputs.metadata.options.prefix})
-        input_params.update({'system-label': self.inputs.metadata.options.prefix})
+        input_params.update({'system-name': inputs.metadata.options.prefix})
+        input_params.update({'system-label': inputs.metadata.options.prefix})
         input_params.update({'use-tree-timer': 'T'})
         input_params.update({'xml-write': 'T'})
         input_params.update({'number-of-species': len(structure.kinds)})
-        input_params.update({'number-of-atoms': len(structure.sites)})
+        input_params.update({'number-of-atoms': len(structure.base.attributes.get('sites', []))})
         input_params.update({'geometry-must-converge': 'T'})
         input_params.update({'lattice-constant': '1.0 Ang'})
         input_params.update({'atomic-coordinates-format': 'Ang'})
@@ -496,6 +679,9 @@ class SiestaCalculation(CalcJob):
         cell_parameters_card += "%endblock lattice-vectors\n"
 
         # ----------------------------ATOMIC_SPECIES & PSEUDOS/IONS-------------------------------
+        # Opt-in remote cache of pseudos/ions, see `aiida_siesta.utils.pseudo_cache`
+        pseudo_cache = settings_dict.get('PSEUDO_CACHE')
+        cached_md5s = get_cached_md5s(code.computer, pseudo_cache) if pseudo_cache else set()
         atomic_species_card_list = []
         # Dictionary to get the atomic number of a given element
         datmn = {v['symbol']: k for k, v in elements.items()}
@@ -517,13 +703,18 @@ class SiestaCalculation(CalcJob):
             # and once as 'C_surf.psf'. This is required by Siesta.
             # It is passed as list of tuples with format ('node_uuid', 'filename', 'relativedestpath').
             # Since no subfolder is present in Siesta for pseudos, filename == relativedestpath.
-            if isinstance(psp_or_ion, IonData):
+            # If the file is in the remote cache, it is instead symlinked.
+            if psp_or_ion.md5 in cached_md5s:
+                cache_name = get_cache_filename(psp_or_ion)
+                file_name = kind.name + os.path.splitext(cache_name)[1]
+                remote_symlink_list.append((code.computer.uuid, os.path.join(pseudo_cache, cache_name), file_name))
+            elif isinstance(psp_or_ion, IonData):
                 file_name = kind.name + ".ion"
                 with folder.open(file_name, 'w', encoding='utf8') as handle:
-                    handle.write(psp_or_ion.get_content_ascii_format())
-            if isinstance(psp_or_ion, PsfData):
+                    psp_or_ion.write_content_ascii_format(handle)
+            elif isinstance(psp_or_ion, PsfData):
                 local_copy_list.append((psp_or_ion.uuid, psp_or_ion.filename, kind.name + ".psf"))
-            if isinstance(psp_or_ion, PsmlData):
+            elif isinstance(psp_or_ion, PsmlData):
                 local_copy_list.append((psp_or_ion.uuid, psp_or_ion.filename, kind.name + ".psml"))
         atomic_species_card_list = (["%block chemicalspecieslabel\n"] + list(atomic_species_card_list))
         atomic_species_card = "".join(atomic_species_card_list)
@@ -532,18 +723,7 @@ class SiestaCalculation(CalcJob):
         del atomic_species_card_list
 
         # -------------------------------------- ATOMIC_POSITIONS -----------------------------------
-        atomic_positions_card_list = ["%block atomiccoordinatesandatomicspecies\n"]
-        countatm = 0
-        for site in structure.sites:
-            countatm += 1
-            sipo = site.position
-            kind = site.kind_name
-            atomic_positions_card_list.append(
-                f"{sipo[0]:18.10f} {sipo[1]:18.10f} {sipo[2]:18.10f} {spind[kind]:4} {kind.rjust(6):6} {countatm:6}\n"
-            )
-        atomic_positions_card = "".join(atomic_positions_card_list)
-        del atomic_positions_card_list  # Free memory
-        atomic_positions_card += "%endblock atomiccoordinatesandatomicspecies\n"
+        atomic_positions_card = get_atomic_positions_card(structure, spind)
 
         # --------------------------------------- K-POINTS ----------------------------------------
         # It is optional, if not specified, gamma point only is performed (default of siesta)
@@ -611,21 +791,35 @@ class SiestaCalculation(CalcJob):
         # ================================= Operations for restart =================================
         # The presence of a 'parent_calc_folder' input node signals that we want to
         # get something from there, as indicated in the self._restart_copy_from attribute.
-        # In Siesta's case, for now, just the density-matrix file is copied
-        # to the current calculation's working folder.
-        # ISSUE: Is this mechanism flexible enough? An alternative would be to
-        # pass the information about which file(s) to copy in the metadata.options dictionary
+        # In Siesta's case, by default, just the density-matrix file is copied
+        # to the current calculation's working folder. The `restart_policy` input allows to
+        # symlink instead of copying and to also transfer the files in self._restart_extra_files.
+        # Glob patterns are used, therefore files missing in the parent folder are simply ignored.
         if parent_calc_folder is not None:
-            remote_copy_list.append((
-                parent_calc_folder.computer.uuid,
-                os.path.join(parent_calc_folder.get_remote_path(), self._restart_copy_from), self._restart_copy_to
-            ))
-            input_params.update({'dm-use-save-dm': "T"})
+            restart_policy = inputs.restart_policy.get_dict() if 'restart_policy' in inputs else {}
+            if parent_calc_folder.computer.uuid != self.node.computer.uuid:
+                # Remote copies among different computers are not possible, siesta will start from scratch
+                self.report(
+                    f'The parent_calc_folder is on computer {parent_calc_folder.computer.label}, '
+                    'the restart files are not transferred'
+                )
+            else:
+                restart_list = remote_symlink_list if restart_policy.get('symlink', False) else remote_copy_list
+                restart_files = [(self._restart_copy_from, 'dm-use-save-dm')]
+                for extension in restart_policy.get('extra_files', []):
+                    restart_files.append((os.path.join('./', f'*.{extension}'), self._restart_extra_files[extension]))
+                for pattern, flag in restart_files:
+                    restart_list.append((
+                        parent_calc_folder.computer.uuid, os.path.join(parent_calc_folder.get_remote_path(),
+                                                                       pattern), self._restart_copy_to
+                    ))
+                    if flag is not None:
+                        input_params.update({flag: "T"})
 
         # ===================================== FDF file creation ====================================
 
         # To have easy access to inputs metadata options
-        metadataoption = self.inputs.metadata.options
+        metadataoption = inputs.metadata.options
 
         # input_filename = self.inputs.metadata.options.input_filename
         input_filename = folder.get_abs_path(metadataoption.input_filename)
@@ -693,31 +887,65 @@ class SiestaCalculation(CalcJob):
         calcinfo.uuid = str(self.uuid)
         calcinfo.local_copy_list = local_copy_list
         calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
         calcinfo.codes_info = [codeinfo]
         # Retrieve by default: the output file, the xml file, the messages file, and the json timing file.
         # If bandskpoints, also the bands file is added to the retrieve list.
         # If getting optical props, also the .EPSIMG file is added.
-        calcinfo.retrieve_list = []
+        # The `retrieve_policy` in settings might move some of them to the temporary retrieve list
+        # and might request the compression of the large ones at the end of the job.
         xml_file = str(metadataoption.prefix) + ".xml"
         bands_file = str(metadataoption.prefix) + ".bands"
         eps2_file = str(metadataoption.prefix) + ".EPSIMG"
 
-        calcinfo.retrieve_list.append(metadataoption.output_filename)
-        calcinfo.retrieve_list.append(xml_file)
-        calcinfo.retrieve_list.append(self._JSON_FILE)
-        calcinfo.retrieve_list.append(self._MESSAGES_FILE)
-        calcinfo.retrieve_list.append(self._BASIS_ENTHALPY_FILE)
-        calcinfo.retrieve_list.append(self._HARRIS_ENTHALPY_FILE)
-        calcinfo.retrieve_list.append("*.ion.xml")
+        parsed_files = [
+            ('output', metadataoption.output_filename),
+            ('xml', xml_file),
+            ('json', self._JSON_FILE),
+            ('messages', self._MESSAGES_FILE),
+            ('enthalpies', self._BASIS_ENTHALPY_FILE),
+            ('enthalpies', self._HARRIS_ENTHALPY_FILE),
+            ('ions', "*.ion.xml"),
+        ]
 
         if bandskpoints is not None:
-            calcinfo.retrieve_list.append(bands_file)
+            parsed_files.append(('bands', bands_file))
 
         if optical is not None:
-            calcinfo.retrieve_list.append(eps2_file)
+            parsed_files.append(('eps2', eps2_file))
+
+        # ========================== Post-processing codes ============================
+        # They run after siesta in the same job, directly on the files written by siesta
+        # (for plstm, the .LDOS file), so no other job and no remote copy are needed.
+        postprocess_commands = []
+        stm_inputs = inputs.get('postprocess', {}).get('stm', {})
+        if stm_inputs:
+            postprocess_commands.append(
+                get_stm_postprocess_command(
+                    folder, stm_inputs, str(metadataoption.prefix), self._STM_INPUT_FILE, self._STM_OUTPUT_FILE
+                )
+            )
+            parsed_files.append(('stm', self._STM_OUTPUT_FILE))
+            parsed_files.append(('stm', "*.STM"))
+
+        retrieve_policy = settings_dict.pop('RETRIEVE_POLICY', {})
+        temporary_labels = get_temporary_labels(retrieve_policy)
+        compression = retrieve_policy.get('compress')
 
+        calcinfo.retrieve_list = []
+        calcinfo.retrieve_temporary_list = []
+        compressed_files = []
+        for label, file_name in parsed_files:
+            retrieve_list = calcinfo.retrieve_temporary_list if label in temporary_labels else calcinfo.retrieve_list
+            retrieve_list.append(file_name)
+            if compression is not None and label in COMPRESSED_LABELS:
+                # The uncompressed file is still retrieved, in case the compression did not take place
+                retrieve_list.append(file_name + COMPRESSORS[compression][1])
+                compressed_files.append(file_name)
+
+        additional_retrieve_list = []
         if lua_retrieve_list is not None:
-            calcinfo.retrieve_list += lua_retrieve_list.get_list()
+            additional_retrieve_list += lua_retrieve_list.get_list()
 
         # If we ever want to avoid having the config.lua file in the repository,
         # since the information is already in the lua_parameters dictionary:
@@ -725,8 +953,22 @@ class SiestaCalculation(CalcJob):
         #    calcinfo.provenance_exclude_list = ['config.lua']
 
         # Any other files specified in the settings dictionary
-        settings_retrieve_list = settings_dict.pop('ADDITIONAL_RETRIEVE_LIST', [])
-        calcinfo.retrieve_list += settings_retrieve_list
+        additional_retrieve_list += settings_dict.pop('ADDITIONAL_RETRIEVE_LIST', [])
+
+        calcinfo.retrieve_list += additional_retrieve_list
+        if compression is not None and retrieve_policy.get('compress_additional', False):
+            # Only plain names and glob patterns, not the (remote, local, depth) tuples
+            for file_name in additional_retrieve_list:
+                if isinstance(file_name, str):
+                    calcinfo.retrieve_list.append(file_name + COMPRESSORS[compression][1])
+                    compressed_files.append(file_name)
+
+        # The post-processing codes run before the compression of the outputs
+        append_texts = list(postprocess_commands)
+        if compressed_files:
+            append_texts.append(get_compress_command(compressed_files, compression))
+        if append_texts:
+            calcinfo.append_text = '\n\n'.join(append_texts)
 
         return calcinfo
 
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 """
 Plugin for the plstm executable of the siesta distribution.
+
+It also hosts the tools to run plstm in the same job of siesta (`postprocess.stm` inputs of the `SiestaCalculation`).
 """
 import os
+import shlex
 
 from aiida import orm
 from aiida.common import CalcInfo, CodeInfo
 from aiida.engine import CalcJob
 from aiida.orm import ArrayData, Dict
 
+from aiida_siesta.utils.retrieve_policy import COMPRESSORS, get_compress_command, validate_retrieve_policy
+from aiida_siesta.utils.tkdict import FDFDict
+
 # See the LICENSE.txt and AUTHORS.txt files.
 
 
@@ -32,6 +38,111 @@ def validate_spin(value, _):
             return f"The allowed options for the port 'spin_option' are {allowedspins}."
 
 
+def validate_settings(value, _):
+    """
+    Validate settings input port, in particular the `retrieve_policy` (only `compress` is used).
+    """
+    if value:
+        settings_dict = {str(k).upper(): v for (k, v) in value.get_dict().items()}
+        if "RETRIEVE_POLICY" in settings_dict:
+            return validate_retrieve_policy(settings_dict["RETRIEVE_POLICY"])
+
+
+def get_stm_value(mode, value):
+    """
+    Return the value of the plstm run: the height converted from Ang to bohr or the current (e/bohr**3).
+    """
+    if mode == "constant-height":
+        return value / 0.529177
+    return value
+
+
+def get_stm_input(prefix, mode, value):
+    """
+    Return the content of the input file of plstm, only necessary for the old versions of plstm.
+
+    :param prefix: the prefix of the siesta run that produced the .LDOS file.
+    :param mode: "constant-height" or "constant-current".
+    :param value: the value of height in Ang or the value of current in e/bohr**3.
+    """
+    return f"{prefix}\nldos\n{mode}\n{get_stm_value(mode, value):.5f}\nunformatted\n"
+
+
+def get_stm_cmdline(prefix, mode, value, spin_option):
+    """
+    Return the command line parameters of plstm, used by the new versions of plstm.
+
+    :param prefix: the prefix of the siesta run that produced the .LDOS file.
+    :param mode: "constant-height" or "constant-current".
+    :param value: the value of height in Ang or the value of current in e/bohr**3.
+    :param spin_option: the plstm spin option, "q", "s", "x", "y" or "z".
+    """
+    flag = '-z' if mode == "constant-height" else '-i'
+    cmdline_params = [flag, f'{get_stm_value(mode, value):.5f}']
+    if spin_option != "q":
+        cmdline_params += ['-s', str(spin_option)]
+
+    return cmdline_params + [prefix + ".LDOS"]
+
+
+def get_serial_command(code, cmdline_params, stdin_name, stdout_name):
+    """
+    Return the bash line running `code` without MPI, as the run line of a serial job.
+
+    The post-processing codes of the siesta distribution are serial. They can not be additional `CodeInfo`
+    entries of the siesta job, since these are run with the MPI setting of the job, therefore they are
+    launched by the `append_text` of the job.
+    :param code: an installed `Code`.
+    :param cmdline_params: the list of command line parameters.
+    :param stdin_name: the name of the file redirected to the standard input.
+    :param stdout_name: the name of the file where the standard output is redirected.
+    """
+    params = code.get_prepend_cmdline_params() + code.get_executable_cmdline_params(cmdline_params)
+    command = ' '.join(shlex.quote(str(param)) for param in params)
+
+    return f'{command} < {shlex.quote(stdin_name)} > {shlex.quote(stdout_name)}'
+
+
+def validate_postprocess(value):
+    """
+    Validate the `postprocess` namespace against the other inputs. Return an error message, None if valid.
+    """
+    stm = value.get('postprocess', {}).get('stm', {})
+    if stm:
+        missing = {'code', 'mode', 'value'} - set(stm)
+        if missing:
+            return f"The inputs {', '.join(sorted(missing))} of `postprocess.stm` are required for the plstm run"
+        if 'parameters' in value and '%block localdensityofstates' not in FDFDict(value['parameters'].get_dict()):
+            return "The plstm run of `postprocess.stm` requires a local-density-of-states block in the parameters"
+        if stm['code'].computer is not None and stm['code'].computer.uuid != value['code'].computer.uuid:
+            return "The plstm code of `postprocess.stm` must be on the same computer of the siesta code"
+
+    return None
+
+
+def get_stm_postprocess_command(folder, stm_inputs, prefix, input_filename, output_filename):
+    """
+    Write the input file of plstm in `folder` and return the lines of the `append_text` running it after siesta.
+
+    The plstm run is skipped if siesta did not even produce the .LDOS file.
+    :param folder: the folder of the siesta calculation.
+    :param stm_inputs: the inputs of the `postprocess.stm` namespace of the `SiestaCalculation`.
+    :param prefix: the prefix of the siesta run.
+    :param input_filename: the name of the input file of plstm.
+    :param output_filename: the name of the file where the standard output of plstm is redirected.
+    """
+    mode = stm_inputs['mode'].value
+    value = stm_inputs['value'].value
+    spin_option = stm_inputs['spin_option'].value if 'spin_option' in stm_inputs else "q"
+    with folder.open(input_filename, 'w', encoding='utf8') as handle:
+        handle.write(get_stm_input(prefix, mode, value))
+    command = get_serial_command(
+        stm_inputs['code'], get_stm_cmdline(prefix, mode, value, spin_option), input_filename, output_filename
+    )
+
+    return f'if [ -f {shlex.quote(prefix + ".LDOS")} ]; then\n    {command}\nfi'
+
+
 class STMCalculation(CalcJob):
     """
     Plugin for the "plstm" program in the Siesta distribution.
@@ -59,7 +170,7 @@ class STMCalculation(CalcJob):
         super().define(spec)
 
         spec.input('code', valid_type=orm.Code, help='Input code')
-        spec.input('settings', valid_type=orm.Dict, help='Input settings', required=False)
+        spec.input('settings', valid_type=orm.Dict, help='Input settings', required=False, validator=validate_settings)
         spec.input(
             'spin_option',
             valid_type=orm.Str,
@@ -138,19 +249,9 @@ class STMCalculation(CalcJob):
         else:
             self.report("No prefix detected from the remote folder, set 'aiida' as prefix")
             prefix = "aiida"
-        ldosfile = prefix + ".LDOS"
 
-        # Convert height to bohr...
-        if mode.value == "constant-height":
-            vvalue = value.value / 0.529177
-        else:
-            vvalue = value.value
         with open(input_filename, 'w', encoding='utf8') as infile:
-            infile.write(f"{prefix}\n")
-            infile.write("ldos\n")
-            infile.write(f"{mode.value}\n")
-            infile.write(f"{vvalue:.5f}\n")
-            infile.write("unformatted\n")
+            infile.write(get_stm_input(prefix, mode.value, value.value))
 
         # ============================== Code and Calc info ===============================
         # Code information object is used to set up the the bash line that launches siesta
@@ -170,15 +271,8 @@ class STMCalculation(CalcJob):
 
         # Code information object. Sets the command line
         codeinfo = CodeInfo()
-        if mode.value == "constant-height":
-            cmdline_params = (list(cmdline_params) + ['-z', f'{vvalue:.5f}'])
-        else:
-            cmdline_params = (list(cmdline_params) + ['-i', f'{vvalue:.5f}'])
-        if spin_option.value != "q":
-            cmdline_params = (list(cmdline_params) + ['-s', str(spin_option.value), ldosfile])
-        else:
-            cmdline_params = (list(cmdline_params) + [ldosfile])
-        codeinfo.cmdline_params = list(cmdline_params)
+        codeinfo.cmdline_params = list(cmdline_params
+                                       ) + get_stm_cmdline(prefix, mode.value, value.value, spin_option.value)
         codeinfo.stdin_name = metadataoption.input_filename
         codeinfo.stdout_name = metadataoption.output_filename
         codeinfo.code_uuid = code.uuid
@@ -197,5 +291,10 @@ class STMCalculation(CalcJob):
         # Any other files specified in the settings dictionary
         settings_retrieve_list = settings_dict.pop('ADDITIONAL_RETRIEVE_LIST', [])
         calcinfo.retrieve_list += settings_retrieve_list
+        # The plot file might be compressed at the end of the job, the parser decompresses it
+        compression = settings_dict.pop('RETRIEVE_POLICY', {}).get('compress')
+        if compression is not None:
+            calcinfo.retrieve_list.append("*.STM" + COMPRESSORS[compression][1])
+            calcinfo.append_text = get_compress_command(["*.STM"], compression)
 
         return calcinfo
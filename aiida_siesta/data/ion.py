@@ -2,8 +2,13 @@
 """
 Module that manages the .ion.xml files in the local repository.
 """
+from collections import OrderedDict, namedtuple
+import hashlib
 import io
+import os
 import pathlib
+import shutil
+import tempfile
 
 from aiida.common.exceptions import StoringNotAllowed
 from aiida.common.files import md5_from_filelike
@@ -11,6 +16,25 @@ from aiida.orm.nodes import SinglefileData
 
 from aiida_siesta.utils.pao_manager import PaoManager
 
+# Radial part of a PAO of an ion file. `r` (Bohr) and `f` (as in the file, without the r**l factor) are NumPy arrays
+IonOrbital = namedtuple('IonOrbital', ['n', 'l', 'zeta', 'polarized', 'population', 'cutoff', 'r', 'f'])
+
+# Names of the real spherical harmonics, in the order used by siesta (m from -l to l)
+ORBITAL_M_NAMES = {
+    0: ['s'],
+    1: ['py', 'pz', 'px'],
+    2: ['dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2'],
+    3: ['fy(3x2-y2)', 'fxyz', 'fz2y', 'fz3', 'fz2x', 'fz(x2-y2)', 'fx(x2-3y2)'],
+}
+
+# Maximum number of ion files whose orbitals are kept in memory, see `IonData.get_radial_orbitals`
+ORBITALS_CACHE_SIZE = 128
+
+_orbitals_cache = OrderedDict()
+
+# Version of the conversion to the ascii .ion format, part of the names of the cached files
+ASCII_FORMAT_VERSION = 1
+
 
 def xml_element_to_string(element, tail=True):
     """
@@ -55,7 +79,98 @@ def parse_ion(stream):
     return parsed_data
 
 
-class IonData(SinglefileData):
+def parse_ion_orbitals(stream):
+    """
+    Retrieve the PAOs from the .ion.xml file, without writing it to disk.
+
+    Only the `<paos>` section is kept in memory: the file is parsed incrementally.
+    :param stream: a binary stream of the .ion.xml file.
+    :return: a tuple of `IonOrbital`, one per (n, l, zeta), with read-only arrays for the radial grid.
+    """
+    from xml.etree.ElementTree import iterparse
+
+    import numpy as np
+
+    orbitals = []
+    for _, element in iterparse(stream, events=('end',)):
+        if element.tag == 'orbital':
+            radfunc = element.find('radfunc')
+            npts = int(radfunc.find('npts').text)
+            data = np.array(radfunc.find('data').text.split(), dtype=float)
+            # The grid is regenerated since the data in the file have fewer significant digits
+            radius = np.arange(npts) * float(radfunc.find('delta').text)
+            values = data[1::2]
+            radius.flags.writeable = False
+            values.flags.writeable = False
+            cutoff = radfunc.find('cutoff')
+            orbitals.append(
+                IonOrbital(
+                    n=int(element.get('n')),
+                    l=int(element.get('l')),
+                    zeta=int(element.get('z')),
+                    polarized=int(element.get('ispol')) != 0,
+                    population=float(element.get('population')),
+                    cutoff=float(cutoff.text) if cutoff is not None else None,
+                    r=radius,
+                    f=values
+                )
+            )
+            element.clear()
+        elif element.tag in ['kbs', 'vna', 'chlocal', 'core']:
+            element.clear()
+
+    return tuple(orbitals)
+
+
+def get_ascii_cache_dir():
+    """
+    Return the directory of the persistent cache of the ascii .ion files, in the AiiDA configuration folder.
+    """
+    from aiida.manage.configuration import get_config
+
+    return os.path.join(get_config().dirpath, 'siesta', 'ion_ascii_cache')
+
+
+class HashingStream:
+    """
+    Wrapper of a binary stream computing the md5 of the data read through it.
+
+    It allows to compute the md5 of a file while it is parsed, reading it once.
+    """
+
+    def __init__(self, stream):
+        """
+        Wrap the binary `stream`.
+        """
+        self._stream = stream
+        self._md5 = hashlib.md5()
+        self.name = getattr(stream, 'name', None)
+
+    def read(self, size=-1):
+        """
+        Read from the stream, updating the md5.
+        """
+        data = self._stream.read(size)
+        self._md5.update(data)
+        return data
+
+    def hexdigest(self):
+        """
+        Return the md5 of the whole stream, reading the part not consumed yet.
+        """
+        for _ in iter(lambda: self.read(65536), b''):
+            pass
+        return self._md5.hexdigest()
+
+
+def clear_orbitals_cache():
+    """
+    Empty the cache of the orbitals parsed from the ion files.
+    """
+    _orbitals_cache.clear()
+
+
+class IonData(SinglefileData):  # pylint: disable=too-many-public-methods
     """
     Handler for ion files.
     """
@@ -89,17 +204,19 @@ class IonData(SinglefileData):
         # Transorm abs_paths in streams
         source = self._prepare_source(source)
         source.seek(0)
-        # Set the md5 attribute
-        self.set_attribute('md5', md5_from_filelike(source))
-        source.seek(0)
-        # Set other attributes extracted reading the source
-        parsed_data = parse_ion(source)
+        # Extract the attributes reading the source, computing at the same time the md5
+        hashing_stream = HashingStream(source)
+        parsed_data = parse_ion(hashing_stream)
+        parsed_data["md5"] = hashing_stream.hexdigest()
         source.seek(0)
+        self.set_attribute('md5', parsed_data["md5"])
         self.set_attribute('element', parsed_data["element"])
         self.set_attribute('name', parsed_data["name"])
         self.set_attribute('atomic_number', parsed_data["atomic_number"])
         if parsed_data["mass"] is not None:
             self.set_attribute('mass', parsed_data["mass"])
+        # Kept to validate the attributes at storing without parsing the file again
+        self._parsed_data = parsed_data
 
     def store(self, **kwargs):  # pylint: disable=arguments-differ
         """
@@ -111,6 +228,7 @@ class IonData(SinglefileData):
         make attributes immutable before storing and, therefore, a crazy user
         might think to change them before storing.
         Here we check that the attributes actually corresponds to the file info.
+        If the file is the one parsed in `set_file` (same md5), it is not parsed again.
         """
 
         if self.is_stored:
@@ -121,25 +239,31 @@ class IonData(SinglefileData):
         except ValueError as exception:
             raise StoringNotAllowed(exception) from exception
 
+        parsed_data = getattr(self, '_parsed_data', None)
+        if parsed_data is not None and parsed_data["md5"] != self.md5:
+            parsed_data = None
+
         try:
-            self.validate_others_atts(self.element, self.name, self.atomic_number)
+            self.validate_others_atts(self.element, self.name, self.atomic_number, parsed_data)
         except ValueError as exception:
             raise StoringNotAllowed(exception) from exception
 
         return super().store(**kwargs)
 
-    def validate_others_atts(self, elem, name, atm_n):
+    def validate_others_atts(self, elem, name, atm_n, parsed_data=None):
         """
         Validate the given element, name, atomic_number are the one of the stored file.
 
-        Unfortunately it requires to reparse the file.
+        Unfortunately it requires to reparse the file, unless its `parsed_data` are passed.
         :param elem: the symbol of the element.
                name: the name assigned to the atom/site.
                atm_n: the atomic number of the atom/site.
+               parsed_data: the result of `parse_ion` for the file, if already available.
         :raises ValueError: if the element symbol is invalid.
         """
-        with self.open(mode='rb') as handle:
-            parsed_data = parse_ion(handle)
+        if parsed_data is None:
+            with self.open(mode='rb') as handle:
+                parsed_data = parse_ion(handle)
         if elem != parsed_data["element"] or name != parsed_data["name"] or atm_n != parsed_data["atomic_number"]:
             raise ValueError(
                 'element, name or atomic_number do not correspond to the the one in the ion file. '
@@ -162,20 +286,10 @@ class IonData(SinglefileData):
                 )
 
     @classmethod
-    def get_or_create(cls, source, filename=None):
+    def _prepare_stream(cls, source):
         """
-        Do the same job of the instantiation, but before it checks for duplicates.
-
-        Accepts the same parameter of the __init__; if a file with the same md5
-        is found, that IonData is returned, otherwise a new IonFile instance is
-        created.
-        :param source: an absolute path file on disk or a filelike object.
-        :param filename: optional explicit filename to give to the file stored in the repository.
-                         Ignored if a file with the same md5 has been found.
-        :return ion: the IonData object.
+        Check the `source` of `get_or_create` and `bulk_get_or_create` and return it as a stream of bytes.
         """
-        from aiida import orm
-
         if isinstance(source, (str, pathlib.Path)):
             if not pathlib.Path(source).is_file():
                 raise TypeError(f'`source` should be a str or pathlib.Path of a filepath on disk, got: {source}')
@@ -189,6 +303,25 @@ class IonData(SinglefileData):
                 f'`source` should be a str or `pathlib.Path` of a filepath on disk or a stream of bytes, got: {source}'
             )
 
+        return source
+
+    @classmethod
+    def get_or_create(cls, source, filename=None):
+        """
+        Do the same job of the instantiation, but before it checks for duplicates.
+
+        Accepts the same parameter of the __init__; if a file with the same md5
+        is found, that IonData is returned, otherwise a new IonFile instance is
+        created.
+        :param source: an absolute path file on disk or a filelike object.
+        :param filename: optional explicit filename to give to the file stored in the repository.
+                         Ignored if a file with the same md5 has been found.
+        :return ion: the IonData object.
+        """
+        from aiida import orm
+
+        source = cls._prepare_stream(source)
+
         query = orm.QueryBuilder()
         query.append(cls, subclassing=False, filters={'attributes.md5': md5_from_filelike(source)})
 
@@ -202,6 +335,50 @@ class IonData(SinglefileData):
 
         return ion
 
+    @classmethod
+    def bulk_get_or_create(cls, sources):
+        """
+        Do the job of `get_or_create` for many files, with a single query, and store the new nodes.
+
+        The nodes with the md5 of the files are searched with a single query. The files not found
+        (each distinct content only once) become new `IonData` nodes, all stored in a single transaction.
+        :param sources: a list of absolute paths of files on disk or filelike objects.
+        :return: the list of stored `IonData`, one per source, in the same order.
+        """
+        from aiida import orm
+        from aiida.manage import get_manager
+
+        streams = [cls._prepare_stream(source) for source in sources]
+        md5s = [md5_from_filelike(stream) for stream in streams]
+
+        ions = {}
+        if md5s:
+            query = orm.QueryBuilder()
+            query.append(
+                cls,
+                subclassing=False,
+                filters={'attributes.md5': {
+                    'in': sorted(set(md5s))
+                }},
+                project=['attributes.md5', '*']
+            )
+            for md5, ion in query.iterall():
+                ions.setdefault(md5, ion)
+
+        new_ions = {}
+        for stream, md5 in zip(streams, md5s):
+            if md5 not in ions and md5 not in new_ions:
+                stream.seek(0)
+                new_ions[md5] = cls(stream)
+
+        if new_ions:
+            with get_manager().get_profile_storage().transaction():
+                for ion in new_ions.values():
+                    ion.store()
+            ions.update(new_ions)
+
+        return [ions[md5] for md5 in md5s]
+
     @property
     def element(self):
         """
@@ -237,15 +414,66 @@ class IonData(SinglefileData):
         """
         return self.get_attribute('md5', None)
 
-    def get_content_ascii_format(self):  #pylint: disable=too-many-statements,too-many-branches,too-many-locals
+    def get_content_ascii_format(self):
         """
         From the content, write the old format (ascii) .ion file.
 
         Necessary since siesta only reads ion info in this format.
         """
+        buffer = io.StringIO()
+        self.write_content_ascii_format(buffer)
+        return buffer.getvalue()
+
+    def get_ascii_cache_path(self):
+        """
+        Return the path of the ascii .ion file of this node in the persistent cache (see `get_ascii_cache_dir`).
+        """
+        return os.path.join(get_ascii_cache_dir(), f"{self.md5}.v{ASCII_FORMAT_VERSION}.ion")
+
+    def write_content_ascii_format(self, handle, use_cache=True):
+        """
+        Write the old format (ascii) .ion file in the text `handle`, for instance a file of the sandbox folder.
+
+        The converted file is stored in a persistent cache, indexed by md5, and copied from there
+        in the next calls (also by other processes). Therefore each ion file is converted only once.
+        If the cache can not be written, the conversion is written directly in `handle`.
+        :param handle: a text file handle.
+        :param use_cache: whether to use the persistent cache.
+        """
+        if use_cache:
+            cache_path = self.get_ascii_cache_path()
+            if not os.path.isfile(cache_path):
+                try:
+                    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                    # Written with a temporary name and renamed, so that a partial file is never read
+                    with tempfile.NamedTemporaryFile(
+                        'w', encoding='utf8', dir=os.path.dirname(cache_path), suffix='.part', delete=False
+                    ) as cache_handle:
+                        self._write_ascii_format(cache_handle)
+                    os.replace(cache_handle.name, cache_path)
+                except OSError:
+                    use_cache = False
+            if use_cache:
+                with open(cache_path, encoding='utf8') as cache_handle:
+                    shutil.copyfileobj(cache_handle, handle)
+                return
+
+        self._write_ascii_format(handle)
+
+    def _write_ascii_format(self, handle):  #pylint: disable=too-many-statements,too-many-branches,too-many-locals
+        """
+        Convert the content to the old format (ascii) .ion file, writing it piece by piece in `handle`.
+        """
         from xml.etree import ElementTree
 
-        root = ElementTree.fromstring(self.get_content())
+        with self.open(mode='rb') as xml_handle:
+            root = ElementTree.parse(xml_handle).getroot()
+
+        def write_radfunc(radfunc):
+            handle.write(radfunc.find("npts").text)
+            handle.write(radfunc.find("delta").text)
+            handle.write(radfunc.find("cutoff").text)
+            handle.write(radfunc.find("data").text)
 
         #preliminary check on lj_projs, necessary due to a problem in siesta.
         #See "Add lj_projs and j support to ion xml files" commit to siesta in GitLab
@@ -261,40 +489,31 @@ class IonData(SinglefileData):
             else:
                 have_lj_proj = True
 
-        #start of the file content construction
-        string = ""
-
         #Construct the preamble (basis spec and pseudo header)
         preamble_el = root.find("preamble")
-        string = string + "<" + preamble_el.tag + ">" + preamble_el.text
-        string = string + xml_element_to_string(preamble_el[0])  #basis
-        string = string + xml_element_to_string(preamble_el[1])  #pseudo_header
-        string = string + "</" + preamble_el.tag + ">\n"
-        string = string + root.find("symbol").text + "\n"
-        string = string + root.find("label").text + "\n"
-        string = string + root.find("z").text + "\n"
-        string = string + root.find("valence").text + "\n"
-        string = string + root.find("mass").text + "\n"
-        string = string + root.find("self_energy").text + "\n"
-        string = string + root.find("lmax_basis").text + root.find("norbs_nl").text + "\n"
-        if have_lj_proj:
-            string = string + root.find("lmax_projs").text + root.find("nprojs_nl").text + "T\n"
-        else:
-            string = string + root.find("lmax_projs").text + root.find("nprojs_nl").text + "#\n"
+        handle.write("<" + preamble_el.tag + ">" + preamble_el.text)
+        handle.write(xml_element_to_string(preamble_el[0]))  #basis
+        handle.write(xml_element_to_string(preamble_el[1]))  #pseudo_header
+        handle.write("</" + preamble_el.tag + ">\n")
+        for tag in ["symbol", "label", "z", "valence", "mass", "self_energy"]:
+            handle.write(root.find(tag).text + "\n")
+        handle.write(root.find("lmax_basis").text + root.find("norbs_nl").text + "\n")
+        handle.write(root.find("lmax_projs").text + root.find("nprojs_nl").text)
+        handle.write("T\n" if have_lj_proj else "#\n")
 
         #The Paos
-        string = string + "# PAOs:__________________________\n"
+        handle.write("# PAOs:__________________________\n")
         for orbital in root.find("paos"):
-            string = string + orbital.attrib["l"] + orbital.attrib["n"] + orbital.attrib["z"] + orbital.attrib[
-                "ispol"] + orbital.attrib["population"] + "\n"
-            radfunc = orbital.find("radfunc")
-            string = string + radfunc.find("npts").text + radfunc.find("delta").text + radfunc.find("cutoff").text
-            string = string + radfunc.find("data").text
+            handle.write(
+                orbital.attrib["l"] + orbital.attrib["n"] + orbital.attrib["z"] + orbital.attrib["ispol"] +
+                orbital.attrib["population"] + "\n"
+            )
+            write_radfunc(orbital.find("radfunc"))
 
         #The KBs. Note that (in case of have_lj_proj) the j value is not read from the .ion.xml but calculated
         #on site. This is because the j value for each projector was added only in recent version of siesta.
         #The implementation assumes that j=l-1/2 is always the first listed, j=l+1/2 the second! Hope it is true!!
-        string = string + "# KBs:__________________________\n"
+        handle.write("# KBs:__________________________\n")
         collect_ln = []
         for projector in root.find("kbs"):
             l_val = int(projector.attrib["l"])
@@ -304,52 +523,61 @@ class IonData(SinglefileData):
                     j_val = "   " + str(l_val + 0.5) + "  "
                 else:
                     j_val = "   " + str(abs(l_val - 0.5)) + "  "  #abs for the l=0 case
-                string = string + " " + str(l_val) + j_val + str(n_val) + projector.attrib["ref_energy"] + "\n"
+                handle.write(" " + str(l_val) + j_val + str(n_val) + projector.attrib["ref_energy"] + "\n")
             else:
-                string = string + " " + str(l_val) + "  " + str(n_val) + projector.attrib["ref_energy"] + "\n"
+                handle.write(" " + str(l_val) + "  " + str(n_val) + projector.attrib["ref_energy"] + "\n")
             collect_ln.append((l_val, n_val))
-            radfunc = projector.find("radfunc")
-            string = string + radfunc.find("npts").text + radfunc.find("delta").text + radfunc.find("cutoff").text
-            string = string + radfunc.find("data").text
+            write_radfunc(projector.find("radfunc"))
 
         #Other quantities
-        string = string + "# Vna:__________________________\n"
-        radfunc = root.find("vna").find("radfunc")
-        string = string + radfunc.find("npts").text + radfunc.find("delta").text + radfunc.find("cutoff").text
-        string = string + radfunc.find("data").text
-        string = string + "# Chlocal:__________________________\n"
-        radfunc = root.find("chlocal").find("radfunc")
-        string = string + radfunc.find("npts").text + radfunc.find("delta").text + radfunc.find("cutoff").text
-        string = string + radfunc.find("data").text
-        core_info = radfunc = root.find("core")
-        if core_info is not None:
-            string = string + "# Core:__________________________\n"
-            radfunc = root.find("core").find("radfunc")
-            string = string + radfunc.find("npts").text + radfunc.find("delta").text + radfunc.find("cutoff").text
-            string = string + radfunc.find("data").text
-
-        return string
+        handle.write("# Vna:__________________________\n")
+        write_radfunc(root.find("vna").find("radfunc"))
+        handle.write("# Chlocal:__________________________\n")
+        write_radfunc(root.find("chlocal").find("radfunc"))
+        if root.find("core") is not None:
+            handle.write("# Core:__________________________\n")
+            write_radfunc(root.find("core").find("radfunc"))
 
-    def get_orbitals(self):
+    def get_radial_orbitals(self):
+        """
+        Return the PAOs of the file, as a tuple of `IonOrbital` (see `parse_ion_orbitals`).
+
+        The result is cached in memory, indexed by md5, for the last `ORBITALS_CACHE_SIZE` ion files.
+        Therefore the repeated calls of `get_orbitals`, `get_pao_modifier`, `get_pao_block` and
+        `pao_size` parse the file only once.
         """
-        Use sisl to read the file and return the orbitals.
+        md5 = self.md5
+        if md5 in _orbitals_cache:
+            _orbitals_cache.move_to_end(md5)
+            return _orbitals_cache[md5]
+
+        with self.open(mode='rb') as handle:
+            orbitals = parse_ion_orbitals(handle)
+        _orbitals_cache[md5] = orbitals
+        if len(_orbitals_cache) > ORBITALS_CACHE_SIZE:
+            _orbitals_cache.popitem(last=False)
+
+        return orbitals
+
+    def get_orbitals(self):
         """
-        import os
+        Return the orbitals (one per m), as `SislAtomicOrbital`, from the PAOs of the file.
 
+        The radial functions are converted as sisl does when reading .ion.xml files (Angstrom units
+        and r**l factor included).
+        """
         import sisl
 
         from aiida_siesta.data.atomic_orbitals import SislAtomicOrbital
 
-        tmp_file = open("tmp.ion.xml", "w", encoding='utf8')  #pylint: disable=consider-using-with
-        tmp_file.write(self.get_content())
-        tmp_file.close()
-        sile = sisl.get_sile("tmp.ion.xml")
-        sisl_atom = sile.read_basis()
+        bohr_to_ang = sisl.unit_convert("Bohr", "Ang")
         listorb = []
-        for orb in sisl_atom.orbitals:
-            atorb = SislAtomicOrbital(orb.name(), (orb.orb.__getstate__()["r"], orb.orb.__getstate__()["f"]), q0=orb.q0)
-            listorb.append(atorb)
-        os.remove("tmp.ion.xml")
+        for orbital in self.get_radial_orbitals():
+            radial = (orbital.r * bohr_to_ang, orbital.f * orbital.r**orbital.l / bohr_to_ang**1.5)
+            q0 = orbital.population / (2 * orbital.l + 1)
+            suffix = f"Z{orbital.zeta}" + ("P" if orbital.polarized else "")
+            for m_name in ORBITAL_M_NAMES[orbital.l]:
+                listorb.append(SislAtomicOrbital(f"{orbital.n}{m_name}{suffix}", radial, q0=q0))
 
         return listorb
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Group of `IonData` nodes, the analogous of the pseudopotential families for the ion files.
+
+An `IonFamily` collects a set of ion files (basis orbitals and KB projectors, for instance optimized bases)
+so that they can be passed to the `SiestaBaseWorkChain` (and the protocols) through the `ion_family` input,
+as the pseudos with `pseudo_family`, instead of wiring them kind by kind in the `ions` namespace.
+
+The ion of a kind is the ion of the family with label equal to the kind name or, if none, the only ion
+of the family for the element of the kind. The family keeps in its extras an index (label -> element,
+md5 and uuid) of its ions, therefore the ions of a structure are resolved without loading the nodes of
+the family, and the ions of many structures are loaded with a single query.
+"""
+import os
+
+from aiida import orm
+
+from aiida_siesta.data.ion import IonData
+
+# Extra of the family storing the index of its ions
+ION_INDEX_EXTRA = 'ion_index'
+
+
+class IonFamily(orm.Group):
+    """
+    Group of `IonData` nodes, with at most one ion per label.
+    """
+
+    @classmethod
+    def create_from_folder(cls, dirpath, label, description=''):
+        """
+        Create a new family with the .ion.xml files in the directory `dirpath`.
+
+        The files are loaded with `IonData.bulk_get_or_create`, reusing the ions already in the database.
+        :param dirpath: the directory with the .ion.xml files.
+        :param label: the label of the new family.
+        :param description: optional description of the family.
+        :raise ValueError: if a family with the same label already exists or the directory has no ion file.
+        :return: the stored `IonFamily`.
+        """
+        if cls.collection.count(filters={'label': label}):
+            raise ValueError(f'A family with label `{label}` already exists')
+
+        filepaths = sorted(
+            os.path.join(os.path.abspath(dirpath), name) for name in os.listdir(dirpath) if name.endswith('.ion.xml')
+        )
+        if not filepaths:
+            raise ValueError(f'No .ion.xml file in the directory {dirpath}')
+
+        ions = IonData.bulk_get_or_create(filepaths)
+        family = cls(label=label, description=description).store()
+        family.add_nodes(ions)
+
+        return family
+
+    @property
+    def ion_index(self):
+        """
+        Return the index of the ions of the family: a dictionary label -> {element, md5, uuid}.
+        """
+        return self.base.extras.get(ION_INDEX_EXTRA, {})
+
+    def add_nodes(self, nodes):
+        """
+        Add `IonData` nodes to the family, updating the index.
+
+        :param nodes: a single or a list of stored `IonData`.
+        :raise TypeError: if any of the nodes is not an `IonData`.
+        :raise ValueError: if the family already has a different ion with the same label.
+        """
+        if not isinstance(nodes, (list, tuple)):
+            nodes = [nodes]
+
+        index = self.ion_index
+        for node in nodes:
+            if not isinstance(node, IonData):
+                raise TypeError(f'only `IonData` nodes can be added to an `IonFamily`, got: {type(node)}')
+            if node.name in index and index[node.name]['md5'] != node.md5:
+                raise ValueError(f'the family already contains a different ion with label `{node.name}`')
+            index[node.name] = {'element': node.element, 'md5': node.md5, 'uuid': node.uuid}
+
+        super().add_nodes(nodes)
+        self.base.extras.set(ION_INDEX_EXTRA, index)
+
+    def remove_nodes(self, nodes):
+        """
+        Remove `IonData` nodes from the family, updating the index.
+        """
+        if not isinstance(nodes, (list, tuple)):
+            nodes = [nodes]
+
+        super().remove_nodes(nodes)
+        uuids = {node.uuid for node in nodes}
+        index = {label: entry for label, entry in self.ion_index.items() if entry['uuid'] not in uuids}
+        self.base.extras.set(ION_INDEX_EXTRA, index)
+
+    def clear(self):
+        """
+        Remove all the nodes from the family, and from the index.
+        """
+        super().clear()
+        self.base.extras.set(ION_INDEX_EXTRA, {})
+
+    def rebuild_index(self):
+        """
+        Rebuild the index from the nodes of the family, for instance if they were added with the `Group` API.
+        """
+        query = orm.QueryBuilder()
+        query.append(orm.Group, filters={'id': self.pk}, tag='group')
+        query.append(
+            IonData,
+            with_group='group',
+            project=['attributes.name', 'attributes.element', 'attributes.md5', 'uuid'],
+        )
+        index = {name: {'element': element, 'md5': md5, 'uuid': uuid} for name, element, md5, uuid in query.iterall()}
+        self.base.extras.set(ION_INDEX_EXTRA, index)
+
+    def get_ion_uuids(self, structure):
+        """
+        Return the uuids of the ions of the family for the kinds of `structure`, from the index.
+
+        :param structure: a `StructureData`.
+        :raise ValueError: if the family has no ion (or more than one ion of its element) for a kind.
+        :return: a dictionary kind name -> uuid.
+        """
+        index = self.ion_index
+        by_element = {}
+        for entry in index.values():
+            by_element.setdefault(entry['element'], []).append(entry['uuid'])
+
+        uuids = {}
+        for kind in structure.kinds:
+            if kind.name in index:
+                uuids[kind.name] = index[kind.name]['uuid']
+            elif len(by_element.get(kind.symbol, [])) == 1:
+                uuids[kind.name] = by_element[kind.symbol][0]
+            else:
+                raise ValueError(f'The family `{self.label}` has no (unique) ion for the kind `{kind.name}`')
+
+        return uuids
+
+    def get_ions_for_structures(self, structures):
+        """
+        Return the ions of the family for the kinds of each structure, loaded with a single query.
+
+        :param structures: a list of `StructureData`.
+        :raise ValueError: if the family has no ion for a kind.
+        :return: a list with a dictionary kind name -> `IonData` for each structure.
+        """
+        kind_uuids = [self.get_ion_uuids(structure) for structure in structures]
+        uuids = sorted({uuid for mapping in kind_uuids for uuid in mapping.values()})
+
+        ions = {}
+        if uuids:
+            query = orm.QueryBuilder()
+            query.append(IonData, filters={'uuid': {'in': uuids}})
+            ions = {ion.uuid: ion for ion in query.all(flat=True)}
+
+        return [{name: ions[uuid] for name, uuid in mapping.items()} for mapping in kind_uuids]
+
+    def get_ions(self, structure):
+        """
+        Return the ions of the family for the kinds of `structure`, as a dictionary kind name -> `IonData`.
+        """
+        return self.get_ions_for_structures([structure])[0]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for a bundle of siesta runs (see `SiestaBundleCalculation`).
+
+Each run is parsed by the `SiestaParser`, from the files in the subdirectory of the run, and its outputs are
+attached in the namespace `runs.<label>`. The exit status of each run is stored in the `exit_statuses` output.
+"""
+from aiida.common import OutputParsingError, exceptions
+from aiida.orm import Dict, FolderData
+
+from aiida_siesta.parsers.siesta import SiestaParser, get_parsing_pool
+from aiida_siesta.utils.retrieve_policy import get_parsing_folder, get_retrieved_names
+
+# See the LICENSE.txt and AUTHORS.txt files.
+
+
+def get_run_folder(folder, subdirectory):
+    """
+    Return an unstored `FolderData` with the files of the `subdirectory` of `folder`.
+
+    Files are copied as they are (possibly compressed). The runs of a bundle are small, therefore the copy
+    is cheap and allows to parse each run exactly as a `SiestaCalculation`.
+    """
+    run_folder = FolderData()
+    if subdirectory not in folder.list_object_names():
+        return run_folder
+    for root, _, names in folder.base.repository.walk(subdirectory):
+        for name in names:
+            path = root / name
+            with folder.base.repository.open(str(path), mode='rb') as handle:
+                run_folder.base.repository.put_object_from_filelike(handle, str(path.relative_to(subdirectory)))
+
+    return run_folder
+
+
+class SiestaBundleParser(SiestaParser):
+    """
+    Parser for the output of a bundle of siesta runs.
+    """
+
+    _label = None
+
+    @property
+    def _run_inputs(self):
+        """
+        The inputs of the parsed siesta run, the ones of the run `self._label` of the bundle.
+        """
+        return self.node.inputs.runs[self._label]
+
+    def _out(self, link_label, node):
+        """
+        Attach an output of the parsed siesta run, in the namespace of the run `self._label`.
+        """
+        self.out(f'runs.{self._label}.{link_label}', node)
+
+    def parse(self, **kwargs):
+        """
+        Parse each run of the bundle and return the `RUNS_FAILED` exit code if at least one failed.
+        """
+        try:
+            output_folder = self.retrieved
+        except exceptions.NotExistent:
+            raise OutputParsingError("Folder not retrieved")
+
+        output_folder = get_parsing_folder(output_folder, kwargs.get('retrieved_temporary_folder'))
+
+        exit_statuses = {}
+        for label in sorted(self.node.inputs.runs):
+            self._label = label
+
+            # As internal convention, the keys of the settings dict are uppercase
+            settings_dict = {}
+            if 'settings' in self._run_inputs:
+                settings_dict = {str(k).upper(): v for (k, v) in self._run_inputs.settings.get_dict().items()}
+
+            run_folder = get_run_folder(output_folder, label)
+            parsing_pool = get_parsing_pool(settings_dict)
+            try:
+                exit_code = self._parse_retrieved(
+                    run_folder, set(get_retrieved_names(run_folder)), settings_dict, parsing_pool
+                )
+            except OutputParsingError as exception:
+                # A run that did not even start (or was killed before writing the xml file)
+                self.logger.error(f'Run {label}: {exception}')
+                exit_code = self.exit_codes.UNEXPECTED_TERMINATION
+            finally:
+                self._remove_scratch()
+            exit_statuses[label] = exit_code.status
+
+        self.out('exit_statuses', Dict(exit_statuses))
+
+        failed = [label for label, status in exit_statuses.items() if status != 0]
+        if failed:
+            return self.exit_codes.RUNS_FAILED.format(labels=', '.join(failed))
+
+        return None
@@ -4,13 +4,36 @@ Parser for a siesta calculation.
 
 Most of the info are parsed from the .xml file but also the .out is checked for errors.
 The .ion.xml is also always parsed. The .bands and .EPSIMG are parsed if bands and
-optical calculations are   requested respectively.
+optical calculations are   requested respectively, the .STM file if a plstm run is requested.
 """
+import tempfile
+
 from aiida.common import OutputParsingError, exceptions
 from aiida.orm import Dict
 from aiida.parsers import Parser
 import numpy as np
 
+from aiida_siesta.calculations.monitors import get_monitor_failure
+from aiida_siesta.parsers.stm import get_stm_data
+from aiida_siesta.utils.cml import (
+    STANDARD_OUTPUT_LIST,
+    CMLIndex,
+    build_structure,
+    get_cml_index,
+    matrix_to_list,
+    read_streamed_cml,
+)
+from aiida_siesta.utils.diagnostics import get_output_diagnostics, get_run_report
+from aiida_siesta.utils.retrieve_policy import (
+    get_local_path,
+    get_parsing_folder,
+    get_retrieved_names,
+    open_local,
+    open_retrieved,
+)
+from aiida_siesta.utils.scf_history import get_scf_history_array
+from aiida_siesta.utils.timing import get_timing_profile
+
 # pylint: disable=protected-access
 
 # See the LICENSE.txt and AUTHORS.txt files.
@@ -28,17 +51,24 @@ def get_timing_info(output_folder, json_name):
     Need a lot of trial and error becuse the format of the file is differente
     changing the siesta version.
     """
+    with open_retrieved(output_folder, json_name) as handle:
+        return get_timing_info_from_handle(handle)
+
+
+def get_timing_info_from_handle(handle):
+    """
+    Extract the global time and the timing decomposition from the binary handle of the time.json file.
+    """
     import json
 
     timing_decomp = {}
     global_time = None
 
-    with output_folder.base.repository.open(json_name, mode='rb') as handle:
-        try:
-            data = json.load(handle)
-        except:  # pylint: disable=bare-except
-            # The JSON file is not parseable...emit message
-            return global_time, timing_decomp
+    try:
+        data = json.load(handle)
+    except:  # pylint: disable=bare-except
+        # The JSON file is not parseable...emit message
+        return global_time, timing_decomp
 
     try:
         data1 = data["global_section"]["siesta"]
@@ -95,16 +125,23 @@ def get_eps2(output_folder, eps2_name):
     """
     Read the eps2_path files to extract an array energy vs eps2.
     """
+    with open_retrieved(output_folder, eps2_name) as handle:
+        return get_eps2_from_handle(handle)
+
+
+def get_eps2_from_handle(handle):
+    """
+    Extract the list of [energy, eps2] from the binary handle of the .EPSIMG file.
+    """
     eps2_list = []
 
-    with output_folder.base.repository.open(eps2_name, mode='r') as handle:
-        for line in handle:
-            # check if the current line starts with "#"
-            if line.startswith("#"):
-                pass
-            else:
-                e_and_eps2 = [float(i) for i in line.split()]
-                eps2_list.append(e_and_eps2)
+    for line in handle:
+        # check if the current line starts with "#"
+        if line.startswith(b"#"):
+            pass
+        else:
+            e_and_eps2 = [float(i) for i in line.split()]
+            eps2_list.append(e_and_eps2)
 
     return eps2_list
 
@@ -113,15 +150,7 @@ def is_polarization_problem(output_folder, out_name):
     """
     Check the presence of polarization errors.
     """
-    with output_folder.base.repository.open(out_name, mode='rb') as handle:
-        print(handle)
-        lines = handle.read().split('\n')
-
-    for line in lines:
-        if "POLARIZATION: Iteration to find the polarization" in line:
-            return True
-
-    return False
+    return get_output_diagnostics(output_folder, out_name)['polarization_problem']
 
 
 def get_min_split(output_folder, out_name):
@@ -130,22 +159,7 @@ def get_min_split(output_folder, out_name):
 
     If present, extract the minimum split_norm parameter. If not, return None.
     """
-    with output_folder.base.repository.open(out_name, mode='rb') as handle:
-        lines = handle.read().split('\n')
-
-    min_split_norm = None
-    split_norm_error = False
-
-    for line in lines:
-        if "split_norm" in line:
-            split_norm_error = True
-            words = line.split()
-
-    if split_norm_error is not None:
-        min_sp = words[4]
-        min_split_norm = float(min_sp[:-1])
-
-    return min_split_norm
+    return get_output_diagnostics(output_folder, out_name)['min_split_norm']
 
 
 def get_parsed_xml_doc(output_folder, xml_name):
@@ -153,13 +167,20 @@ def get_parsed_xml_doc(output_folder, xml_name):
     Check that the parsed xml is not corrupted.
     """
 
+    with open_retrieved(output_folder, xml_name) as handle:
+        return read_xml_doc(handle)
+
+
+def read_xml_doc(handle):
+    """
+    Return the minidom document of the xml file opened (in binary mode) in `handle`.
+    """
     from xml.dom import minidom
 
-    with output_folder.base.repository.open(xml_name, mode='rb') as handle:
-        try:
-            xmldoc = minidom.parse(handle)
-        except EOFError:
-            raise OutputParsingError("Faulty Xml File")
+    try:
+        xmldoc = minidom.parse(handle)
+    except EOFError:
+        raise OutputParsingError("Faulty Xml File")
 
     return xmldoc
 
@@ -174,32 +195,23 @@ def get_dict_from_xml_doc(xmldoc):
     written, even if something goes wrong. For instance, during a relaxation
     that gets interrupted, "Finalize" is not present, but an "SCF Finalization"
     yes and that can be used for restart.
+    The `xmldoc` can be the minidom document or its `CMLIndex`, that is built only once.
     """
-    # List of scalar values from CML to be transferred to AiiDA
-    #pylint: disable=invalid-name
-    standard_output_list = ['siesta:FreeE', 'siesta:E_KS', 'siesta:Ebs', 'siesta:E_Fermi', 'siesta:stot']
+    cml_index = get_cml_index(xmldoc)
 
     # Scalar items
     scalar_dict = {}
-    # Metadata items
-    itemlist = xmldoc.getElementsByTagName('metadata')
-    # Transform metagata in scalar
-    for item in itemlist:
+    # Metadata items, transformed in scalar
+    for item in cml_index.metadata:
         # Maybe make sure that 'name' does not contain forbidden characters
         name = item.attributes['name'].value
         value = item.attributes['content'].value
         scalar_dict[name] = value
 
-    # Look for "SCF Finalization" module, present if at least one scf converged
-    itemlist = xmldoc.getElementsByTagName('module')
-    scf_final = None
-    for item in itemlist:
-        if 'title' in list(item.attributes.keys()):
-            # Get last scf finalization module
-            if item.attributes['title'].value == "SCF Finalization":
-                scf_final = item
+    # Last "SCF Finalization" module, present if at least one scf converged.
     # In a geom_optimization run, we catch the data of last run even if the
     # geom_optimization failed
+    scf_final = cml_index.scf_final
 
     if scf_final is not None:
         # wrapped in <property> elements with a <scalar> child
@@ -207,7 +219,7 @@ def get_dict_from_xml_doc(xmldoc):
         for prop in props:
             if 'dictRef' in list(prop.attributes.keys()):
                 name = prop.attributes['dictRef'].value
-                if name in standard_output_list:
+                if name in STANDARD_OUTPUT_LIST:
                     data = prop.getElementsByTagName('scalar')[0]
                     value = data.childNodes[0].nodeValue
                     units = data.attributes['units'].value
@@ -221,10 +233,10 @@ def get_dict_from_xml_doc(xmldoc):
                     scalar_dict[reduced_name + "_units"] = unit_name
 
     #Detect if it was a geometry optimization (relax) or a single point calculation
-    scalar_dict['variable_geometry'] = is_variable_geometry(xmldoc)
+    scalar_dict['variable_geometry'] = is_variable_geometry(cml_index)
 
     # Sizes of orbital set (and non-zero interactions), and mesh
-    no_u, nnz, mesh = get_sizes_info(xmldoc)
+    no_u, nnz, mesh = get_sizes_info(cml_index)
     if no_u is not None:
         scalar_dict['no_u'] = no_u
     if nnz is not None:
@@ -238,19 +250,11 @@ def get_dict_from_xml_doc(xmldoc):
 def is_variable_geometry(xmldoc):
     """
     Try to guess whether the calculation involves changes in geometry.
-    """
-    itemlist = xmldoc.getElementsByTagName('module')
-    for item in itemlist:
-        # Check there is a step which is a "geometry optimization" one
-        if 'dictRef' in list(item.attributes.keys()):
-            ref = item.attributes['dictRef'].value
-            # This is a very simple-minded approach, since
-            # there might be Lua runs which are not properly
-            # geometry optimizations.
-            if ref in ("Geom. Optim", "LUA"):
-                return True
 
-    return False
+    Checks there is a step which is a "geometry optimization" one. This is a very simple-minded
+    approach, since there might be Lua runs which are not properly geometry optimizations.
+    """
+    return get_cml_index(xmldoc).variable_geometry
 
 
 def get_sizes_info(xmldoc):
@@ -261,54 +265,32 @@ def get_sizes_info(xmldoc):
     nnz = None
     mesh = None
 
-    itemlist = xmldoc.getElementsByTagName('module')
-    for item in itemlist:
-        # Process the first "step" module, which is a "geometry" one
-        if 'serial' in list(item.attributes.keys()):
-            # Get properties here
-            props_list = item.getElementsByTagName('property')
-            for prop in props_list:
-                if 'dictRef' in list(prop.attributes.keys()):
-                    if prop.attributes['dictRef'].value == "siesta:no_u":
-                        scalar = prop.getElementsByTagName('scalar')[0]
-                        no_u = int(scalar.childNodes[0].data)
-                    if prop.attributes['dictRef'].value == "siesta:nnz":
-                        scalar = prop.getElementsByTagName('scalar')[0]
-                        nnz = int(scalar.childNodes[0].data)
-                    if prop.attributes['dictRef'].value == "siesta:ntm":
-                        array = prop.getElementsByTagName('array')[0]
-                        mesh = [int(s) for s in array.childNodes[0].data.split()]
+    # The index holds the last of these properties found in the "step" modules
+    sizes = get_cml_index(xmldoc).sizes
+    if "siesta:no_u" in sizes:
+        scalar = sizes["siesta:no_u"].getElementsByTagName('scalar')[0]
+        no_u = int(scalar.childNodes[0].data)
+    if "siesta:nnz" in sizes:
+        scalar = sizes["siesta:nnz"].getElementsByTagName('scalar')[0]
+        nnz = int(scalar.childNodes[0].data)
+    if "siesta:ntm" in sizes:
+        array = sizes["siesta:ntm"].getElementsByTagName('array')[0]
+        mesh = [int(s) for s in array.childNodes[0].data.split()]
 
     return no_u, nnz, mesh
 
 
-def get_last_structure(xmldoc, input_structure):
+def get_last_geometry(xmldoc, number_of_real_atoms):
     """
-    Get the final structure of a relaxation.
-    """
-    itemlist = xmldoc.getElementsByTagName('module')
+    Get the positions of the first `number_of_real_atoms` atoms and the cell of the last geometry.
 
-    # Use the last "geometry" module, and not the "Finalization" one.
-    finalmodule = None
-    for item in itemlist:
-        # Get a "geometry" module by the criteria:
-        if 'serial' in list(item.attributes.keys()):
-            if 'dictRef' in list(item.attributes.keys()):
-                if item.attributes['dictRef'].value != "SCF":
-                    finalmodule = item
+    :return: the tuple (atomlist, cell) as required by `build_structure` or None if no geometry is found.
+    """
+    # Use the last "geometry" module (a "step" module that is not "SCF"), and not the "Finalization" one.
+    finalmodule = get_cml_index(xmldoc).last_geometry
 
-    # In case there is no appropriate data, fall back and at least return the initial structure
-    # (this should not be necessary, as the initial Geometry module is opened very soon)
     if finalmodule is None:
-        return False, input_structure
-
-    # When using floating sites, Siesta associates 'atomic positions' to them, and
-    # the structure (and forces) in the XML file include these fake atoms.
-    # In order to return physical structures and forces, we need to remove them.
-    # Recall that the input structure is the physical one, as the floating sites
-    # are specified in the 'basis' input
-
-    number_of_real_atoms = len(input_structure.sites)
+        return None
 
     atoms = finalmodule.getElementsByTagName('atom')
     cellvectors = finalmodule.getElementsByTagName('latticeVector')
@@ -327,46 +309,39 @@ def get_last_structure(xmldoc, input_structure):
         data = latt.childNodes[0].data.split()
         cell.append([float(s) for s in data])
 
-    # Generally it is better to clone the input structure and reset the data, since site
-    # 'names' are not handled by the CML file (at least not in Siesta versions <= 4.0)
+    return atomlist, cell
 
-    import copy
 
-    from aiida.orm.nodes.data.structure import Site
-    new_structure = input_structure.clone()
-    new_structure.reset_cell(cell)
-    new_structure.clear_sites()
-    for indx in range(number_of_real_atoms):
-        new_site = Site(site=input_structure.sites[indx])
-        new_site.position = copy.deepcopy(atomlist[indx][1])
-        new_structure.append_site(new_site)
+def get_last_structure(xmldoc, input_structure):
+    """
+    Get the final structure of a relaxation.
+    """
+    # When using floating sites, Siesta associates 'atomic positions' to them, and
+    # the structure (and forces) in the XML file include these fake atoms.
+    # In order to return physical structures and forces, we need to remove them.
+    # Recall that the input structure is the physical one, as the floating sites
+    # are specified in the 'basis' input
+    last_geometry = get_last_geometry(xmldoc, len(input_structure.sites))
 
-    # The most obvious alternative does not work, as the reset method below does not
-    # work if the numbers do not match.
-    #
-    ## new_pos = [atom[1] for atom in atomlist]
-    ## new_structure.reset_sites_positions(new_pos)
+    # In case there is no appropriate data, fall back and at least return the initial structure
+    # (this should not be necessary, as the initial Geometry module is opened very soon)
+    if last_geometry is None:
+        return False, input_structure
+
+    atomlist, cell = last_geometry
 
-    return True, new_structure
+    return True, build_structure(input_structure, atomlist, cell)
 
 
 def get_final_forces_and_stress(xmldoc):
     """
     Extract final forces and stress as lists of lists.
     """
-    itemlist = xmldoc.getElementsByTagName('module')
-
     # Note: In modern versions of Siesta, forces and stresses
     # are written in the "SCF Finalization" modules at the end
     # of each geometry step.
-    # Search for the last one of those modules.
-
-    scf_final = None
-    for item in itemlist:
-        if 'title' in list(item.attributes.keys()):
-            # Get last scf finalization module
-            if item.attributes['title'].value == "SCF Finalization":
-                scf_final = item
+    # Use the last one of those modules.
+    scf_final = get_cml_index(xmldoc).scf_final
 
     forces = None
     stress = None
@@ -382,9 +357,7 @@ def get_final_forces_and_stress(xmldoc):
                     # using info on rows and columns in CML file
                     rows = int(mat.attributes['rows'].value)
                     cols = int(mat.attributes['columns'].value)
-                    f = mat.childNodes[0].data.split()  #pylint: disable=invalid-name
-                    f = [float(x) for x in f]  #pylint: disable=invalid-name
-                    forces = [f[rows * i:rows * (i + 1)] for i in range(cols)]
+                    forces = matrix_to_list(mat.childNodes[0].data, rows, cols)
 
                 if prop.attributes['dictRef'].value == 'siesta:stress':
                     mat = prop.getElementsByTagName('matrix')[0]
@@ -392,13 +365,161 @@ def get_final_forces_and_stress(xmldoc):
                     # using info on rows and columns in CML file
                     rows = int(mat.attributes['rows'].value)
                     cols = int(mat.attributes['columns'].value)
-                    s = mat.childNodes[0].data.split()  #pylint: disable=invalid-name
-                    s = [float(x) for x in s]  #pylint: disable=invalid-name
-                    stress = [s[rows * i:rows * (i + 1)] for i in range(cols)]
+                    stress = matrix_to_list(mat.childNodes[0].data, rows, cols)
 
     return forces, stress
 
 
+def get_bands_from_tokens(tottx, band_lines):
+    """
+    Extract the eigenvalues from the tokens (the whitespace-split content) of a .bands file.
+
+    The header of the file is followed by a block for each kpoint, containing the kpoint
+    coordinates (three for BandPoints, the path length for BandLines) and the `nbands * nspins`
+    eigenvalues (first all the bands of spin up, then the ones of spin down).
+    The tokens of all the blocks are converted at once and reshaped in a (nkpoints, block) array.
+    Any content after the last block (the labels of BandLines) is ignored.
+
+    :param tottx: list of the tokens of the file.
+    :param band_lines: True for the BandLines layout, False for BandPoints.
+    :return: a (nkpoints, nbands) array if nspin = 1, a tuple of two of them (spin up, spin down) if nspin = 2.
+    :raise ValueError: if the file is truncated, it contains unexpected tokens or nspin > 2.
+    """
+    #ef = float(tottx[0])
+    if band_lines:
+        #mink, maxk = float(tottx[1]), float(tottx[2])
+        #minfreq, maxfreq = float(tottx[3]), float(tottx[4])
+        nbands, nspins, nkpoints = int(tottx[5]), int(tottx[6]), int(tottx[7])
+        header, ncoords = 8, 1
+    else:
+        #minfreq, maxfreq = float(tottx[1]), float(tottx[2])
+        nbands, nspins, nkpoints = int(tottx[3]), int(tottx[4]), int(tottx[5])
+        header, ncoords = 6, 3
+
+    if nspins not in (1, 2):
+        raise ValueError('detected nspin > 2, something wrong')
+
+    block_length = ncoords + nbands * nspins
+    # The reshape raises ValueError if less tokens than expected are present
+    values = np.array(tottx[header:header + nkpoints * block_length], dtype=float).reshape(nkpoints, block_length)
+
+    #coords = values[:, :ncoords]
+    spinup = values[:, ncoords:ncoords + nbands]
+    if nspins == 2:
+        spindown = values[:, ncoords + nbands:]
+        return (spinup, spindown)
+
+    return spinup  #, coords
+
+
+def parse_cml(handle, streaming, number_of_real_atoms):
+    """
+    Extract from the xml (CML) file all the quantities needed by the `SiestaParser`.
+
+    :param handle: the xml file, opened in binary mode.
+    :param streaming: whether to use the `StreamedCML` instead of the minidom tree.
+    :param number_of_real_atoms: number of sites of the input structure (floating sites excluded).
+    :return: the tuple (result_dict, last_geometry, forces, stress). The `last_geometry` is the
+        (atomlist, cell) tuple of `get_last_geometry`, always None for runs with fixed geometry.
+    """
+    last_geometry = None
+
+    if streaming:
+        streamed_cml = read_streamed_cml(handle)
+        result_dict = streamed_cml.get_dict()
+        if result_dict['variable_geometry']:
+            last_geometry = streamed_cml.get_last_geometry(number_of_real_atoms)
+        forces, stress = streamed_cml.get_final_forces_and_stress()
+    else:
+        # All the helpers below look up the modules they need in the index, built once
+        xmldoc = CMLIndex(read_xml_doc(handle))
+        result_dict = get_dict_from_xml_doc(xmldoc)
+        if result_dict['variable_geometry']:
+            last_geometry = get_last_geometry(xmldoc, number_of_real_atoms)
+        forces, stress = get_final_forces_and_stress(xmldoc)
+
+    return result_dict, last_geometry, forces, stress
+
+
+def get_bands_from_handle(handle, band_lines):
+    """
+    Extract the eigenvalues from the .bands file opened (in binary mode) in `handle`.
+
+    See `get_bands_from_tokens` for the meaning of `band_lines` and the returned value.
+    """
+    return get_bands_from_tokens(handle.read().split(), band_lines)
+
+
+def call_on_file(output_folder, name, function, *args):
+    """
+    Open the file `name` of `output_folder` and return `function(handle, *args)`.
+    """
+    with open_retrieved(output_folder, name) as handle:
+        return function(handle, *args)
+
+
+def call_on_path(path, function, *args):
+    """
+    Open the file `path` of the local file system and return `function(handle, *args)`.
+
+    It is the task submitted to the parsing pool, only the path of the file is sent to the workers.
+    """
+    with open_local(path) as handle:
+        return function(handle, *args)
+
+
+class DeferredCall:
+    """
+    A function call executed, in the calling thread, only when its result is requested.
+
+    It replaces the `concurrent.futures.Future` of the pool when the parsing is sequential.
+    """
+
+    def __init__(self, function, *args):
+        """
+        Store the function and its arguments.
+        """
+        self.function = function
+        self.args = args
+
+    def result(self):
+        """
+        Execute the call and return its result.
+        """
+        return self.function(*self.args)
+
+    def cancel(self):
+        """
+        Nothing to cancel, the call is never executed if the result is not requested.
+        """
+        return True
+
+
+# Executors of the parsing, created once for each type and number of workers and reused by all the parsings
+_PARSING_POOLS = {}
+
+
+def get_parsing_pool(settings_dict):
+    """
+    Return the executor for the parsing of the retrieved files, None if the parsing is sequential.
+
+    It is requested with the `PARSER_WORKERS` (number of workers) and `PARSER_POOL` ("thread" or
+    "process", default "thread") keys of the (uppercased) `settings_dict`. The executor is created
+    at the first request and then reused (unless broken), it is never shut down by the parser.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    workers = settings_dict.get('PARSER_WORKERS', 1)
+    if workers < 2:
+        return None
+    kind = settings_dict.get('PARSER_POOL', 'thread')
+    pool = _PARSING_POOLS.get((kind, workers))
+    if pool is None or pool._broken:
+        executor = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        pool = _PARSING_POOLS[(kind, workers)] = executor(max_workers=workers)
+    return pool
+
+
 ##################################
 # END OF AUXILIARY FUNCTIONS SET #
 ##################################
@@ -411,36 +532,138 @@ class SiestaParser(Parser):
 
     _version = '2.0.1.dev0'
 
-    def parse(self, **kwargs):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    # Scratch directory (a `tempfile.TemporaryDirectory`) of the files sent to the parsing pool
+    _scratch = None
+
+    def parse(self, **kwargs):
         """
         Receives in input a dictionary of retrieved nodes. Does all the logic here.
         """
+        try:
+            output_folder = self.retrieved
+        except exceptions.NotExistent:
+            raise OutputParsingError("Folder not retrieved")
+
+        # As internal convention, the keys of the settings dict are uppercase
+        if 'settings' in self.node.inputs:
+            settings = self.node.inputs.settings.get_dict()
+            settings_dict = {str(k).upper(): v for (k, v) in settings.items()}
+        else:
+            settings_dict = {}
+
+        # Files retrieved only temporarily (see the `retrieve_policy` in settings) are collected
+        # together with the retrieved ones, without copies. Compressed files are always read with `open_retrieved`.
+        output_folder = get_parsing_folder(output_folder, kwargs.get('retrieved_temporary_folder'))
+
+        # The manifest of the retrieved files (with the names of the uncompressed files), computed once
+        retrieved_names = set(get_retrieved_names(output_folder))
+
+        # When a pool is requested in the settings, the independent and CPU-heavy parsing tasks
+        # (xml, bands and eps2 files) are submitted to it all at once. The ion files are parsed
+        # in the meantime, since they generate nodes. Otherwise each task is executed only when its
+        # result is needed, exactly as in the sequential parsing.
+        parsing_pool = get_parsing_pool(settings_dict)
+        try:
+            return self._parse_retrieved(output_folder, retrieved_names, settings_dict, parsing_pool)
+        finally:
+            self._remove_scratch()
+
+    @property
+    def _run_inputs(self):
+        """
+        The inputs of the parsed siesta run, the ones of the calculation.
+        """
+        return self.node.inputs
+
+    def _out(self, link_label, node):
+        """
+        Attach an output of the parsed siesta run.
+        """
+        self.out(link_label, node)
+
+    def _submit(self, parsing_pool, output_folder, name, function, *args):
+        """
+        Submit to the `parsing_pool` the call `function(handle, *args)` on the retrieved file `name`.
+
+        Only the path of the file on the local file system is sent to the pool workers, so that
+        neither the repository nor the nodes need to be accessed by them and the file is never
+        read in memory here. Files retrieved temporarily are read in place, the others are first
+        copied (in streaming) to a scratch directory, removed at the end of the parsing.
+        If the pool is None, the call is deferred and the file is read only when the result is requested.
+        """
+        if parsing_pool is None:
+            return DeferredCall(call_on_file, output_folder, name, function, *args)
+
+        if self._scratch is None:
+            self._scratch = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        path = get_local_path(output_folder, name, self._scratch.name)
+
+        return parsing_pool.submit(call_on_path, path, function, *args)
+
+    def _remove_scratch(self):
+        """
+        Remove the scratch directory of the files sent to the parsing pool, if created.
+        """
+        if self._scratch is not None:
+            self._scratch.cleanup()
+            self._scratch = None
+
+    def _parse_retrieved(self, output_folder, retrieved_names, settings_dict, parsing_pool):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements,too-many-return-statements
+        """
+        Parse the retrieved files and return the exit code.
+
+        :param output_folder: the retrieved FolderData.
+        :param retrieved_names: the set of names of the retrieved files.
+        :param settings_dict: the content of the settings input, with uppercase keys.
+        :param parsing_pool: the executor for the parsing tasks, None for sequential parsing.
+        """
         from aiida.engine import ExitCode
 
         parser_info = {}
         parser_info['parser_info'] = f'AiiDA Siesta Parser V. {self._version}'
 
-        try:
-            output_folder = self.retrieved
-        except exceptions.NotExistent:
-            raise OutputParsingError("Folder not retrieved")
+        # When using floating sites, Siesta associates 'atomic positions' to them, and
+        # the structure and forces in the XML file include these fake atoms.
+        # In order to return physical structures and forces, we need to remove them.
+        # Recall that the input structure is the physical one, and the floating sites
+        # are specified in the 'basis' input
+        physical_structure = self._run_inputs.structure
+        number_of_real_atoms = len(physical_structure.sites)
 
         xml_name = str(self.node.get_option('prefix')) + ".xml"
-        if xml_name not in output_folder.list_object_names():
+        if xml_name not in retrieved_names:
             raise OutputParsingError("Xml file not retrieved")
-        xmldoc = get_parsed_xml_doc(output_folder, xml_name)
-        result_dict = get_dict_from_xml_doc(xmldoc)
+        # The streaming mode keeps in memory only the needed modules of the xml file.
+        # Results are identical, it is recommended for long relaxations and MD runs.
+        xml_streaming = settings_dict.get('XML_STREAMING', False)
+        xml_task = self._submit(parsing_pool, output_folder, xml_name, parse_cml, xml_streaming, number_of_real_atoms)
+
+        namebandsfile = str(self.node.get_option('prefix')) + ".bands"
+        if namebandsfile in retrieved_names and "bandskpoints" in self._run_inputs:
+            band_lines = self._run_inputs.bandskpoints.labels is not None
+            bands_task = self._submit(parsing_pool, output_folder, namebandsfile, get_bands_from_handle, band_lines)
+        else:
+            bands_task = DeferredCall(self._get_bands, output_folder, namebandsfile)
+
+        nameepsfile = str(self.node.get_option('prefix')) + ".EPSIMG"
+        eps2_task = None
+        if nameepsfile in retrieved_names:
+            eps2_task = self._submit(parsing_pool, output_folder, nameepsfile, get_eps2_from_handle)
+
+        result_dict, last_geometry, forces, stress = xml_task.result()
 
         out_name = self.node.get_option('output_filename')
-        if out_name not in output_folder.list_object_names():
+        if out_name not in retrieved_names:
             raise OutputParsingError("output file not retrieved")
 
         output_dict = dict(list(result_dict.items()) + list(parser_info.items()))
 
         warnings_list = []
 
+        timing_profile = None
         json_name = self.node.process_class._JSON_FILE
-        if json_name in output_folder.list_object_names():
+        if json_name in retrieved_names:
+            timing_profile = get_timing_profile(output_folder, json_name)
             global_time, timing_decomp = get_timing_info(output_folder, json_name)
             if global_time is None:
                 warnings_list.append(["Cannot fully parse the time.json file"])
@@ -449,8 +672,8 @@ class SiestaParser(Parser):
                 output_dict["timing_decomposition"] = timing_decomp
 
         basis_enthalpy_name = self.node.process_class._BASIS_ENTHALPY_FILE
-        if basis_enthalpy_name in output_folder.list_object_names():
-            with output_folder.base.repository.open(basis_enthalpy_name, mode='rb') as handle:
+        if basis_enthalpy_name in retrieved_names:
+            with open_retrieved(output_folder, basis_enthalpy_name) as handle:
                 bas_enthalpy = float(handle.read().split()[0])
             output_dict["basis_enthalpy"] = bas_enthalpy
             output_dict["basis_enthalpy_units"] = "eV"
@@ -458,8 +681,8 @@ class SiestaParser(Parser):
             warnings_list.append(["BASIS_ENTHALPY file not retrieved"])
 
         harris_en_name = self.node.process_class._HARRIS_ENTHALPY_FILE
-        if harris_en_name in output_folder.list_object_names():
-            with output_folder.base.repository.open(harris_en_name, mode='rb') as handle:
+        if harris_en_name in retrieved_names:
+            with open_retrieved(output_folder, harris_en_name) as handle:
                 harr_enthalpy = float(handle.read().split()[0])
             output_dict["harris_basis_enthalpy"] = harr_enthalpy
             output_dict["harris_basis_enthalpy_units"] = "eV"
@@ -468,7 +691,7 @@ class SiestaParser(Parser):
 
         have_errors_to_analyse = False
         message_name = self.node.process_class._MESSAGES_FILE
-        if message_name not in output_folder.list_object_names():
+        if message_name not in retrieved_names:
             # Perhaps using an old version of Siesta
             warnings_list.append(['WARNING: No MESSAGES file, could not check if calculation terminated correctly'])
         else:
@@ -478,74 +701,88 @@ class SiestaParser(Parser):
             warnings_list.append(from_message)
         output_dict["warnings"] = warnings_list
 
+        # The .out file is read once. The SCF history and the memory per process reported by siesta (used to
+        # size the resources of the following runs) are always extracted. If something went wrong, the file is
+        # also scanned for all the known errors: the diagnostics are stored in the output parameters, the
+        # handlers of the SiestaBaseWorkChain rely on them.
+        with_diagnostics = have_errors_to_analyse and (
+            not succesful or any(not line.startswith('INFO') for line in from_message)
+        )
+        run_report = get_run_report(output_folder, out_name, diagnostics=with_diagnostics)
+        output_dict.update(run_report['memory'])
+        diagnostics = run_report['diagnostics']
+        if diagnostics is not None:
+            output_dict["diagnostics"] = diagnostics
+
         # An output_parametrs port is always return, even if only parser's info are present
         output_data = Dict(output_dict)
-        self.out('output_parameters', output_data)
+        self._out('output_parameters', output_data)
 
-        # When using floating sites, Siesta associates 'atomic positions' to them, and
-        # the structure and forces in the XML file include these fake atoms.
-        # In order to return physical structures and forces, we need to remove them.
-        # Recall that the input structure is the physical one, and the floating sites
-        # are specified in the 'basis' input
-        physical_structure = self.node.inputs.structure
-        number_of_real_atoms = len(physical_structure.sites)
+        # The complete tree of the siesta timer
+        if timing_profile is not None:
+            self._out('timing_profile', timing_profile)
+
+        # The SCF iterations of all the geometry steps
+        scf_history = get_scf_history_array(run_report['scf_history'])
+        if scf_history is not None:
+            self._out('scf_history', scf_history)
 
         # If the structure has changed, save it
         if output_dict['variable_geometry']:
-            in_struc = self.node.inputs.structure
-            # The next function never fails. If problems arise, the initial structure is
-            # returned. The input structure is also necessary because the CML file
-            # traditionally contains only the atomic symbols and not the site names.
-            # The returned structure does not have any floating atoms, they are removed
-            # in the `get_last_structure` call.
-            success, out_struc = get_last_structure(xmldoc, in_struc)
-            if not success:
+            in_struc = self._run_inputs.structure
+            # If problems arise, the initial structure is returned. The input structure is
+            # also necessary because the CML file traditionally contains only the atomic symbols
+            # and not the site names. The last geometry does not have any floating atoms, they
+            # are removed in the `parse_cml` call.
+            if last_geometry is None:
                 self.logger.warning("Problem in parsing final structure, returning inp structure in output_structure")
+                out_struc = in_struc
+            else:
+                out_struc = build_structure(in_struc, *last_geometry)
 
-            self.out('output_structure', out_struc)
+            self._out('output_structure', out_struc)
 
         # Attempt to parse forces and stresses. In case of failure "None" is returned.
         # Therefore the function never crashes
-        forces, stress = get_final_forces_and_stress(xmldoc)
         if forces is not None and stress is not None:
             from aiida.orm import ArrayData
             arraydata = ArrayData()
             arraydata.set_array('forces', np.array(forces[0:number_of_real_atoms]))
             arraydata.set_array('stress', np.array(stress))
-            self.out('forces_and_stress', arraydata)
+            self._out('forces_and_stress', arraydata)
 
         #Attempt to parse the ion files. Files ".ion.xml" are not produced by siesta if ions file are used
         #in input (`user-basis = T`). This explains the first "if" statement. The SiestaCal input is called
         #`ions__El` (El is the element label) therefore we look for the str "ions" in any of the inputs name.
-        if not any(("ions" in inp for inp in self.node.inputs)):  #pylint: disable=too-many-nested-blocks
+        if not any(("ions" in inp for inp in self._run_inputs)):  #pylint: disable=too-many-nested-blocks
             from aiida_siesta.data.ion import IonData
             ions = {}
             #Ions from the structure
-            in_struc = self.node.inputs.structure
+            in_struc = self._run_inputs.structure
             for kind in in_struc.get_kind_names():
                 ion_file_name = kind + ".ion.xml"
-                if ion_file_name in output_folder.list_object_names():
-                    with output_folder.base.repository.open(ion_file_name, mode='rb') as handle:
+                if ion_file_name in retrieved_names:
+                    with open_retrieved(output_folder, ion_file_name) as handle:
                         ions[kind] = IonData(handle)
                 else:
                     self.logger.warning(f"no ion file retrieved for {kind}")
             #Ions from floating_sites
-            if "basis" in self.node.inputs:
-                basis_dict = self.node.inputs.basis.get_dict()
+            if "basis" in self._run_inputs:
+                basis_dict = self._run_inputs.basis.get_dict()
                 if "floating_sites" in basis_dict:
                     floating_kinds = []
                     for orb in basis_dict["floating_sites"]:
                         if orb["name"] not in floating_kinds:
                             floating_kinds.append(orb["name"])
                             ion_file_name = orb["name"] + ".ion.xml"
-                            if ion_file_name in output_folder.list_object_names():
-                                with output_folder.base.repository.open(ion_file_name, mode='rb') as handle:
+                            if ion_file_name in retrieved_names:
+                                with open_retrieved(output_folder, ion_file_name) as handle:
                                     ions[orb["name"]] = IonData(handle)
                             else:
                                 self.logger.warning(f"no ion file retrieved for {orb['name']}")
             #Return the outputs
             if ions:
-                self.out('ion_files', ions)
+                self._out('ion_files', ions)
 
         # Error analysis
         if have_errors_to_analyse:
@@ -554,57 +791,82 @@ class SiestaParser(Parser):
             # (succesful False)
             for line in from_message:
                 if 'split options' in line:
-                    min_split = get_min_split(output_folder, out_name)
+                    min_split = diagnostics['min_split_norm']
                     if min_split:
                         self.logger.error(f"Error in split_norm option. Minimum value is {min_split}")
                         return self.exit_codes.SPLIT_NORM
                 if 'sys::die' in line:
                     #This is the situation when siesta dies with no specified error
                     #to be reported in "MESSAGES", unfortunately some interesting cases
-                    #are treated in this way, we explore the .out file for more insights.
-                    if is_polarization_problem(output_folder, out_name):
+                    #are treated in this way, the .out file gives more insights.
+                    if diagnostics['polarization_problem']:
                         return self.exit_codes.BASIS_POLARIZ
                 if 'SCF_NOT_CONV' in line:
+                    if diagnostics['walltime_stop']:
+                        self.logger.warning("SCF stopped due to max-walltime")
                     return self.exit_codes.SCF_NOT_CONV
                 if 'GEOM_NOT_CONV' in line:
+                    if diagnostics['walltime_stop']:
+                        self.logger.warning("Relaxation stopped due to max-walltime")
                     return self.exit_codes.GEOM_NOT_CONV
+            if diagnostics is not None and diagnostics['memory_allocation_failure']:
+                self.logger.error(diagnostics['lines']['memory_allocation_failure'])
+                return self.exit_codes.MEMORY_ALLOCATION_FAIL
+            # A job killed by one of the siesta monitors. The check of the monitor is repeated here
+            # on the complete retrieved output, in order to return the specific exit code.
+            if not succesful and scf_history is not None:
+                history = {name: scf_history.get_array(name) for name in scf_history.get_arraynames()}
+                failure = get_monitor_failure(self.node, history)
+                if failure is not None:
+                    self.logger.error(failure[1])
+                    return self.exit_codes[failure[0]]
 
         #Because no known error has been found, attempt to parse bands if requested
-        namebandsfile = str(self.node.get_option('prefix')) + ".bands"
-        if namebandsfile not in output_folder.list_object_names():
-            if "bandskpoints" in self.node.inputs:
+        if namebandsfile not in retrieved_names:
+            if "bandskpoints" in self._run_inputs:
                 return self.exit_codes.BANDS_FILE_NOT_PRODUCED
         else:
             #bands, coords = self._get_bands(bands_path)
             try:
-                bands = self._get_bands(output_folder, namebandsfile)
+                bands = bands_task.result()
             except (ValueError, IndexError):
                 return self.exit_codes.BANDS_PARSE_FAIL
             from aiida.orm import BandsData
             arraybands = BandsData()
             #Reset the cell for KpointsData of bands, necessary
             #for bandskpoints without cell and if structure changed
-            bkp = self.node.inputs.bandskpoints.clone()
+            bkp = self._run_inputs.bandskpoints.clone()
             if output_dict['variable_geometry']:
                 bkp.set_cell_from_structure(out_struc)
             else:
-                bkp.set_cell_from_structure(self.node.inputs.structure)
+                bkp.set_cell_from_structure(self._run_inputs.structure)
             arraybands.set_kpointsdata(bkp)
             arraybands.set_bands(bands, units="eV")
-            self.out('bands', arraybands)
+            self._out('bands', arraybands)
             #bandsparameters = Dict(dict={"kp_coordinates": coords})
-            #self.out('bands_parameters', bandsparameters)
+            #self._out('bands_parameters', bandsparameters)
 
         #Because no known error has been found, attempt to parse EPSIMG file if requested
-        nameepsfile = str(self.node.get_option('prefix')) + ".EPSIMG"
-        if nameepsfile not in output_folder.list_object_names():
-            if "optical" in self.node.inputs:
+        if nameepsfile not in retrieved_names:
+            if "optical" in self._run_inputs:
                 return self.exit_codes.EPS2_FILE_NOT_PRODUCED
         else:
-            eps2_list = get_eps2(output_folder, nameepsfile)
+            eps2_list = eps2_task.result()
             optical_eps2 = ArrayData()
             optical_eps2.set_array('e_eps2', np.array(eps2_list))
-            self.out('optical_eps2', optical_eps2)
+            self._out('optical_eps2', optical_eps2)
+
+        #Attempt to parse the plot file of the plstm run, if requested in the `postprocess` inputs
+        if "postprocess" in self._run_inputs and "stm" in self._run_inputs["postprocess"]:
+            stm_names = sorted(name for name in retrieved_names if name.endswith(".STM"))
+            if not stm_names:
+                return self.exit_codes.STM_FILE_NOT_PRODUCED
+            try:
+                with open_retrieved(output_folder, stm_names[0]) as handle:
+                    stm_array = get_stm_data(handle.read().decode('utf8'))
+            except (IOError, OSError, EOFError, ValueError):
+                return self.exit_codes.STM_PARSE_FAIL
+            self._out('stm_array', stm_array)
 
         #At the very end, return a particular exit code if "INFO: Job completed"
         #was not present in the MESSAGES file, but no known error is detected.
@@ -625,7 +887,8 @@ class SiestaParser(Parser):
         This file contains a line per message, prefixed with 'INFO', 'WARNING' or 'FATAL'.
         Returns a boolean indicating success (True) or failure (False) and a list of strings.
         """
-        lines = output_folder.get_object_content(messages_name).split('\n')
+        with open_retrieved(output_folder, messages_name) as handle:
+            lines = handle.read().decode('utf8', errors='replace').split('\n')
         #print(handle)
         #lines = handle.read().split('\n')  # There will be a final '' element
 
@@ -659,52 +922,7 @@ class SiestaParser(Parser):
         I recognise these two situations by looking at bandskpoints.label
         (like I did in the plugin)
         """
-        tottx = []
-        with output_folder.base.repository.open(bands_name, mode='rb') as handle:
+        with open_retrieved(output_folder, bands_name) as handle:
             tottx = handle.read().split()
-        #ef = float(tottx[0])
-        if self.node.inputs.bandskpoints.labels is None:
-            #minfreq, maxfreq = float(tottx[1]), float(tottx[2])
-            nbands, nspins, nkpoints = int(tottx[3]), int(tottx[4]), int(tottx[5])
-            spinup = np.zeros((nkpoints, nbands))
-            spindown = np.zeros((nkpoints, nbands))
-            #coords = np.zeros(nkpoints)
-            if nspins == 2:
-                block_length = nbands * 2
-            else:
-                block_length = nbands
-            for kp_indx in range(nkpoints):
-                # coords[kp_indx] = float(tottx[kp_indx * (block_length + 3) + 6])
-                for band_indx in range(nbands):
-                    spinup[kp_indx, band_indx] = (float(tottx[kp_indx * (block_length + 3) + 6 + band_indx + 3]))
-                    if nspins == 2:
-                        # Need more test!!!
-                        spindown[kp_indx,
-                                 band_indx] = (float(tottx[kp_indx * (nbands * 2 + 3) + 6 + band_indx + 3 + nbands]))
-        else:
-            #mink, maxk = float(tottx[1]), float(tottx[2])
-            #minfreq, maxfreq = float(tottx[3]), float(tottx[4])
-            nbands, nspins, nkpoints = int(tottx[5]), int(tottx[6]), int(tottx[7])
-            spinup = np.zeros((nkpoints, nbands))
-            spindown = np.zeros((nkpoints, nbands))
-            #coords = np.zeros(nkpoints)
-            if nspins == 2:
-                block_length = nbands * 2
-            else:
-                block_length = nbands
-
-            for kp_indx in range(nkpoints):
-                #coords[kp_indx] = float(tottx[kp_indx * (block_length + 1) + 8])
-                for band_indx in range(nbands):
-                    spinup[kp_indx, band_indx] = (float(tottx[kp_indx * (block_length + 1) + 8 + band_indx + 1]))
-                    if nspins == 2:
-                        spindown[kp_indx,
-                                 band_indx] = (float(tottx[kp_indx * (nbands * 2 + 1) + 8 + band_indx + 1 + nbands]))
-        if nspins == 2:
-            bands = (spinup, spindown)
-        elif nspins == 1:
-            bands = spinup
-        else:
-            raise ValueError('detected nspin > 2, something wrong')
 
-        return bands  #, coords
+        return get_bands_from_tokens(tottx, self._run_inputs.bandskpoints.labels is not None)
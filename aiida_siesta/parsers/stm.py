@@ -6,6 +6,8 @@ from aiida.common import exceptions
 from aiida.orm import Dict
 from aiida.parsers import Parser
 
+from aiida_siesta.utils.retrieve_policy import get_retrieved_names, open_retrieved
+
 # See the LICENSE.txt and AUTHORS.txt files.
 
 
@@ -28,7 +30,8 @@ class STMParser(Parser):
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
         filename_plot = None
-        for element in output_folder.list_object_names():
+        # Names of the uncompressed files, the plot file might be stored compressed
+        for element in get_retrieved_names(output_folder):
             if ".STM" in element:
                 filename_plot = element
 
@@ -46,8 +49,9 @@ class STMParser(Parser):
             )
 
         try:
-            plot_contents = output_folder.get_object_content(filename_plot)
-        except (IOError, OSError):
+            with open_retrieved(output_folder, filename_plot) as handle:
+                plot_contents = handle.read().decode('utf8')
+        except (IOError, OSError, EOFError):
             return self.exit_codes.ERROR_OUTPUT_PLOT_READ
 
         # Save grid_X, grid_Y, and STM arrays in an ArrayData object
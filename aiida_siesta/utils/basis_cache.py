@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the reuse of the ion files generated by previous calculations.
+
+A `SiestaCalculation` without `ions` generates the basis of each species from its pseudopotential and the
+PAO options of the `basis` input, and the parser stores the resulting ".ion.xml" files as `ion_files` outputs.
+When the basis cache is activated (`basis_cache` input of the `SiestaBaseWorkChain`), the ion files produced by
+a calculation are registered with a key (extra `siesta_basis_cache` of the `IonData`), that is the hash of the
+uuid of the code, of the md5 of the pseudopotential, of the name of the species and of the options that determine
+the generation of the basis. The following calculations with the same key for all their species receive the
+registered ions in input (therefore `user-basis` is set) and skip the generation of the basis.
+
+The key is conservative: all the PAO options of the `basis` input (not only the ones of a species) and the
+exchange-correlation options of the `parameters` input are part of it. The cache is per code, since the basis
+functions and the format of the ion files can change between versions (and builds) of siesta: ions generated
+with a code are never reused by another one, even if it runs the same executable.
+"""
+import hashlib
+import json
+
+from aiida_siesta.utils.tkdict import FDFDict
+
+# Name of the extra of the `IonData` nodes recording the key of the basis cache
+BASIS_CACHE_EXTRA = 'siesta_basis_cache'
+
+# Keys of the `parameters` (translated by the `FDFDict`) affecting the generation of the basis
+PARAMETERS_KEYS = ('xcfunctional', 'xcauthors')
+
+
+def _canonical_value(key, value):
+    """
+    Return a representation of an fdf value that does not depend on the formatting.
+
+    Blocks are compared line by line (with normalized spaces), the other values are parsed by `FDFDict.parse_value`.
+    """
+    if key.startswith('%block'):
+        return [' '.join(line.split()) for line in str(value).splitlines() if line.strip()]
+    value = FDFDict.parse_value(value)
+    if isinstance(value, tuple):
+        return [value.value, value.unit.lower()]
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def get_basis_options(basis=None, parameters=None):
+    """
+    Return the canonical options (PAO options of `basis` and exchange-correlation options of `parameters`).
+
+    :param basis: the python dictionary of the `basis` input (the `floating_sites` are ignored).
+    :param parameters: the python dictionary of the `parameters` input.
+    """
+    options = {}
+    for key, value in FDFDict(basis or {}).items():
+        if key.replace('%block', '').strip().startswith('pao'):
+            options[key] = _canonical_value(key, value)
+    for key, value in FDFDict(parameters or {}).items():
+        if key in PARAMETERS_KEYS:
+            options[key] = _canonical_value(key, value)
+    return options
+
+
+def get_basis_cache_keys(pseudos, code, basis=None, parameters=None):
+    """
+    Return the keys in the basis cache of the ions of each species.
+
+    :param pseudos: dictionary of the pseudos (`PsfData` or `PsmlData`), the keys are the names of the species
+        (kinds of the structure and floating sites).
+    :param code: the siesta code generating the basis.
+    :param basis: the python dictionary of the `basis` input.
+    :param parameters: the python dictionary of the `parameters` input.
+    :return: dictionary with the names of the species as keys and the keys of the cache as values.
+    """
+    options = get_basis_options(basis, parameters)
+    floating = {item['name'] for item in (basis or {}).get('floating_sites', [])}
+    keys = {}
+    for name, pseudo in pseudos.items():
+        content = {
+            'code': code.uuid,
+            'pseudo': pseudo.md5,
+            'name': name,
+            'floating': name in floating,
+            'options': options,
+        }
+        keys[name] = hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+    return keys
+
+
+def get_cached_ions(keys):
+    """
+    Return the `IonData` registered in the cache for the `keys`, with a single query.
+
+    When more ions are registered with the same key, the oldest one is returned.
+    :param keys: dictionary with the names of the species as keys and the keys of the cache as values.
+    :return: dictionary with the names of the species as keys and the `IonData` as values. Only the found
+        species are present.
+    """
+    from aiida.orm import QueryBuilder
+
+    from aiida_siesta.data.ion import IonData
+
+    if not keys:
+        return {}
+
+    filters = {f'extras.{BASIS_CACHE_EXTRA}': {'in': sorted(set(keys.values()))}}
+    query = QueryBuilder().append(IonData, filters=filters, tag='ion')
+    query.order_by({'ion': [{'ctime': 'desc'}]})
+    found = {ion.base.extras.get(BASIS_CACHE_EXTRA): ion for ion, in query.iterall()}
+
+    return {name: found[key] for name, key in keys.items() if key in found}
+
+
+def register_ions(ions, keys):
+    """
+    Register in the cache the ions generated by a calculation, for the species not already registered.
+
+    :param ions: dictionary with the names of the species as keys and the stored `IonData` as values,
+        for instance the `ion_files` outputs of a `SiestaCalculation`.
+    :param keys: dictionary with the names of the species as keys and the keys of the cache as values.
+    :return: the list of the names of the registered species.
+    """
+    cached = get_cached_ions(keys)
+    registered = []
+    for name, ion in ions.items():
+        if name in keys and name not in cached:
+            ion.base.extras.set(BASIS_CACHE_EXTRA, keys[name])
+            registered.append(name)
+    return registered
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the parsing of the CML (.xml) file produced by siesta.
+
+The `SiestaParser` traditionally loads the entire file in a `xml.dom.minidom` tree. For long relaxations
+and MD runs the file can reach hundreds of MB and the minidom tree several GB of memory.
+The `StreamedCML` class implemented here extracts the same information in a single pass over the file,
+based on `xml.etree.ElementTree.iterparse`, keeping in memory only the modules that are actually needed.
+"""
+from xml.etree.ElementTree import ParseError, iterparse
+
+# Keys of the scalar quantities transferred from the last "SCF Finalization" module to the output parameters
+STANDARD_OUTPUT_LIST = ['siesta:FreeE', 'siesta:E_KS', 'siesta:Ebs', 'siesta:E_Fermi', 'siesta:stot']
+
+# Keys of the properties reporting the sizes of the system (orbitals, non-zero interactions and mesh)
+SIZES_LIST = ['siesta:no_u', 'siesta:nnz', 'siesta:ntm']
+
+
+def local_name(tag):
+    """
+    Return the tag of an element without the namespace ('{http://www.xml-cml.org/schema}module' -> 'module').
+    """
+    return tag.rpartition('}')[2]
+
+
+def build_structure(input_structure, atomlist, cell):
+    """
+    Return a clone of `input_structure` with the new cell and the new positions of the sites.
+
+    :param input_structure: the input StructureData, only the first `len(atomlist)` sites are considered.
+    :param atomlist: list of [kind, [x, y, z]] for each real atom, in the order of the input structure.
+    :param cell: list of the three lattice vectors.
+    """
+    # Generally it is better to clone the input structure and reset the data, since site
+    # 'names' are not handled by the CML file (at least not in Siesta versions <= 4.0)
+
+    import copy
+
+    from aiida.orm.nodes.data.structure import Site
+
+    new_structure = input_structure.clone()
+    new_structure.reset_cell(cell)
+    new_structure.clear_sites()
+    for indx, atom in enumerate(atomlist):
+        new_site = Site(site=input_structure.sites[indx])
+        new_site.position = copy.deepcopy(atom[1])
+        new_structure.append_site(new_site)
+
+    # The most obvious alternative does not work, as the reset method below does not
+    # work if the numbers do not match.
+    #
+    ## new_pos = [atom[1] for atom in atomlist]
+    ## new_structure.reset_sites_positions(new_pos)
+
+    return new_structure
+
+
+def matrix_to_list(text, rows, cols):
+    """
+    Transform the text content of a CML <matrix> in a list of lists.
+
+    In CML the row (first) index is fastest, therefore the list has `cols` entries of `rows` elements.
+    """
+    flat = [float(x) for x in text.split()]
+    return [flat[rows * i:rows * (i + 1)] for i in range(cols)]
+
+
+class CMLIndex:  # pylint: disable=too-few-public-methods
+    """
+    Index of the relevant parts of a CML minidom tree, built in a single traversal.
+
+    The parsing helpers of `aiida_siesta.parsers.siesta` need the metadata, the last "SCF Finalization"
+    module, the last geometry module, the properties with the sizes of the system and the presence
+    of "Geom. Optim" or "LUA" modules. Instead of scanning all the modules of the tree each time,
+    they look up here the elements, recorded by role.
+    """
+
+    def __init__(self, xmldoc):
+        """
+        Build the index.
+
+        :param xmldoc: the `xml.dom.minidom.Document` of the CML file.
+        """
+        self.xmldoc = xmldoc
+        self.metadata = []
+        self.scf_final = None
+        self.last_geometry = None
+        self.sizes = {}
+        self.variable_geometry = False
+
+        self._index(xmldoc.documentElement, False)
+
+    def _index(self, element, in_serial):
+        """
+        Visit the children of `element` in document order, the same order of `getElementsByTagName`.
+
+        :param in_serial: whether `element` is (or is inside) a module with a "serial" attribute.
+        """
+        for child in element.childNodes:
+            if child.nodeType != child.ELEMENT_NODE:
+                continue
+            if child.tagName == 'module':
+                if child.getAttribute('title') == "SCF Finalization":
+                    self.scf_final = child
+                if child.hasAttribute('serial') and child.hasAttribute('dictRef'):
+                    if child.getAttribute('dictRef') != "SCF":
+                        self.last_geometry = child
+                if child.getAttribute('dictRef') in ("Geom. Optim", "LUA"):
+                    self.variable_geometry = True
+                self._index(child, in_serial or child.hasAttribute('serial'))
+                continue
+            if child.tagName == 'metadata':
+                self.metadata.append(child)
+            elif child.tagName == 'property' and in_serial:
+                if child.getAttribute('dictRef') in SIZES_LIST:
+                    self.sizes[child.getAttribute('dictRef')] = child
+            self._index(child, in_serial)
+
+
+def get_cml_index(xmldoc):
+    """
+    Return the `CMLIndex` of `xmldoc`. If `xmldoc` is already an index, it is returned unchanged.
+    """
+    if isinstance(xmldoc, CMLIndex):
+        return xmldoc
+    return CMLIndex(xmldoc)
+
+
+class StreamedCML:
+    """
+    Summary of a CML file obtained with a single streaming pass.
+
+    Only the metadata, the last "SCF Finalization" module, the last geometry module, the sizes info
+    and a flag signaling a variable geometry run are kept. The "SCF" step modules are discarded as soon
+    as they are read, and the same is done for any other top level element of the file.
+    The methods of this class return exactly the same results of the homonymous functions
+    in `aiida_siesta.parsers.siesta` that operate on the minidom tree.
+    """
+
+    def __init__(self, handle):
+        """
+        Parse the CML file.
+
+        :param handle: a file-like object (opened in binary mode) of the CML file.
+        """
+        self.metadata = {}
+        self.scf_final = None
+        self.last_geometry = None
+        self.no_u = None
+        self.nnz = None
+        self.mesh = None
+        self.variable_geometry = False
+
+        self._parse(handle)
+
+    def _parse(self, handle):  # pylint: disable=too-many-branches
+        """
+        Go through the file and store what is needed.
+
+        The "last" modules are selected when they are opened, in order to follow the document order
+        of `getElementsByTagName`. The elements are complete once the whole file is consumed.
+        """
+        elem_stack = []
+        module_stack = []
+
+        for event, elem in iterparse(handle, events=('start', 'end')):
+            tag = local_name(elem.tag)
+
+            if event == 'start':
+                elem_stack.append(elem)
+                if tag == 'module':
+                    module_stack.append(elem)
+                    if elem.get('title') == "SCF Finalization":
+                        self.scf_final = elem
+                    if 'serial' in elem.attrib and 'dictRef' in elem.attrib:
+                        if elem.get('dictRef') != "SCF":
+                            self.last_geometry = elem
+                    if elem.get('dictRef') in ("Geom. Optim", "LUA"):
+                        self.variable_geometry = True
+                continue
+
+            elem_stack.pop()
+
+            if tag == 'metadata':
+                self.metadata[elem.attrib['name']] = elem.attrib['content']
+
+            elif tag == 'property':
+                if elem.get('dictRef') in SIZES_LIST and any('serial' in mod.attrib for mod in module_stack):
+                    self._set_size(elem)
+
+            elif tag == 'module':
+                module_stack.pop()
+
+            # Top level elements and SCF steps are detached from their parent. The ones
+            # we need survive through the references stored in self.
+            if len(elem_stack) == 1 or (tag == 'module' and elem.get('dictRef') == "SCF" and elem_stack):
+                elem_stack[-1].remove(elem)
+
+    def _set_size(self, prop):
+        """
+        Set no_u, nnz or mesh from the corresponding property element.
+        """
+        name = prop.get('dictRef')
+        if name == "siesta:no_u":
+            self.no_u = int(prop.find('.//{*}scalar').text)
+        if name == "siesta:nnz":
+            self.nnz = int(prop.find('.//{*}scalar').text)
+        if name == "siesta:ntm":
+            self.mesh = [int(s) for s in prop.find('.//{*}array').text.split()]
+
+    def _scf_final_properties(self):
+        """
+        Iterate over the properties (with a dictRef) of the last "SCF Finalization" module.
+        """
+        if self.scf_final is None:
+            return
+        for prop in self.scf_final.iterfind('.//{*}property'):
+            if 'dictRef' in prop.attrib:
+                yield prop.get('dictRef'), prop
+
+    def get_dict(self):
+        """
+        Return the same dictionary of `get_dict_from_xml_doc`.
+        """
+        scalar_dict = dict(self.metadata)
+
+        for name, prop in self._scf_final_properties():
+            if name in STANDARD_OUTPUT_LIST:
+                data = prop.find('.//{*}scalar')
+                units = data.get('units')
+                unit_name = units[units.find(':') + 1:]
+                reduced_name = name[name.find(':') + 1:]
+                scalar_dict[reduced_name] = float(data.text)
+                scalar_dict[reduced_name + "_units"] = unit_name
+
+        scalar_dict['variable_geometry'] = self.variable_geometry
+
+        if self.no_u is not None:
+            scalar_dict['no_u'] = self.no_u
+        if self.nnz is not None:
+            scalar_dict['nnz'] = self.nnz
+        if self.mesh is not None:
+            scalar_dict['mesh'] = self.mesh
+
+        return scalar_dict
+
+    def get_last_geometry(self, number_of_real_atoms):
+        """
+        Return the same (atomlist, cell) tuple, or None, of `get_last_geometry`.
+        """
+        if self.last_geometry is None:
+            return None
+
+        atoms = list(self.last_geometry.iterfind('.//{*}atom'))
+        atomlist = []
+        for atm in atoms[0:number_of_real_atoms]:
+            position = [float(atm.get('x3')), float(atm.get('y3')), float(atm.get('z3'))]
+            atomlist.append([atm.get('elementType'), position])
+
+        cell = []
+        for latt in self.last_geometry.iterfind('.//{*}latticeVector'):
+            cell.append([float(s) for s in latt.text.split()])
+
+        return atomlist, cell
+
+    def get_final_forces_and_stress(self):
+        """
+        Return the same (forces, stress) tuple of `get_final_forces_and_stress`.
+        """
+        forces = None
+        stress = None
+
+        for name, prop in self._scf_final_properties():
+            if name in ('siesta:forces', 'siesta:stress'):
+                mat = prop.find('.//{*}matrix')
+                rows = int(mat.get('rows'))
+                cols = int(mat.get('columns'))
+                if name == 'siesta:forces':
+                    forces = matrix_to_list(mat.text, rows, cols)
+                else:
+                    stress = matrix_to_list(mat.text, rows, cols)
+
+        return forces, stress
+
+
+def read_streamed_cml(handle):
+    """
+    Return the `StreamedCML` of the xml file opened (in binary mode) in `handle`.
+
+    Corrupted files raise the same `OutputParsingError` of `get_parsed_xml_doc`.
+    """
+    from aiida.common import OutputParsingError
+
+    try:
+        cml = StreamedCML(handle)
+    except (EOFError, ParseError):
+        raise OutputParsingError("Faulty Xml File")
+
+    return cml
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the detection of known errors in the standard output (.out file) of siesta.
+
+Verbose runs can produce .out files of several GB, that are not read in memory and split in lines.
+The file is memory-mapped (when possible) and traversed once, in chunks small enough to stay in the
+processor cache. In each chunk all the known error signatures are searched (with the fast substring
+search of python bytes, a regex alternation of the signatures is more than ten times slower).
+The result is a "diagnostics" dictionary, stored by the `SiestaParser` in the `output_parameters`
+and consumed by the error handlers of the `SiestaBaseWorkChain`.
+
+The memory reported by siesta and the SCF history are extracted, for all the runs, with a single regex pass
+on the same mapped content, see `scan_run`. The diagnostics are added only when needed.
+Compressed files (see the retrieve policy) can not be mapped: they are decompressed in streaming and scanned
+in chunks of whole lines (`scan_output_stream` and `scan_run_stream`), never entirely in memory.
+"""
+import re
+
+from aiida_siesta.utils.retrieve_policy import get_stored_name, map_retrieved, open_retrieved, split_compressed_name
+from aiida_siesta.utils.scf_history import collect_scf_history
+
+# Signatures of the known problems, each of them is a tuple of alternative byte strings.
+# - The last line containing "split_norm" reports the minimum acceptable value.
+# - The "POLARIZATION" iteration loops when the polarization orbitals can not be generated,
+#   siesta then dies with no specific message.
+# - Memory failures include the siesta `alloc_err` and the common messages of compilers and runtimes.
+# - Siesta stops when the time set with `max-walltime` is close to exhaustion.
+OUTPUT_SIGNATURES = {
+    'split_norm_error': (b'split_norm',),
+    'polarization_problem': (b'POLARIZATION: Iteration to find the polarization',),
+    'scf_not_converged': (b'SCF_NOT_CONV',),
+    'geom_not_converged': (b'GEOM_NOT_CONV',),
+    'memory_allocation_failure': (
+        b'alloc_err: ',
+        b'insufficient virtual memory',
+        b'Cannot allocate memory',
+        b'Out of memory',
+        b'out of memory',
+    ),
+    'walltime_stop': (b'wall time exhaustion', b'walltime exhaustion', b'alltime reached', b'allTime reached'),
+}
+
+_CHUNK_SIZE = 1 << 20
+
+# Line of the memory report of siesta, for instance `* Maximum dynamic memory allocated =     3 MB`
+# or, in older versions, `* Maximum dynamic memory allocated : Node    0 =     3 MB`
+MEMORY_SIGNATURE = b'Maximum dynamic memory allocated'
+MEMORY_UNITS = {'kB': 1 / 1024, 'MB': 1, 'GB': 1024}
+
+# The SCF lines (see `aiida_siesta.utils.scf_history`) and the memory reports, found in a single pass
+_RUN_LINE = re.compile(rb'^ *(iscf|scf:) +(.*)$|^\* ' + MEMORY_SIGNATURE + rb'(.*)$', re.MULTILINE)
+
+
+def _get_line(buffer, start, end):
+    """
+    Return the (decoded) line of `buffer` containing the match from `start` to `end`.
+    """
+    line_start = buffer.rfind(b'\n', 0, start) + 1
+    line_end = buffer.find(b'\n', end)
+    if line_end == -1:
+        line_end = len(buffer)
+    return buffer[line_start:line_end].decode(errors='replace').strip()
+
+
+def scan_output(buffer):
+    """
+    Search all the known error signatures in the content of the .out file.
+
+    :param buffer: the content of the file, as bytes or `mmap.mmap` object.
+    :return: the diagnostics dictionary. It has a boolean for each key of `OUTPUT_SIGNATURES`,
+        the `min_split_norm` (float or None) and, under `lines`, the last line matching each detected signature.
+    """
+    return _get_diagnostics(_find_signature_lines(buffer))
+
+
+def _find_signature_lines(buffer):
+    """
+    Return a dictionary with the last line of `buffer` matching each detected signature.
+    """
+    lines = {}
+
+    # Consecutive chunks overlap, so that signatures across the boundaries are not missed
+    overlap = max(len(sign) for alternatives in OUTPUT_SIGNATURES.values() for sign in alternatives) - 1
+    size = len(buffer)
+    last_position = {}
+    for start in range(0, size, _CHUNK_SIZE):
+        end = min(start + _CHUNK_SIZE + overlap, size)
+        for name, alternatives in OUTPUT_SIGNATURES.items():
+            for sign in alternatives:
+                position = buffer.rfind(sign, start, end)
+                if position > last_position.get(name, (-1, 0))[0]:
+                    last_position[name] = (position, position + len(sign))
+
+    for name, (start, end) in last_position.items():
+        lines[name] = _get_line(buffer, start, end)
+
+    return lines
+
+
+def _get_diagnostics(lines):
+    """
+    Return the diagnostics dictionary (see `scan_output`) from the last lines matching each detected signature.
+    """
+    diagnostics = {name: name in lines for name in OUTPUT_SIGNATURES}
+    diagnostics['min_split_norm'] = None
+    if 'split_norm_error' in lines:
+        try:
+            diagnostics['min_split_norm'] = float(lines['split_norm_error'].split()[4][:-1])
+        except (IndexError, ValueError):
+            pass
+
+    diagnostics['lines'] = lines
+
+    return diagnostics
+
+
+def _iter_chunks(handle):
+    """
+    Read the stream `handle` in chunks of (about) `_CHUNK_SIZE` bytes, each of them made of whole lines.
+    """
+    rest = b''
+    while True:
+        chunk = handle.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        content = rest + chunk
+        cut = content.rfind(b'\n') + 1
+        if cut:
+            yield content[:cut]
+        rest = content[cut:]
+    if rest:
+        yield rest
+
+
+def scan_output_stream(handle):
+    """
+    Search all the known error signatures in the .out file opened (in binary mode) in `handle`.
+
+    Same as `scan_output`, but the stream (for instance a decompressing handle) is read in chunks.
+    """
+    lines = {}
+    for chunk in _iter_chunks(handle):
+        lines.update(_find_signature_lines(chunk))
+
+    return _get_diagnostics(lines)
+
+
+def _is_compressed(output_folder, out_name):
+    """
+    Return True if the file `out_name` is stored compressed in `output_folder`.
+    """
+    return split_compressed_name(get_stored_name(output_folder, out_name))[1] is not None
+
+
+def get_output_diagnostics(output_folder, out_name):
+    """
+    Return the diagnostics dictionary (see `scan_output`) of the .out file in `output_folder`.
+
+    The file is memory-mapped if the repository returns a handle on a real file, a compressed file is
+    decompressed in streaming. Otherwise (for instance for packed objects) the content is read in memory.
+    """
+    if _is_compressed(output_folder, out_name):
+        with open_retrieved(output_folder, out_name) as handle:
+            return scan_output_stream(handle)
+
+    with map_retrieved(output_folder, out_name) as buffer:
+        return scan_output(buffer)
+
+
+def _get_memory_report(lines):
+    """
+    Return the memory report (see `scan_memory`) from the decoded memory lines of siesta.
+    """
+    values = []
+    for line in lines:
+        try:
+            value, unit = line.rsplit('=', 1)[1].split()
+            values.append(float(value) * MEMORY_UNITS[unit])
+        except (IndexError, KeyError, ValueError):
+            pass
+
+    if not values:
+        return {}
+
+    return {'memory_estimate': values[0], 'memory_peak': max(values), 'memory_units': 'MB'}
+
+
+def scan_memory(buffer):
+    """
+    Extract the memory reported by siesta in the content of the .out file.
+
+    Siesta reports the maximum memory allocated by a process ("Node") so far at the end of the setup, before
+    the SCF cycle, and after each geometry step.
+    :param buffer: the content of the file, as bytes or `mmap.mmap` object.
+    :return: a dictionary with the `memory_estimate` (the memory needed after the setup), the `memory_peak`
+        and the `memory_units` (MB), all per MPI process; empty if no memory report is found.
+    """
+    lines = []
+    position = buffer.find(MEMORY_SIGNATURE)
+    while position != -1:
+        end = position + len(MEMORY_SIGNATURE)
+        lines.append(_get_line(buffer, position, end))
+        position = buffer.find(MEMORY_SIGNATURE, end)
+
+    return _get_memory_report(lines)
+
+
+def scan_run(buffer, diagnostics=True):
+    """
+    Extract from the content of the .out file everything the `SiestaParser` needs.
+
+    The SCF lines and the memory reports are collected in a single regex pass, the error signatures are
+    searched (see `scan_output`) only if `diagnostics` is True.
+    :param buffer: the content of the file, as bytes or `mmap.mmap` object.
+    :return: a dictionary with the `scf_history` (see `aiida_siesta.utils.scf_history.parse_scf_history`),
+        the `memory` (see `scan_memory`) and the `diagnostics` (None if not requested).
+    """
+    scf_lines = []
+    memory_lines = []
+    _collect_run_lines(buffer, scf_lines, memory_lines)
+
+    return {
+        'scf_history': collect_scf_history(scf_lines),
+        'memory': _get_memory_report(memory_lines),
+        'diagnostics': scan_output(buffer) if diagnostics else None,
+    }
+
+
+def _collect_run_lines(buffer, scf_lines, memory_lines):
+    """
+    Append to `scf_lines` and `memory_lines` the SCF lines and the memory reports found in `buffer`.
+    """
+    for match in _RUN_LINE.finditer(buffer):
+        if match.group(1) is None:
+            memory_lines.append(match.group(3).decode(errors='replace'))
+        else:
+            scf_lines.append((match.group(1), match.group(2)))
+
+
+def scan_run_stream(handle, diagnostics=True):
+    """
+    Extract everything the `SiestaParser` needs from the .out file opened (in binary mode) in `handle`.
+
+    Same as `scan_run`, but the stream (for instance a decompressing handle) is read in chunks of whole lines,
+    each of them searched for the SCF lines, the memory reports and (if requested) the error signatures.
+    """
+    scf_lines = []
+    memory_lines = []
+    lines = {}
+    for chunk in _iter_chunks(handle):
+        _collect_run_lines(chunk, scf_lines, memory_lines)
+        if diagnostics:
+            lines.update(_find_signature_lines(chunk))
+
+    return {
+        'scf_history': collect_scf_history(scf_lines),
+        'memory': _get_memory_report(memory_lines),
+        'diagnostics': _get_diagnostics(lines) if diagnostics else None,
+    }
+
+
+def get_run_report(output_folder, out_name, diagnostics=True):
+    """
+    Return the report (see `scan_run`) of the .out file in `output_folder`, reading the file once.
+
+    The file is memory-mapped (see `map_retrieved`) if stored uncompressed, otherwise it is decompressed
+    in streaming (see `scan_run_stream`), so that its content is never entirely in memory.
+    """
+    if _is_compressed(output_folder, out_name):
+        with open_retrieved(output_folder, out_name) as handle:
+            return scan_run_stream(handle, diagnostics)
+
+    with map_retrieved(output_folder, out_name) as buffer:
+        return scan_run(buffer, diagnostics)
@@ -0,0 +1,606 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools to import in the database siesta runs performed outside AiiDA.
+
+Each run directory (a directory with an .fdf input and the .xml output of siesta) becomes a `CalcJobNode`
+of a `SiestaCalculation`, marked as imported, with the inputs reconstructed from the fdf file (`structure`,
+`parameters`, `basis`, `kpoints` and the `pseudos` found in the directory) and the outputs of the `SiestaParser`
+(`output_parameters`, `output_structure`, `forces_and_stress`), plus `remote_folder` (the run directory) and,
+optionally, `retrieved`.
+
+The import is split in two parts:
+
+* the reading of the files of each run (`parse_run_directory`), executed in a pool of processes. It does not
+  touch the database and returns plain python data;
+* the creation of the nodes (`store_run`), in the main process, in batches committed in a single transaction.
+
+Every imported calculation has the absolute path of its run directory in the `siesta_import_path` extra.
+Directories already imported are skipped, therefore an interrupted import can be simply restarted.
+"""
+import hashlib
+import os
+
+from aiida_siesta.parsers.siesta import get_timing_info_from_handle, parse_cml
+from aiida_siesta.utils.diagnostics import scan_memory
+from aiida_siesta.utils.retrieve_policy import COMPRESSORS, split_compressed_name
+from aiida_siesta.utils.tkdict import FDFDict
+
+# Extra storing the run directory of an imported calculation
+IMPORT_PATH_EXTRA = 'siesta_import_path'
+
+# Conversion factors to Angstrom of the length units of fdf
+LENGTH_UNITS = {'ang': 1.0, 'bohr': 0.529177210903, 'nm': 10.0, 'm': 1e10, 'cm': 1e8}
+
+# Keys of the fdf that are reconstructed as the structure and kpoints inputs or set by the plugin
+STRUCTURAL_KEYS = [
+    FDFDict.translate_key(key) for key in [
+        'lattice-constant',
+        '%block lattice-vectors',
+        '%block lattice-parameters',
+        '%block chemical-species-label',
+        '%block atomic-coordinates-and-atomic-species',
+        'atomic-coordinates-format',
+        '%block kgrid_monkhorst_pack',
+        '%block kgrid-monkhorst-pack',
+    ]
+]
+
+# Output files stored in the `retrieved` folder (besides the .xml file)
+RETRIEVED_NAMES = ['MESSAGES', 'time.json', 'BASIS_ENTHALPY', 'BASIS_HARRIS_ENTHALPY']
+
+
+def _strip_comment(line):
+    """
+    Return the line without the fdf comment (starting with `#`, `!` or `;`).
+    """
+    for char in '#!;':
+        position = line.find(char)
+        if position != -1:
+            line = line[:position]
+    return line
+
+
+def _read_lines(path):
+    """
+    Return the lines of the text file `path`, decompressing it if needed.
+    """
+    _, opener = split_compressed_name(path)
+    if opener is None:
+        with open(path, 'rb') as handle:
+            content = handle.read()
+    else:
+        with opener(path) as handle:
+            content = handle.read()
+    return content.decode(errors='replace').splitlines()
+
+
+def read_fdf(path, fdf=None):
+    r"""
+    Read the fdf file `path` in an `FDFDict`.
+
+    The `%include` directives, the `%block name < file` and the `key < file` redirections are followed
+    (relative paths refer to the directory of the including file). Blocks are stored with the key
+    `%block name` and the value `\n<lines>\n%endblock name`, as in the `parameters` of the `SiestaCalculation`.
+    A key with no value is a logical true. As in fdf, the first definition of a key is kept.
+    :param path: the path of the fdf file.
+    :param fdf: the `FDFDict` to fill, a new one if None.
+    :return: the `FDFDict`.
+    """
+    if fdf is None:
+        fdf = FDFDict()
+    directory = os.path.dirname(path)
+
+    def add(key, value):
+        if key not in fdf:
+            fdf[key] = value
+
+    lines = iter(_read_lines(path))
+    for line in lines:
+        tokens = _strip_comment(line).split()
+        if not tokens:
+            continue
+        directive = tokens[0].lower()
+        if directive == '%include' and len(tokens) > 1:
+            read_fdf(os.path.join(directory, tokens[1]), fdf)
+        elif directive == '%block' and len(tokens) > 1:
+            name = tokens[1]
+            if len(tokens) > 3 and tokens[2] == '<':
+                block_lines = [item.strip() for item in _read_lines(os.path.join(directory, tokens[3]))]
+            else:
+                block_lines = []
+                for block_line in lines:
+                    block_tokens = _strip_comment(block_line).split()
+                    if block_tokens and block_tokens[0].lower() == '%endblock':
+                        break
+                    if block_tokens:
+                        block_lines.append(' '.join(block_tokens))
+            add(f'%block {name}', '\n' + '\n'.join(block_lines) + f'\n%endblock {name}')
+        elif len(tokens) > 2 and tokens[1] == '<':
+            included = read_fdf(os.path.join(directory, tokens[2]))
+            if tokens[0] in included:
+                add(tokens[0], included[tokens[0]])
+        elif not directive.startswith('%'):
+            add(tokens[0], ' '.join(tokens[1:]) if len(tokens) > 1 else 'T')
+
+    return fdf
+
+
+def get_block_rows(fdf, name):
+    """
+    Return the rows (lists of tokens) of the block `name` of `fdf`, None if the block is not defined.
+    """
+    key = '%block ' + FDFDict.translate_key(name)
+    if key not in fdf:
+        return None
+    return [line.split() for line in fdf[key].splitlines()[1:-1] if line.strip()]
+
+
+def get_length(fdf, key, default):
+    """
+    Return the length `key` of `fdf` in Angstrom (a number is in Bohr, the default unit of fdf lengths).
+    """
+    if key not in fdf:
+        return default
+    value = fdf.get_typed(key)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value * LENGTH_UNITS['bohr']
+    try:
+        return value.value * LENGTH_UNITS[value.unit.lower()]
+    except (AttributeError, KeyError) as exception:
+        raise ValueError(f'Unsupported value of `{key}`: {fdf[key]}') from exception
+
+
+def get_structure_from_fdf(fdf):
+    """
+    Return the structure defined in `fdf`, as plain python data.
+
+    :return: a dictionary with the `cell` (Angstrom), the `species` (list of (label, atomic number) in the
+        order of the chemicalspecieslabel block, negative atomic numbers for floating sites) and the `sites`
+        (list of (label, [x, y, z]) in Angstrom).
+    :raise ValueError: if the structure can not be reconstructed.
+    """
+    import numpy as np
+
+    alat = get_length(fdf, 'lattice-constant', None)
+    vectors = get_block_rows(fdf, 'lattice-vectors')
+    parameters = get_block_rows(fdf, 'lattice-parameters')
+    if vectors is None and parameters is None:
+        raise ValueError('The lattice is not defined (no lattice-vectors or lattice-parameters block)')
+    if alat is None:
+        raise ValueError('The lattice-constant is not defined')
+    if vectors is not None:
+        cell = np.array([[float(value) for value in row[:3]] for row in vectors[:3]]) * alat
+    else:
+        from ase.geometry import cellpar_to_cell
+        lengths = [float(value) * alat for value in parameters[0][:3]]
+        cell = cellpar_to_cell(lengths + [float(value) for value in parameters[0][3:6]])
+
+    species_rows = get_block_rows(fdf, 'chemical-species-label')
+    if not species_rows:
+        raise ValueError('The chemical-species-label block is not defined')
+    species = [(row[2], int(row[1])) for row in species_rows]
+    labels = {int(row[0]): row[2] for row in species_rows}
+
+    coordinates = get_block_rows(fdf, 'atomic-coordinates-and-atomic-species')
+    if not coordinates:
+        raise ValueError('The atomic-coordinates-and-atomic-species block is not defined')
+    positions = np.array([[float(value) for value in row[:3]] for row in coordinates])
+    coordinates_format = FDFDict.translate_key(str(fdf.get('atomic-coordinates-format', 'Bohr')))
+    if coordinates_format in ['bohr', 'notscaledcartesianbohr']:
+        positions *= LENGTH_UNITS['bohr']
+    elif coordinates_format == 'scaledcartesian':
+        positions *= alat
+    elif coordinates_format in ['fractional', 'scaledbylatticevectors']:
+        positions = positions @ cell
+    elif coordinates_format not in ['ang', 'notscaledcartesianang']:
+        raise ValueError(f'Unsupported atomic-coordinates-format: {coordinates_format}')
+    sites = [(labels[int(row[3])], position) for row, position in zip(coordinates, positions.tolist())]
+
+    return {'cell': cell.tolist(), 'species': species, 'sites': sites}
+
+
+def get_kpoints_from_fdf(fdf):
+    """
+    Return the (mesh, offset) of the kgrid_monkhorst_pack block of `fdf`, None if not defined (gamma only).
+
+    :raise ValueError: if the grid is not diagonal (not supported by the `SiestaCalculation`).
+    """
+    rows = get_block_rows(fdf, 'kgrid_monkhorst_pack') or get_block_rows(fdf, 'kgrid-monkhorst-pack')
+    if rows is None:
+        return None
+    mesh = []
+    offset = []
+    for index, row in enumerate(rows[:3]):
+        values = [int(value) for value in row[:3]]
+        if any(value for position, value in enumerate(values) if position != index):
+            raise ValueError('Only diagonal kgrid_monkhorst_pack blocks are supported')
+        mesh.append(values[index])
+        offset.append(float(row[3]) if len(row) > 3 else 0.)
+    return mesh, offset
+
+
+def split_fdf(fdf):
+    """
+    Split the keys of `fdf` in the `parameters` and the `basis` (the pao keys) inputs of a `SiestaCalculation`.
+
+    The structural keys and the keys set by the plugin are dropped. The dots in the keys, not allowed in the
+    keys of a `Dict`, are replaced by dashes (an equivalent spelling for fdf).
+    """
+    from aiida_siesta.calculations.siesta import SiestaCalculation
+
+    dropped = set(STRUCTURAL_KEYS + SiestaCalculation._aiida_blocked_keywords)  # pylint: disable=protected-access
+    parameters = {}
+    basis = {}
+    for key, value in fdf.untranslated_items():
+        translated = FDFDict.translate_key(key)
+        if translated in dropped:
+            continue
+        if translated.startswith('pao') or translated.startswith('%block pao'):
+            basis[key.replace('.', '-')] = value
+        else:
+            parameters[key.replace('.', '-')] = value
+    return parameters, basis
+
+
+def find_run_directories(root):
+    """
+    Return the sorted list of the run directories under `root`: the ones with an .fdf and a .xml file.
+    """
+    xml_suffixes = tuple('.xml' + suffix for _, suffix, _ in COMPRESSORS.values()) + ('.xml',)
+    directories = []
+    for directory, _, names in os.walk(root):
+        if any(name.endswith('.fdf') for name in names) and any(name.endswith(xml_suffixes) for name in names):
+            directories.append(os.path.abspath(directory))
+    return sorted(directories)
+
+
+def _find_file(directory, names, name):
+    """
+    Return the path of the file `name` of `directory`, or of its compressed version, None if not present.
+    """
+    if name in names:
+        return os.path.join(directory, name)
+    for _, suffix, _ in COMPRESSORS.values():
+        if name + suffix in names:
+            return os.path.join(directory, name + suffix)
+    return None
+
+
+def _open(path):
+    """
+    Open the file `path` in binary mode, decompressing it in streaming if needed.
+    """
+    _, opener = split_compressed_name(path)
+    return open(path, 'rb') if opener is None else opener(path)
+
+
+def _md5(path):
+    """
+    Return the md5 of the content of the file `path`.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_input_fdf(directory, names):
+    """
+    Return the path of the input fdf file of the run in `directory` and its `FDFDict`.
+
+    Files included by other fdf files are not candidates. Among several candidates, the one whose
+    SystemLabel corresponds to the .xml file of the directory is selected.
+    :raise ValueError: if the input fdf file can not be identified.
+    """
+    fdf_names = sorted(name for name in names if name.endswith('.fdf'))
+    included = set()
+    for name in fdf_names:
+        for line in _read_lines(os.path.join(directory, name)):
+            tokens = _strip_comment(line).split()
+            if len(tokens) > 1 and tokens[0].lower() == '%include':
+                included.add(os.path.basename(tokens[1]))
+            elif len(tokens) > 3 and tokens[0].lower() == '%block' and tokens[2] == '<':
+                included.add(os.path.basename(tokens[3]))
+    candidates = [name for name in fdf_names if name not in included]
+
+    matching = []
+    for name in candidates:
+        fdf = read_fdf(os.path.join(directory, name))
+        label = str(fdf.get('system-label', 'siesta'))
+        if _find_file(directory, names, label + '.xml') is not None:
+            matching.append((name, fdf))
+    if len(matching) != 1:
+        raise ValueError(f'Can not identify the input fdf file among: {", ".join(candidates) or "none"}')
+    return matching[0]
+
+
+def parse_run_directory(directory):  # pylint: disable=too-many-locals
+    """
+    Read the input and the output files of the siesta run in `directory`.
+
+    It does not access the database, it can run in a separate process.
+    :return: a dictionary with plain python data: the `path`, the `input_filename`, the `prefix`, the `structure`
+        (see `get_structure_from_fdf`), the `kpoints` (mesh, offset) or None, the `parameters` and `basis`,
+        the `pseudos` ({label: (path, md5)}), the `output_parameters`, the `last_geometry`, the `forces` and
+        `stress`, the `messages` (lines of the MESSAGES file, None if missing) and the `retrieved` files.
+        If the run can not be read, only the `path` and the `error` message.
+    """
+    try:
+        names = set(os.listdir(directory))
+        input_filename, fdf = get_input_fdf(directory, names)
+        prefix = str(fdf.get('system-label', 'siesta'))
+
+        structure = get_structure_from_fdf(fdf)
+        kpoints = get_kpoints_from_fdf(fdf)
+        parameters, basis = split_fdf(fdf)
+
+        pseudos = {}
+        for label, _ in structure['species']:
+            for extension in ['.psf', '.psml']:
+                if label + extension in names:
+                    path = os.path.join(directory, label + extension)
+                    pseudos[label] = (path, _md5(path))
+                    break
+            else:
+                raise ValueError(f'No pseudopotential file for the species {label}')
+
+        number_of_real_atoms = sum(1 for label, _ in structure['sites'] if dict(structure['species'])[label] > 0)
+        xml_path = _find_file(directory, names, prefix + '.xml')
+        with _open(xml_path) as handle:
+            output_parameters, last_geometry, forces, stress = parse_cml(handle, True, number_of_real_atoms)
+        retrieved = [xml_path]
+
+        json_path = _find_file(directory, names, 'time.json')
+        if json_path is not None:
+            with _open(json_path) as handle:
+                global_time, timing_decomposition = get_timing_info_from_handle(handle)
+            if global_time is not None:
+                output_parameters['global_time'] = global_time
+                output_parameters['timing_decomposition'] = timing_decomposition
+
+        out_names = sorted(name for name in names if split_compressed_name(name)[0].endswith('.out'))
+        output_filename = None
+        if out_names:
+            output_filename = split_compressed_name(out_names[0])[0]
+            with _open(os.path.join(directory, out_names[0])) as handle:
+                output_parameters.update(scan_memory(handle.read()))
+            retrieved.append(os.path.join(directory, out_names[0]))
+
+        messages = None
+        messages_path = _find_file(directory, names, 'MESSAGES')
+        if messages_path is not None:
+            messages = [line.strip() for line in _read_lines(messages_path) if line.strip()]
+            output_parameters['warnings'] = [messages]
+
+        for name in RETRIEVED_NAMES:
+            path = _find_file(directory, names, name)
+            if path is not None and path not in retrieved:
+                retrieved.append(path)
+    except Exception as exception:  # pylint: disable=broad-except
+        return {'path': directory, 'error': f'{type(exception).__name__}: {exception}'}
+
+    return {
+        'path': directory,
+        'input_filename': input_filename,
+        'output_filename': output_filename,
+        'prefix': prefix,
+        'structure': structure,
+        'kpoints': kpoints,
+        'parameters': parameters,
+        'basis': basis,
+        'pseudos': pseudos,
+        'output_parameters': output_parameters,
+        'last_geometry': last_geometry,
+        'forces': forces,
+        'stress': stress,
+        'messages': messages,
+        'retrieved': retrieved,
+    }
+
+
+def get_exit_status(messages):
+    """
+    Return the exit status of the `SiestaCalculation` for a run with the MESSAGES file `messages`.
+
+    Runs without a MESSAGES file (old versions of siesta) are considered successful.
+    """
+    from aiida_siesta.calculations.siesta import SiestaCalculation
+
+    if messages is None:
+        return 0
+    exit_codes = SiestaCalculation.exit_codes
+    if any('SCF_NOT_CONV' in line for line in messages):
+        return exit_codes.SCF_NOT_CONV.status  #pylint: disable = no-member
+    if any('GEOM_NOT_CONV' in line for line in messages):
+        return exit_codes.GEOM_NOT_CONV.status  #pylint: disable = no-member
+    if any('INFO: Job completed' in line for line in messages):
+        return 0
+    return exit_codes.UNEXPECTED_TERMINATION.status  #pylint: disable = no-member
+
+
+def get_imported_paths():
+    """
+    Return the set of run directories already imported in the database.
+    """
+    from aiida import orm
+
+    query = orm.QueryBuilder()
+    query.append(
+        orm.CalcJobNode,
+        filters={'extras': {
+            'has_key': IMPORT_PATH_EXTRA
+        }},
+        project=f'extras.{IMPORT_PATH_EXTRA}',
+    )
+    return set(query.all(flat=True))
+
+
+def get_pseudo(path, md5, pseudo_nodes):
+    """
+    Return the stored pseudopotential node of the file `path`, reusing the nodes with the same md5.
+
+    :param pseudo_nodes: a dictionary {md5: node}, caching the nodes across the runs.
+    """
+    from aiida_pseudo.data.pseudo import PsfData, PsmlData
+
+    if md5 not in pseudo_nodes:
+        pseudo_class = PsmlData if path.endswith('.psml') else PsfData
+        pseudo = pseudo_class.get_or_create(path)
+        if not pseudo.is_stored:
+            pseudo.store()
+        pseudo_nodes[md5] = pseudo
+    return pseudo_nodes[md5]
+
+
+def store_run(run, computer, code=None, pseudo_nodes=None, store_retrieved=True):  # pylint: disable=too-many-locals,too-many-statements
+    """
+    Create and store the imported `CalcJobNode`, with its inputs and outputs, of a run read by `parse_run_directory`.
+
+    :param run: the dictionary returned by `parse_run_directory`.
+    :param computer: the computer of the `remote_folder` and of the calculation.
+    :param code: optional code linked as input of the calculation.
+    :param pseudo_nodes: a dictionary {md5: node} of the pseudopotentials already stored.
+    :param store_retrieved: whether to store the output files in the `retrieved` folder.
+    :return: the stored `CalcJobNode`.
+    """
+    from aiida import orm
+    from aiida.common import LinkType
+    from aiida.common.constants import elements
+    from aiida.orm.nodes.data.structure import Kind
+    import numpy as np
+    from plumpy import ProcessState
+
+    from aiida_siesta.utils.cml import build_structure
+
+    pseudo_nodes = {} if pseudo_nodes is None else pseudo_nodes
+    atomic_numbers = dict(run['structure']['species'])
+
+    structure = orm.StructureData(cell=run['structure']['cell'])
+    for label, atomic_number in run['structure']['species']:
+        if atomic_number > 0:
+            structure.append_kind(Kind(symbols=elements[atomic_number]['symbol'], name=label))
+    floating_sites = []
+    for label, position in run['structure']['sites']:
+        if atomic_numbers[label] > 0:
+            structure.append_site(orm.nodes.data.structure.Site(kind_name=label, position=position))
+        else:
+            symbol = elements[-atomic_numbers[label]]['symbol']
+            floating_sites.append({'name': label, 'symbols': symbol, 'position': position})
+
+    basis = dict(run['basis'])
+    if floating_sites:
+        basis['floating_sites'] = floating_sites
+
+    inputs = {'structure': structure, 'parameters': orm.Dict(run['parameters'])}
+    if basis:
+        inputs['basis'] = orm.Dict(basis)
+    if run['kpoints'] is not None:
+        kpoints = orm.KpointsData()
+        kpoints.set_kpoints_mesh(*run['kpoints'])
+        inputs['kpoints'] = kpoints
+    for label, (path, md5) in run['pseudos'].items():
+        inputs[f'pseudos__{label}'] = get_pseudo(path, md5, pseudo_nodes)
+    if code is not None:
+        inputs['code'] = code
+
+    node = orm.CalcJobNode(computer=computer, process_type='aiida.calculations:siesta.siesta')
+    node.set_process_label('SiestaCalculation')
+    node.set_option('input_filename', run['input_filename'])
+    if run['output_filename'] is not None:
+        node.set_option('output_filename', run['output_filename'])
+    node.set_option('prefix', run['prefix'])
+    node.set_option('parser_name', 'siesta.parser')
+    node.base.attributes.set(node.IMMIGRATED_KEY, True)
+    node.base.extras.set(IMPORT_PATH_EXTRA, run['path'])
+    for link_label, input_node in inputs.items():
+        if not input_node.is_stored:
+            input_node.store()
+        node.base.links.add_incoming(input_node, link_type=LinkType.INPUT_CALC, link_label=link_label)
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(get_exit_status(run['messages']))
+    node.store()
+
+    outputs = {
+        'output_parameters': orm.Dict(run['output_parameters']),
+        'remote_folder': orm.RemoteData(computer=computer, remote_path=run['path']),
+    }
+    if run['output_parameters'].get('variable_geometry') and run['last_geometry'] is not None:
+        outputs['output_structure'] = build_structure(structure, *run['last_geometry'])
+    if run['forces'] is not None and run['stress'] is not None:
+        number_of_real_atoms = len(structure.sites)
+        forces_and_stress = orm.ArrayData()
+        forces_and_stress.set_array('forces', np.array(run['forces'][0:number_of_real_atoms]))
+        forces_and_stress.set_array('stress', np.array(run['stress']))
+        outputs['forces_and_stress'] = forces_and_stress
+    if store_retrieved:
+        retrieved = orm.FolderData()
+        for path in run['retrieved']:
+            retrieved.base.repository.put_object_from_file(path, os.path.basename(path))
+        outputs['retrieved'] = retrieved
+    for link_label, output_node in outputs.items():
+        output_node.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=link_label)
+        output_node.store()
+
+    return node
+
+
+def import_runs(root, computer, code=None, group=None, processes=None, batch_size=100, store_retrieved=True):  # pylint: disable=too-many-locals,too-many-arguments
+    """
+    Import in the database all the siesta runs found under the directory `root`.
+
+    The run directories are read in a pool of `processes` processes and the nodes are created in batches of
+    `batch_size` runs, each committed in a single transaction. The runs already imported are skipped.
+    :param root: the directory to explore.
+    :param computer: the `Computer` where the runs were performed (for instance `localhost`).
+    :param code: optional `Code` linked as input of the calculations.
+    :param group: optional `Group` where the imported calculations are added.
+    :param processes: the number of processes of the pool (by default the number of CPUs). If 0,
+        the runs are read in the main process.
+    :param batch_size: the number of runs stored in each transaction.
+    :param store_retrieved: whether to store the output files in the `retrieved` folder of the calculations.
+    :return: a dictionary with the list of pks of the `imported` calculations, the number of `skipped`
+        directories (already imported) and the `failed` ones ({path: error message}).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from aiida.manage import get_manager
+
+    imported_paths = get_imported_paths()
+    all_directories = find_run_directories(root)
+    directories = [directory for directory in all_directories if directory not in imported_paths]
+    summary = {'imported': [], 'skipped': len(all_directories) - len(directories), 'failed': {}}
+
+    storage = get_manager().get_profile_storage()
+    pseudo_nodes = {}
+
+    def store_batch(batch):
+        nodes = []
+        with storage.transaction():
+            for run in batch:
+                if 'error' in run:
+                    summary['failed'][run['path']] = run['error']
+                else:
+                    nodes.append(store_run(run, computer, code, pseudo_nodes, store_retrieved))
+        if group is not None and nodes:
+            group.add_nodes(nodes)
+        summary['imported'].extend(node.pk for node in nodes)
+
+    def process(runs):
+        batch = []
+        for run in runs:
+            batch.append(run)
+            if len(batch) == batch_size:
+                store_batch(batch)
+                batch = []
+        if batch:
+            store_batch(batch)
+
+    if processes == 0:
+        process(parse_run_directory(directory) for directory in directories)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            chunksize = max(1, min(32, len(directories) // (4 * (pool._max_workers or 1)) or 1))  # pylint: disable=protected-access
+            process(pool.map(parse_run_directory, directories, chunksize=chunksize))
+
+    return summary
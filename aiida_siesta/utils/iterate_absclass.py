@@ -8,11 +8,13 @@ import itertools
 
 from aiida.common import AttributeDict
 from aiida.engine import ToContext, WorkChain, while_
-from aiida.orm import Int, List, Node, Str, load_node
+from aiida.orm import Bool, Int, List, Node, Str, load_node
 from aiida.orm.nodes.data.base import to_aiida_type
 from aiida.plugins import DataFactory
 import numpy as np
 
+from aiida_siesta.calculations.bundle import BundleRun
+
 # pylint: disable=protected-access
 
 
@@ -525,6 +527,17 @@ class BaseIterator(WorkChain):
             one single batch if you want.'''
         )
 
+        # The processes of a batch can be run in a single bundle if the _process_class supports it
+        if getattr(cls._process_class, '_bundle_process_class', None) is not None:
+            spec.input(
+                "bundle",
+                valid_type=Bool,
+                default=lambda: Bool(False),
+                help='''Whether to run all the simulations of a batch together, in a single
+                bundle (see the `_bundle_process_class` of the process). The options of the first
+                simulation are used for the whole bundle.'''
+            )
+
         # We expose the inputs of the _process_class, in addition some more args
         # can be passed to the expose_inputs method (for instance inputs to exclude)
         spec.expose_inputs(cls._process_class, **cls._expose_inputs_kwargs)
@@ -759,11 +772,16 @@ class BaseIterator(WorkChain):
 
         The numeber of processes for
         each batch is decided by the user through the input port `batch_size`.
-        For each item in the batch, it calls `_run_process`.
+        For each item in the batch, it calls `_run_process`. If the input `bundle` is True,
+        the inputs of all the items are instead passed to `get_bundle_inputs` of the `_process_class`
+        and a single bundle process is submitted.
         """
         self.ctx.last_step_processes = []
+        self.ctx.last_step_bundle = 'bundle' in self.ctx.inputs and self.ctx.inputs.bundle.value
 
         processes = {}
+        batch_inputs = []
+        bundle = self.ctx.last_step_bundle
         batch_size = self.ctx.inputs.batch_size.value
         # Run as many processes as the "batch_size" input tells us to
         for batch_ind in range(batch_size):
@@ -777,6 +795,11 @@ class BaseIterator(WorkChain):
                     # we will just run a smaller batch
                     break
 
+            # In bundle mode, the processes of the batch are run all together at the end
+            if bundle:
+                batch_inputs.append(AttributeDict(self._get_process_inputs()))
+                continue
+
             # Submit the process
             process_node = self._run_process()
 
@@ -786,7 +809,16 @@ class BaseIterator(WorkChain):
             # And then store the process (this will be passed to context at the end of the method)
             processes[process_node.uuid] = process_node
 
-        self.report(f'Launched batch of {len(self.ctx.last_step_processes)}/{batch_size} processes')
+        if bundle:
+            bundle_class = self._process_class._bundle_process_class
+            bundle_inputs = self._process_class.get_bundle_inputs(batch_inputs)
+            self.ctx.last_step_runs = list(bundle_inputs['runs'])
+            process_node = self.submit(bundle_class, **bundle_inputs)
+            self.ctx.last_step_processes.append(process_node.uuid)
+            processes[process_node.uuid] = process_node
+            self.report(f'Launched batch of {len(batch_inputs)}/{batch_size} processes in {bundle_class.__name__}')
+        else:
+            self.report(f'Launched batch of {len(self.ctx.last_step_processes)}/{batch_size} processes')
 
         # Wait for the processes to finish
         return ToContext(**processes)
@@ -797,6 +829,17 @@ class BaseIterator(WorkChain):
 
         Before running, it sets up the inputs.
         """
+        inputs = self._get_process_inputs()
+
+        # Run the process and store the results
+        process_node = self.submit(self._process_class, **inputs)
+
+        return process_node
+
+    def _get_process_inputs(self):
+        """
+        Return the inputs of the process for the current value (self.current_val).
+        """
         # Get the exposed inputs for the process that we want to run.
         if self._reuse_inputs and hasattr(self.ctx, 'last_inputs'):
             inputs = self.ctx.last_inputs
@@ -815,10 +858,7 @@ class BaseIterator(WorkChain):
 
         self.ctx.last_inputs = inputs
 
-        # Run the process and store the results
-        process_node = self.submit(self._process_class, **inputs)
-
-        return process_node
+        return inputs
 
     def _add_inputs(self, key, val, inputs):
         """
@@ -856,7 +896,12 @@ class BaseIterator(WorkChain):
         """
         for process_id in self.ctx.last_step_processes:
 
-            self._analyze_process(self.ctx[process_id])
+            if self.ctx.get('last_step_bundle', False):
+                # Each run of the bundle is analyzed as a process, in the order of the batch
+                for label in self.ctx.last_step_runs:
+                    self._analyze_process(BundleRun(self.ctx[process_id], label))
+            else:
+                self._analyze_process(self.ctx[process_id])
 
     def _analyze_process(self, process_node):
         """
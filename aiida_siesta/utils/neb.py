@@ -38,7 +38,7 @@ def parse_neb_results(file, traj_in):
     """
     Parses NEB.results.
 
-    :param: file: NEB results
+    :param: file: NEB results (path or file handle)
     :param: traj_in: TrajectoryData object with final MEP images
     :return: Extended trajectory object with NEB data arrays
              and estimation of barrier, and number of iterations.
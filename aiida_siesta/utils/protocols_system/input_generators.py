@@ -164,14 +164,11 @@ class SiestaCalculationInputGenerator(InputGenerator):
         else:
             parameters = sp_parameters.copy()
 
-        #Basis
-        basis = self._get_basis(protocol, ok_structure)
-
         #Kpoints (might not be present, for molecules for instance)
         kpoints_mesh = self._get_kpoints(protocol, ok_structure)
 
-        #Pseudo fam
-        pseudos = self._get_pseudos(protocol, ok_structure)
+        #Basis and pseudo fam, or the ions (fixed basis) of the ion family
+        basis_inputs = self._get_basis_inputs(protocol, ok_structure)
 
         #Computational resources
         options = calc_engines['siesta']["options"]
@@ -181,11 +178,10 @@ class SiestaCalculationInputGenerator(InputGenerator):
             'structure': ok_structure,
             'parameters': Dict(parameters),
             'code': code,
-            'basis': Dict(basis),
-            'pseudos': pseudos,
             'metadata': {
                 "options": options
             },
+            **basis_inputs,
         }
 
         #bandskpoints and kpoints are optional, possible return None
@@ -6,7 +6,7 @@ The protocol manager.
 import os
 
 from aiida.common import exceptions
-from aiida.orm import Group
+from aiida.orm import Dict, Group
 import yaml
 
 
@@ -106,21 +106,22 @@ class ProtocolManager:
                         f'Wrong format of `mesh-cutoff` in `parameters` of protocol `{k}`. Value and units required.'
                     )
 
-            if 'basis' not in v:
+            if 'basis' not in v and 'ion_family' not in v:
                 raise_invalid(f'protocol `{k}` does not define the mandatory key `basis`')
 
-            if 'pseudo_family' not in v:
+            if 'pseudo_family' not in v and 'ion_family' not in v:
                 raise_invalid(f'protocol `{k}` does not define the mandatory key `pseudo_family`')
-            else:
-                famname = self._protocols[k]["pseudo_family"]
-                messagg = (
-                    f'protocol `{k}` requires `pseudo_family` with name {famname} ' +
-                    'but no family with this name is loaded in the database'
-                )
-                try:
-                    Group.get(label=famname)
-                except exceptions.NotExistent:
-                    raise_invalid(messagg)
+            for family_key in ['pseudo_family', 'ion_family']:
+                if family_key in v:
+                    famname = self._protocols[k][family_key]
+                    messagg = (
+                        f'protocol `{k}` requires `{family_key}` with name {famname} ' +
+                        'but no family with this name is loaded in the database'
+                    )
+                    try:
+                        Group.get(label=famname)
+                    except exceptions.NotExistent:
+                        raise_invalid(messagg)
 
         if self._default_protocol not in self._protocols:
             raise_invalid(f'default protocol `{self._default_protocol}` is not a defined protocol')
@@ -356,3 +357,22 @@ class ProtocolManager:
 
         pseudos = group.get_pseudos(structure=structure)
         return pseudos
+
+    def _get_ions(self, key, structure):
+        """
+        Get ions from the ion family, used instead of basis and pseudos when the protocol defines `ion_family`.
+        """
+        family = self._protocols[key]["ion_family"]
+        group = Group.collection.get(label=family)
+
+        ions = group.get_ions(structure)
+        return ions
+
+    def _get_basis_inputs(self, key, structure):
+        """
+        Get the inputs defining basis and pseudos: `basis` and `pseudos`, or `ions` for protocols with `ion_family`.
+        """
+        if "ion_family" in self._protocols[key]:
+            return {'ions': self._get_ions(key, structure)}
+
+        return {'basis': Dict(self._get_basis(key, structure)), 'pseudos': self._get_pseudos(key, structure)}
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the remote cache of pseudopotentials and ion files.
+
+By default, every `SiestaCalculation` uploads its pseudos (or the .ion files) to the working directory.
+When the `pseudo_cache` key of the settings input is set to a directory of the remote computer,
+the files that are present in that directory are instead symlinked. Files in the cache are content-addressed:
+the name is the md5 checksum of the node followed by the extension (".psf", ".psml" or ".ion").
+
+The cache is populated (once) with `populate_pseudo_cache`, that also records in the metadata
+of the computer the checksums of the uploaded files, so that the calculations know, without connecting
+to the computer, which files can be linked. Files not recorded as cached are uploaded as usual.
+The cache requires a code installed on the computer (`InstalledCode`), it is not available to portable codes.
+
+The recorded checksums are never verified again against the content of the remote directory. If the cache
+directory (or some of its files) is deleted, its entry must be removed from the `siesta_pseudo_cache` property
+of the computer (see `clear_pseudo_cache`), otherwise the calculations will link missing files.
+"""
+import os
+import tempfile
+
+# Name of the property of the computer recording the content of the caches
+CACHE_PROPERTY = 'siesta_pseudo_cache'
+
+
+def get_cache_filename(node):
+    """
+    Return the name of the file of a `PsfData`, `PsmlData` or `IonData` node in the cache.
+    """
+    from aiida_pseudo.data.pseudo.psf import PsfData
+    from aiida_pseudo.data.pseudo.psml import PsmlData
+
+    from aiida_siesta.data.ion import IonData
+
+    extensions = ((PsfData, '.psf'), (PsmlData, '.psml'), (IonData, '.ion'))
+    for data_class, extension in extensions:
+        if isinstance(node, data_class):
+            return node.md5 + extension
+
+    raise TypeError(f'Node of type {type(node)} can not be stored in the pseudo cache')
+
+
+def get_cached_md5s(computer, cache_dir):
+    """
+    Return the set of md5 checksums recorded as present in the `cache_dir` of `computer`.
+    """
+    return set(computer.get_property(CACHE_PROPERTY, {}).get(cache_dir, []))
+
+
+def _write_content(node, path):
+    """
+    Write in `path` the content of the file of the cache for a node.
+    """
+    import shutil
+
+    from aiida_siesta.data.ion import IonData
+
+    if isinstance(node, IonData):
+        with open(path, 'w', encoding='utf8') as handle:
+            node.write_content_ascii_format(handle)
+    else:
+        with node.open(mode='rb') as source, open(path, 'wb') as handle:
+            shutil.copyfileobj(source, handle)
+
+
+def populate_pseudo_cache(computer, cache_dir, nodes):
+    """
+    Upload the files of `nodes` to the `cache_dir` of `computer`, if not already present.
+
+    Files are uploaded with a temporary name and then renamed, so that calculations never link
+    a partially written file. The checksums of all the files present in the cache are then recorded
+    in the metadata of the computer.
+    :param computer: the aiida Computer.
+    :param cache_dir: absolute path of the cache directory on the computer. It is created if necessary.
+    :param nodes: iterable of `PsfData`, `PsmlData` or `IonData` nodes, for instance the pseudos of a family.
+    :return: the list of names of the uploaded files.
+    """
+    if not os.path.isabs(cache_dir):
+        raise ValueError('The `cache_dir` must be an absolute path')
+
+    nodes = {get_cache_filename(node): node for node in nodes}
+    uploaded = []
+    with computer.get_transport() as transport:
+        transport.makedirs(cache_dir, ignore_existing=True)
+        existing = set(transport.listdir(cache_dir))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, node in nodes.items():
+                if name in existing:
+                    continue
+                local_path = os.path.join(tmpdir, name)
+                _write_content(node, local_path)
+                partial_path = os.path.join(cache_dir, f'.{name}.part')
+                transport.putfile(local_path, partial_path)
+                transport.rename(partial_path, os.path.join(cache_dir, name))
+                uploaded.append(name)
+
+    cached = {name.rsplit('.', 1)[0] for name in existing | set(nodes) if not name.startswith('.')}
+    caches = computer.get_property(CACHE_PROPERTY, {})
+    caches[cache_dir] = sorted(cached | set(caches.get(cache_dir, [])))
+    computer.set_property(CACHE_PROPERTY, caches)
+
+    return uploaded
+
+
+def clear_pseudo_cache(computer, cache_dir):
+    """
+    Forget the content recorded for the `cache_dir` of `computer`, the remote files are not touched.
+
+    To be called when the cache directory is deleted on the computer, so that the calculations upload again
+    the files. The cache can then be populated again with `populate_pseudo_cache`.
+    """
+    caches = computer.get_property(CACHE_PROPERTY, {})
+    if caches.pop(cache_dir, None) is not None:
+        computer.set_property(CACHE_PROPERTY, caches)
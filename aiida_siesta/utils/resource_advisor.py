@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools to size the resources of a siesta job from the metrics of a previous, similar, run.
+
+The `SiestaParser` stores in the `output_parameters` the size of the system (`no_u`, the number of orbitals,
+`nnz`, the non-zero elements of the sparse matrices, and `mesh`, the real space grid) and the timing of the run
+(`global_time` and `timing_decomposition`). From these metrics of a reference run, the serial cost of a new
+run is estimated, scaling the different sections of the timing with the size of the new system:
+
+* the solver (`compute_DM`) with the cube of the number of orbitals (diagonalization);
+* the grid operations (`setup_H`) with the number of mesh points (the volume of the cell);
+* everything else linearly with the number of orbitals.
+
+The number of orbitals of the new system is estimated from the number of atoms. The parallel efficiency
+is modeled as `1 / (1 + (cores - 1) / cores_half)`, where `cores_half = no_u / orbitals_per_core` is the number
+of cores at which the efficiency halves. The advisor selects the largest number of cores (MPI processes times
+OpenMP threads) with an efficiency above `target_efficiency`, and the walltime for that number of cores,
+multiplied by a safety factor.
+
+The memory needed by a run is checked against the memory of the machines with `get_memory_advice`, from the
+peak memory per process of a short pre-flight run of the same system (see the `memory_preflight` input of
+the `SiestaBaseWorkChain`).
+"""
+import math
+
+# Default parameters of the advisor (the keys accepted by the `resource_advisor` input of the workchains)
+DEFAULT_ADVISOR_PARAMETERS = {
+    'mode': 'set',
+    'target_efficiency': 0.7,
+    'orbitals_per_core': 20,
+    'threads_per_process': 1,
+    'cores_per_machine': None,
+    'max_machines': None,
+    'walltime_factor': 2.0,
+    'min_walltime': 600,
+    'max_walltime': None,
+}
+
+# Default parameters of the memory pre-flight (the keys accepted by the `memory_preflight` input of the workchains)
+DEFAULT_PREFLIGHT_PARAMETERS = {
+    'mode': 'set',
+    'memory_per_machine': None,
+    'safety_factor': 1.2,
+    'max_machines': None,
+}
+
+# Sections of the `timing_decomposition` and exponent of the number of orbitals (None for the mesh points)
+# with which they scale. The rest of the global time scales linearly.
+SCALING_SECTIONS = {'compute_DM': 3, 'setup_H': None}
+
+
+def validate_advisor_parameters(parameters):
+    """
+    Validate the parameters of the resource advisor. Return an error message, None if they are valid.
+    """
+    unknown = set(parameters) - set(DEFAULT_ADVISOR_PARAMETERS)
+    if unknown:
+        return f"Unknown keys in the `resource_advisor`: {', '.join(sorted(unknown))}"
+    if parameters.get('mode', 'set') not in ['set', 'recommend']:
+        return "The `mode` of the `resource_advisor` must be `set` or `recommend`"
+    efficiency = parameters.get('target_efficiency', 0.7)
+    if not isinstance(efficiency, (int, float)) or not 0 < efficiency < 1:
+        return "The `target_efficiency` of the `resource_advisor` must be a number between 0 and 1"
+    for key in ['orbitals_per_core', 'walltime_factor', 'min_walltime', 'max_walltime']:
+        value = parameters.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            return f"The `{key}` of the `resource_advisor` must be a positive number"
+    for key in ['threads_per_process', 'cores_per_machine', 'max_machines']:
+        value = parameters.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            return f"The `{key}` of the `resource_advisor` must be a positive integer"
+
+    return None
+
+
+def validate_preflight_parameters(parameters):
+    """
+    Validate the parameters of the memory pre-flight. Return an error message, None if they are valid.
+    """
+    unknown = set(parameters) - set(DEFAULT_PREFLIGHT_PARAMETERS)
+    if unknown:
+        return f"Unknown keys in the `memory_preflight`: {', '.join(sorted(unknown))}"
+    if parameters.get('mode', 'set') not in ['set', 'check']:
+        return "The `mode` of the `memory_preflight` must be `set` or `check`"
+    for key in ['memory_per_machine', 'safety_factor']:
+        value = parameters.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            return f"The `{key}` of the `memory_preflight` must be a positive number"
+    value = parameters.get('max_machines')
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+        return "The `max_machines` of the `memory_preflight` must be a positive integer"
+
+    return None
+
+
+def get_parallel_efficiency(cores, no_u, orbitals_per_core):
+    """
+    Return the modeled parallel efficiency of a run of `no_u` orbitals on `cores` cores.
+    """
+    cores_half = max(no_u / orbitals_per_core, 1e-6)
+    return 1 / (1 + (cores - 1) / cores_half)
+
+
+def get_run_metrics(output_parameters):
+    """
+    Return the metrics of a siesta run, needed by the advisor, from its `output_parameters`.
+
+    The number of cores is the one of the resources of the calculation that created the `output_parameters`
+    (MPI processes times `num_cores_per_mpiproc`) or, if not available, the number of MPI processes
+    reported by siesta.
+    :param output_parameters: the `output_parameters` Dict of a `SiestaCalculation`.
+    :return: a dictionary with `no_u`, `mesh_points`, `global_time`, `timing_decomposition`, `cores`,
+        `number_of_atoms` and `cell_volume` (None if the structure of the run is not available).
+    :raise ValueError: if the metrics were not parsed.
+    """
+    results = output_parameters.get_dict()
+    if results.get('no_u') is None or results.get('global_time') is None:
+        raise ValueError(f'The output parameters<{output_parameters.pk}> do not contain `no_u` and `global_time`')
+
+    cores = None
+    number_of_atoms = None
+    cell_volume = None
+    calculation = output_parameters.creator
+    if calculation is not None:
+        resources = calculation.get_option('resources') or {}
+        if 'num_machines' in resources and 'num_mpiprocs_per_machine' in resources:
+            cores = resources['num_machines'] * resources['num_mpiprocs_per_machine']
+        elif 'tot_num_mpiprocs' in resources:
+            cores = resources['tot_num_mpiprocs']
+        if cores is not None:
+            cores *= resources.get('num_cores_per_mpiproc') or 1
+        if 'structure' in calculation.inputs:
+            number_of_atoms = len(calculation.inputs.structure.sites)
+            cell_volume = calculation.inputs.structure.get_cell_volume()
+    if cores is None:
+        try:
+            cores = int(results.get('siesta:Nodes', 1))
+        except ValueError:
+            cores = 1
+
+    return {
+        'no_u': results['no_u'],
+        'mesh_points': math.prod(results['mesh']) if results.get('mesh') else None,
+        'global_time': results['global_time'],
+        'timing_decomposition': results.get('timing_decomposition', {}),
+        'cores': cores,
+        'number_of_atoms': number_of_atoms,
+        'cell_volume': cell_volume,
+    }
+
+
+def find_reference(structure, max_candidates=200):
+    """
+    Return the `output_parameters` of the stored siesta run most similar to a run on `structure`, None if none.
+
+    The candidates are the most recent successful `SiestaCalculation` with the parsed timing, on a structure with
+    the same elements; the one with the closest number of atoms is selected (the most recent one in case of ties).
+    :param structure: the StructureData of the new run.
+    :param max_candidates: the maximum number of recent calculations that are compared.
+    """
+    from aiida import orm
+
+    elements = set(structure.get_symbols_set())
+    number_of_atoms = len(structure.sites)
+
+    query = orm.QueryBuilder()
+    query.append(
+        orm.CalcJobNode,
+        filters={
+            'process_type': 'aiida.calculations:siesta.siesta',
+            'attributes.exit_status': 0
+        },
+        tag='calculation',
+    )
+    query.append(orm.StructureData, with_outgoing='calculation', edge_filters={'label': 'structure'}, project='*')
+    query.append(
+        orm.Dict,
+        with_incoming='calculation',
+        edge_filters={'label': 'output_parameters'},
+        filters={'attributes': {
+            'has_key': 'global_time'
+        }},
+        project='*',
+    )
+    query.order_by({'calculation': {'ctime': 'desc'}})
+    query.limit(max_candidates)
+
+    best = None
+    best_distance = None
+    for candidate_structure, output_parameters in query.all():
+        if set(candidate_structure.get_symbols_set()) != elements:
+            continue
+        distance = abs(math.log(len(candidate_structure.sites) / number_of_atoms))
+        if best_distance is None or distance < best_distance:
+            best, best_distance = output_parameters, distance
+
+    return best
+
+
+def get_resource_advice(reference_metrics, number_of_atoms=None, volume_ratio=1.0, parameters=None, with_mpi=True):
+    """
+    Return the resources recommended for a new run, from the metrics of a reference run.
+
+    :param reference_metrics: the metrics of the reference run, as returned by `get_run_metrics`.
+    :param number_of_atoms: the number of atoms of the new run. If None, or if the number of atoms of the
+        reference is unknown, the new system is assumed to have the same size of the reference.
+    :param volume_ratio: the ratio between the volumes of the cells of the new and of the reference run,
+        scaling the number of mesh points.
+    :param parameters: the parameters of the advisor (see `DEFAULT_ADVISOR_PARAMETERS`).
+    :param with_mpi: whether the new run uses MPI. If False, a single process is recommended.
+    :return: a dictionary with `num_machines`, `num_mpiprocs_per_machine`, `threads_per_process`,
+        `max_wallclock_seconds`, and the estimated `no_u`, `efficiency` and `serial_time` (in seconds).
+    """
+    params = {**DEFAULT_ADVISOR_PARAMETERS, **(parameters or {})}
+
+    size_ratio = 1.0
+    if number_of_atoms is not None and reference_metrics['number_of_atoms']:
+        size_ratio = number_of_atoms / reference_metrics['number_of_atoms']
+    no_u = max(1, round(reference_metrics['no_u'] * size_ratio))
+
+    # Serial time of the reference, then scaled section by section to the new system
+    ref_efficiency = get_parallel_efficiency(
+        reference_metrics['cores'], reference_metrics['no_u'], params['orbitals_per_core']
+    )
+    timing = reference_metrics['timing_decomposition']
+    scaled_time = reference_metrics['global_time'] * size_ratio
+    for section, exponent in SCALING_SECTIONS.items():
+        if timing.get(section) is not None:
+            section_ratio = size_ratio**exponent if exponent is not None else volume_ratio
+            scaled_time += timing[section] * (section_ratio - size_ratio)
+    serial_time = scaled_time * reference_metrics['cores'] * ref_efficiency
+
+    # The largest number of cores with the target efficiency, within the allowed machines
+    threads = params['threads_per_process']
+    cores_half = no_u / params['orbitals_per_core']
+    max_cores = max(1, int(1 + cores_half * (1 / params['target_efficiency'] - 1)))
+    cores_per_machine = params['cores_per_machine'] or max_cores
+    processes_per_machine = max(1, cores_per_machine // threads)
+    processes = max(1, max_cores // threads) if with_mpi else 1
+    if params['max_machines'] is not None:
+        processes = min(processes, params['max_machines'] * processes_per_machine)
+    if processes > processes_per_machine:
+        # Only full machines
+        num_machines = processes // processes_per_machine
+    else:
+        num_machines = 1
+        processes_per_machine = processes
+    cores = num_machines * processes_per_machine * threads
+
+    efficiency = get_parallel_efficiency(cores, no_u, params['orbitals_per_core'])
+    walltime = serial_time / (cores * efficiency) * params['walltime_factor']
+    walltime = max(walltime, params['min_walltime'])
+    if params['max_walltime'] is not None:
+        walltime = min(walltime, params['max_walltime'])
+
+    return {
+        'num_machines': num_machines,
+        'num_mpiprocs_per_machine': processes_per_machine,
+        'threads_per_process': threads,
+        'max_wallclock_seconds': int(math.ceil(walltime)),
+        'no_u': no_u,
+        'efficiency': round(efficiency, 3),
+        'serial_time': round(serial_time, 1),
+    }
+
+
+def apply_resource_advice(options, advice):
+    """
+    Return a copy of the calculation `options` with the resources and the walltime of the `advice`.
+
+    The OpenMP threads are requested with `num_cores_per_mpiproc` and the `OMP_NUM_THREADS` environment variable.
+    :param options: the dictionary of the `metadata.options` of a calculation.
+    :param advice: the dictionary returned by `get_resource_advice`.
+    """
+    options = dict(options)
+    resources = {
+        key: value
+        for key, value in options.get('resources', {}).items()
+        if key not in ['num_machines', 'num_mpiprocs_per_machine', 'tot_num_mpiprocs', 'num_cores_per_mpiproc']
+    }
+    resources['num_machines'] = advice['num_machines']
+    resources['num_mpiprocs_per_machine'] = advice['num_mpiprocs_per_machine']
+    if advice['threads_per_process'] > 1:
+        resources['num_cores_per_mpiproc'] = advice['threads_per_process']
+        options['environment_variables'] = {
+            **options.get('environment_variables', {}), 'OMP_NUM_THREADS': str(advice['threads_per_process'])
+        }
+    options['resources'] = resources
+    options['max_wallclock_seconds'] = advice['max_wallclock_seconds']
+
+    return options
+
+
+def get_memory_advice(memory_per_process, num_machines, processes_per_machine, memory_per_machine, parameters=None):
+    """
+    Return the number of machines needed to fit in memory a run, from the peak memory of a pre-flight run.
+
+    The memory is assumed to be distributed among the processes, therefore the memory per process decreases
+    with the number of machines (at fixed processes per machine). The replicated part is covered by the
+    `safety_factor`. In the `check` mode the number of machines is not changed.
+    :param memory_per_process: the peak memory per process (MB) of the pre-flight run.
+    :param num_machines: the number of machines of the pre-flight run.
+    :param processes_per_machine: the number of MPI processes per machine.
+    :param memory_per_machine: the memory available on each machine (MB).
+    :param parameters: the parameters of the pre-flight (see `DEFAULT_PREFLIGHT_PARAMETERS`).
+    :return: a dictionary with `num_machines`, the `required_memory` per machine (MB) with that number of
+        machines and `fits`, False if the run does not fit in the allowed machines.
+    """
+    params = {**DEFAULT_PREFLIGHT_PARAMETERS, **(parameters or {})}
+
+    total_memory = memory_per_process * processes_per_machine * num_machines * params['safety_factor']
+    if params['mode'] == 'set':
+        needed_machines = max(num_machines, int(math.ceil(total_memory / memory_per_machine)))
+        if params['max_machines'] is not None:
+            needed_machines = min(needed_machines, max(params['max_machines'], num_machines))
+    else:
+        needed_machines = num_machines
+    required_memory = total_memory / needed_machines
+
+    return {
+        'num_machines': needed_machines,
+        'required_memory': round(required_memory, 1),
+        'fits': required_memory <= memory_per_machine,
+    }
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the retrieve policy of siesta calculations.
+
+By default, all the files parsed by the `SiestaParser` are retrieved permanently (and uncompressed)
+in the repository. With the `retrieve_policy` key of the settings input, a dictionary, it is possible to:
+
+* retrieve some of these files only temporarily, for the parsing (key `temporary`, the list of the
+  labels of the files in `RETRIEVE_LABELS`, or True for all of them);
+* compress the large text outputs on the remote computer, at the end of the job, reducing transfer time
+  and repository size (key `compress`, one of the `COMPRESSORS`). With `compress_additional` set to True,
+  also the files of the `additional_retrieve_list` and of the lua `retrieve_list` are compressed.
+
+The retrieved `FolderData` then stores the compressed files. They are read through `open_retrieved`, that
+decompresses them in streaming, therefore the decompressed content is never written to disk.
+"""
+from contextlib import contextmanager
+import gzip
+import lzma
+import mmap
+import os
+import shutil
+import tempfile
+
+# Labels of the files parsed by the `SiestaParser`, that can be retrieved only temporarily
+RETRIEVE_LABELS = ['output', 'xml', 'json', 'messages', 'enthalpies', 'ions', 'bands', 'eps2', 'stm']
+
+# Labels of the (potentially large) text outputs that are compressed on the remote side
+COMPRESSED_LABELS = ['output', 'xml', 'bands', 'eps2', 'stm']
+
+# Compression methods: the remote command, the suffix of the compressed files and the python opener
+COMPRESSORS = {
+    'gzip': ('gzip -f', '.gz', gzip.open),
+    'xz': ('xz -f', '.xz', lzma.open),
+}
+
+
+def validate_retrieve_policy(policy):
+    """
+    Validate the `retrieve_policy` of the settings. Return an error message, None if the policy is valid.
+    """
+    if not isinstance(policy, dict):
+        return 'The `retrieve_policy` in settings must be a dictionary'
+    unknown = set(policy) - {'temporary', 'compress', 'compress_additional'}
+    if unknown:
+        return f"Unknown keys in the `retrieve_policy` of the settings: {', '.join(sorted(unknown))}"
+    temporary = policy.get('temporary', [])
+    if temporary is not True and (not isinstance(temporary, list) or not set(temporary).issubset(RETRIEVE_LABELS)):
+        return f"The `temporary` of the `retrieve_policy` must be True or a list among {', '.join(RETRIEVE_LABELS)}"
+    if policy.get('compress') not in [None] + list(COMPRESSORS):
+        return f"The `compress` of the `retrieve_policy` must be one of {', '.join(COMPRESSORS)}"
+    if not isinstance(policy.get('compress_additional', False), bool):
+        return 'The `compress_additional` of the `retrieve_policy` must be a boolean'
+
+    return None
+
+
+def get_temporary_labels(policy):
+    """
+    Return the list of labels of the files to be retrieved only temporarily.
+    """
+    temporary = policy.get('temporary', [])
+    return list(RETRIEVE_LABELS) if temporary is True else temporary
+
+
+def get_compress_command(names, compression):
+    """
+    Return the bash lines compressing the files `names` (if present) in the working directory.
+
+    The original file is replaced by the compressed one only if the compression succeeds.
+    """
+    command = COMPRESSORS[compression][0]
+    return f'for f in {" ".join(names)}; do\n    if [ -f "$f" ]; then {command} "$f"; fi\ndone'
+
+
+def split_compressed_name(name):
+    """
+    Return the name of the uncompressed file and the opener (None if not compressed) of the file `name`.
+    """
+    for _, suffix, opener in COMPRESSORS.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)], opener
+    return name, None
+
+
+def get_retrieved_names(folder):
+    """
+    Return a dictionary {name: stored name} for the files in `folder`.
+
+    The name is the one of the uncompressed file, the stored name the one in the repository, possibly with
+    the suffix of the compression. An uncompressed file is preferred to its compressed version, since it
+    means that the compression of the file was not completed.
+    """
+    stored_names = {}
+    for root, _, names in folder.base.repository.walk():
+        for name in names:
+            stored_name = str(root / name)
+            uncompressed_name, opener = split_compressed_name(stored_name)
+            if opener is None or uncompressed_name not in stored_names:
+                stored_names[uncompressed_name] = stored_name
+
+    return stored_names
+
+
+def get_stored_name(folder, name):
+    """
+    Return the name in `folder` of the file `name`, possibly with the suffix of the compression.
+
+    The name is returned unchanged if neither the file nor its compressed version is present.
+    """
+    names = folder.list_object_names(os.path.dirname(name) or None)
+    base_name = os.path.basename(name)
+    if base_name not in names:
+        for _, suffix, _ in COMPRESSORS.values():
+            if base_name + suffix in names:
+                return name + suffix
+    return name
+
+
+@contextmanager
+def open_retrieved(folder, name):
+    """
+    Open in binary mode the file `name` of `folder`, decompressing it in streaming if stored compressed.
+
+    :param folder: a `FolderData`, for instance the `retrieved` output of a calculation.
+    :param name: the name of the uncompressed file.
+    :raise FileNotFoundError: if neither the file nor its compressed version is present.
+    """
+    stored_name = get_stored_name(folder, name)
+    _, opener = split_compressed_name(stored_name)
+    with folder.base.repository.open(stored_name, mode='rb') as handle:
+        if opener is None:
+            yield handle
+        else:
+            with opener(handle) as stream:
+                yield stream
+
+
+@contextmanager
+def map_retrieved(folder, name):
+    """
+    Return the content of the file `name` of `folder`, as `mmap.mmap` object if possible, otherwise as bytes.
+
+    The file is memory-mapped if the repository returns a handle on a real, uncompressed, file. Otherwise
+    (for instance for packed objects and compressed files) the content is read in memory.
+    """
+    with open_retrieved(folder, name) as handle:  # pylint: disable=contextmanager-generator-missing-cleanup
+        buffer = None
+        # The file descriptor of the decompressing handles is the one of the compressed file
+        if not isinstance(handle, (gzip.GzipFile, lzma.LZMAFile)):
+            try:
+                buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                # Handles not backed by a file descriptor and empty files (that can not be mapped)
+                pass
+        if buffer is None:
+            content = handle.read()
+
+    if buffer is None:
+        yield content
+    else:
+        with buffer:
+            yield buffer
+
+
+class ParsingFolder:
+    """
+    Read-only view on the files of the `retrieved` folder and of the folder of the temporary files.
+
+    It provides the subset of the `FolderData` interface used by the parsers (`list_object_names`,
+    `base.repository.walk` and `base.repository.open`), resolving each name in the temporary folder first
+    and then in `retrieved`. No file is copied.
+    """
+
+    def __init__(self, retrieved, temporary_folder):
+        """
+        Construct the view on the two folders.
+
+        :param retrieved: the `retrieved` FolderData.
+        :param temporary_folder: the path of the temporary folder with the files of the `retrieve_temporary_list`.
+        """
+        self.retrieved = retrieved
+        self.temporary_folder = temporary_folder
+
+    @property
+    def base(self):
+        """Mirror `FolderData.base`, the methods of the repository are the ones of the view itself."""
+        return self
+
+    @property
+    def repository(self):
+        """Mirror `FolderData.base.repository`."""
+        return self
+
+    def get_temporary_path(self, path=None):
+        """Return the path of `path` in the temporary folder (the file is not necessarily there)."""
+        return os.path.join(self.temporary_folder, str(path)) if path else self.temporary_folder
+
+    def list_object_names(self, path=None):
+        """
+        Return the sorted names of the objects in the directory `path` of both folders.
+
+        :raise FileNotFoundError: if the directory is in neither of them.
+        """
+        names = set()
+        found = False
+        try:
+            names.update(self.retrieved.list_object_names(path))
+            found = True
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        if os.path.isdir(self.get_temporary_path(path)):
+            names.update(os.listdir(self.get_temporary_path(path)))
+            found = True
+        if not found:
+            raise FileNotFoundError(f'object with path `{path}` does not exist')
+        return sorted(names)
+
+    def walk(self, path=None):
+        """
+        Walk the directory `path` of both folders, yielding `(root, dirnames, filenames)` as `FolderData`.
+        """
+        from pathlib import PurePosixPath
+
+        start = PurePosixPath(path or '.')
+        tree = {}
+        try:
+            for root, dirnames, filenames in self.retrieved.base.repository.walk(path):
+                dirs, files = tree.setdefault(PurePosixPath(root), (set(), set()))
+                dirs.update(dirnames)
+                files.update(filenames)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        temporary_path = self.get_temporary_path(path)
+        for root, dirnames, filenames in os.walk(temporary_path):
+            relative = PurePosixPath(*os.path.relpath(root, temporary_path).split(os.sep))
+            dirs, files = tree.setdefault(start / relative, (set(), set()))
+            dirs.update(dirnames)
+            files.update(filenames)
+
+        for root in sorted(tree):
+            dirs, files = tree[root]
+            yield root, sorted(dirs), sorted(files)
+
+    def open(self, path, mode='rb'):
+        """
+        Open the file `path`, from the temporary folder if present there, otherwise from `retrieved`.
+        """
+        temporary_path = self.get_temporary_path(path)
+        if os.path.isfile(temporary_path):
+            return open(temporary_path, mode)  # pylint: disable=unspecified-encoding
+        return self.retrieved.base.repository.open(path, mode=mode)
+
+
+def get_local_path(folder, name, directory):
+    """
+    Return the path on the local file system of the file `name` of `folder`, as stored (possibly compressed).
+
+    The files retrieved temporarily are already on the local file system. The others are copied, in
+    streaming, to a new file in `directory`, that is never overwritten. The returned path can be read
+    with `open_local`, also by other processes.
+    """
+    stored_name = get_stored_name(folder, name)
+    if isinstance(folder, ParsingFolder):
+        temporary_path = folder.get_temporary_path(stored_name)
+        if os.path.isfile(temporary_path):
+            return temporary_path
+
+    _, suffix = os.path.splitext(stored_name)
+    with folder.base.repository.open(stored_name, mode='rb') as source:
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=suffix, delete=False) as target:
+            shutil.copyfileobj(source, target)
+
+    return target.name
+
+
+def open_local(path):
+    """
+    Open in binary mode the file `path` of the local file system, decompressing it in streaming if compressed.
+    """
+    _, opener = split_compressed_name(path)
+    return (opener or open)(path, 'rb')
+
+
+def get_parsing_folder(retrieved, temporary_folder=None):
+    """
+    Return the folder with the files to be parsed.
+
+    If no file was retrieved temporarily, it is just the `retrieved` folder. Otherwise, it is a
+    `ParsingFolder` resolving the names in both the `retrieved` folder and the `temporary_folder`,
+    without copying any file. Compressed files are left as they are, they must be read with `open_retrieved`.
+    :param retrieved: the `retrieved` FolderData.
+    :param temporary_folder: the path of the temporary folder with the files of the `retrieve_temporary_list`.
+    """
+    if temporary_folder is None or not any(names for _, _, names in os.walk(temporary_folder)):
+        return retrieved
+
+    return ParsingFolder(retrieved, temporary_folder)
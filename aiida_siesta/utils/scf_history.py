@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the history of the SCF cycles of siesta.
+
+For each SCF iteration, siesta writes in the standard output (.out file) a line like::
+
+       iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)
+       scf:    1     -216.250309     -215.244932     -215.244932  1.812015 -3.826300  0.170499
+
+where the header is repeated at the beginning of the SCF cycle of each geometry step.
+These lines are collected (with a single pass on the memory-mapped file, if not compressed) in an `ArrayData`,
+stored by the `SiestaParser` in the `scf_history` output. The parser collects them in the same pass
+that extracts the memory report (see `aiida_siesta.utils.diagnostics.scan_run`).
+"""
+import re
+
+import numpy as np
+
+# Columns of the siesta SCF lines and corresponding names of the arrays
+SCF_COLUMNS = {
+    'Eharris(eV)': 'harris_energy',
+    'E_KS(eV)': 'energy',
+    'FreeEng(eV)': 'free_energy',
+    'dDmax': 'ddmax',
+    'Ef(eV)': 'fermi_energy',
+    'dHmax(eV)': 'dhmax',
+}
+
+_SCF_LINE = re.compile(rb'^ *(iscf|scf:) +(.*)$', re.MULTILINE)
+
+
+def parse_scf_history(buffer, header=None):
+    """
+    Extract the SCF history from the content of the .out file.
+
+    :param buffer: the content of the file, as bytes or `mmap.mmap` object.
+    :param header: optional string with the names of the columns (as in the "iscf" header of siesta) to be
+        used for the SCF lines that come before the first header. Useful for the last lines of a file:
+        these lines belong to a previous geometry step, therefore they are assigned to the step 0 and
+        the first header starts the step 1.
+    :return: a dictionary of numpy arrays with one entry per SCF iteration. The arrays are `geometry_step`
+        (starting from 0), `iteration` and the ones listed in `SCF_COLUMNS`. Columns missing in the
+        output of the specific siesta version are set to NaN. An empty dictionary is returned if no SCF
+        line is found.
+    """
+    return collect_scf_history(((match.group(1), match.group(2)) for match in _SCF_LINE.finditer(buffer)), header)
+
+
+def collect_scf_history(lines, header=None):
+    """
+    Build the SCF history (see `parse_scf_history`) from the SCF lines of the .out file.
+
+    :param lines: iterable of (label, fields) tuples of bytes, the label is `iscf` for the headers and `scf:`
+        for the iterations. It allows to collect the lines in the same pass of other searches (see
+        `aiida_siesta.utils.diagnostics.scan_run`).
+    :param header: see `parse_scf_history`.
+    """
+    steps = []
+    iterations = []
+    values = {name: [] for name in SCF_COLUMNS.values()}
+
+    # Without `header`, the lines before the first header are skipped and the first header starts the step 0
+    step = -1 if header is None else 0
+    columns = None if header is None else [SCF_COLUMNS.get(word) for word in header.split()]
+    for label, fields in lines:
+        words = fields.decode(errors='replace').split()
+        if label == b'iscf':
+            step += 1
+            columns = [SCF_COLUMNS.get(word) for word in words]
+            continue
+        if columns is None or len(words) != len(columns) + 1:
+            # No header or a line with fields that are merged (overflow of the fortran format)
+            continue
+        try:
+            iteration = int(words[0])
+            numbers = [float(word) for word in words[1:]]
+        except ValueError:
+            continue
+        steps.append(step)
+        iterations.append(iteration)
+        line_values = dict(zip(columns, numbers))
+        for name, array in values.items():
+            array.append(line_values.get(name, np.nan))
+
+    if not iterations:
+        return {}
+
+    history = {'geometry_step': np.array(steps), 'iteration': np.array(iterations)}
+    for name, array in values.items():
+        history[name] = np.array(array)
+
+    return history
+
+
+def get_scf_history_array(history):
+    """
+    Return the `ArrayData` with the arrays of the SCF `history`, None if the history is empty.
+    """
+    from aiida.orm import ArrayData
+
+    if not history:
+        return None
+
+    arraydata = ArrayData()
+    for name, array in history.items():
+        arraydata.set_array(name, array)
+
+    return arraydata
+
+
+def _get_ddmax_slope(ddmax, window):
+    """
+    Return the slope of log10(dDmax) versus iteration in the last `window` iterations, None if not computable.
+    """
+    ddmax = ddmax[-window:]
+    ddmax = ddmax[np.isfinite(ddmax) & (ddmax > 0)]
+    if len(ddmax) < 3:
+        return None
+
+    return np.polyfit(np.arange(len(ddmax)), np.log10(ddmax), 1)[0]
+
+
+def get_scf_trend(scf_history, window=10):
+    """
+    Classify the last SCF cycle stored in the `scf_history` as "diverging" or "slow".
+
+    A straight line is fitted to log10(dDmax) versus iteration on the last `window` iterations of the
+    last geometry step. If dDmax is not decreasing the cycle is "diverging" (or oscillating with
+    increasing amplitude), otherwise the cycle is just "slow".
+    :param scf_history: the `ArrayData` stored in the `scf_history` output.
+    :param window: the number of iterations considered.
+    :return: "diverging", "slow" or None if less than three iterations are available.
+    """
+    steps = scf_history.get_array('geometry_step')
+    slope = _get_ddmax_slope(scf_history.get_array('ddmax')[steps == steps[-1]], window)
+    if slope is None:
+        return None
+
+    return 'diverging' if slope >= 0 else 'slow'
+
+
+def check_scf_divergence(history, min_iterations=20, window=10):
+    """
+    Check whether the SCF cycle of the last geometry step is diverging or stagnating.
+
+    :param history: the dictionary returned by `parse_scf_history`.
+    :param min_iterations: the cycle is not checked before this number of iterations.
+    :param window: the number of last iterations where dDmax must decrease.
+    :return: a message describing the problem, None if no problem is detected.
+    """
+    if not history:
+        return None
+
+    steps = history['geometry_step']
+    ddmax = history['ddmax'][steps == steps[-1]]
+    if len(ddmax) < max(min_iterations, 3):
+        return None
+
+    slope = _get_ddmax_slope(ddmax, window)
+    if slope is None or slope < 0:
+        return None
+
+    return (
+        f'dDmax did not decrease in the last {min(window, len(ddmax))} scf iterations '
+        f'(from {ddmax[-window:][0]:.3g} to {ddmax[-1]:.3g})'
+    )
+
+
+def get_step_energies(history):
+    """
+    Return the free energy (the Kohn-Sham energy if not available) at the end of each completed geometry step.
+
+    The last geometry step is considered in progress and excluded.
+    """
+    steps = history['geometry_step']
+    energies = history['free_energy']
+    if np.isnan(energies).all():
+        energies = history['energy']
+    # Index of the last iteration of each geometry step
+    last_iterations = np.flatnonzero(np.diff(steps))
+
+    return energies[last_iterations]
+
+
+def check_geometry_oscillation(history, window=8, energy_tolerance=1.e-3):
+    """
+    Check whether the last geometry steps oscillate without lowering the energy.
+
+    The relaxation is considered stuck if, in the last `window` completed geometry steps, the energy
+    never went below the lowest energy found before them (minus `energy_tolerance`) and its changes
+    alternate sign at least half of the times.
+    :param history: the dictionary returned by `parse_scf_history`.
+    :param window: the number of last geometry steps considered.
+    :param energy_tolerance: the minimum lowering of the energy (in eV) considered a progress.
+    :return: a message describing the problem, None if no problem is detected.
+    """
+    if not history:
+        return None
+
+    energies = get_step_energies(history)
+    if len(energies) <= window:
+        return None
+
+    recent = energies[-window:]
+    best_before = energies[:-window].min()
+    if recent.min() < best_before - energy_tolerance:
+        return None
+
+    signs = np.sign(np.diff(recent))
+    sign_changes = np.count_nonzero(signs[1:] != signs[:-1])
+    if sign_changes < (len(signs) - 1) / 2:
+        return None
+
+    return (
+        f'the energy oscillated in the last {window} geometry steps without going below {best_before:.6f} eV '
+        f'(tolerance {energy_tolerance} eV)'
+    )
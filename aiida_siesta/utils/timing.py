@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Collect tools for the timing profile of siesta calculations.
+
+Siesta writes in the time.json file the tree of the timed sections of the code, with the
+time, number of calls and percentage of the total time of each section.
+The `SiestaParser` stores the whole tree in the `timing_profile` output (an `ArrayData`), the
+functions implemented here allow to collect these profiles for a group of calculations
+and to estimate how each section scales with the size of the system and the number of MPI processes.
+"""
+import numpy as np
+
+from aiida_siesta.utils.retrieve_policy import open_retrieved
+
+# Separator of the names of the nested sections in the paths
+SECTION_SEPARATOR = '/'
+
+# Quantities (besides the MPI processes) that are stored in the `output_parameters` of a calculation
+SIZE_QUANTITIES = ['no_u', 'nnz', 'mesh']
+
+
+def flatten_timer_tree(data):
+    """
+    Transform the tree of time.json in a list of sections, in the order of the file.
+
+    :param data: the content of time.json, as loaded by `json.load`.
+    :return: a list of (path, time, calls, percentage) tuples, one for each section. The path is the
+        name of the section prefixed with the names of its parent sections, for instance
+        "siesta/IterGeom/IterSCF/setup_H". The root "global_section" is not included.
+    :raise KeyError: if the "global_section" is missing.
+    """
+    sections = []
+
+    def _visit(tree, parent):
+        for name, value in tree.items():
+            if not isinstance(value, dict):
+                continue
+            path = parent + SECTION_SEPARATOR + name if parent else name
+            sections.append(
+                (path, float(value.get('_time', 0.0)), int(value.get('_calls', 0)), float(value.get('_%', 0.0)))
+            )
+            _visit(value, path)
+
+    _visit(data['global_section'], '')
+
+    return sections
+
+
+def get_timing_profile(output_folder, json_name):
+    """
+    Parse the time.json file and return the `ArrayData` with the complete timing profile.
+
+    The arrays are `sections` (the paths of the sections, see `flatten_timer_tree`), `time`
+    (in seconds), `calls` and `percentage`. None is returned if the file can not be parsed.
+    """
+    import json
+
+    from aiida.orm import ArrayData
+
+    with open_retrieved(output_folder, json_name) as handle:
+        try:
+            sections = flatten_timer_tree(json.load(handle))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    if not sections:
+        return None
+
+    paths, times, calls, percentages = zip(*sections)
+    profile = ArrayData()
+    profile.set_array('sections', np.array(paths))
+    profile.set_array('time', np.array(times))
+    profile.set_array('calls', np.array(calls))
+    profile.set_array('percentage', np.array(percentages))
+
+    return profile
+
+
+def get_mpi_processes(calc):
+    """
+    Return the number of MPI processes used by a calculation (1 if it did not run with MPI).
+    """
+    if not calc.get_option('withmpi'):
+        return 1
+
+    resources = calc.get_option('resources') or {}
+    if 'tot_num_mpiprocs' in resources:
+        return resources['tot_num_mpiprocs']
+
+    per_machine = resources.get('num_mpiprocs_per_machine')
+    if per_machine is None and calc.computer is not None:
+        per_machine = calc.computer.get_default_mpiprocs_per_machine()
+
+    return resources.get('num_machines', 1) * (per_machine or 1)
+
+
+def aggregate_timing_profiles(group):
+    """
+    Collect the timing profiles of the calculations in `group`.
+
+    All the calculations with a `timing_profile` output are considered, the others are ignored.
+    :param group: an aiida Group (or its label).
+    :return: a list with one dictionary for each calculation. It contains the `pk`, the size quantities
+        `no_u`, `nnz` and `mesh` (the total number of mesh points), `mpi_processes`, and the
+        `sections`, a dictionary {path: {'time': t, 'calls': c, 'percentage': p}}.
+    """
+    from aiida import orm
+
+    if isinstance(group, str):
+        group = orm.load_group(group)
+
+    query = orm.QueryBuilder()
+    query.append(orm.Group, filters={'id': group.pk}, tag='group')
+    query.append(orm.CalcJobNode, with_group='group', tag='calc', project='*')
+    query.append(
+        orm.ArrayData, with_incoming='calc', edge_filters={'label': 'timing_profile'}, tag='profile', project='*'
+    )
+    query.append(
+        orm.Dict,
+        with_incoming='calc',
+        edge_filters={'label': 'output_parameters'},
+        project=[f'attributes.{quantity}' for quantity in SIZE_QUANTITIES]
+    )
+
+    records = []
+    for calc, profile, no_u, nnz, mesh in query.iterall():
+        record = {
+            'pk': calc.pk,
+            'no_u': no_u,
+            'nnz': nnz,
+            'mesh': int(np.prod(mesh)) if mesh else None,
+            'mpi_processes': get_mpi_processes(calc),
+        }
+        arrays = zip(
+            profile.get_array('sections'), profile.get_array('time'), profile.get_array('calls'),
+            profile.get_array('percentage')
+        )
+        record['sections'] = {
+            str(path): {
+                'time': float(time),
+                'calls': int(calls),
+                'percentage': float(perc)
+            } for path, time, calls, perc in arrays
+        }
+        records.append(record)
+
+    return sorted(records, key=lambda record: record['pk'])
+
+
+def get_timing_scaling(records, quantity, sections=None):
+    """
+    Estimate how the time of each section scales with a quantity.
+
+    For each section a power law time = A * quantity^alpha is fitted (least squares in log-log scale)
+    on the records where both the time and the quantity are positive.
+    :param records: the list returned by `aggregate_timing_profiles`.
+    :param quantity: one of 'no_u', 'nnz', 'mesh' or 'mpi_processes'.
+    :param sections: optional list of section paths. By default all the sections found in the records.
+    :return: a dictionary {path: (alpha, number of points)}. Sections with less than two distinct
+        values of the quantity are not included.
+    """
+    if quantity not in SIZE_QUANTITIES + ['mpi_processes']:
+        raise ValueError(f'`quantity` must be one of {SIZE_QUANTITIES + ["mpi_processes"]}')
+
+    if sections is None:
+        sections = []
+        for record in records:
+            sections += [path for path in record['sections'] if path not in sections]
+
+    scaling = {}
+    for path in sections:
+        points = []
+        for record in records:
+            value = record[quantity]
+            if value and path in record['sections'] and record['sections'][path]['time'] > 0:
+                points.append((value, record['sections'][path]['time']))
+        if len({value for value, _ in points}) < 2:
+            continue
+        log_values, log_times = np.log(np.array(points)).T
+        alpha = np.polyfit(log_values, log_times, 1)[0]
+        scaling[path] = (float(alpha), len(points))
+
+    return scaling
@@ -11,12 +11,53 @@ all represent the same key in the dictionary. The actual form of the
 key returned by methods such as 'keys()' is the latest to be used in
 a setting operation.
 
+The translation of the keys is memoized, since the same few hundred keys are translated over and over by
+validators and workchains. The dictionaries can be merged and compared (`merge`, `diff`) without translating
+again the keys and have a `content_hash` independent of the spelling and the order of the keys.
+The values of an `FDFDict` can be optionally parsed (`get_typed`) into numbers, logicals and quantities
+with units.
+
 Vladimir Dikan and Alberto Garcia, 2017
 Refined by Emanuele Bosoni in 2020
 """
 
 from abc import abstractmethod
+from collections import namedtuple
 from collections.abc import MutableMapping
+import functools
+import hashlib
+import json
+
+# A "value unit" fdf string, like "100 Ry", parsed by `FDFDict.parse_value`
+FDFQuantity = namedtuple('FDFQuantity', ['value', 'unit'])
+
+_FDF_TRANSLATION = str.maketrans('', '', '-.:')
+_FDF_TRUE = frozenset(['t', 'true', '.true.', 'yes'])
+_FDF_FALSE = frozenset(['f', 'false', '.false.', 'no'])
+
+
+@functools.lru_cache(maxsize=8192)
+def _translate_fdf_key(key):
+    """
+    Drop dashes/dots/colons from key and make it lowercase.
+    """
+    return key.translate(_FDF_TRANSLATION).lower()
+
+
+def _parse_number(string):
+    """
+    Return the int or float represented by `string` (also with the fortran `d` exponent), None if not a number.
+    """
+    if string[0] not in '0123456789+-.':
+        return None
+    try:
+        return int(string)
+    except ValueError:
+        pass
+    try:
+        return float(string.replace('d', 'e').replace('D', 'e'))
+    except ValueError:
+        return None
 
 
 class TKDict(MutableMapping):
@@ -30,6 +71,8 @@ class TKDict(MutableMapping):
     with the translated_keys as keys and the (value, original-key) tuples as values.
     """
 
+    __slots__ = ('_storage',)
+
     @classmethod
     @abstractmethod
     def translate_key(cls, key):
@@ -82,6 +125,12 @@ class TKDict(MutableMapping):
         """
         self._storage.__delitem__(self.translate_key(key))
 
+    def __contains__(self, key):
+        """
+        Translate the key and check its presence.
+        """
+        return self.translate_key(key) in self._storage
+
     def __iter__(self):
         """
         We iter on the translated keys.
@@ -110,7 +159,7 @@ class TKDict(MutableMapping):
         """
         Return list of values.
         """
-        return [self[k] for k in self]
+        return [val[0] for val in self._storage.values()]
 
     def untranslated_keys(self):
         """
@@ -168,6 +217,58 @@ class TKDict(MutableMapping):
         return self._storage[trans_key][1]
         #A KeyError here means the key is not defined
 
+    def copy(self):
+        """
+        Return a shallow copy, without translating again the keys.
+        """
+        new = self.__class__()
+        new._storage = dict(self._storage)  # pylint: disable=protected-access
+        return new
+
+    def merge(self, other):
+        """
+        Return a new dictionary with the items of `self` updated with the ones of `other`.
+
+        :param other: a dictionary or a TKDict of the same class. The keys of a TKDict are not translated again.
+        """
+        new = self.copy()
+        if isinstance(other, self.__class__):
+            new._storage.update(other._storage)  # pylint: disable=protected-access
+        else:
+            for key, value in other.items():
+                new[key] = value
+        return new
+
+    def diff(self, other):
+        """
+        Return the differences with `other`, a dictionary or a TKDict of the same class.
+
+        :return: a dictionary with the translated keys that differ as keys and the tuples
+            (value in `self`, value in `other`) as values. A missing key has value None.
+        """
+        if not isinstance(other, self.__class__):
+            other = self.__class__(dict(other))
+        other_storage = other._storage  # pylint: disable=protected-access
+        differences = {}
+        for key, (value, _) in self._storage.items():
+            if key not in other_storage:
+                differences[key] = (value, None)
+            elif other_storage[key][0] != value:
+                differences[key] = (value, other_storage[key][0])
+        for key, (value, _) in other_storage.items():
+            if key not in self._storage:
+                differences[key] = (None, value)
+        return differences
+
+    def content_hash(self):
+        """
+        Return a stable hash of the content, that does not depend on the spelling and on the order of the keys.
+
+        The values must be serializable to JSON (other objects are represented by their `str`).
+        """
+        content = json.dumps(self.get_dict(), sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
 
 class FDFDict(TKDict):  # pylint: disable=too-many-ancestors
     """
@@ -179,16 +280,51 @@ class FDFDict(TKDict):  # pylint: disable=too-many-ancestors
     (that keeps other special characters including underscores untouched)
     """
 
+    __slots__ = ()
+
     @classmethod
     def translate_key(cls, key):
         """
         The central function that set the translation rules.
         """
-        to_remove = "-.:"
-
         if not isinstance(key, str):
             raise Exception("Key name error in FDFDict")
 
-        # Unicode uses a single dictionary for translation
-        table = {ord(char): None for char in to_remove}
-        return key.translate(table).lower()
+        return _translate_fdf_key(key)
+
+    @staticmethod
+    def parse_value(value):
+        """
+        Parse an fdf value into a typed value.
+
+        Numbers become int or float, fdf logicals (T, .true., yes, ...) become bool and "value unit"
+        strings become an `FDFQuantity`. Other values (blocks, labels, ...) are returned unchanged.
+        """
+        if not isinstance(value, str):
+            return value
+        tokens = value.split()
+        if len(tokens) == 1:
+            lowered = tokens[0].lower()
+            if lowered in _FDF_TRUE:
+                return True
+            if lowered in _FDF_FALSE:
+                return False
+            number = _parse_number(tokens[0])
+            return value if number is None else number
+        if len(tokens) == 2:
+            number = _parse_number(tokens[0])
+            if number is not None:
+                return FDFQuantity(number, tokens[1])
+        return value
+
+    def get_typed(self, key):
+        """
+        Return the value of `key` parsed by `parse_value`.
+        """
+        return self.parse_value(self[key])
+
+    def get_typed_dict(self):
+        """
+        Return a dictionary, where the key are the translated keys and the values are parsed by `parse_value`.
+        """
+        return {key: self.parse_value(val[0]) for key, val in self._storage.items()}
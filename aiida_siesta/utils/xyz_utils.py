@@ -8,18 +8,24 @@ def get_positions_from_xyz_file(file):
     """
     Simple parser for xyz file and return positions in a list.
     """
-    positions = []
     with open(file, 'r', encoding='utf8') as fileh:
-        lines = fileh.readlines()
-        for line in lines[2:]:
-            parts = line.split()
-            # Support the case in which the species label is present
-            if len(parts) == 4:
-                start = 1
-            else:
-                start = 0
-            pos = [float(i) for i in parts[start:]]
-            positions.append(pos)
+        return get_positions_from_xyz_lines(fileh.readlines())
+
+
+def get_positions_from_xyz_lines(lines):
+    """
+    Return the positions in a list from the lines (str or bytes) of a xyz file.
+    """
+    positions = []
+    for line in lines[2:]:
+        parts = line.split()
+        # Support the case in which the species label is present
+        if len(parts) == 4:
+            start = 1
+        else:
+            start = 0
+        pos = [float(i) for i in parts[start:]]
+        positions.append(pos)
 
     return positions
 
@@ -51,6 +57,35 @@ def get_structure_list_from_folder(folder, ref_struct):
     return structure_list
 
 
+def get_structure_list_from_retrieved(retrieved, ref_struct):
+    """
+    Return a list of StructureData with coordinates taken from the .xyz files of a FolderData.
+
+    The files are read from the repository (decompressed in streaming if stored compressed),
+    without copying them to disk.
+    :param retrieved: a FolderData, for instance the `retrieved` output of a calculation
+    :param ref_struct: a StructureData used as a reference, from it
+                       the kinds and cells are taken.
+    """
+    from aiida_siesta.utils.retrieve_policy import get_retrieved_names, open_retrieved
+
+    xyz_list = sorted(name for name in get_retrieved_names(retrieved) if name.endswith(".xyz") and "/" not in name)
+
+    # Compute number of expected (physical) sites and use it
+    # below to discard ghost sites (which are always trailing the rest)
+    nsites = len(ref_struct.sites)
+
+    structure_list = []
+    for name in xyz_list:
+        with open_retrieved(retrieved, name) as handle:
+            positions = get_positions_from_xyz_lines(handle.readlines())
+        struct = ref_struct.clone()
+        struct.reset_sites_positions(positions[0:nsites])
+        structure_list.append(struct)
+
+    return structure_list
+
+
 def write_xyz_file_from_structure(struct, filename, labels=True):
     """
     From a StructureData, returns an xyz file located in `filename` absolute path.
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Workchain tuning the parallel settings of siesta with short pilot runs.
+
+The throughput of siesta depends on settings like `Diag.ParallelOverK`, `BlockSize`, the solver and
+the split of the cores between MPI processes and OpenMP threads, and the best choice depends on the system.
+The `SiestaAutotuneWorkChain` runs a pilot calculation, limited to a couple of SCF steps, for each
+combination of a small grid of these settings and selects the fastest one, using the timing of the SCF
+sections parsed from the time.json file (see `get_timing_info` in the parser).
+The SCF of the pilots does not converge, therefore they are plain `SiestaCalculation` runs (the error
+handlers of the `SiestaBaseWorkChain` would restart them) and their `SCF_NOT_CONV` exit status is accepted.
+"""
+import itertools
+
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, append_, calcfunction
+
+from aiida_siesta.calculations.siesta import SiestaCalculation
+from aiida_siesta.utils.resource_advisor import apply_resource_advice
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import SiestaBaseWorkChain, get_calculation_inputs, get_pilot_parameters
+
+# Sections of the `timing_decomposition` repeated at each SCF step, measuring the throughput of a pilot run
+SCF_SECTIONS = ('setup_H', 'compute_DM')
+
+
+def get_scf_time(output_parameters):
+    """
+    Return the time spent in the SCF steps of a run, the total time if the SCF sections were not parsed.
+
+    :param output_parameters: the dictionary of the `output_parameters` of a siesta run.
+    :return: the time in seconds, None if the run has no timing information.
+    """
+    timing = output_parameters.get('timing_decomposition', {})
+    if all(section in timing for section in SCF_SECTIONS):
+        return sum(timing[section] for section in SCF_SECTIONS)
+    return output_parameters.get('global_time')
+
+
+def validate_tuning_grid(value, _):
+    """
+    Validate tuning_grid input port: a list of values for fdf keys that aiida allows to set.
+    """
+    if value:
+        for key, values in value.get_dict().items():
+            if not isinstance(values, list) or not values:
+                return f"The values of `{key}` in the `tuning_grid` must be a non-empty list"
+            translated = FDFDict.translate_key(key)
+            if translated in SiestaCalculation._aiida_blocked_keywords or "pao" in translated:  # pylint: disable=protected-access
+                return f"The key `{key}` can not be tuned"
+
+
+def validate_mpi_omp_splits(value, _):
+    """
+    Validate mpi_omp_splits input port: a list of [MPI processes per machine, OpenMP threads] pairs.
+    """
+    if value:
+        for split in value.get_list():
+            if (
+                not isinstance(split, list) or len(split) != 2 or
+                not all(isinstance(number, int) and number > 0 for number in split)
+            ):
+                return "The `mpi_omp_splits` must be a list of [MPI processes per machine, OpenMP threads] pairs"
+
+
+@calcfunction
+def get_fastest_settings(candidates, **pilot_outputs):
+    """
+    Select the fastest among the pilot runs.
+
+    :param candidates: Dict with the list `candidates`, the settings of each pilot run (`parameters` and `options`).
+    :param pilot_outputs: the `output_parameters` of the successful pilot runs, named `pilot_<index>`.
+    :return: the `optimal_parameters` and `optimal_options` of the fastest run and the `pilot_timings`.
+    """
+    timings = []
+    for index, candidate in enumerate(candidates['candidates']):
+        label = f'pilot_{index}'
+        scf_time = get_scf_time(pilot_outputs[label].get_dict()) if label in pilot_outputs else None
+        timings.append({'label': label, 'scf_time': scf_time, **candidate})
+
+    successful = [timing for timing in timings if timing['scf_time'] is not None]
+    fastest = min(successful, key=lambda timing: timing['scf_time'])
+
+    return {
+        'optimal_parameters': orm.Dict(fastest['parameters']),
+        'optimal_options': orm.Dict(fastest['options']),
+        'pilot_timings': orm.Dict({
+            'pilots': timings,
+            'fastest': fastest['label']
+        }),
+    }
+
+
+class SiestaAutotuneWorkChain(WorkChain):
+    """
+    Workchain selecting the fastest parallel settings of siesta for a system with short pilot runs.
+
+    A pilot `SiestaCalculation` (with no restarts) is run for each combination of the
+    values in `tuning_grid` and of the `mpi_omp_splits`. The `optimal_parameters` (only the tuned keys) can be
+    merged in the production `parameters` and the `optimal_options` used as production `options`.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """
+        Define the specs.
+        """
+        super().define(spec)
+        spec.expose_inputs(SiestaBaseWorkChain, exclude=('metadata',))
+        spec.input(
+            'tuning_grid',
+            valid_type=orm.Dict,
+            default=lambda: orm.Dict({
+                'diag-parallel-over-k': [False, True],
+                'blocksize': [8, 16, 32]
+            }),
+            validator=validate_tuning_grid,
+            help='The values of the fdf keys to try, all the combinations are tested'
+        )
+        spec.input(
+            'mpi_omp_splits',
+            valid_type=orm.List,
+            required=False,
+            validator=validate_mpi_omp_splits,
+            help='The [MPI processes per machine, OpenMP threads] pairs to try, by default the options are used'
+        )
+        spec.input(
+            'pilot_scf_steps',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(2),
+            help='The number of SCF steps of the pilot runs'
+        )
+        spec.outline(
+            cls.setup,
+            cls.run_pilots,
+            cls.results,
+        )
+        spec.output('optimal_parameters', valid_type=orm.Dict, help='The fastest values of the tuned fdf keys')
+        spec.output('optimal_options', valid_type=orm.Dict, help='The options with the fastest MPI/OpenMP split')
+        spec.output('pilot_timings', valid_type=orm.Dict, help='The settings and the SCF time of all the pilots')
+        spec.exit_code(200, 'ERROR_PILOTS_FAILED', message='None of the pilot runs finished with timing information')
+
+    def setup(self):
+        """
+        Define the settings of the pilot runs, the combinations of the `tuning_grid` and the `mpi_omp_splits`.
+        """
+        grid = self.inputs.tuning_grid.get_dict()
+        keys = sorted(grid)
+        options = self.inputs.options.get_dict()
+
+        if 'mpi_omp_splits' in self.inputs:
+            num_machines = options.get('resources', {}).get('num_machines', 1)
+            split_options = []
+            for processes, threads in self.inputs.mpi_omp_splits.get_list():
+                advice = {
+                    'num_machines': num_machines,
+                    'num_mpiprocs_per_machine': processes,
+                    'threads_per_process': threads,
+                    'max_wallclock_seconds': options['max_wallclock_seconds']
+                }
+                split_options.append(apply_resource_advice(options, advice))
+        else:
+            split_options = [options]
+
+        self.ctx.candidates = [{
+            'parameters': dict(zip(keys, values)),
+            'options': split
+        } for values in itertools.product(*(grid[key] for key in keys)) for split in split_options]
+
+    def run_pilots(self):
+        """
+        Submit a pilot calculation for each candidate.
+        """
+        # The pilots are single points, with no analysis and no post-processing
+        inputs = AttributeDict(
+            get_calculation_inputs(
+                self.exposed_inputs(SiestaBaseWorkChain),
+                excluded=('metadata', 'bandskpoints', 'optical', 'postprocess'),
+            )
+        )
+        parameters = self.inputs.parameters.get_dict()
+
+        for index, candidate in enumerate(self.ctx.candidates):
+            inputs['parameters'] = orm.Dict(
+                get_pilot_parameters(parameters, candidate['parameters'], self.inputs.pilot_scf_steps.value)
+            )
+            inputs['metadata'] = {'options': candidate['options'], 'call_link_label': f'pilot_{index}'}
+            running = self.submit(SiestaCalculation, **inputs)
+            self.report(f'Launched pilot SiestaCalculation<{running.pk}> with {candidate["parameters"]}')
+            self.to_context(pilots=append_(running))
+
+    def results(self):
+        """
+        Select the fastest settings among the successful pilot runs.
+
+        A pilot is successful if it has timing information and it finished correctly or with `SCF_NOT_CONV`,
+        the expected result of the limited number of SCF steps.
+        """
+        accepted = (0, SiestaCalculation.exit_codes.SCF_NOT_CONV.status)  # pylint: disable=no-member
+        pilot_outputs = {}
+        for index, pilot in enumerate(self.ctx.pilots):
+            if (
+                pilot.is_finished and pilot.exit_status in accepted and 'output_parameters' in pilot.outputs and
+                get_scf_time(pilot.outputs.output_parameters.get_dict()) is not None
+            ):
+                pilot_outputs[f'pilot_{index}'] = pilot.outputs.output_parameters
+            else:
+                self.report(f'The pilot run {pilot.process_label}<{pilot.pk}> failed or has no timing')
+
+        if not pilot_outputs:
+            return self.exit_codes.ERROR_PILOTS_FAILED
+
+        outputs = get_fastest_settings(orm.Dict({'candidates': self.ctx.candidates}), **pilot_outputs)
+        self.out_many(outputs)
+        self.report(f'The fastest pilot is {outputs["pilot_timings"]["fastest"]}')
+
+        return None
@@ -69,8 +69,10 @@ def validate_inputs(value, _):
 
     #Check each kind in the structure (including freshly added ghosts) have a corresponding pseudo or ion
     kinds = [kind.name for kind in structure.kinds]
-    if 'ions' in value:
+    if 'ions' in value or 'ion_family' in value:
         quantity = 'ions'
+        if 'ions' in value and 'ion_family' in value:
+            return "You cannot specify both `ions` and `ion_family`"
         if 'pseudos' in value or 'pseudo_family' in value:
             warnings.warn("At least one ion file in input, all the pseudos or pseudo_family will be ignored")
     else:
@@ -80,7 +82,13 @@ def validate_inputs(value, _):
         if 'pseudos' in value and 'pseudo_family' in value:
             return "You cannot specify both `pseudos` and `pseudo_family`"
 
-    if 'pseudo_family' in value:
+    if 'ion_family' in value:
+        group = orm.Group.collection.get(label=value['ion_family'].value)
+        try:
+            group.get_ion_uuids(structure)
+        except ValueError:
+            return "The ion family does not incude all the required ions"
+    elif 'pseudo_family' in value:
         group = orm.Group.get(label=value['pseudo_family'].value)
         try:
             group.get_pseudos(structure=structure)
@@ -8,9 +8,22 @@ It handles error and it is based on the RestartWorkChain of aiida core.
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.common.exceptions import NotExistent
-from aiida.engine import BaseRestartWorkChain, ProcessHandlerReport, process_handler, while_
+from aiida.engine import BaseRestartWorkChain, ProcessHandlerReport, ToContext, if_, process_handler, while_
 
+from aiida_siesta.calculations.bundle import BUNDLE_EXCLUDED_INPUTS, SiestaBundleCalculation
 from aiida_siesta.calculations.siesta import SiestaCalculation, bandskpoints_warnings, internal_structure
+from aiida_siesta.groups.ion_family import IonFamily
+from aiida_siesta.utils.basis_cache import get_basis_cache_keys, get_cached_ions, register_ions
+from aiida_siesta.utils.resource_advisor import (
+    apply_resource_advice,
+    find_reference,
+    get_memory_advice,
+    get_resource_advice,
+    get_run_metrics,
+    validate_advisor_parameters,
+    validate_preflight_parameters,
+)
+from aiida_siesta.utils.scf_history import get_scf_trend
 from aiida_siesta.utils.tkdict import FDFDict
 
 
@@ -23,6 +36,31 @@ def validate_options(value, _):
             return "the `max_wallclock_seconds` key is required in the options dict."
 
 
+def validate_resource_advisor(value, _):
+    """
+    Validate resource_advisor input port.
+    """
+    if value:
+        return validate_advisor_parameters(value.get_dict())
+
+
+def validate_resource_reference(value, _):
+    """
+    Validate resource_reference input port, it must contain the metrics parsed from a siesta run.
+    """
+    if value:
+        if 'no_u' not in value.get_dict() or 'global_time' not in value.get_dict():
+            return "the `resource_reference` must be the `output_parameters` of a siesta run, with `global_time`."
+
+
+def validate_memory_preflight(value, _):
+    """
+    Validate memory_preflight input port.
+    """
+    if value:
+        return validate_preflight_parameters(value.get_dict())
+
+
 def validate_ps_fam(value, _):
     """
     Validate pseudo_family input port.
@@ -34,6 +72,19 @@ def validate_ps_fam(value, _):
             return f"{value.value} does not correspond to any known pseudo family."
 
 
+def validate_ion_fam(value, _):
+    """
+    Validate ion_family input port.
+    """
+    if value:
+        try:
+            group = orm.Group.collection.get(label=value.value)
+        except NotExistent:
+            return f"{value.value} does not correspond to any known ion family."
+        if not isinstance(group, IonFamily):
+            return f"{value.value} is not an `IonFamily`."
+
+
 def validate_inputs(value, _):
     """
     Validate the entire input namespace.
@@ -57,8 +108,10 @@ def validate_inputs(value, _):
 
         #Check each kind in the structure (including freshly added ghosts) have a corresponding pseudo or ion
         kinds = [kind.name for kind in structure.kinds]
-        if 'ions' in value:
+        if 'ions' in value or 'ion_family' in value:
             quantity = 'ions'
+            if 'ions' in value and 'ion_family' in value:
+                return "You cannot specify both `ions` and `ion_family`"
             if 'pseudos' in value or 'pseudo_family' in value:
                 warnings.warn("At least one ion file in input, all the pseudos or pseudo_family will be ignored")
         else:
@@ -68,7 +121,13 @@ def validate_inputs(value, _):
             if 'pseudos' in value and 'pseudo_family' in value:
                 return "You cannot specify both `pseudos` and `pseudo_family`"
 
-        if 'pseudo_family' in value:
+        if 'ion_family' in value:
+            group = orm.Group.collection.get(label=value['ion_family'].value)
+            try:
+                group.get_ion_uuids(structure)
+            except ValueError:
+                return "The ion family does not incude all the required ions"
+        elif 'pseudo_family' in value:
             group = orm.Group.get(label=value['pseudo_family'].value)
             try:
                 group.get_pseudos(structure=structure)
@@ -85,6 +144,78 @@ def validate_inputs(value, _):
                 return string_out
 
 
+def get_family_pseudos(family_label, structure, basis=None):
+    """
+    Return the pseudos of the family `family_label` for the kinds of `structure` and the floating sites of `basis`.
+    """
+    group = orm.Group.get(label=family_label)
+    if basis is not None:
+        structure = internal_structure(structure, basis.get_dict())
+
+    return group.get_pseudos(structure=structure)
+
+
+def get_family_ions(family_label, structure, basis=None):
+    """
+    Return the ions of the family `family_label` for the kinds of `structure` and the floating sites of `basis`.
+    """
+    group = orm.Group.collection.get(label=family_label)
+    if basis is not None:
+        structure = internal_structure(structure, basis.get_dict())
+
+    return group.get_ions(structure)
+
+
+def get_calculation_inputs(inputs, excluded=BUNDLE_EXCLUDED_INPUTS):
+    """
+    Return the inputs of a `SiestaCalculation` from the `inputs` of a `SiestaBaseWorkChain`.
+
+    The pseudos (or the ions) of the `pseudo_family` (or `ion_family`) are included.
+    :param excluded: the inputs of the calculation that are not returned.
+    """
+    calculation_ports = SiestaCalculation.spec().inputs
+    calc_inputs = {
+        key: value for key, value in inputs.items() if key in calculation_ports and key not in excluded and value != {}
+    }
+    if 'ion_family' in inputs:
+        calc_inputs['ions'] = get_family_ions(inputs['ion_family'].value, inputs['structure'], inputs.get('basis'))
+    elif 'pseudo_family' in inputs:
+        calc_inputs['pseudos'] = get_family_pseudos(
+            inputs['pseudo_family'].value, inputs['structure'], inputs.get('basis')
+        )
+
+    return calc_inputs
+
+
+def get_pilot_parameters(parameters, settings, scf_steps):
+    """
+    Return the parameters of a short pilot run: a single point with `scf_steps` SCF steps and the `settings`.
+
+    The md keys are removed and the SCF is not required to converge.
+    """
+    pilot = FDFDict(parameters)
+    for key in list(pilot):
+        if key.startswith("md"):
+            del pilot[key]
+    for key, value in settings.items():
+        pilot[key] = value
+    pilot['max-scf-iterations'] = scf_steps
+    pilot['scf-must-converge'] = False
+
+    return pilot.get_untranslated_dict()
+
+
+def get_diagnostics(node):
+    """
+    Return the diagnostics of the .out file of a SiestaCalculation, as stored by the parser.
+
+    An empty dictionary is returned if the .out was not scanned (or the parser is too old to do it).
+    """
+    if 'output_parameters' not in node.outputs:
+        return {}
+    return node.outputs.output_parameters.get_dict().get('diagnostics', {})
+
+
 class SiestaBaseWorkChain(BaseRestartWorkChain):
     """
     Base Workchain to launch a total energy calculation via Siesta.
@@ -93,6 +224,9 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
     _process_class = SiestaCalculation
     _proc_exit_cod = _process_class.exit_codes
 
+    # Process running at once the calculations of many instances of this workchain (see `get_bundle_inputs`)
+    _bundle_process_class = SiestaBundleCalculation
+
     @classmethod
     def define(cls, spec):
         """
@@ -101,12 +235,50 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         super().define(spec)
         spec.expose_inputs(SiestaCalculation, exclude=('metadata',))
         spec.input('pseudo_family', valid_type=orm.Str, required=False, validator=validate_ps_fam)
+        spec.input(
+            'ion_family',
+            valid_type=orm.Str,
+            required=False,
+            validator=validate_ion_fam,
+            help='The label of an `IonFamily`, providing the ions of the kinds of the structure'
+        )
         spec.input('options', valid_type=orm.Dict, validator=validate_options)
+        spec.input(
+            'resource_advisor',
+            valid_type=orm.Dict,
+            required=False,
+            validator=validate_resource_advisor,
+            help='Activate the sizing of the resources from a reference run, with these parameters'
+        )
+        spec.input(
+            'resource_reference',
+            valid_type=orm.Dict,
+            required=False,
+            validator=validate_resource_reference,
+            help='The output_parameters of the reference run of the resource advisor'
+        )
+        spec.input(
+            'memory_preflight',
+            valid_type=orm.Dict,
+            required=False,
+            validator=validate_memory_preflight,
+            help='Activate the check of the memory with a short pre-flight run, with these parameters'
+        )
+        spec.input(
+            'basis_cache',
+            valid_type=orm.Bool,
+            required=False,
+            help='Reuse the ion files generated by calculations with the same pseudos and basis options'
+        )
 
         spec.outline(
             cls.preprocess,
             cls.setup,
             cls.prepare_inputs,
+            if_(cls.should_run_preflight)(
+                cls.run_preflight,
+                cls.inspect_preflight,
+            ),
             while_(cls.should_run_process)(
                 cls.run_process,
                 cls.inspect_process,
@@ -121,6 +293,29 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
 
         spec.exit_code(403, 'ERROR_BASIS_POL', message='Basis polarization problem.')
         spec.exit_code(404, 'ERROR_BANDS_PARSING', message='Error in the parsing of bands')
+        spec.exit_code(405, 'ERROR_MEMORY_ALLOCATION', message='Siesta failed to allocate memory.')
+        spec.exit_code(406, 'ERROR_MEMORY_PREFLIGHT', message='The run does not fit in the memory of the machines.')
+        spec.exit_code(407, 'ERROR_PREFLIGHT_FAILED', message='The pre-flight calculation failed.')
+
+    @classmethod
+    def get_bundle_inputs(cls, batch_inputs):
+        """
+        Return the inputs of a `SiestaBundleCalculation` running the calculations of a batch of workchains.
+
+        Each workchain becomes the run `run_<index>` of the bundle, that runs in a single job. The restarts and
+        the error handling of the workchain are not performed. The `code` and the `options` of the bundle
+        are the ones of the first workchain.
+        :param batch_inputs: list with the inputs of each workchain.
+        """
+        runs = {f'run_{index}': get_calculation_inputs(inputs) for index, inputs in enumerate(batch_inputs)}
+
+        return {
+            'code': batch_inputs[0]['code'],
+            'runs': runs,
+            'metadata': {
+                'options': batch_inputs[0]['options'].get_dict()
+            },
+        }
 
     def preprocess(self):
         """
@@ -140,16 +335,183 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         self.ctx.inputs = AttributeDict(self.exposed_inputs(SiestaCalculation))
         self.ctx.inputs['metadata'] = {'options': self.inputs.options.get_dict()}
 
-        structure = self.inputs.structure
+        if "ion_family" in self.inputs:
+            self.ctx.inputs['ions'] = get_family_ions(
+                self.inputs.ion_family.value, self.inputs.structure, self.inputs.get('basis')
+            )
+        elif "pseudo_family" in self.inputs:
+            self.ctx.inputs['pseudos'] = get_family_pseudos(
+                self.inputs.pseudo_family.value, self.inputs.structure, self.inputs.get('basis')
+            )
 
-        if "pseudo_family" in self.inputs:
-            fam_name = self.inputs.pseudo_family.value
-            group = orm.Group.get(label=fam_name)
-            if 'basis' in self.inputs:
-                temp_structure = internal_structure(structure, self.inputs.basis.get_dict())
-                self.ctx.inputs['pseudos'] = group.get_pseudos(structure=temp_structure)
-            else:
-                self.ctx.inputs['pseudos'] = group.get_pseudos(structure=structure)
+        if self.inputs.get('basis_cache', False) and self.ctx.inputs.get('pseudos'):
+            self._use_basis_cache()
+
+        if "resource_advisor" in self.inputs:
+            self._advise_resources()
+
+    def _use_basis_cache(self):
+        """
+        Pass as `ions` the ion files registered in the basis cache, when present for all the species.
+
+        Otherwise the ion files generated by the calculation are registered in `inspect_process`.
+        See `aiida_siesta.utils.basis_cache`.
+        """
+        basis = self.ctx.inputs['basis'].get_dict() if 'basis' in self.ctx.inputs else None
+        keys = get_basis_cache_keys(
+            self.ctx.inputs['pseudos'], self.ctx.inputs['code'], basis, self.ctx.inputs['parameters'].get_dict()
+        )
+        ions = get_cached_ions(keys)
+        if len(ions) == len(keys):
+            reused = ', '.join(f'{name}<{ion.pk}>' for name, ion in ions.items())
+            self.report(f'Basis cache: reusing the ion files {reused}')
+            self.ctx.inputs['ions'] = ions
+            self.ctx.inputs.pop('pseudos')
+
+    def _advise_resources(self):
+        """
+        Size the resources and the walltime from the metrics of the `resource_reference` or of a similar run.
+
+        See `aiida_siesta.utils.resource_advisor`. In the `recommend` mode the advice is only reported.
+        """
+        parameters = self.inputs.resource_advisor.get_dict()
+        reference = self.inputs.get('resource_reference')
+        if reference is None:
+            reference = find_reference(self.inputs.structure)
+            if reference is None:
+                self.report('Resource advisor: no similar siesta run found, the resources of `options` are used')
+                return
+        metrics = get_run_metrics(reference)
+
+        options = self.ctx.inputs.metadata['options']
+        computer = self.inputs.code.computer
+        if parameters.get('cores_per_machine') is None and computer is not None:
+            parameters['cores_per_machine'] = computer.get_default_mpiprocs_per_machine()
+        volume_ratio = 1.0
+        if metrics['cell_volume']:
+            volume_ratio = self.inputs.structure.get_cell_volume() / metrics['cell_volume']
+        with_mpi = options.get('withmpi', getattr(self.inputs.code, 'with_mpi', None))
+        advice = get_resource_advice(
+            metrics, len(self.inputs.structure.sites), volume_ratio, parameters, with_mpi is not False
+        )
+
+        self.report(
+            f'Resource advisor, from the run with output_parameters<{reference.pk}>: {advice["num_machines"]} '
+            f'machines, {advice["num_mpiprocs_per_machine"]} MPI processes per machine, '
+            f'{advice["threads_per_process"]} threads per process, {advice["max_wallclock_seconds"]} s '
+            f'(estimated {advice["no_u"]} orbitals, efficiency {advice["efficiency"]})'
+        )
+        if parameters.get('mode', 'set') == 'set':
+            self.ctx.inputs.metadata['options'] = apply_resource_advice(options, advice)
+
+    def should_run_preflight(self):
+        """
+        Return whether the memory pre-flight was requested.
+        """
+        return "memory_preflight" in self.inputs
+
+    def run_preflight(self):
+        """
+        Run the pre-flight calculation: the setup of the system and a single SCF step, with the same resources.
+
+        It measures the memory of the run, including the one of the solver. The restarts, the analysis
+        (bands, optical) and the post-processing are not performed.
+        """
+        inputs = AttributeDict(self.ctx.inputs)
+        for port in ['bandskpoints', 'optical', 'postprocess']:
+            inputs.pop(port, None)
+        inputs['parameters'] = orm.Dict(get_pilot_parameters(self.ctx.inputs.parameters.get_dict(), {}, 1))
+        inputs['metadata'] = {'options': dict(self.ctx.inputs.metadata['options']), 'call_link_label': 'preflight'}
+
+        running = self.submit(SiestaCalculation, **inputs)
+        self.report(f'Launching the pre-flight {running.process_label}<{running.pk}>')
+
+        return ToContext(preflight=running)
+
+    def inspect_preflight(self):
+        """
+        Check that the memory measured by the pre-flight calculation fits in the machines.
+
+        The memory of the machines is the `memory_per_machine` of the `memory_preflight` (in MB), or the
+        `max_memory_kb` of the options or the default memory per machine of the computer.
+        In the `set` mode the number of machines is increased if needed.
+        """
+        node = self.ctx.preflight
+        # The single SCF iteration of the pre-flight does not converge, the parser returns `SCF_NOT_CONV`
+        scf_not_conv = node.exit_status == self._proc_exit_cod.SCF_NOT_CONV.status  #pylint: disable = no-member
+        if not node.is_finished_ok and not scf_not_conv:
+            if node.exit_status == self._proc_exit_cod.MEMORY_ALLOCATION_FAIL.status:  #pylint: disable = no-member
+                self.report(f'The pre-flight {node.process_label}<{node.pk}> failed to allocate memory')
+                return self.exit_codes.ERROR_MEMORY_PREFLIGHT
+            self.report(f'The pre-flight {node.process_label}<{node.pk}> failed with exit status {node.exit_status}')
+            return self.exit_codes.ERROR_PREFLIGHT_FAILED
+
+        memory_per_process = None
+        if 'output_parameters' in node.outputs:
+            memory_per_process = node.outputs.output_parameters.get_dict().get('memory_peak')
+        if memory_per_process is None:
+            self.report('No memory report in the output of the pre-flight calculation, the check is skipped')
+            return None
+
+        parameters = self.inputs.memory_preflight.get_dict()
+        options = self.ctx.inputs.metadata['options']
+        resources = dict(options.get('resources', {}))
+        computer = self.inputs.code.computer
+        memory_per_machine = parameters.get('memory_per_machine')
+        if memory_per_machine is None and options.get('max_memory_kb'):
+            memory_per_machine = options['max_memory_kb'] / 1024
+        if memory_per_machine is None and computer is not None and computer.get_default_memory_per_machine():
+            memory_per_machine = computer.get_default_memory_per_machine() / 1024
+        if memory_per_machine is None:
+            self.report(
+                f'Peak memory of the pre-flight: {memory_per_process} MB per process. The memory of the machines '
+                'is unknown, the check is skipped'
+            )
+            return None
+
+        num_machines = resources.get('num_machines', 1)
+        processes_per_machine = resources.get('num_mpiprocs_per_machine')
+        if processes_per_machine is None and 'tot_num_mpiprocs' in resources:
+            processes_per_machine = resources['tot_num_mpiprocs'] // num_machines
+        if processes_per_machine is None and computer is not None:
+            processes_per_machine = computer.get_default_mpiprocs_per_machine()
+        if options.get('withmpi') is False or not processes_per_machine:
+            processes_per_machine = 1
+
+        advice = get_memory_advice(
+            memory_per_process, num_machines, processes_per_machine, memory_per_machine, parameters
+        )
+        self.report(
+            f'Peak memory of the pre-flight: {memory_per_process} MB per process, {advice["required_memory"]} MB '
+            f'per machine on {advice["num_machines"]} machines ({memory_per_machine} MB available)'
+        )
+        if not advice['fits']:
+            return self.exit_codes.ERROR_MEMORY_PREFLIGHT
+
+        if advice['num_machines'] != num_machines:
+            resources['num_machines'] = advice['num_machines']
+            if 'tot_num_mpiprocs' in resources:
+                resources['tot_num_mpiprocs'] = advice['num_machines'] * processes_per_machine
+            self.ctx.inputs.metadata['options'] = {**options, 'resources': resources}
+
+        return None
+
+    def inspect_process(self):
+        """
+        Register the ion files of the last calculation in the basis cache (if requested), then analyse its results.
+
+        The keys are obtained from the inputs of the calculation, since the basis might be modified by the handlers.
+        Ion files are produced only by calculations that generated the basis (no `ions` in input).
+        """
+        node = self.ctx.children[self.ctx.iteration - 1]
+        if self.inputs.get('basis_cache', False) and 'ion_files' in node.outputs:
+            basis = node.inputs.basis.get_dict() if 'basis' in node.inputs else None
+            keys = get_basis_cache_keys(node.inputs.pseudos, node.inputs.code, basis, node.inputs.parameters.get_dict())
+            registered = register_ions(node.outputs.ion_files, keys)
+            if registered:
+                self.report(f'Basis cache: registered the ion files of {", ".join(registered)}')
+
+        return super().inspect_process()
 
     def postprocess(self):
         """
@@ -172,6 +534,8 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         """
 
         self.report(f'SiestaCalculation<{node.pk}> did not reach geometry convergence')
+        if get_diagnostics(node).get('walltime_stop'):
+            self.report('The relaxation was stopped because the max-walltime was reached')
 
         # We need to take care of passing the output geometry of old_calc to the new calculation.
         if node.outputs.output_parameters.attributes["variable_geometry"]:
@@ -187,10 +551,16 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         """
         SCF convergence was not reached.
 
-        We need to restart from the previous calculation without changing any of the input parameters.
+        We need to restart from the previous calculation. If the `scf_history` shows that the last scf cycle
+        was diverging (and not just slow), the mixing weight is also halved.
         """
 
         self.report(f'SiestaCalculation<{node.pk}> did not achieve scf convergence.')
+        if get_diagnostics(node).get('walltime_stop'):
+            self.report('The scf cycle was stopped because the max-walltime was reached')
+        elif 'scf_history' in node.outputs and get_scf_trend(node.outputs.scf_history) == 'diverging':
+            self.report('The scf cycle was diverging')
+            self._halve_mixing_weight()
 
         # We need to take care of passing the output geometry of old_calc to the new calculation.
         if node.outputs.output_parameters.attributes["variable_geometry"]:
@@ -203,24 +573,64 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
 
         return ProcessHandlerReport(do_break=True)
 
+    @process_handler(priority=82, exit_codes=_proc_exit_cod.SCF_DIVERGED)  #pylint: disable = no-member
+    def handle_error_scf_diverged(self, node):
+        """
+        The calculation was stopped by the `siesta.scf_divergence` monitor.
+
+        We restart from the previous calculation with half of the mixing weight.
+        """
+
+        self.report(f'SiestaCalculation<{node.pk}> was stopped because the scf was diverging.')
+        self._halve_mixing_weight()
+
+        if node.outputs.output_parameters.attributes["variable_geometry"]:
+            self.ctx.inputs['structure'] = node.outputs.output_structure
+
+        self.ctx.inputs['parent_calc_folder'] = node.outputs.remote_folder
+
+        return ProcessHandlerReport(do_break=True)
+
+    @process_handler(priority=81, exit_codes=_proc_exit_cod.GEOM_OSCILLATING)  #pylint: disable = no-member
+    def handle_error_geom_oscillating(self, node):
+        """
+        The calculation was stopped by the `siesta.geometry_oscillation` monitor.
+
+        We restart from the last geometry with half of the maximum atomic displacement per step.
+        """
+
+        self.report(f'SiestaCalculation<{node.pk}> was stopped because the relaxation was oscillating.')
+        # The default of siesta is 0.2 Bohr
+        self._halve_parameter(['md-max-displacement'], '0.2 Bohr')
+
+        if node.outputs.output_parameters.attributes["variable_geometry"]:
+            self.ctx.inputs['structure'] = node.outputs.output_structure
+
+        self.ctx.inputs['parent_calc_folder'] = node.outputs.remote_folder
+
+        return ProcessHandlerReport(do_break=True)
+
     @process_handler(priority=90, exit_codes=_proc_exit_cod.SPLIT_NORM)  #pylint: disable = no-member
     def handle_error_split_norm(self, node):
         """
         The split_norm parameter was too small.
 
-        We need to change it and restart. The minimum split_norm is stored in the logs of the old calculation.
+        We need to change it and restart. The minimum split_norm is stored in the diagnostics of the old
+        calculation (in the logs for calculations parsed by older versions of the plugin).
         This error happens only at the beginning of the run, therefore no real restart needed.
         Just a new calculation with a new split_norm.
         """
 
         self.report(f'SiestaCalculation<{node.pk}> crashed with split_norm issue.')
 
-        #Retrive the minimum split norm from the logs of failed calc.
-        logs = orm.Log.objects.get_logs_for(node)
-        for log in logs:
-            if "Error in split_norm option" in log.message:
-                mylog = log.message.split()
-        new_split_norm = float(mylog[-1]) + 0.001
+        #Retrive the minimum split norm from the diagnostics or the logs of failed calc.
+        min_split_norm = get_diagnostics(node).get('min_split_norm')
+        if min_split_norm is None:
+            logs = orm.Log.objects.get_logs_for(node)
+            for log in logs:
+                if "Error in split_norm option" in log.message:
+                    min_split_norm = float(log.message.split()[-1])
+        new_split_norm = min_split_norm + 0.001
 
         # We want to understand the presence of "pao-split-norm" in input and:
         # 1) if present, we change its value to the minimum allowed
@@ -255,6 +665,45 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         """
         return ProcessHandlerReport(True, self.exit_codes.ERROR_BASIS_POL)
 
+    @process_handler(priority=88, exit_codes=_proc_exit_cod.MEMORY_ALLOCATION_FAIL)  #pylint: disable = no-member
+    def handle_error_memory_allocation(self, node):
+        """
+        Siesta could not allocate memory.
+
+        Restarting with the same resources would fail again, therefore we terminate
+        the WorkChain with a specific error code.
+        """
+        line = get_diagnostics(node).get('lines', {}).get('memory_allocation_failure')
+        self.report(f'SiestaCalculation<{node.pk}> failed to allocate memory: {line}')
+        return ProcessHandlerReport(True, self.exit_codes.ERROR_MEMORY_ALLOCATION)
+
+    def _halve_parameter(self, keys, default):
+        """
+        Halve the value of an fdf keyword in the parameters of the next calculation.
+
+        As we don't know in which sintax the user passed the keyword (every fdf variant is allowed),
+        we translate the parameters to a FDFDict that is aware of equivalent keywords.
+        :param keys: the list of equivalent keywords, in order of precedence. The first one is set if none
+            of them is present.
+        :param default: the default value of siesta. Values (and defaults) can be strings with units.
+        """
+        transl_params = FDFDict(self.ctx.inputs["parameters"].get_dict())
+        key = next((key for key in keys if key in transl_params), keys[0])
+        words = str(transl_params.get(key, default)).split()
+        new_value = float(words[0]) / 2
+        if len(words) > 1:
+            new_value = f'{new_value} {" ".join(words[1:])}'
+        self.report(f'Setting {key} to {new_value}')
+        transl_params[key] = new_value
+        self.ctx.inputs["parameters"] = orm.Dict(dict=transl_params)
+
+    def _halve_mixing_weight(self):
+        """
+        Halve the mixing weight of the scf cycle, also when given with the old "DM.MixingWeight".
+        """
+        # The default of siesta is 0.25
+        self._halve_parameter(['scf-mixer-weight', 'dm-mixing-weight'], 0.25)
+
     #pylint: disable = no-member
     @process_handler(priority=60, exit_codes=[_proc_exit_cod.BANDS_PARSE_FAIL, _proc_exit_cod.BANDS_FILE_NOT_PRODUCED])
     def handle_error_bands(self, node):  #pylint: disable = unused-argument
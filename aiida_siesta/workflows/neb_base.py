@@ -25,28 +25,23 @@ def parse_neb(retrieved, ref_structure):
     :return: a Trajectory object generated from the .xyz files, and
              with extra arrays for NEB results.
     """
-    import os
-    import tempfile
-
     from aiida.orm import TrajectoryData
 
     from aiida_siesta.utils.neb import parse_neb_results
-    from aiida_siesta.utils.xyz_utils import get_structure_list_from_folder
+    from aiida_siesta.utils.retrieve_policy import get_retrieved_names, open_retrieved
+    from aiida_siesta.utils.xyz_utils import get_structure_list_from_retrieved
 
-    with tempfile.TemporaryDirectory() as dirpath:
-        retrieved.copy_tree(dirpath)
-        struct_list = get_structure_list_from_folder(dirpath, ref_structure)
+    # The files are read in streaming from the repository, they might be stored compressed
+    struct_list = get_structure_list_from_retrieved(retrieved, ref_structure)
 
     traj = TrajectoryData(struct_list)
 
     annotated_traj = None
 
     neb_results_file = 'NEB.results'
-    if neb_results_file in retrieved.list_object_names():
-        with tempfile.TemporaryDirectory() as dirpath:
-            retrieved.copy_tree(dirpath)
-            neb_results_path = os.path.join(dirpath, neb_results_file)
-            annotated_traj = parse_neb_results(neb_results_path, traj)
+    if neb_results_file in get_retrieved_names(retrieved):
+        with open_retrieved(retrieved, neb_results_file) as handle:
+            annotated_traj = parse_neb_results(handle, traj)
 
         _kinds_raw = [k.get_raw() for k in ref_structure.kinds]
         annotated_traj.set_attribute('kinds', _kinds_raw)
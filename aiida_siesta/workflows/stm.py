@@ -4,7 +4,7 @@ Workchain to run siesta and then plstm, obtaining the STM image.
 """
 from aiida.common import AttributeDict
 from aiida.engine import ToContext, WorkChain, calcfunction
-from aiida.orm import ArrayData, Code, Dict, Float, Str, StructureData
+from aiida.orm import ArrayData, Bool, Code, Dict, Float, Str, StructureData
 
 from aiida_siesta.calculations.stm import STMCalculation
 from aiida_siesta.utils.tkdict import FDFDict
@@ -74,6 +74,12 @@ class SiestaSTMWorkChain(WorkChain):
         spec.input('stm_mode', valid_type=Str, help='Allowed values are "constant-height" or "constant-current"')
         spec.input('stm_value', valid_type=Float, help='Value of height in Ang or value of current in e/bohr**3')
         spec.input('stm_spin', valid_type=Str, help='Allowed values are "none", "collinear" or "non-collinear"')
+        spec.input(
+            'chain_stm',
+            valid_type=Bool,
+            default=lambda: Bool(False),
+            help='Run plstm in the same job of the siesta calculation producing the .LDOS file'
+        )
         spec.outline(
             cls.checks,
             cls.run_siesta_wc,
@@ -163,6 +169,17 @@ class SiestaSTMWorkChain(WorkChain):
 
         self.ctx.spinstm = spinstm
 
+        #The plstm run can be chained to the siesta run producing the .LDOS file (see the `postprocess`
+        #inputs of the SiestaCalculation), saving a job and the copy of the .LDOS file. The
+        #non-collinear analysis requires four plstm runs, they are always executed in separate jobs.
+        self.ctx.chain_stm = self.inputs.chain_stm.value
+        if self.ctx.chain_stm and spinstm == "non-collinear":
+            self.report(
+                'WARNING: The non-collinear STM analysis requires four plstm runs, they can not be chained '
+                'to the siesta calculation and are executed in separate jobs'
+            )
+            self.ctx.chain_stm = False
+
         #LDOS check, the inputs "emax" and "emin" define the energy range for the calculation of the
         #ldos. If a block "localdensityofstates" is found in the parameters of the siesta calculation,
         #a warining is issued and the block is stripped.
@@ -231,6 +248,15 @@ class SiestaSTMWorkChain(WorkChain):
         restart.parent_calc_folder = outwc.remote_folder
         settings_dict = {'additional_retrieve_list': ['aiida.BONDS', 'aiida.LDOS']}
         restart.settings = Dict(settings_dict)
+        if self.ctx.chain_stm:
+            restart.postprocess = {
+                'stm': {
+                    'code': self.inputs.stm_code,
+                    'mode': self.inputs.stm_mode,
+                    'value': self.inputs.stm_value,
+                    'spin_option': Str("s" if self.ctx.spinstm == "collinear" else "q"),
+                }
+            }
 
         running = self.submit(restart)
         self.report(f'Launched SiestaBaseWorkChain<{running.pk}> to obtain the .LDOS file.')
@@ -252,6 +278,10 @@ class SiestaSTMWorkChain(WorkChain):
             f'is in the node {remote_folder.pk}'
         )
 
+        if self.ctx.chain_stm:
+            #The plstm run was already executed in the same job
+            return None
+
         if 'stm_options' in self.inputs:
             optio = self.inputs.stm_options.get_dict()
         else:
@@ -304,6 +334,10 @@ class SiestaSTMWorkChain(WorkChain):
                 cumarray[spinmod] = stmnode.outputs.stm_array
             stm_array = create_non_coll_array(**cumarray)
             self.out('stm_array', stm_array)
+        elif self.ctx.chain_stm:
+            if 'stm_array' not in self.ctx.siesta_ldos.outputs:
+                return self.exit_codes.ERROR_STM_PLUGIN
+            self.out('stm_array', self.ctx.siesta_ldos.outputs.stm_array)
         else:
             if not self.ctx.stm_calc.is_finished_ok:
                 return self.exit_codes.ERROR_STM_PLUGIN
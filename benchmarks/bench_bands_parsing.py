@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing of the siesta .bands file: nested python loops versus `get_bands_from_tokens`.
+
+Synthetic .bands files of increasing size are generated, for the BandLines and BandPoints layouts
+and for nspin=1 and nspin=2. For each file, the eigenvalues are extracted with the loop-based
+implementation used by the `SiestaParser` up to now (reproduced here as reference) and with the
+vectorized one. The results of the two implementations are also compared.
+
+Usage::
+
+    python benchmarks/bench_bands_parsing.py --nbands 200 --nkpoints 100 1000 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+def reference_parsing(tottx, band_lines):
+    """
+    The loop-based extraction of the eigenvalues, as previously implemented in `SiestaParser._get_bands`.
+    """
+    if not band_lines:
+        nbands, nspins, nkpoints = int(tottx[3]), int(tottx[4]), int(tottx[5])
+        spinup = np.zeros((nkpoints, nbands))
+        spindown = np.zeros((nkpoints, nbands))
+        block_length = nbands * 2 if nspins == 2 else nbands
+        for kp_indx in range(nkpoints):
+            for band_indx in range(nbands):
+                spinup[kp_indx, band_indx] = (float(tottx[kp_indx * (block_length + 3) + 6 + band_indx + 3]))
+                if nspins == 2:
+                    spindown[kp_indx,
+                             band_indx] = (float(tottx[kp_indx * (nbands * 2 + 3) + 6 + band_indx + 3 + nbands]))
+    else:
+        nbands, nspins, nkpoints = int(tottx[5]), int(tottx[6]), int(tottx[7])
+        spinup = np.zeros((nkpoints, nbands))
+        spindown = np.zeros((nkpoints, nbands))
+        block_length = nbands * 2 if nspins == 2 else nbands
+        for kp_indx in range(nkpoints):
+            for band_indx in range(nbands):
+                spinup[kp_indx, band_indx] = (float(tottx[kp_indx * (block_length + 1) + 8 + band_indx + 1]))
+                if nspins == 2:
+                    spindown[kp_indx,
+                             band_indx] = (float(tottx[kp_indx * (nbands * 2 + 1) + 8 + band_indx + 1 + nbands]))
+    if nspins == 2:
+        return (spinup, spindown)
+    return spinup
+
+
+def generate_bands(path, nbands, nspins, nkpoints, band_lines):
+    """Write a synthetic .bands file in the format produced by siesta."""
+    rng = np.random.default_rng(42)
+    eigs = rng.uniform(-20, 20, size=(nkpoints, nspins * nbands))
+    with open(path, 'w', encoding='utf8') as handle:
+        if band_lines:
+            handle.write(f'{-3.5:16.6f}\n{0.0:16.6f}{2.5:16.6f}\n{-20.0:16.6f}{20.0:16.6f}\n')
+        else:
+            handle.write(f'{-3.5:16.6f}\n{-20.0:16.6f}{20.0:16.6f}\n')
+        handle.write(f'{nbands:10d}{nspins:10d}{nkpoints:10d}\n')
+        for ik in range(nkpoints):
+            if band_lines:
+                coords = f'{2.5 * ik / nkpoints:16.6f}'
+            else:
+                coords = f'{ik / nkpoints:16.6f}{0.0:16.6f}{0.0:16.6f}'
+            values = eigs[ik]
+            lines = [''.join(f'{x:12.4f}' for x in values[i:i + 10]) for i in range(0, len(values), 10)]
+            handle.write(coords + '\n'.join(lines) + '\n')
+        if band_lines:
+            handle.write(f'{2:10d}\n{0.0:16.6f}  \'\\Gamma\'\n{2.5:16.6f}  \'X\'\n')
+
+
+def timed(function, path, band_lines):
+    """Read and tokenize the file, extract the eigenvalues and return (time, result)."""
+    start = time.perf_counter()
+    with open(path, 'rb') as handle:
+        tottx = handle.read().split()
+    result = function(tottx, band_lines)
+    return time.perf_counter() - start, result
+
+
+def same_result(first, second):
+    """Compare the results of the two implementations."""
+    if isinstance(first, tuple):
+        return all(np.array_equal(a, b) for a, b in zip(first, second))
+    return np.array_equal(first, second)
+
+
+def main():
+    """Generate the files and run the benchmark."""
+    from aiida_siesta.parsers.siesta import get_bands_from_tokens
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nbands', type=int, default=200, help='Number of bands')
+    parser.add_argument(
+        '--nkpoints', type=int, nargs='+', default=[100, 1000, 5000], help='Number of kpoints (one file per value)'
+    )
+    args = parser.parse_args()
+
+    print(f'{"layout":>10} {"nspin":>5} {"nkpoints":>8} {"size MB":>8} {"loops s":>8} {"numpy s":>8} {"same":>5}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'aiida.bands')
+        for band_lines in (True, False):
+            for nspins in (1, 2):
+                for nkpoints in args.nkpoints:
+                    generate_bands(path, args.nbands, nspins, nkpoints, band_lines)
+                    size = os.path.getsize(path) / 1024 / 1024
+                    ref_time, ref_res = timed(reference_parsing, path, band_lines)
+                    new_time, new_res = timed(get_bands_from_tokens, path, band_lines)
+                    layout = 'BandLines' if band_lines else 'BandPoints'
+                    print(
+                        f'{layout:>10} {nspins:>5} {nkpoints:>8} {size:>8.1f} {ref_time:>8.3f} {new_time:>8.3f} '
+                        f'{str(same_result(ref_res, new_res)):>5}'
+                    )
+
+
+if __name__ == '__main__':
+    main()
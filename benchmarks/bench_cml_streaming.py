@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing of the siesta CML (.xml) file: minidom tree versus streaming (`StreamedCML`).
+
+A synthetic CML file mimicking a long geometry optimization is generated (500 MB by default), then
+each parsing mode runs in a separate process, so that the reported peak memory (max RSS) is not
+polluted by the other mode. The extracted results of the two modes are also compared.
+
+Usage::
+
+    python benchmarks/bench_cml_streaming.py --size-mb 500 --natoms 1000
+
+The minidom mode needs several GB of memory for large files, it can be skipped with `--skip-minidom`.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+HEADER = """<?xml version="1.0" encoding="UTF-8" ?>
+<cml convention="CMLComp" xmlns="http://www.xml-cml.org/schema"
+ xmlns:siesta="http://www.uam.es/siesta/namespace"
+ xmlns:siestaUnits="http://www.uam.es/siesta/namespace/units">
+ <metadataList>
+  <metadata name="siesta:Program" content="Siesta" />
+  <metadata name="siesta:Version" content="synthetic" />
+ </metadataList>
+"""
+
+SCF_STEP = """  <module dictRef="SCF" role="step" serial="{serial}">
+   <propertyList title="Energy Decomposition">
+    <property dictRef="siesta:Ebs">
+     <scalar dataType="xsd:double" units="siestaUnits:eV">-73.115879
+     </scalar>
+    </property>
+    <property dictRef="siesta:FreeE">
+     <scalar dataType="xsd:double" units="siestaUnits:eV">{energy}
+     </scalar>
+    </property>
+   </propertyList>
+  </module>
+"""
+
+
+def scalar_property(name, value, units="siestaUnits:eV"):
+    """Return a <property> with a scalar."""
+    return (
+        f'    <property dictRef="{name}">\n'
+        f'     <scalar dataType="xsd:double" units="{units}">{value}\n     </scalar>\n    </property>\n'
+    )
+
+
+def geometry_step(serial, natoms, nscf):
+    """Return the text of a "Geom. Optim" module with `nscf` SCF steps and a "SCF Finalization"."""
+    lines = [f' <module dictRef="Geom. Optim" role="step" serial="{serial}">\n  <molecule>\n   <atomArray>\n']
+    shift = 0.0001 * serial
+    for iat in range(natoms):
+        lines.append(
+            f'    <atom elementType="Si" id="a{iat + 1}" ref="siesta:e001"\n'
+            f'     x3="{1.3575 * (iat % 10) + shift:.8f}" y3="{1.3575 * (iat // 10 % 10):.8f}"'
+            f' z3="{1.3575 * (iat // 100):.8f}" />\n'
+        )
+    lines.append('   </atomArray>\n  </molecule>\n  <lattice dictRef="siesta:ucell">\n')
+    for vec in ([40.0 + shift, 0.0, 0.0], [0.0, 40.0, 0.0], [0.0, 0.0, 40.0]):
+        lines.append(
+            '   <latticeVector units="siestaUnits:Ang" dictRef="cml:latticeVector">\n'
+            f'  {vec[0]:.12E}  {vec[1]:.12E}  {vec[2]:.12E}\n   </latticeVector>\n'
+        )
+    lines.append('  </lattice>\n  <propertyList title="Orbital info">\n')
+    lines.append(
+        '   <property title="Number of orbitals in unit cell" dictRef="siesta:no_u">\n'
+        f'    <scalar dataType="xsd:integer" units="cmlUnits:countable">{13 * natoms}\n    </scalar>\n   </property>\n'
+        '   <property title="Number of non-zeros" dictRef="siesta:nnz">\n'
+        f'    <scalar dataType="xsd:integer" units="cmlUnits:countable">{500 * natoms + serial}\n'
+        '    </scalar>\n   </property>\n  </propertyList>\n'
+        '  <propertyList>\n   <property title="Mesh" dictRef="siesta:ntm">\n'
+        '    <array units="cmlUnits:countable" size="3" dataType="xsd:integer">\n'
+        '          180          180          180\n    </array>\n   </property>\n  </propertyList>\n'
+    )
+    for iscf in range(nscf):
+        lines.append(SCF_STEP.format(serial=iscf + 1, energy=-215.0 - 0.001 * iscf))
+    lines.append('  <module title="SCF Finalization">\n   <propertyList title="Energies and spin">\n')
+    for name, value in (("siesta:E_KS", -215.24), ("siesta:FreeE", -215.25 - serial * 1e-5), ("siesta:Ebs", -73.3),
+                        ("siesta:E_Fermi", -3.72)):
+        lines.append(scalar_property(name, value))
+    lines.append('   </propertyList>\n   <propertyList title="Forces">\n    <property dictRef="siesta:forces">\n')
+    lines.append(f'     <matrix units="siestaUnits:evpa" columns="{natoms}" rows="3" dataType="xsd:double">\n')
+    for iat in range(natoms):
+        lines.append(f' {1e-3 * serial:.12E} {-1e-3 * iat:.12E} {1e-4:.12E}\n')
+    lines.append('     </matrix>\n    </property>\n   </propertyList>\n')
+    lines.append('   <property title="Stress" dictRef="siesta:stress">\n')
+    lines.append('    <matrix units="siestaUnits:evpa3" columns="3" rows="3" dataType="xsd:double">\n')
+    lines.append(f' {3e-4:.12E} {6e-5:.12E} {-5e-5:.12E}\n' * 3)
+    lines.append('    </matrix>\n   </property>\n  </module>\n </module>\n')
+    return "".join(lines)
+
+
+def generate_cml(path, size_mb, natoms, nscf):
+    """Write a synthetic CML file of (about) `size_mb` MB and return the number of geometry steps."""
+    target = size_mb * 1024 * 1024
+    nsteps = 0
+    with open(path, 'w', encoding='utf8') as handle:
+        handle.write(HEADER)
+        while handle.tell() < target:
+            nsteps += 1
+            handle.write(geometry_step(nsteps, natoms, nscf))
+        handle.write(' <metadata name="dc:contributor" content="Siesta-CML" />\n</cml>\n')
+    return nsteps
+
+
+def run_minidom(path, queue):
+    """Parse with the minidom tree, as in the standard `SiestaParser`."""
+    from xml.dom import minidom
+
+    from aiida_siesta.parsers.siesta import get_dict_from_xml_doc, get_final_forces_and_stress
+
+    start = time.perf_counter()
+    with open(path, 'rb') as handle:
+        xmldoc = minidom.parse(handle)
+    result = get_dict_from_xml_doc(xmldoc)
+    forces, stress = get_final_forces_and_stress(xmldoc)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, (result, forces, stress)))
+
+
+def run_streaming(path, queue):
+    """Parse with the `StreamedCML`."""
+    from aiida_siesta.utils.cml import StreamedCML
+
+    start = time.perf_counter()
+    with open(path, 'rb') as handle:
+        cml = StreamedCML(handle)
+    result = cml.get_dict()
+    forces, stress = cml.get_final_forces_and_stress()
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, (result, forces, stress)))
+
+
+def measure(target, path):
+    """Run `target` in a fresh process and return (time, max RSS in MB, results)."""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=target, args=(path, queue))
+    proc.start()
+    elapsed, maxrss, results = queue.get()
+    proc.join()
+    return elapsed, maxrss / 1024, results
+
+
+def main():
+    """Generate the file and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=500, help='Size of the synthetic CML file in MB')
+    parser.add_argument('--natoms', type=int, default=1000, help='Number of atoms of the system')
+    parser.add_argument('--nscf', type=int, default=15, help='Number of SCF steps per geometry step')
+    parser.add_argument('--skip-minidom', action='store_true', help='Do not run the minidom parsing')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'aiida.xml')
+        nsteps = generate_cml(path, args.size_mb, args.natoms, args.nscf)
+        size = os.path.getsize(path) / 1024 / 1024
+        print(f'Synthetic CML: {size:.1f} MB, {nsteps} geometry steps, {args.natoms} atoms')
+
+        stream_time, stream_mem, stream_res = measure(run_streaming, path)
+        print(f'streaming : {stream_time:8.2f} s  max RSS {stream_mem:9.1f} MB')
+
+        if not args.skip_minidom:
+            dom_time, dom_mem, dom_res = measure(run_minidom, path)
+            print(f'minidom   : {dom_time:8.2f} s  max RSS {dom_mem:9.1f} MB')
+            print(f'identical results: {dom_res == stream_res}')
+
+
+if __name__ == '__main__':
+    main()
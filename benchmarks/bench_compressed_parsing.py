@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing of plain versus compressed (gzip and xz) retrieved files.
+
+A synthetic CML file (see `bench_cml_streaming.py`) and a synthetic .out file of a long relaxation are
+generated and compressed. The streaming parsing of the CML file (`parse_cml`) and the scan of the .out file
+(`scan_run` and `scan_run_stream`, as done by the parser) are then timed reading the plain files (the .out
+file is memory-mapped) and decompressing the compressed ones in streaming, as done by `open_retrieved`.
+The sizes of the files and the results of the parsing of the three versions are also compared.
+
+Usage::
+
+    python benchmarks/bench_compressed_parsing.py --size-mb 200
+"""
+import argparse
+import gzip
+import lzma
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_cml_streaming import generate_cml  # pylint: disable=wrong-import-position
+
+from aiida_siesta.parsers.siesta import parse_cml  # pylint: disable=wrong-import-position
+from aiida_siesta.utils.diagnostics import scan_run, scan_run_stream  # pylint: disable=wrong-import-position
+
+OPENERS = {'plain': open, 'gzip': gzip.open, 'xz': lzma.open}
+SUFFIXES = {'plain': '', 'gzip': '.gz', 'xz': '.xz'}
+
+
+def generate_out(path, size_mb, nscf):
+    """Write a synthetic .out file of (about) `size_mb` MB with the scf lines of many geometry steps."""
+    target = size_mb * 1024 * 1024
+    with open(path, 'w', encoding='utf8') as handle:
+        while handle.tell() < target:
+            handle.write('\n   iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n')
+            for iscf in range(1, nscf + 1):
+                handle.write(
+                    f'   scf: {iscf:4d}     -215.248867     -215.247951     -215.247951  {1.0 / iscf:8.6f} '
+                    '-3.727489  0.002638\n'
+                )
+            handle.write('siesta: Atomic forces (eV/Ang):\n' + '     1   -0.000001    0.000002   -0.000003\n' * 50)
+        handle.write('\n>> End of run\n')
+
+
+def compress(path, method):
+    """Compress the file `path` with `method` and return the path of the compressed file."""
+    compressed = path + SUFFIXES[method]
+    with open(path, 'rb') as source, OPENERS[method](compressed, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    return compressed
+
+
+def parse_xml(path, method, natoms):
+    """Parse the CML file in streaming, decompressing it if needed."""
+    with OPENERS[method](path, 'rb') as handle:
+        return parse_cml(handle, True, natoms)
+
+
+def parse_out(path, method):
+    """Scan the .out file for errors and collect the scf history, memory-mapping the plain file."""
+    with OPENERS[method](path, 'rb') as handle:
+        if method == 'plain':
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                report = scan_run(buffer)
+        else:
+            report = scan_run_stream(handle)
+    return report['diagnostics'], len(report['scf_history']['iteration'])
+
+
+def timed(function, *args):
+    """Return the time and the result of `function(*args)`."""
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    """Generate the files and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=200, help='Size of each synthetic file in MB')
+    parser.add_argument('--natoms', type=int, default=500, help='Number of atoms of the system')
+    parser.add_argument('--nscf', type=int, default=15, help='Number of SCF steps per geometry step')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        xml_path = os.path.join(tmpdir, 'aiida.xml')
+        out_path = os.path.join(tmpdir, 'aiida.out')
+        generate_cml(xml_path, args.size_mb, args.natoms, args.nscf)
+        generate_out(out_path, args.size_mb, args.nscf)
+
+        results = {}
+        print(f'{"":6} {"xml MB":>8} {"xml s":>8} {"out MB":>8} {"out s":>8}')
+        for method in OPENERS:
+            paths = [xml_path, out_path] if method == 'plain' else [
+                compress(xml_path, method), compress(out_path, method)
+            ]
+            sizes = [os.path.getsize(path) / 1024 / 1024 for path in paths]
+            xml_time, xml_result = timed(parse_xml, paths[0], method, args.natoms)
+            out_time, out_result = timed(parse_out, paths[1], method)
+            results[method] = (xml_result, out_result)
+            print(f'{method:6} {sizes[0]:8.1f} {xml_time:8.2f} {sizes[1]:8.1f} {out_time:8.2f}')
+
+        print(f'identical results: {all(result == results["plain"] for result in results.values())}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the FDFDict operations used in the generation and validation of the inputs.
+
+Each operation is timed with the implementation used by `FDFDict` up to now (reproduced here as reference:
+the translation table is rebuilt at each call of `translate_key`) and with the current one, on a typical
+parameters dictionary of `nkeys` keys:
+
+* `translate`: translation of all the keys (as done by `drop_md_keys` and the validators);
+* `build`: creation of the FDFDict from the dictionary (as done by `validate_parameters`,
+  `prepare_for_submission` and the parsing functions of the iterators);
+* `lookup`: `in` and `[]` for all the keys;
+* `merge`: update of a copy with a second dictionary (reference: loop of settings on a new FDFDict);
+* `hash`: the `content_hash` (no reference, only the current implementation).
+
+No aiida profile is needed.
+
+Usage::
+
+    python benchmarks/bench_fdfdict.py --nkeys 40 200 --repeat 2000
+"""
+import argparse
+from collections.abc import MutableMapping
+import time
+
+
+class ReferenceFDFDict(MutableMapping):
+    """The previous implementation of FDFDict, with the translation table rebuilt at each call."""
+
+    def __init__(self, inp_dict=None):
+        """Store the items of `inp_dict`, if given."""
+        self._storage = {}
+        if inp_dict is not None:
+            for inp_key in inp_dict:
+                self[inp_key] = inp_dict[inp_key]
+
+    @classmethod
+    def translate_key(cls, key):
+        """The previous translation rule."""
+        to_remove = "-.:"
+        if not isinstance(key, str):
+            raise TypeError("Key name error in FDFDict")
+        table = {ord(char): None for char in to_remove}
+        return key.translate(table).lower()
+
+    def __setitem__(self, key, value):
+        """Store the value with the translated key, keeping the original key."""
+        self._storage.__setitem__(self.translate_key(key), (value, key))
+
+    def __getitem__(self, key):
+        """Return the value of the translated key."""
+        return self._storage[self.translate_key(key)][0]
+
+    def __delitem__(self, key):
+        """Delete the translated key."""
+        self._storage.__delitem__(self.translate_key(key))
+
+    def __iter__(self):
+        """Iterate over the translated keys."""
+        return iter(self._storage)
+
+    def __len__(self):
+        """Return the number of keys."""
+        return len(self._storage)
+
+
+def generate_parameters(nkeys):
+    """Return a parameters dictionary with `nkeys` keys in mixed fdf spellings."""
+    spellings = ['MD.Key-Number{}', 'md-key-number-{}', 'mdKeyNumber{}', 'Mesh.Cutoff.{}']
+    return {spellings[index % 4].format(index): f'{index * 10} Ry' for index in range(nkeys)}
+
+
+def get_benchmarks(parameters):
+    """
+    Return the list of benchmarks on the `parameters` dictionary, as (name, reference call, current call).
+
+    The settings merged in the `merge` benchmark are one key out of four of the `parameters`.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    settings = dict(list(parameters.items())[::4])
+    ref_dict = ReferenceFDFDict(parameters)
+    new_dict = FDFDict(parameters)
+    new_settings = FDFDict(settings)
+
+    def ref_merge():
+        merged = ReferenceFDFDict(parameters)
+        for key, value in settings.items():
+            merged[key] = value
+
+    return [
+        (
+            'translate', lambda: [ReferenceFDFDict.translate_key(key) for key in parameters],
+            lambda: [FDFDict.translate_key(key) for key in parameters]
+        ),
+        ('build', lambda: ReferenceFDFDict(parameters), lambda: FDFDict(parameters)),
+        (
+            'lookup', lambda: [ref_dict[key] for key in parameters if key in ref_dict],
+            lambda: [new_dict[key] for key in parameters if key in new_dict]
+        ),
+        ('merge', ref_merge, lambda: new_dict.merge(new_settings)),
+        ('hash', None, new_dict.content_hash),
+    ]
+
+
+def timed(function, repeat):
+    """Run the function `repeat` times and return the time in microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    """Generate the dictionaries and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--nkeys', type=int, nargs='+', default=[40, 200], help='Number of keys of the dictionary (one run per value)'
+    )
+    parser.add_argument('--repeat', type=int, default=2000, help='Number of calls of each operation')
+    args = parser.parse_args()
+
+    print(f'{"nkeys":>6} {"operation":>10} {"ref us":>9} {"new us":>9} {"speedup":>8}')
+    for nkeys in args.nkeys:
+        for name, reference, current in get_benchmarks(generate_parameters(nkeys)):
+            new_time = timed(current, args.repeat)
+            if reference is None:
+                print(f'{nkeys:>6} {name:>10} {"-":>9} {new_time:>9.2f} {"-":>8}')
+            else:
+                ref_time = timed(reference, args.repeat)
+                print(f'{nkeys:>6} {name:>10} {ref_time:>9.2f} {new_time:>9.2f} {ref_time / new_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
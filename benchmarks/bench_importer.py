@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the reading phase of `import_runs`: run directories read per second, serially and in a pool.
+
+A tree of `nruns` copies of a run directory (the fdf files of the tests and the outputs of a parser fixture)
+is generated in a temporary directory, then read with `parse_run_directory` in the main process and in
+process pools of increasing size. The creation of the nodes is not included (it needs an aiida profile).
+
+Usage::
+
+    python benchmarks/bench_importer.py --nruns 400 --processes 1 2 4
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_tree(root, nruns):
+    """Create `nruns` run directories under `root`, from the fixtures used in `tests/utils/test_importer.py`."""
+    sys.path.insert(0, ROOT)
+    from tests.utils.test_importer import MAIN_FDF, STRUCTURE_FDF  # pylint: disable=import-error
+
+    fixture = os.path.join(ROOT, 'tests', 'parsers', 'fixtures', 'siesta', 'bandspoints')
+    for index in range(nruns):
+        directory = os.path.join(root, f'project_{index % 10}', f'run_{index}')
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'aiida.fdf'), 'w', encoding='utf8') as handle:
+            handle.write(MAIN_FDF)
+        with open(os.path.join(directory, 'structure.fdf'), 'w', encoding='utf8') as handle:
+            handle.write(STRUCTURE_FDF)
+        shutil.copy(os.path.join(ROOT, 'tests', 'fixtures', 'pseudos', 'Si.psf'), directory)
+        for filename in ['aiida.xml', 'aiida.out', 'time.json', 'MESSAGES']:
+            shutil.copy(os.path.join(fixture, filename), directory)
+
+
+def main():
+    """Generate the tree and time the reading of the runs."""
+    from aiida_siesta.utils.importer import find_run_directories, parse_run_directory
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nruns', type=int, default=400, help='Number of run directories')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='Sizes of the process pool')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        generate_tree(root, args.nruns)
+        directories = find_run_directories(root)
+
+        print(f'{"processes":>10} {"time s":>8} {"runs/s":>8}')
+        start = time.perf_counter()
+        runs = [parse_run_directory(directory) for directory in directories]
+        elapsed = time.perf_counter() - start
+        assert not any('error' in run for run in runs)
+        print(f'{"serial":>10} {elapsed:>8.2f} {len(runs) / elapsed:>8.1f}')
+
+        for processes in args.processes:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                start = time.perf_counter()
+                runs = list(pool.map(parse_run_directory, directories, chunksize=16))
+                elapsed = time.perf_counter() - start
+            print(f'{processes:>10} {elapsed:>8.2f} {len(runs) / elapsed:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
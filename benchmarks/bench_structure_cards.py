@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the generation of the structure blocks of the fdf file for large systems.
+
+Structures of increasing size, with two kinds and a number of floating sites equal to 1% of the atoms,
+are generated. For each of them, the floating sites are added and the atomiccoordinatesandatomicspecies
+block is created with the implementation used by `SiestaCalculation` up to now (reproduced here as
+reference: `append_atom` for each floating site and one f-string per `Site`) and with the bulk one
+(`append_floating_sites` and `get_atomic_positions_card`). The resulting blocks are also compared.
+An aiida profile must be loaded (`verdi run` or `runaiida`).
+
+Usage::
+
+    verdi run benchmarks/bench_structure_cards.py --natoms 10000 50000 200000
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+def reference_card(structure, floating):
+    """Add the floating sites and generate the block as previously implemented in `SiestaCalculation`."""
+    for item in floating:
+        structure.append_atom(position=item["position"], symbols=item["symbols"], name=item["name"])
+    spind = {kind.name: index for index, kind in enumerate(structure.kinds, start=1)}
+    atomic_positions_card_list = ["%block atomiccoordinatesandatomicspecies\n"]
+    countatm = 0
+    for site in structure.sites:
+        countatm += 1
+        sipo = site.position
+        kind = site.kind_name
+        atomic_positions_card_list.append(
+            f"{sipo[0]:18.10f} {sipo[1]:18.10f} {sipo[2]:18.10f} {spind[kind]:4} {kind.rjust(6):6} {countatm:6}\n"
+        )
+    atomic_positions_card = "".join(atomic_positions_card_list)
+    atomic_positions_card += "%endblock atomiccoordinatesandatomicspecies\n"
+    return atomic_positions_card
+
+
+def bulk_card(structure, floating):
+    """Add the floating sites and generate the block with the bulk implementation."""
+    from aiida_siesta.calculations.siesta import append_floating_sites, get_atomic_positions_card
+
+    append_floating_sites(structure, floating)
+    spind = {kind.name: index for index, kind in enumerate(structure.kinds, start=1)}
+    return get_atomic_positions_card(structure, spind)
+
+
+def generate_structure(natoms):
+    """Return an unstored StructureData with `natoms` random atoms and the list of floating sites."""
+    from aiida.orm import StructureData
+    from aiida.orm.nodes.data.structure import Kind
+
+    rng = np.random.default_rng(42)
+    side = (natoms * 20.)**(1. / 3.)
+    structure = StructureData(cell=np.eye(3) * side)
+    structure.append_kind(Kind(symbols='Si', name='Si'))
+    structure.append_kind(Kind(symbols='O', name='O'))
+    positions = rng.uniform(0, side, size=(natoms, 3)).tolist()
+    sites = [{'position': pos, 'kind_name': 'O' if index % 3 else 'Si'} for index, pos in enumerate(positions)]
+    structure.base.attributes.set('sites', sites)
+    floating = [{
+        'name': 'Si_bond',
+        'symbols': 'Si',
+        'position': tuple(pos)
+    } for pos in rng.uniform(0, side, size=(max(natoms // 100, 1), 3)).tolist()]
+    return structure, floating
+
+
+def timed(function, structure, floating):
+    """Run the function on a clone of the structure and return (time, result)."""
+    structure = structure.clone()
+    start = time.perf_counter()
+    result = function(structure, floating)
+    return time.perf_counter() - start, result
+
+
+def main():
+    """Generate the structures and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--natoms', type=int, nargs='+', default=[10000, 50000, 200000], help='Number of atoms (one run per value)'
+    )
+    args = parser.parse_args()
+
+    print(f'{"natoms":>8} {"floating":>8} {"loops s":>8} {"bulk s":>8} {"same":>5}')
+    for natoms in args.natoms:
+        structure, floating = generate_structure(natoms)
+        ref_time, ref_res = timed(reference_card, structure, floating)
+        new_time, new_res = timed(bulk_card, structure, floating)
+        print(f'{natoms:>8} {len(floating):>8} {ref_time:>8.3f} {new_time:>8.3f} {str(ref_res == new_res):>5}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from aiida import orm
+import pytest
+
+from aiida_siesta.calculations.bundle import get_bundle_runner
+
+
+def test_bundle(aiida_profile, bundle_entry_points, fixture_sandbox, generate_calc_job, fixture_code,
+    generate_structure, generate_param, generate_psf_data):
+    """
+    Test that the runs of a bundle are prepared in their subdirectories and launched by the runner.
+    """
+    psf = generate_psf_data('Si')
+    runs = {}
+    for index, cutoff in enumerate([100, 200, 300]):
+        parameters = generate_param().get_dict()
+        parameters['mesh-cutoff'] = f'{cutoff} Ry'
+        runs[f'run_{index}'] = {
+            'structure': generate_structure(),
+            'parameters': orm.Dict(parameters),
+            'pseudos': {'Si': psf, 'SiDiff': psf},
+        }
+    runs['run_2']['settings'] = orm.Dict({'cmdline': ['-option1'], 'retrieve_policy': {'compress': 'gzip'}})
+
+    inputs = {
+        'code': fixture_code('siesta.siesta'),
+        'runs': runs,
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1, 'num_mpiprocs_per_machine': 4},
+               'max_wallclock_seconds': 1800,
+               'procs_per_run': 2,
+               'withmpi': True,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, 'siesta.bundle', inputs)
+
+    assert calc_info.codes_info == []
+    assert (psf.uuid, psf.filename, 'run_1/SiDiff.psf') in calc_info.local_copy_list
+    assert len(calc_info.local_copy_list) == 6
+    assert 'run_0/aiida.xml' in calc_info.retrieve_list
+    assert 'run_2/aiida.out.gz' in calc_info.retrieve_list
+    assert calc_info.append_text == 'bash bundle_runner.sh'
+
+    assert sorted(fixture_sandbox.get_content_list()) == ['bundle_runner.sh', 'run_0', 'run_1', 'run_2']
+    with fixture_sandbox.open('run_1/aiida.fdf') as handle:
+        assert 'meshcutoff 200 Ry' in handle.read()
+    with fixture_sandbox.open('bundle_runner.sh') as handle:
+        runner = handle.read()
+    # Two runs of two processes at the same time
+    assert 'while [ "$(jobs -pr | wc -l)" -ge 2 ]; do' in runner
+    assert "    mpirun -np 2 /bin/true -option1 < aiida.fdf > aiida.out\n" in runner
+    assert runner.count('mpirun -np 2 /bin/true') == 3
+    assert 'gzip -f "$f"' in runner
+
+
+def test_bundle_validation(aiida_profile, bundle_entry_points, fixture_sandbox, generate_calc_job, fixture_code,
+    generate_structure, generate_param, generate_psf_data, fixture_localhost):
+    """
+    Test the validation of the runs of a bundle.
+    """
+    run = {
+        'structure': generate_structure(),
+        'parameters': generate_param(),
+        'pseudos': {'Si': generate_psf_data('Si'), 'SiDiff': generate_psf_data('Si')},
+    }
+    inputs = {
+        'code': fixture_code('siesta.siesta'),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1},
+               'max_wallclock_seconds': 1800,
+               }
+        }
+    }
+
+    # The missing pseudo of a run
+    inputs['runs'] = {'good': run, 'bad': {**run, 'pseudos': {'Si': generate_psf_data('Si')}}}
+    with pytest.raises(ValueError, match='Invalid inputs for the run `bad`'):
+        generate_calc_job(fixture_sandbox, 'siesta.bundle', inputs)
+
+    # Restarts are not supported
+    remote = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+    inputs['runs'] = {'good': {**run, 'parent_calc_folder': remote}}
+    with pytest.raises(ValueError, match='parent_calc_folder are not allowed'):
+        generate_calc_job(fixture_sandbox, 'siesta.bundle', inputs)
+
+
+def test_bundle_runner():
+    """
+    Test the bash script of the runner.
+    """
+    runner = get_bundle_runner([('a', ['siesta < aiida.fdf > aiida.out']), ('b c', ['echo 1\necho 2'])], 3)
+
+    assert runner.startswith('#!/bin/bash\n# Run the 2 siesta runs of the bundle, at most 3 at the same time\n')
+    assert "(\n    cd a || exit 1\n    siesta < aiida.fdf > aiida.out\n) &\n" in runner
+    assert "(\n    cd 'b c' || exit 1\n    echo 1\n    echo 2\n) &\n" in runner
+    assert runner.endswith('\nwait\n')
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.utils.tkdict import FDFDict, FDFQuantity
 
 
 def test_fdfdict_wrong_argument():
@@ -62,3 +62,60 @@ def test_fdfdict_methods():
     assert sorted(f.untranslated_items()) == sorted([("w--",5),("e",4)])
     assert f.get_dict() == {"w":5,"e":4}
     assert f.get_untranslated_dict() == {"w--":5,"e":4}
+
+
+def test_fdfdict_merge_diff():
+    """
+    Test the merge and the comparison of FDFDict instances
+    """
+
+    f = FDFDict({"Mesh-Cutoff": "100 Ry", "xc.functional": "GGA"})
+    g = FDFDict({"meshcutoff": "200 Ry", "DM.Tolerance": 1.e-4})
+
+    merged = f.merge(g)
+    assert merged.get_untranslated_dict() == {"meshcutoff": "200 Ry", "xc.functional": "GGA", "DM.Tolerance": 1.e-4}
+    assert f["mesh-cutoff"] == "100 Ry"
+    assert f.merge({"XC-Functional": "LDA"})["xcfunctional"] == "LDA"
+
+    assert f.diff(g) == {"meshcutoff": ("100 Ry", "200 Ry"), "xcfunctional": ("GGA", None), "dmtolerance": (None, 1.e-4)}
+    assert f.diff({"meshcutoff": "100 Ry", "xc-functional": "GGA"}) == {}
+
+
+def test_fdfdict_content_hash():
+    """
+    The content hash does not depend on the spelling and on the order of the keys
+    """
+
+    f = FDFDict({"Mesh-Cutoff": "100 Ry", "xc.functional": "GGA"})
+    g = FDFDict({"xcfunctional": "GGA", "meshcutoff": "100 Ry"})
+
+    assert f.content_hash() == g.content_hash()
+    g["mesh-cutoff"] = "200 Ry"
+    assert f.content_hash() != g.content_hash()
+
+
+def test_fdfdict_typed_values():
+    """
+    Test the parsing of the values into typed values
+    """
+
+    f = FDFDict({
+        "mesh-cutoff": "100 Ry",
+        "dm-tolerance": "1.d-4",
+        "max-scf-iterations": "50",
+        "spin": "polarized",
+        "write-mulliken-pop": ".true.",
+        "md-steps": 10,
+        "%block pao-basis": "\nSi 2\n%endblock pao-basis",
+    })
+
+    assert f.get_typed("meshcutoff") == FDFQuantity(100, "Ry")
+    assert f.get_typed_dict() == {
+        "meshcutoff": FDFQuantity(100, "Ry"),
+        "dmtolerance": 1.e-4,
+        "maxscfiterations": 50,
+        "spin": "polarized",
+        "writemullikenpop": True,
+        "mdsteps": 10,
+        "%block paobasis": "\nSi 2\n%endblock pao-basis",
+    }
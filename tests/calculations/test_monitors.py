@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Tests for the monitors of the siesta calculations."""
+import pytest
+
+from aiida_siesta.calculations.monitors import monitor_geometry_oscillation, monitor_scf_divergence
+
+HEADER = "        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n"
+
+
+def _scf_lines(ddmax_values):
+    """Return the scf lines of the .out file with the given dDmax."""
+    return ''.join(
+        f'   scf: {iscf:4d}     -215.248867     -215.247951     -215.247951  {ddmax:8.6f} -3.727489  0.002638\n'
+        for iscf, ddmax in enumerate(ddmax_values, start=1)
+    )
+
+
+@pytest.fixture
+def running_node(fixture_localhost, generate_calc_job_node, tmp_path):
+    """Return a function that writes the remote files and returns the node of the running calculation."""
+
+    def _running_node(out_content, messages=''):
+        (tmp_path / 'aiida.out').write_text(out_content)
+        (tmp_path / 'MESSAGES').write_text(messages)
+        node = generate_calc_job_node('siesta.siesta', fixture_localhost, attributes={'output_filename': 'aiida.out'})
+        node.set_remote_workdir(str(tmp_path))
+        return node
+
+    return _running_node
+
+
+def test_monitor_scf_divergence(fixture_localhost, running_node):
+    """
+    The job is killed only if the scf is diverging and the calculation did not end already.
+    """
+    converging = HEADER + _scf_lines([1.0 / 2**i for i in range(20)])
+    diverging = HEADER + _scf_lines([1.0 / 2**i for i in range(10)] + [0.01 * 1.2**i for i in range(10)])
+
+    with fixture_localhost.get_transport() as transport:
+        assert monitor_scf_divergence(running_node(converging), transport) is None
+        result = monitor_scf_divergence(running_node(diverging), transport)
+        assert 'SCF diverging' in result.message
+        assert not result.override_exit_code
+        # Only the last lines are read, the header is not among them
+        assert monitor_scf_divergence(running_node(diverging), transport, max_lines=15) is not None
+        assert monitor_scf_divergence(running_node(diverging), transport, min_iterations=25) is None
+        assert monitor_scf_divergence(running_node(diverging, 'INFO: Job completed\n'), transport) is None
+
+
+def test_monitor_scf_divergence_new_step(fixture_localhost, running_node):
+    """
+    The last lines of a converged geometry step are not merged with the SCF cycle of the next step.
+    """
+    previous_step = HEADER + _scf_lines([1.0 / 1.3**i for i in range(50)])
+    content = previous_step + HEADER + _scf_lines([1.0 / 2**i for i in range(5)])
+
+    with fixture_localhost.get_transport() as transport:
+        # The header of the previous step is not among the 50 lines read
+        assert monitor_scf_divergence(running_node(content), transport, max_lines=50, min_iterations=5) is None
+        assert monitor_scf_divergence(running_node(content), transport, max_lines=50) is None
+
+
+def test_monitor_geometry_oscillation(fixture_localhost, running_node):
+    """
+    The job is killed if the energies of the last geometry steps oscillate.
+    """
+    energies = [-1.0, -2.0, -3.0] + [-2.9, -2.95] * 5
+    content = ''.join(
+        HEADER + f'   scf:    1     {energy:.6f}     {energy:.6f}     {energy:.6f}  0.000100 -3.727489  0.002638\n'
+        for energy in energies
+    )
+
+    with fixture_localhost.get_transport() as transport:
+        result = monitor_geometry_oscillation(running_node(content), transport, window=8)
+        assert 'Geometry oscillating' in result.message
+        assert monitor_geometry_oscillation(running_node(content), transport, window=12) is None
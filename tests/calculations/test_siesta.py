@@ -170,6 +170,15 @@ def test_validators(aiida_profile, fixture_sandbox, generate_calc_job,
         calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
     inputs["kpoints"] = generate_kpoints_mesh(2)
 
+    # Test the settings validator
+    inputs["settings"] = orm.Dict(dict={"parser_workers": 0})
+    with pytest.raises(ValueError):
+        calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    inputs["settings"] = orm.Dict(dict={"parser_workers": 2, "parser_pool": "mpi"})
+    with pytest.raises(ValueError):
+        calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    inputs.pop("settings")
+
     # Test missing pseudo
     with pytest.raises(ValueError):
         calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
@@ -632,3 +641,296 @@ def test_optical(aiida_profile, fixture_sandbox, generate_calc_job,
         input_written = handle.read()
 
     file_regression.check(input_written, encoding='utf-8', extension='.fdf')
+
+
+def test_structure_cards(aiida_profile, generate_structure):
+    """
+    Test the bulk addition of floating sites and the generation of the atomic positions block.
+    """
+    from aiida_siesta.calculations.siesta import get_atomic_positions_card, internal_structure
+
+    structure = generate_structure()
+    floating = [
+        {"name": 'Si_bond', "symbols": 'Si', "position": (0.125, 0.125, 0.125)},
+        {"name": 'Si_bond', "symbols": 'Si', "position": (1, 2, 3)},
+        {"name": 'O_bond', "symbols": 'O', "position": (0.5, 0.5, 0.5)},
+    ]
+    tweaked = internal_structure(structure, {"floating_sites": floating})
+
+    assert [kind.name for kind in tweaked.kinds] == ['Si', 'SiDiff', 'Si_bond', 'O_bond']
+    assert [site.kind_name for site in tweaked.sites] == ['Si', 'SiDiff', 'Si_bond', 'Si_bond', 'O_bond']
+    assert tweaked.sites[3].position == (1., 2., 3.)
+    assert len(structure.sites) == 2
+
+    # Same name of a kind of the structure
+    clash = [{"name": 'Si', "symbols": 'Si', "position": (0, 0, 0)}]
+    assert internal_structure(structure, {"floating_sites": clash}) is None
+    # Same name, different symbols
+    floating.append({"name": 'O_bond', "symbols": 'N', "position": (0.5, 0.5, 0.5)})
+    with pytest.raises(ValueError):
+        internal_structure(structure, {"floating_sites": floating})
+
+    spind = {'Si': 1, 'SiDiff': 2, 'Si_bond': 3, 'O_bond': 4}
+    reference = ["%block atomiccoordinatesandatomicspecies\n"]
+    for index, site in enumerate(tweaked.sites, start=1):
+        pos = site.position
+        kind = site.kind_name
+        reference.append(f"{pos[0]:18.10f} {pos[1]:18.10f} {pos[2]:18.10f} {spind[kind]:4} {kind.rjust(6):6} {index:6}\n")
+    reference.append("%endblock atomiccoordinatesandatomicspecies\n")
+
+    assert get_atomic_positions_card(tweaked, spind) == "".join(reference)
+
+
+def test_pseudo_cache(aiida_profile, fixture_sandbox, generate_calc_job, fixture_code, generate_structure,
+    generate_param, generate_psf_data, generate_psml_data, tmp_path):
+    """
+    Test the remote cache of pseudos: the population of the cache and the symlinks of the cached files.
+    """
+    from aiida_siesta.utils.pseudo_cache import CACHE_PROPERTY, clear_pseudo_cache, populate_pseudo_cache
+
+    entry_point_name = 'siesta.siesta'
+
+    psf = generate_psf_data('Si')
+    psml = generate_psml_data('Si')
+    code = fixture_code(entry_point_name)
+    computer = code.computer
+    cache_dir = str(tmp_path / 'cache')
+
+    with pytest.raises(ValueError):
+        populate_pseudo_cache(computer, 'cache', [psf])
+
+    # Only the psf is cached
+    assert populate_pseudo_cache(computer, cache_dir, [psf, psf]) == [f'{psf.md5}.psf']
+    assert populate_pseudo_cache(computer, cache_dir, [psf]) == []
+    assert (tmp_path / 'cache' / f'{psf.md5}.psf').read_text() == psf.get_content()
+    assert computer.get_property(CACHE_PROPERTY)[cache_dir] == [psf.md5]
+
+    inputs = {
+        'code': code,
+        'structure': generate_structure(),
+        'parameters': generate_param(),
+        'pseudos': {
+            'Si': psf,
+            'SiDiff': psml
+        },
+        'settings': orm.Dict(dict={'pseudo_cache': cache_dir}),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    assert calc_info.local_copy_list == [(psml.uuid, psml.filename, 'SiDiff.psml')]
+    assert calc_info.remote_symlink_list == [(computer.uuid, op.join(cache_dir, f'{psf.md5}.psf'), 'Si.psf')]
+
+    inputs['settings'] = orm.Dict(dict={'pseudo_cache': 'cache'})
+    with pytest.raises(ValueError):
+        generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    # Once the record of the cache is cleared, the pseudos are uploaded again
+    clear_pseudo_cache(computer, cache_dir)
+    assert cache_dir not in computer.get_property(CACHE_PROPERTY)
+    inputs['settings'] = orm.Dict(dict={'pseudo_cache': cache_dir})
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.remote_symlink_list == []
+    assert (psf.uuid, psf.filename, 'Si.psf') in calc_info.local_copy_list
+
+
+def test_pseudo_cache_portable_code(aiida_profile, fixture_localhost, tmp_path):
+    """
+    The pseudo cache is refused for a code that is not installed on a computer.
+    """
+    from aiida_siesta.calculations.siesta import validate_inputs
+
+    (tmp_path / 'siesta').write_text('')
+    code = orm.PortableCode(filepath_executable='siesta', filepath_files=tmp_path)
+    settings = orm.Dict(dict={'pseudo_cache': '/scratch/cache'})
+    assert 'InstalledCode' in validate_inputs({'code': code, 'settings': settings, 'pseudos': {}}, None)
+
+    installed = orm.InstalledCode(computer=fixture_localhost, filepath_executable='/bin/true')
+    assert validate_inputs({'code': installed, 'settings': settings, 'pseudos': {}}, None) is None
+
+
+def test_restart_policy(aiida_profile, fixture_sandbox, generate_calc_job, fixture_code, generate_structure,
+    generate_param, generate_psf_data):
+    """
+    Test the transfer of the files of the `parent_calc_folder` according to the `restart_policy`.
+    """
+    entry_point_name = 'siesta.siesta'
+
+    code = fixture_code(entry_point_name)
+    computer = code.computer
+    parent = orm.RemoteData(computer=computer, remote_path='/tmp/parent')
+
+    inputs = {
+        'code': code,
+        'structure': generate_structure(),
+        'parameters': generate_param(),
+        'pseudos': {
+            'Si': generate_psf_data('Si'),
+            'SiDiff': generate_psf_data('Si')
+        },
+        'parent_calc_folder': parent,
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               }
+        }
+    }
+
+    # Default: the density matrix is copied
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.remote_copy_list == [(computer.uuid, '/tmp/parent/./*.DM', './')]
+    assert calc_info.remote_symlink_list == []
+
+    inputs['restart_policy'] = orm.Dict({'symlink': True, 'extra_files': ['XV', 'LBFGS']})
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.remote_copy_list == []
+    assert calc_info.remote_symlink_list == [
+        (computer.uuid, '/tmp/parent/./*.DM', './'),
+        (computer.uuid, '/tmp/parent/./*.XV', './'),
+        (computer.uuid, '/tmp/parent/./*.LBFGS', './'),
+    ]
+    with fixture_sandbox.open('aiida.fdf') as handle:
+        input_written = handle.read()
+    assert 'dmusesavedm T' in input_written
+    assert 'mdusesavexv T' in input_written
+    assert 'mdusesavecg' not in input_written
+
+    # Parent on another computer: the transfer is skipped, or the inputs rejected if requested
+    other = orm.Computer(
+        label='other_computer', hostname='other', transport_type='core.local', scheduler_type='core.direct'
+    ).store()
+    inputs['parent_calc_folder'] = orm.RemoteData(computer=other, remote_path='/tmp/parent')
+    inputs['restart_policy'] = orm.Dict({'extra_files': ['XV']})
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.remote_copy_list == []
+    assert calc_info.remote_symlink_list == []
+
+    inputs['restart_policy'] = orm.Dict({'skip_other_computer': False})
+    with pytest.raises(ValueError):
+        generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    inputs['restart_policy'] = orm.Dict({'extra_files': ['DM']})
+    with pytest.raises(ValueError):
+        generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+
+def test_retrieve_policy(aiida_profile, fixture_sandbox, generate_calc_job, fixture_code, generate_structure,
+    generate_param, generate_psf_data):
+    """
+    Test the temporary retrieval and the remote compression requested with the `retrieve_policy` in settings.
+    """
+    entry_point_name = 'siesta.siesta'
+
+    inputs = {
+        'code': fixture_code(entry_point_name),
+        'structure': generate_structure(),
+        'parameters': generate_param(),
+        'pseudos': {
+            'Si': generate_psf_data('Si'),
+            'SiDiff': generate_psf_data('Si')
+        },
+        'settings': orm.Dict({'retrieve_policy': {'temporary': ['xml', 'messages'], 'compress': 'xz'}}),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    assert calc_info.retrieve_temporary_list == ['aiida.xml', 'aiida.xml.xz', 'MESSAGES']
+    assert sorted(calc_info.retrieve_list) == sorted([
+        'aiida.out', 'aiida.out.xz', 'time.json', 'BASIS_ENTHALPY', 'BASIS_HARRIS_ENTHALPY', '*.ion.xml'
+    ])
+    assert 'for f in aiida.out aiida.xml; do' in calc_info.append_text
+    assert 'xz -f "$f"' in calc_info.append_text
+
+    inputs['settings'] = orm.Dict({'retrieve_policy': {'temporary': True}})
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.retrieve_list == []
+    assert calc_info.append_text is None
+
+    # The additional files are compressed only if requested
+    settings = {
+        'additional_retrieve_list': ['aiida.PDOS', ('out/*', '.', 1)],
+        'retrieve_policy': {'compress': 'gzip', 'compress_additional': True}
+    }
+    inputs['settings'] = orm.Dict(settings)
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+    assert calc_info.retrieve_list[-3:] == ['aiida.PDOS', ['out/*', '.', 1], 'aiida.PDOS.gz']
+    assert 'for f in aiida.out aiida.xml aiida.PDOS; do' in calc_info.append_text
+
+    for policy in [{'compress': 'zip'}, {'temporary': ['DM']}, {'archive': True}]:
+        inputs['settings'] = orm.Dict({'retrieve_policy': policy})
+        with pytest.raises(ValueError):
+            generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+
+def test_postprocess_stm(aiida_profile, fixture_sandbox, generate_calc_job, fixture_code, generate_structure,
+    generate_param, generate_psf_data):
+    """
+    Test that the plstm run of `postprocess.stm` is chained to siesta in the same job.
+    """
+    entry_point_name = 'siesta.siesta'
+
+    parameters = generate_param().get_dict()
+    parameters['%block local-density-of-states'] = '\n -9.6  -1.6 eV \n %endblock local-density-of-states'
+    inputs = {
+        'code': fixture_code(entry_point_name),
+        'structure': generate_structure(),
+        'parameters': orm.Dict(parameters),
+        'pseudos': {
+            'Si': generate_psf_data('Si'),
+            'SiDiff': generate_psf_data('Si')
+        },
+        'postprocess': {
+            'stm': {
+                'code': fixture_code('siesta.stm'),
+                'mode': orm.Str('constant-current'),
+                'value': orm.Float(2),
+                'spin_option': orm.Str('s'),
+            }
+        },
+        'settings': orm.Dict({'retrieve_policy': {'compress': 'gzip'}}),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': True,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    # Only siesta in the run line, plstm is serial and runs before the compression of the outputs
+    assert len(calc_info.codes_info) == 1
+    assert calc_info.append_text.startswith(
+        'if [ -f aiida.LDOS ]; then\n    /bin/true -i 2.00000 -s s aiida.LDOS < stm.in > stm.out\nfi\n\n'
+    )
+    assert 'for f in aiida.out aiida.xml stm.out *.STM; do' in calc_info.append_text
+    assert {'stm.out', '*.STM', '*.STM.gz'}.issubset(calc_info.retrieve_list)
+    with fixture_sandbox.open('stm.in') as handle:
+        assert handle.read() == 'aiida\nldos\nconstant-current\n2.00000\nunformatted\n'
+
+    # The LDOS block is necessary
+    inputs['parameters'] = generate_param()
+    with pytest.raises(ValueError, match='local-density-of-states'):
+        generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    inputs['parameters'] = orm.Dict(parameters)
+    inputs['postprocess'] = {'stm': {'code': fixture_code('siesta.stm'), 'value': orm.Float(2)}}
+    with pytest.raises(ValueError, match='mode of `postprocess.stm` are required'):
+        generate_calc_job(fixture_sandbox, entry_point_name, inputs)
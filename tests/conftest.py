@@ -15,6 +15,14 @@ pytest_plugins = ['aiida.manage.tests.pytest_fixtures']  # pylint: disable=inval
 #Here there is aiida_profile, aiida_localhost
 #Strange way to call it, it is the way of pytest https://docs.pytest.org/en/latest/plugins.html
 
+@pytest.fixture(autouse=True)
+def ion_ascii_cache(tmp_path, monkeypatch):
+    """Redirect the persistent cache of the ascii .ion files to a temporary directory."""
+    cache_dir = tmp_path / 'ion_ascii_cache'
+    monkeypatch.setattr('aiida_siesta.data.ion.get_ascii_cache_dir', lambda: str(cache_dir))
+    return cache_dir
+
+
 @pytest.fixture(scope='function')
 def fixture_sandbox():
     """Return a `SandboxFolder`."""
@@ -42,6 +50,16 @@ def fixture_code(fixture_localhost):
     return _fixture_code
 
 
+@pytest.fixture
+def bundle_entry_points(entry_points):
+    """Make sure that the entry points of the `SiestaBundleCalculation` and of its parser are available."""
+    from aiida_siesta.calculations.bundle import SiestaBundleCalculation
+    from aiida_siesta.parsers.bundle import SiestaBundleParser
+
+    entry_points.add(SiestaBundleCalculation, 'aiida.calculations:siesta.bundle')
+    entry_points.add(SiestaBundleParser, 'aiida.parsers:siesta.bundle')
+
+
 @pytest.fixture
 def generate_calc_job():
     """Fixture to construct a new `CalcJob` instance and call `prepare_for_submission` for testing `CalcJob` classes.
@@ -397,6 +415,38 @@ def generate_parser():
     return _generate_parser
 
 
+@pytest.fixture
+def generate_parsed_calc_job_node(fixture_localhost, generate_calc_job_node, generate_parser, generate_structure):
+    """Return a finished `SiestaCalculation` node, with the outputs and exit status of the parsing of a fixture."""
+
+    def _generate_parsed_calc_job_node(test_name, inputs=None):
+        """Return the node, parsing the files in the `parsers/fixtures/siesta/{test_name}` folder.
+        :param inputs: the inputs of the calculation, by default only the structure
+        """
+        from aiida.common import AttributeDict, LinkType
+        from plumpy import ProcessState
+
+        inputs = inputs or {'structure': generate_structure()}
+        attributes = AttributeDict({'input_filename': 'aiida.fdf', 'output_filename': 'aiida.out', 'prefix': 'aiida'})
+        node = generate_calc_job_node('siesta.siesta', fixture_localhost, test_name, inputs, attributes)
+
+        results, calcfunction = generate_parser('siesta.parser').parse_from_node(node, store_provenance=False)
+        for link_label, output in results.items():
+            if isinstance(output, collections.abc.Mapping):
+                for name, nested in output.items():
+                    nested.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=f'{link_label}__{name}')
+                    nested.store()
+            else:
+                output.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=link_label)
+                output.store()
+        node.set_process_state(ProcessState.FINISHED)
+        node.set_exit_status(calcfunction.exit_status)
+
+        return node
+
+    return _generate_parsed_calc_job_node
+
+
 @pytest.fixture
 def generate_remote_data():
     """Return a `RemoteData` node."""
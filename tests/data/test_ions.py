@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import os
+
 from aiida.common.exceptions import StoringNotAllowed
 import pytest
 
+from aiida_siesta.data.ion import IonData
+
 
 def test_ions(generate_ion_data):
     """
@@ -115,6 +119,57 @@ def test_get_or_create(generate_ion_data):
     assert test_i.is_stored == True
 
 
+def test_single_parse(generate_ion_data, monkeypatch):
+    """
+    The md5 is computed while parsing and the file is not parsed again at storing
+    """
+
+    from aiida.common.files import md5_from_filelike
+
+    from aiida_siesta.data import ion as ion_module
+
+    ion = generate_ion_data('Si')
+    with ion.open(mode='rb') as handle:
+        assert ion.md5 == md5_from_filelike(handle)
+
+    def fail(stream):
+        raise AssertionError('The ion file should not be parsed again')
+
+    monkeypatch.setattr(ion_module, 'parse_ion', fail)
+    ion.store()
+    assert ion.is_stored
+
+
+def test_bulk_get_or_create(generate_ion_data):
+    """
+    Test the `bulk_get_or_create` method
+    """
+
+    import io
+    import os
+
+    from aiida_siesta.data.ion import IonData
+
+    filepaths = [
+        os.path.abspath(os.path.join('tests', 'fixtures', 'ions', f'{name}.ion.xml'))
+        for name in ['SiTris', 'Si_with_conf']
+    ]
+    stored = IonData.get_or_create(filepaths[0]).store()
+
+    with io.open(filepaths[1], 'rb') as handle:
+        ions = IonData.bulk_get_or_create([filepaths[0], filepaths[1], handle])
+
+    assert len(ions) == 3
+    assert all(ion.is_stored for ion in ions)
+    assert ions[0].uuid == stored.uuid
+    assert ions[1].uuid == ions[2].uuid
+    assert ions[1].name == 'Si'
+
+    assert IonData.bulk_get_or_create([]) == []
+    with pytest.raises(TypeError):
+        IonData.bulk_get_or_create(["ss"])
+
+
 def test_get_orbitals(generate_ion_data):
     """
     Test the get_orbitals method
@@ -127,6 +182,38 @@ def test_get_orbitals(generate_ion_data):
     assert isinstance(orbit_list[0],SislAtomicOrbital)
 
 
+def test_get_radial_orbitals(generate_ion_data, monkeypatch):
+    """
+    Test the in-memory parsing of the PAOs and its cache
+    """
+
+    from aiida_siesta.data import ion as ion_module
+
+    ion_module.clear_orbitals_cache()
+    ion = generate_ion_data('Si')
+    orbitals = ion.get_radial_orbitals()
+    assert [(orb.n, orb.l, orb.zeta, orb.polarized) for orb in orbitals] == [
+        (3, 0, 1, False), (3, 0, 2, False), (3, 1, 1, False), (3, 1, 2, False), (3, 2, 1, True),
+        (3, 2, 2, True)
+    ]
+    assert orbitals[0].population == 2.0
+    assert orbitals[0].r.shape == orbitals[0].f.shape == (500,)
+    assert not orbitals[0].f.flags.writeable
+
+    # A second node with the same file is served from the cache
+    def fail(stream):
+        raise AssertionError('The ion file should not be parsed again')
+
+    monkeypatch.setattr(ion_module, 'parse_ion_orbitals', fail)
+    assert generate_ion_data('Si').get_radial_orbitals() is orbitals
+
+    # The cache is bounded
+    monkeypatch.undo()
+    monkeypatch.setattr(ion_module, 'ORBITALS_CACHE_SIZE', 1)
+    generate_ion_data('SiDiff').get_radial_orbitals()
+    assert ion.md5 not in ion_module._orbitals_cache
+
+
 def test_analyze_basis_specs(generate_ion_data):
     """
     Test the method hidden _analyze_basis_specs
@@ -171,3 +258,33 @@ def test_get_info_soft_conf(generate_ion_data):
 
 # The `get_content_ascii_format` is tested is the calculations/test_siesta.py
 # the rest of methods in utils/test_pao_manager.py
+
+
+def test_ascii_format_cache(generate_ion_data, ion_ascii_cache, monkeypatch):
+    """
+    Test the persistent cache of the ascii .ion files
+    """
+    import io
+
+    ion = generate_ion_data('Si')
+    content = ion.get_content_ascii_format()
+    assert os.listdir(ion_ascii_cache) == [os.path.basename(ion.get_ascii_cache_path())]
+
+    # The next conversions, also of other nodes with the same file, are copied from the cache
+    def fail(handle):
+        raise AssertionError('The ion file should not be converted again')
+
+    monkeypatch.setattr(IonData, '_write_ascii_format', fail)
+    handle = io.StringIO()
+    generate_ion_data('Si').write_content_ascii_format(handle)
+    assert handle.getvalue() == content
+    monkeypatch.undo()
+
+    # Without cache, or if the cache can not be written, the conversion is direct
+    handle = io.StringIO()
+    generate_ion_data('SiDiff').write_content_ascii_format(handle, use_cache=False)
+    assert handle.getvalue().startswith('<preamble>')
+    assert len(os.listdir(ion_ascii_cache)) == 1
+
+    monkeypatch.setattr('aiida_siesta.data.ion.get_ascii_cache_dir', lambda: '/proc/not_writable')
+    assert generate_ion_data('Si').get_content_ascii_format() == content
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Tests for the `IonFamily` group."""
+import os
+import shutil
+
+from aiida import orm
+import pytest
+
+from aiida_siesta.groups.ion_family import ION_INDEX_EXTRA, IonFamily
+
+IONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'ions')
+
+
+@pytest.fixture
+def generate_ion_family(entry_points, tmp_path):
+    """Return a function creating an `IonFamily` from some of the ion files of the fixtures."""
+
+    entry_points.add(IonFamily, 'aiida.groups:siesta.ion_family')
+
+    def _generate_ion_family(label, names=('Si', 'SiDiff', 'SiTris')):
+        dirpath = tmp_path / label
+        dirpath.mkdir(exist_ok=True)
+        for name in names:
+            shutil.copy(os.path.join(IONS, f'{name}.ion.xml'), dirpath)
+        return IonFamily.create_from_folder(str(dirpath), label)
+
+    return _generate_ion_family
+
+
+def test_ion_family(aiida_profile, generate_ion_family, generate_structure, generate_ion_data):
+    """Test the creation of a family, its index and the resolution of the ions of structures."""
+
+    family = generate_ion_family('ions')
+
+    assert len(family.nodes) == 3
+    assert sorted(family.ion_index) == ['Si', 'SiDiff', 'SiTris']
+    assert family.ion_index['SiDiff']['element'] == 'Si'
+    assert orm.Group.collection.get(label='ions').ion_index == family.ion_index
+
+    with pytest.raises(ValueError, match='already exists'):
+        generate_ion_family('ions')
+
+    # The kinds are resolved by label, with a single query for many structures
+    structure = generate_structure()
+    ions = family.get_ions(structure)
+    assert ions['Si'].name == 'Si'
+    assert ions['SiDiff'].name == 'SiDiff'
+    scaled = generate_structure()
+    for ions in family.get_ions_for_structures([structure, scaled]):
+        assert set(ions) == {'Si', 'SiDiff'}
+
+    # By element only if the family has a single ion for it
+    other = orm.StructureData(cell=structure.cell)
+    other.append_atom(position=(0., 0., 0.), symbols='Si', name='Si2')
+    with pytest.raises(ValueError, match='no \\(unique\\) ion for the kind `Si2`'):
+        family.get_ions(other)
+    single = generate_ion_family('single', names=('SiTris',))
+    assert single.get_ions(other)['Si2'].name == 'SiTris'
+
+    # Only ions, and only one per label
+    with pytest.raises(TypeError):
+        family.add_nodes(orm.Int(1).store())
+    with pytest.raises(ValueError, match='different ion with label `Si`'):
+        family.add_nodes(generate_ion_data('Si_with_conf').store())
+
+    family.remove_nodes(ions['SiDiff'])
+    assert sorted(family.ion_index) == ['Si', 'SiTris']
+
+    family.base.extras.delete(ION_INDEX_EXTRA)
+    family.rebuild_index()
+    assert sorted(family.ion_index) == ['Si', 'SiTris']
+
+    family.clear()
+    assert family.ion_index == {}
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+
+from aiida import orm
+from aiida.common import AttributeDict, LinkType
+
+
+def test_bundle(aiida_profile, bundle_entry_points, fixture_localhost, generate_calc_job_node, generate_parser,
+    generate_structure, generate_basis):
+    """
+    Test the parsing of a bundle: a successful run, a run without scf convergence and a run that did not start.
+    Each run is parsed into its own outputs and the bundle fails listing the failed runs.
+    """
+    basis = generate_basis().get_dict()
+    basis["floating_sites"] = [{"name": 'Si_bond', "symbols": 'Si', "position": (0.125, 0.125, 0.125)}]
+    inputs = AttributeDict({
+        'runs': {
+            'good': {'structure': generate_structure(), 'basis': orm.Dict(basis)},
+            'no_scf': {'structure': generate_structure()},
+            'lost': {'structure': generate_structure()},
+        }
+    })
+    attributes = AttributeDict({'input_filename': 'aiida.fdf', 'output_filename': 'aiida.out', 'prefix': 'aiida'})
+    node = generate_calc_job_node('siesta.bundle', fixture_localhost, None, inputs, attributes)
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta')
+    retrieved = orm.FolderData()
+    retrieved.base.repository.put_object_from_tree(os.path.join(fixtures, 'default'), 'good')
+    retrieved.base.repository.put_object_from_tree(os.path.join(fixtures, 'no_scf_conv'), 'no_scf')
+    retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+
+    parser = generate_parser('siesta.bundle')
+    results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished
+    assert calcfunction.exception is None
+    assert calcfunction.exit_status == 444
+    assert calcfunction.exit_message == 'At least one run of the bundle failed: lost, no_scf'
+    assert results['exit_statuses'].get_dict() == {'good': 0, 'lost': 350, 'no_scf': 450}
+    assert set(results['runs']) == {'good', 'no_scf'}
+    assert set(results['runs']['good']) == {
+        'output_parameters', 'output_structure', 'forces_and_stress', 'scf_history', 'ion_files'
+    }
+    assert set(results['runs']['good']['ion_files']) == {'Si', 'SiDiff', 'Si_bond'}
+    assert 'output_parameters' in results['runs']['no_scf']
@@ -312,6 +312,18 @@ def test_siesta_no_geom_conv(aiida_profile, fixture_localhost, generate_calc_job
     assert 'output_parameters' in results
     assert 'output_structure' in results
 
+    # The complete timer tree is stored, including the sections not in the timing_decomposition
+    profile = results['timing_profile']
+    sections = list(profile.get_array('sections'))
+    assert sections[0] == 'siesta'
+    assert 'siesta/IterGeom/state_init/hsparse' in sections
+    assert profile.get_array('calls')[sections.index('siesta/IterGeom')] == 4
+    assert profile.get_array('time')[0] == results['output_parameters']['global_time']
+
+    # The scf history of the four geometry steps
+    scf_history = results['scf_history']
+    assert list(scf_history.get_array('geometry_step')) == [0] * 4 + [1] * 4 + [2] * 4 + [3]
+
     data_regression.check({
         'output_structure': results['output_structure'].attributes,
         'output_parameters': results['output_parameters'].get_dict()
@@ -434,3 +446,313 @@ def test_siesta_optical_error(aiida_profile, fixture_localhost, generate_calc_jo
     assert 'output_parameters' in results
     assert 'output_structure' in results
     assert 'optical_eps2' not in results
+
+
+@pytest.mark.parametrize('name', ['default', 'no_geom_conv', 'no_scf_conv'])
+def test_siesta_xml_streaming(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, name):
+    """
+    Test that the streaming parsing of the .xml file (`xml_streaming` in settings) returns exactly
+    the same outputs and exit status of the standard parsing based on minidom.
+    """
+
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    collect = []
+    for settings in [{}, {'xml_streaming': True}]:
+        inputs = AttributeDict({
+            'structure': generate_structure(),
+            'settings': orm.Dict(dict=settings)
+        })
+        node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+        parser = generate_parser(entry_point_parser)
+        results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+        collect.append((results, calcfunction))
+
+    (std_res, std_calc), (stream_res, stream_calc) = collect
+
+    assert std_calc.exit_status == stream_calc.exit_status
+    assert set(std_res) == set(stream_res)
+    assert std_res['output_parameters'].get_dict() == stream_res['output_parameters'].get_dict()
+    if 'forces_and_stress' in std_res:
+        for arr in ['forces', 'stress']:
+            assert (std_res['forces_and_stress'].get_array(arr) == stream_res['forces_and_stress'].get_array(arr)).all()
+    if 'output_structure' in std_res:
+        assert std_res['output_structure'].cell == stream_res['output_structure'].cell
+        assert std_res['output_structure'].sites[1].position == stream_res['output_structure'].sites[1].position
+
+
+def test_cml_index():
+    """
+    Test that the `CMLIndex` records the correct modules by role and that the parsing helpers
+    return the same results when they receive the minidom document or its index.
+    """
+    import os
+    from xml.dom import minidom
+
+    from aiida_siesta.parsers.siesta import get_dict_from_xml_doc, get_final_forces_and_stress
+    from aiida_siesta.utils.cml import CMLIndex
+
+    filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta', 'no_geom_conv', 'aiida.xml')
+    xmldoc = minidom.parse(filepath)
+    cml_index = CMLIndex(xmldoc)
+
+    assert cml_index.variable_geometry
+    assert cml_index.last_geometry.getAttribute('serial') == '4'
+    assert cml_index.scf_final.parentNode is cml_index.last_geometry
+    assert set(cml_index.sizes) == {'siesta:no_u', 'siesta:nnz', 'siesta:ntm'}
+    assert len(cml_index.metadata) == len(xmldoc.getElementsByTagName('metadata'))
+
+    assert get_dict_from_xml_doc(cml_index) == get_dict_from_xml_doc(xmldoc)
+    assert get_final_forces_and_stress(cml_index) == get_final_forces_and_stress(xmldoc)
+
+
+@pytest.mark.parametrize('band_lines', [True, False])
+@pytest.mark.parametrize('nspins', [1, 2])
+def test_get_bands_from_tokens(band_lines, nspins):
+    """
+    Test the extraction of the eigenvalues from the .bands tokens, for both the BandLines and
+    BandPoints layouts and for one and two spins. Trailing labels (BandLines) are ignored,
+    truncated files raise ValueError.
+    """
+    import numpy as np
+
+    from aiida_siesta.parsers.siesta import get_bands_from_tokens
+
+    nbands, nkpoints = 4, 3
+    eigs = np.arange(nkpoints * nspins * nbands, dtype=float).reshape(nkpoints, nspins, nbands)
+
+    if band_lines:
+        tokens = ['-3.5', '0.0', '1.2', '-15.7', '78.6', str(nbands), str(nspins), str(nkpoints)]
+        coords = [[0.1 * ik] for ik in range(nkpoints)]
+    else:
+        tokens = ['-3.5', '-15.7', '78.6', str(nbands), str(nspins), str(nkpoints)]
+        coords = [[0.1 * ik, 0.2, 0.3] for ik in range(nkpoints)]
+    for ik in range(nkpoints):
+        tokens += [str(x) for x in coords[ik]] + [str(x) for x in eigs[ik].flatten()]
+    if band_lines:
+        tokens += ['2', '0.0', "'G'", '1.2', "'X'"]
+    tokens = [tok.encode() for tok in tokens]
+
+    bands = get_bands_from_tokens(tokens, band_lines)
+
+    if nspins == 1:
+        assert (bands == eigs[:, 0, :]).all()
+    else:
+        assert (bands[0] == eigs[:, 0, :]).all()
+        assert (bands[1] == eigs[:, 1, :]).all()
+
+    with pytest.raises(ValueError):
+        get_bands_from_tokens(tokens[:-(nbands + 5)], band_lines)
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+@pytest.mark.parametrize('name', ['bandspoints', 'bands_error', 'optical', 'no_geom_conv'])
+def test_siesta_parsing_pool(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, name, pool):
+    """
+    Test that the parsing with a pool of workers (`parser_workers` and `parser_pool` in settings)
+    returns exactly the same outputs and exit status of the sequential parsing.
+    """
+
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    collect = []
+    for settings in [{}, {'parser_workers': 2, 'parser_pool': pool}]:
+        structure = generate_structure()
+        inputs = AttributeDict({'structure': structure, 'settings': orm.Dict(dict=settings)})
+        if name in ['bandspoints', 'bands_error']:
+            bandskpoints = orm.KpointsData()
+            bandskpoints.set_cell(structure.cell, structure.pbc)
+            bandskpoints.set_kpoints([(0.500,  0.250, 0.750), (0.500,  0.500, 0.500), (0., 0., 0.)])
+            inputs['bandskpoints'] = bandskpoints
+        node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+        parser = generate_parser(entry_point_parser)
+        results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+        collect.append((results, calcfunction))
+
+    (seq_res, seq_calc), (pool_res, pool_calc) = collect
+
+    assert seq_calc.exit_status == pool_calc.exit_status
+    assert set(seq_res) == set(pool_res)
+    assert seq_res['output_parameters'].get_dict() == pool_res['output_parameters'].get_dict()
+    for label, output in seq_res.items():
+        if isinstance(output, orm.ArrayData):
+            for arr in output.get_arraynames():
+                assert (output.get_array(arr) == pool_res[label].get_array(arr)).all()
+    if 'output_structure' in seq_res:
+        assert seq_res['output_structure'].cell == pool_res['output_structure'].cell
+        assert seq_res['output_structure'].sites[1].position == pool_res['output_structure'].sites[1].position
+
+
+def test_get_parsing_pool():
+    """
+    The executors of the parsing are created once for each type and number of workers, then reused.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    from aiida_siesta.parsers.siesta import get_parsing_pool
+
+    assert get_parsing_pool({}) is None
+    assert get_parsing_pool({'PARSER_WORKERS': 1}) is None
+
+    pool = get_parsing_pool({'PARSER_WORKERS': 2})
+    assert isinstance(pool, ThreadPoolExecutor)
+    assert get_parsing_pool({'PARSER_WORKERS': 2, 'PARSER_POOL': 'thread'}) is pool
+    assert get_parsing_pool({'PARSER_WORKERS': 3}) is not pool
+
+    process_pool = get_parsing_pool({'PARSER_WORKERS': 2, 'PARSER_POOL': 'process'})
+    assert isinstance(process_pool, ProcessPoolExecutor)
+    assert get_parsing_pool({'PARSER_WORKERS': 2, 'PARSER_POOL': 'process'}) is process_pool
+
+
+def test_siesta_stopped_by_monitor(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, tmp_path):
+    """
+    Test a parser in the situation when the job is killed by the `siesta.scf_divergence` monitor.
+    The retrieved files are the ones of `no_scf_conv`, but the scf cycle is diverging and the
+    MESSAGES file does not report any error. The check of the monitor is repeated by the parser.
+    """
+    import os
+    import shutil
+
+    from aiida.common import LinkType
+
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta', 'no_scf_conv')
+    for name in ['Si.ion.xml', 'SiDiff.ion.xml', 'aiida.xml']:
+        shutil.copy(os.path.join(fixture, name), tmp_path)
+    with open(os.path.join(fixture, 'aiida.out'), encoding='utf8') as handle:
+        lines = handle.readlines()[:494]
+    for iscf in range(4, 12):
+        lines.append(f'   scf: {iscf:4d}     -215.248867     -215.247951     -215.247951  {0.001 * iscf:8.6f} '
+                     '-3.727489  0.002638\n')
+    (tmp_path / 'aiida.out').write_text(''.join(lines))
+    (tmp_path / 'MESSAGES').write_text('')
+
+    monitor = orm.Dict({'entry_point': 'siesta.scf_divergence', 'kwargs': {'min_iterations': 8, 'window': 5}})
+    inputs = AttributeDict({'structure': generate_structure(), 'monitors': {'scf': monitor}})
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, None, inputs, attributes)
+    retrieved = orm.FolderData()
+    retrieved.base.repository.put_object_from_tree(str(tmp_path))
+    retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+
+    parser = generate_parser(entry_point_parser)
+    results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished
+    assert calcfunction.exception is None
+    assert calcfunction.exit_status == node.process_class.exit_codes.SCF_DIVERGED.status
+    assert 'scf_history' in results
+    assert any('dDmax did not decrease' in log.message for log in orm.Log.objects.get_logs_for(node))
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz'])
+def test_siesta_retrieve_policy(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, tmp_path, compression):
+    """
+    Test that the files compressed on the remote and the ones retrieved temporarily (`retrieve_policy`
+    in settings) give the same outputs and exit status of the standard retrieval.
+    """
+    import gzip
+    import lzma
+    import os
+    import shutil
+
+    from aiida.common import LinkType
+
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+    name = 'no_scf_conv'
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name,
+        AttributeDict({'structure': generate_structure()}), attributes)
+    std_res, std_calc = generate_parser(entry_point_parser).parse_from_node(node, store_provenance=False)
+
+    # The large files are compressed, the others are retrieved temporarily
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta', name)
+    (tmp_path / 'retrieved').mkdir()
+    (tmp_path / 'temporary').mkdir()
+    opener, suffix = {'gzip': (gzip.open, '.gz'), 'xz': (lzma.open, '.xz')}[compression]
+    for file_name in ['aiida.out', 'aiida.xml']:
+        with open(os.path.join(fixture, file_name), 'rb') as source:
+            with opener(tmp_path / 'retrieved' / (file_name + suffix), 'wb') as target:
+                shutil.copyfileobj(source, target)
+    for file_name in ['MESSAGES', 'time.json', 'Si.ion.xml', 'SiDiff.ion.xml']:
+        shutil.copy(os.path.join(fixture, file_name), tmp_path / 'temporary')
+
+    policy = {'temporary': ['json', 'messages', 'ions'], 'compress': compression}
+    inputs = AttributeDict({'structure': generate_structure(), 'settings': orm.Dict({'retrieve_policy': policy})})
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, None, inputs, attributes)
+    retrieved = orm.FolderData()
+    retrieved.base.repository.put_object_from_tree(str(tmp_path / 'retrieved'))
+    retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+
+    results, calcfunction = generate_parser(entry_point_parser).parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=str(tmp_path / 'temporary')
+    )
+
+    assert calcfunction.exit_status == std_calc.exit_status
+    assert set(results) == set(std_res)
+    assert results['output_parameters'].get_dict() == std_res['output_parameters'].get_dict()
+    assert (results['scf_history'].get_array('ddmax') == std_res['scf_history'].get_array('ddmax')).all()
+    # The retrieved folder is untouched
+    assert sorted(retrieved.list_object_names()) == ['aiida.out' + suffix, 'aiida.xml' + suffix]
+
+
+def test_siesta_postprocess_stm(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, fixture_code):
+    """
+    Test that the plot file of the plstm run chained to siesta (`postprocess.stm`) is parsed in the `stm_array`.
+    """
+    import os
+
+    from aiida.common import LinkType
+
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+    inputs = AttributeDict({
+        'structure': generate_structure(),
+        'postprocess': {
+            'stm': {
+                'code': fixture_code('siesta.stm'),
+                'mode': orm.Str('constant-height'),
+                'value': orm.Float(1),
+            }
+        }
+    })
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    for with_stm in [True, False]:
+        node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, None, inputs, attributes)
+        retrieved = orm.FolderData()
+        retrieved.base.repository.put_object_from_tree(os.path.join(fixtures, 'siesta', 'default'))
+        if with_stm:
+            retrieved.base.repository.put_object_from_tree(os.path.join(fixtures, 'stm', 'default'))
+        retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='retrieved')
+        retrieved.store()
+
+        results, calcfunction = generate_parser(entry_point_parser).parse_from_node(node, store_provenance=False)
+
+        if with_stm:
+            assert calcfunction.is_finished_ok, calcfunction.exit_message
+            assert results['stm_array'].get_arraynames() == ['grid_X', 'grid_Y', 'STM']
+        else:
+            assert calcfunction.exit_status == 455
+            assert 'stm_array' not in results
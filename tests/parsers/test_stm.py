@@ -36,3 +36,39 @@ def test_stm_default(aiida_profile, fixture_localhost, generate_calc_job_node,
         'stm_array': results['stm_array'].attributes,
         'output_parameters': results['output_parameters'].attributes,
     })
+
+
+def test_stm_compressed(aiida_profile, fixture_localhost, generate_calc_job_node, generate_parser, tmp_path):
+    """Test that a plot file stored compressed (`retrieve_policy` in settings) is parsed like the plain one."""
+    import gzip
+    import os
+    import shutil
+
+    from aiida.common import LinkType
+
+    entry_point_calc_job = 'siesta.stm'
+    entry_point_parser = 'siesta.stm'
+
+    inputs = AttributeDict({'spin_option': orm.Str("q")})
+    attributes = AttributeDict({'input_filename': 'stm.in', 'output_filename': 'stm.out'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, 'default', inputs, attributes)
+    std_results, _ = generate_parser(entry_point_parser).parse_from_node(node, store_provenance=False)
+
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'stm', 'default')
+    for name in os.listdir(fixture):
+        with open(os.path.join(fixture, name), 'rb') as source, gzip.open(tmp_path / f'{name}.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, None, inputs, attributes)
+    retrieved = orm.FolderData()
+    retrieved.base.repository.put_object_from_tree(str(tmp_path))
+    retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+
+    results, calcfunction = generate_parser(entry_point_parser).parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished_ok, calcfunction.exit_message
+    assert results['output_parameters'].get_dict() == std_results['output_parameters'].get_dict()
+    for name in ['grid_X', 'grid_Y', 'STM']:
+        assert (results['stm_array'].get_array(name) == std_results['stm_array'].get_array(name)).all()
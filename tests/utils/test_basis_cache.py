@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Tests for the basis cache, reusing the ion files generated by previous calculations."""
+from aiida_siesta.utils.basis_cache import (
+    BASIS_CACHE_EXTRA,
+    get_basis_cache_keys,
+    get_basis_options,
+    get_cached_ions,
+    register_ions,
+)
+
+
+def test_get_basis_options():
+    """Test the canonicalization of the options that determine the generation of the basis."""
+
+    basis = {
+        'PAO.EnergyShift': '0.02 Ry',
+        '%block PAO.Basis': '\n Si  2\n  n=3 0 2\n%endblock PAO.Basis',
+        'floating_sites': [{
+            'name': 'Si_bond',
+            'symbols': 'Si',
+            'position': (0.0, 0.0, 0.0)
+        }],
+    }
+    parameters = {'xc-functional': 'GGA', 'xc-authors': 'PBE', 'mesh-cutoff': '200 Ry'}
+
+    options = get_basis_options(basis, parameters)
+    assert options == {
+        'paoenergyshift': [0.02, 'ry'],
+        '%block paobasis': ['Si 2', 'n=3 0 2', '%endblock PAO.Basis'],
+        'xcfunctional': 'gga',
+        'xcauthors': 'pbe',
+    }
+
+    # Same options with a different spelling
+    other_basis = {
+        'pao-energy-shift': '0.020  ry',
+        '%block pao-basis': 'Si 2\nn=3 0 2\n\n%endblock PAO.Basis',
+    }
+    other_parameters = {'XC.Functional': 'gga', 'XC.Authors': 'PBE'}
+    assert get_basis_options(other_basis, other_parameters) == options
+
+
+def test_basis_cache(aiida_profile, fixture_code, generate_psml_data, generate_ion_data):
+    """Test the keys of the species, the registration of ions and their retrieval."""
+
+    psml = generate_psml_data('Si').store()
+    basis = {'pao-energy-shift': '300 meV'}
+    pseudos = {'Si': psml, 'SiDiff': psml}
+    code = fixture_code('siesta.siesta').store()
+    keys = get_basis_cache_keys(pseudos, code, basis, {'xc-functional': 'LDA'})
+
+    assert len(set(keys.values())) == 2
+    assert keys == get_basis_cache_keys(pseudos, code, {'PAO.EnergyShift': '300 meV'}, {'XC.functional': 'LDA'})
+    assert keys != get_basis_cache_keys(pseudos, code, basis, {'xc-functional': 'GGA'})
+
+    # The cache is per code
+    other_code = fixture_code('siesta.siesta').store()
+    assert keys != get_basis_cache_keys(pseudos, other_code, basis, {'xc-functional': 'LDA'})
+    assert get_cached_ions(keys) == {}
+
+    ion = generate_ion_data('Si').store()
+    assert register_ions({'Si': ion}, keys) == ['Si']
+    assert ion.base.extras.get(BASIS_CACHE_EXTRA) == keys['Si']
+    assert get_cached_ions(keys) == {'Si': ion}
+
+    # A species already registered is not registered again, the first ion is kept
+    other = generate_ion_data('Si').store()
+    sidiff = generate_ion_data('SiDiff').store()
+    assert register_ions({'Si': other, 'SiDiff': sidiff}, keys) == ['SiDiff']
+    assert BASIS_CACHE_EXTRA not in other.base.extras.keys()
+    assert get_cached_ions(keys) == {'Si': ion, 'SiDiff': sidiff}
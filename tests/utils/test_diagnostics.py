@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Tests for the scan of the siesta .out file."""
+import pytest
+
+from aiida_siesta.utils import diagnostics
+from aiida_siesta.utils.diagnostics import (
+    get_run_report,
+    scan_memory,
+    scan_output,
+    scan_output_stream,
+    scan_run,
+    scan_run_stream,
+)
+
+SCF_LINE = b"   scf:    1    -1234.567890    -1234.567890    -1234.567890  0.000001 -3.7  0.12345\n"
+
+
+def test_scan_output_clean():
+    """
+    No signature is detected in a normal output.
+    """
+    result = scan_output(SCF_LINE * 100)
+
+    assert not any(result[name] for name in diagnostics.OUTPUT_SIGNATURES)
+    assert result['min_split_norm'] is None
+    assert result['lines'] == {}
+
+
+@pytest.mark.parametrize(
+    'line,name', [
+        (b'POLARIZATION: Iteration to find the polarization orbital', 'polarization_problem'),
+        (b'SCF_NOT_CONV: SCF did not converge in maximum number of steps (required).', 'scf_not_converged'),
+        (b'GEOM_NOT_CONV: Geometry relaxation not converged', 'geom_not_converged'),
+        (b'alloc_err: allocate status error  1 Hamiltonian', 'memory_allocation_failure'),
+        (b'forrtl: severe (41): insufficient virtual memory', 'memory_allocation_failure'),
+        (b'SCF_NOT_CONV: SCF did not converge before wall time exhaustion', 'walltime_stop'),
+    ]
+)
+def test_scan_output_signatures(line, name):
+    """
+    Each signature is detected and the corresponding line reported.
+    """
+    result = scan_output(SCF_LINE * 100 + line + b'\n' + SCF_LINE * 10)
+
+    assert result[name]
+    assert result['lines'][name] == line.decode()
+
+
+def test_scan_output_split_norm():
+    """
+    The minimum split_norm is extracted from the last line mentioning split_norm.
+    """
+    content = b'split_norm: first warning\n' + SCF_LINE + b'ERROR: split_norm too small 0.1550; increase it\n'
+    result = scan_output(content)
+
+    assert result['split_norm_error']
+    assert result['min_split_norm'] == 0.155
+
+
+def test_scan_output_chunk_boundary(monkeypatch):
+    """
+    Signatures across the boundary of two chunks are detected.
+    """
+    monkeypatch.setattr(diagnostics, '_CHUNK_SIZE', 64)
+    content = b'x' * 60 + b'GEOM_NOT_CONV: Geometry relaxation not converged\n'
+    result = scan_output(content)
+
+    assert result['geom_not_converged']
+    assert result['lines']['geom_not_converged'] == content.decode().strip()
+
+
+def test_scan_memory():
+    """
+    The memory after the setup and the peak memory are extracted from both formats of the report.
+    """
+    content = (
+        b'* Maximum dynamic memory allocated =     3 MB\n' + SCF_LINE * 10 +
+        b'* Maximum dynamic memory allocated =     1.5 GB\n' + SCF_LINE +
+        b'* Maximum dynamic memory allocated : Node    0 =   512 MB\n'
+    )
+
+    assert scan_memory(content) == {'memory_estimate': 3.0, 'memory_peak': 1536.0, 'memory_units': 'MB'}
+    assert scan_memory(SCF_LINE * 10) == {}
+
+
+def test_scan_run():
+    """
+    The SCF history and the memory are extracted in the same pass, the diagnostics only if requested.
+    """
+    header = b'        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n'
+    content = (
+        b'* Maximum dynamic memory allocated =     3 MB\n' + header + SCF_LINE * 10 +
+        b'* Maximum dynamic memory allocated =     1.5 GB\n' + header + SCF_LINE * 5 + b'FATAL: SCF_NOT_CONV\n'
+    )
+
+    report = scan_run(content, diagnostics=False)
+    assert report['diagnostics'] is None
+    assert report['memory'] == scan_memory(content)
+    assert len(report['scf_history']['iteration']) == 15
+    assert list(report['scf_history']['geometry_step']).count(1) == 5
+
+    assert scan_run(content)['diagnostics'] == scan_output(content)
+
+
+def test_scan_run_stream(aiida_profile, monkeypatch):
+    """
+    The scan of a stream in chunks of whole lines gives the same report of the scan of the whole content,
+    a compressed .out file is scanned in streaming.
+    """
+    import gzip
+    import io
+
+    from aiida import orm
+
+    header = b'        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n'
+    content = (
+        b'* Maximum dynamic memory allocated =     3 MB\n' + header + SCF_LINE * 10 + b'SCF_NOT_CONV: SCF\n' +
+        b'* Maximum dynamic memory allocated =     1.5 GB\n' + header + SCF_LINE * 5 + b'FATAL: SCF_NOT_CONV'
+    )
+    monkeypatch.setattr(diagnostics, '_CHUNK_SIZE', 64)
+
+    expected = scan_run(content)
+    report = scan_run_stream(io.BytesIO(content))
+    assert report['memory'] == expected['memory']
+    assert report['diagnostics'] == expected['diagnostics']
+    assert report['diagnostics']['lines']['scf_not_converged'] == 'FATAL: SCF_NOT_CONV'
+    for name, array in expected['scf_history'].items():
+        assert (report['scf_history'][name] == array).all()
+    assert scan_run_stream(io.BytesIO(content), diagnostics=False)['diagnostics'] is None
+    assert scan_output_stream(io.BytesIO(content)) == scan_output(content)
+
+    folder = orm.FolderData()
+    folder.base.repository.put_object_from_bytes(gzip.compress(content), 'aiida.out.gz')
+    report = get_run_report(folder, 'aiida.out')
+    assert report['memory'] == expected['memory']
+    assert report['diagnostics'] == expected['diagnostics']
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Tests for the import of siesta runs performed outside AiiDA."""
+import os
+import shutil
+
+from aiida import orm
+import pytest
+
+from aiida_siesta.calculations.siesta import SiestaCalculation
+from aiida_siesta.utils.importer import (
+    IMPORT_PATH_EXTRA, find_run_directories, get_structure_from_fdf, import_runs, parse_run_directory, read_fdf
+)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'parsers', 'fixtures', 'siesta')
+PSEUDOS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'pseudos')
+
+MAIN_FDF = """\
+SystemLabel aiida   # the xml file is aiida.xml
+MeshCutoff 100 Ry
+%include structure.fdf
+PAO.EnergyShift 0.02 Ry
+%block PAO.Basis
+Si 2
+ n=3 0 2
+   0.0 0.0
+ n=3 1 2
+   0.0 0.0
+%endblock PAO.Basis
+%block kgrid_monkhorst_pack
+ 4 0 0 0.5
+ 0 4 0 0.5
+ 0 0 4 0.5
+%endblock kgrid_monkhorst_pack
+WriteForces
+"""
+
+STRUCTURE_FDF = """\
+LatticeConstant 5.43 Ang
+%block LatticeVectors
+ 0.5 0.5 0.0
+ 0.0 0.5 0.5
+ 0.5 0.0 0.5
+%endblock LatticeVectors
+NumberOfSpecies 1
+%block ChemicalSpeciesLabel
+ 1 14 Si
+%endblock ChemicalSpeciesLabel
+AtomicCoordinatesFormat Fractional
+%block AtomicCoordinatesAndAtomicSpecies
+ 0.00 0.00 0.00 1
+ 0.25 0.25 0.25 1
+%endblock AtomicCoordinatesAndAtomicSpecies
+MeshCutoff 200 Ry  ! ignored, already defined
+"""
+
+
+@pytest.fixture
+def run_directory(tmp_path):
+    """Return a function creating the directory of a siesta run from the outputs of a parser fixture."""
+
+    def _run_directory(name, fixture='no_scf_conv'):
+        directory = tmp_path / name
+        directory.mkdir(parents=True)
+        (directory / 'aiida.fdf').write_text(MAIN_FDF)
+        (directory / 'structure.fdf').write_text(STRUCTURE_FDF)
+        shutil.copy(os.path.join(PSEUDOS, 'Si.psf'), directory)
+        for filename in ['aiida.xml', 'aiida.out', 'time.json', 'MESSAGES']:
+            shutil.copy(os.path.join(FIXTURES, fixture, filename), directory)
+        return str(directory)
+
+    return _run_directory
+
+
+def test_read_fdf(run_directory):
+    """Test the reading of an fdf file with includes, blocks and comments, and the structure it defines."""
+
+    fdf = read_fdf(os.path.join(run_directory('run'), 'aiida.fdf'))
+
+    assert fdf['systemlabel'] == 'aiida'
+    assert fdf['mesh-cutoff'] == '100 Ry'
+    assert fdf['write-forces'] == 'T'
+    assert fdf['%block pao-basis'] == '\nSi 2\nn=3 0 2\n0.0 0.0\nn=3 1 2\n0.0 0.0\n%endblock PAO.Basis'
+
+    structure = get_structure_from_fdf(fdf)
+    assert structure['species'] == [('Si', 14)]
+    assert structure['cell'][0] == pytest.approx([2.715, 2.715, 0.])
+    assert structure['sites'][1][0] == 'Si'
+    assert structure['sites'][1][1] == pytest.approx([1.3575, 1.3575, 1.3575])
+
+
+def test_parse_run_directory(run_directory, tmp_path):
+    """Test the reading of a run directory, without database access."""
+
+    run = parse_run_directory(run_directory('run'))
+
+    assert run['input_filename'] == 'aiida.fdf'
+    assert run['kpoints'] == ([4, 4, 4], [0.5, 0.5, 0.5])
+    assert set(run['parameters']) == {'MeshCutoff', 'WriteForces'}
+    assert set(run['basis']) == {'PAO-EnergyShift', '%block PAO-Basis'}
+    assert list(run['pseudos']) == ['Si']
+    assert 'global_time' in run['output_parameters']
+    assert run['messages'][0].startswith('FATAL: SCF_NOT_CONV')
+
+    os.remove(os.path.join(tmp_path, 'run', 'Si.psf'))
+    run = parse_run_directory(os.path.join(tmp_path, 'run'))
+    assert run['error'] == 'ValueError: No pseudopotential file for the species Si'
+
+
+def test_import_runs(aiida_profile, run_directory, fixture_localhost, tmp_path):
+    """Test the import of a tree of runs, the reuse of the pseudos and the resume of an import."""
+
+    run_directory('first')
+    run_directory(os.path.join('nested', 'second'), fixture='bandspoints')
+    broken = run_directory('broken')
+    os.remove(os.path.join(broken, 'structure.fdf'))
+
+    assert len(find_run_directories(str(tmp_path))) == 3
+
+    group = orm.Group(label='imported_runs').store()
+    summary = import_runs(str(tmp_path), fixture_localhost, group=group, processes=0, batch_size=1)
+
+    assert len(summary['imported']) == 2
+    assert summary['skipped'] == 0
+    assert list(summary['failed']) == [broken]
+    assert len(group.nodes) == 2
+
+    node = orm.load_node(summary['imported'][0])
+    assert node.is_imported
+    assert node.process_class == SiestaCalculation
+    assert node.exit_status == SiestaCalculation.exit_codes.SCF_NOT_CONV.status
+    assert node.base.extras.get(IMPORT_PATH_EXTRA) == str(tmp_path / 'first')
+    assert node.inputs.parameters['MeshCutoff'] == '100 Ry'
+    assert node.inputs.kpoints.get_kpoints_mesh() == ([4, 4, 4], [0.5, 0.5, 0.5])
+    assert len(node.inputs.structure.sites) == 2
+    assert 'aiida.xml' in node.outputs.retrieved.base.repository.list_object_names()
+    assert node.outputs.remote_folder.get_remote_path() == str(tmp_path / 'first')
+
+    second = orm.load_node(summary['imported'][1])
+    assert second.exit_status == 0
+    assert second.outputs.forces_and_stress.get_array('forces').shape == (2, 3)
+    assert second.inputs.pseudos.Si.uuid == node.inputs.pseudos.Si.uuid
+
+    # Only the broken run is tried again, here in the process pool
+    summary = import_runs(str(tmp_path), fixture_localhost, processes=1, store_retrieved=False)
+
+    assert summary['imported'] == []
+    assert summary['skipped'] == 2
+    assert list(summary['failed']) == [broken]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Tests for the resource advisor."""
+from aiida import orm
+from aiida.common import AttributeDict, LinkType
+import pytest
+
+from aiida_siesta.utils.resource_advisor import (
+    apply_resource_advice,
+    find_reference,
+    get_memory_advice,
+    get_resource_advice,
+    get_run_metrics,
+    validate_advisor_parameters,
+    validate_preflight_parameters,
+)
+
+METRICS = {
+    'no_u': 2000,
+    'mesh_points': None,
+    'global_time': 1000.0,
+    'timing_decomposition': {'siesta': 1000.0, 'compute_DM': 600.0, 'setup_H': 200.0},
+    'cores': 4,
+    'number_of_atoms': 100,
+    'cell_volume': None,
+}
+
+
+def test_get_resource_advice():
+    """
+    The largest number of cores with the target efficiency is selected, on full machines.
+    """
+    advice = get_resource_advice(METRICS, parameters={'cores_per_machine': 16})
+
+    # 43 cores would have the target efficiency 0.7, two full machines are used
+    assert advice['num_machines'] == 2
+    assert advice['num_mpiprocs_per_machine'] == 16
+    assert advice['efficiency'] == pytest.approx(1 / 1.31, abs=1e-3)
+    assert advice['max_wallclock_seconds'] == 600
+
+    # Double size: the solver scales with the cube of the orbitals, the grid with the volume
+    advice = get_resource_advice(METRICS, 200, 2.0, {'cores_per_machine': 16, 'min_walltime': 1})
+    assert advice['no_u'] == 4000
+    assert advice['num_machines'] == 5
+    assert advice['serial_time'] == pytest.approx(5600 * 4 / 1.03, abs=0.1)
+    assert advice['max_wallclock_seconds'] == pytest.approx(
+        2 * advice['serial_time'] / (80 * advice['efficiency']), abs=2
+    )
+
+    advice = get_resource_advice(
+        METRICS, parameters={'cores_per_machine': 16, 'max_machines': 1, 'threads_per_process': 4}
+    )
+    assert (advice['num_machines'], advice['num_mpiprocs_per_machine'], advice['threads_per_process']) == (1, 4, 4)
+
+    advice = get_resource_advice(METRICS, parameters={'cores_per_machine': 16}, with_mpi=False)
+    assert (advice['num_machines'], advice['num_mpiprocs_per_machine']) == (1, 1)
+
+
+def test_apply_resource_advice():
+    """
+    The resources and the walltime of the options are replaced, the other options are kept.
+    """
+    advice = {'num_machines': 2, 'num_mpiprocs_per_machine': 8, 'threads_per_process': 2, 'max_wallclock_seconds': 900}
+    options = {'resources': {'num_machines': 1, 'tot_num_mpiprocs': 4}, 'max_wallclock_seconds': 60, 'queue_name': 'q'}
+
+    new_options = apply_resource_advice(options, advice)
+
+    assert new_options == {
+        'resources': {'num_machines': 2, 'num_mpiprocs_per_machine': 8, 'num_cores_per_mpiproc': 2},
+        'max_wallclock_seconds': 900,
+        'queue_name': 'q',
+        'environment_variables': {'OMP_NUM_THREADS': '2'},
+    }
+    assert options['max_wallclock_seconds'] == 60
+
+
+def test_validate_advisor_parameters():
+    """
+    Test the validation of the parameters of the advisor.
+    """
+    assert validate_advisor_parameters({'target_efficiency': 0.5, 'max_machines': 2}) is None
+    assert 'Unknown keys' in validate_advisor_parameters({'efficiency': 0.5})
+    assert 'target_efficiency' in validate_advisor_parameters({'target_efficiency': 1.5})
+    assert 'max_machines' in validate_advisor_parameters({'max_machines': 1.5})
+    assert 'mode' in validate_advisor_parameters({'mode': 'guess'})
+
+
+def test_find_reference(aiida_profile, fixture_localhost, generate_calc_job_node, generate_structure):
+    """
+    The stored run on the same elements with the closest number of atoms is the reference, with its metrics.
+    """
+    structure = generate_structure()
+    attributes = AttributeDict({'resources': {'num_machines': 2, 'num_mpiprocs_per_machine': 4}})
+    node = generate_calc_job_node('siesta.siesta', fixture_localhost, None, {'structure': structure}, attributes)
+    node.set_exit_status(0)
+    output_parameters = orm.Dict({'no_u': 26, 'global_time': 12.5, 'mesh': [36, 36, 36], 'siesta:Nodes': '1'})
+    output_parameters.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='output_parameters')
+    output_parameters.store()
+
+    assert find_reference(structure).uuid == output_parameters.uuid
+    assert find_reference(orm.StructureData(cell=structure.cell, pbc=structure.pbc)) is None
+
+    metrics = get_run_metrics(output_parameters)
+    assert metrics['cores'] == 8
+    assert metrics['number_of_atoms'] == 2
+    assert metrics['mesh_points'] == 36**3
+    assert metrics['cell_volume'] == pytest.approx(structure.get_cell_volume())
+
+    with pytest.raises(ValueError):
+        get_run_metrics(orm.Dict({'no_u': 26}))
+
+
+def test_get_memory_advice():
+    """
+    Test the number of machines needed to fit a run in memory.
+    """
+    # 2 GB per process, 16 processes per machine and 32 GB per machine: fits, with the safety factor, on 2 machines
+    advice = get_memory_advice(2048, 1, 16, 32768)
+    assert advice == {'num_machines': 2, 'required_memory': 19660.8, 'fits': True}
+
+    advice = get_memory_advice(2048, 1, 16, 32768, {'mode': 'check'})
+    assert advice == {'num_machines': 1, 'required_memory': 39321.6, 'fits': False}
+
+    advice = get_memory_advice(2048, 1, 16, 32768, {'safety_factor': 1.0, 'max_machines': 1})
+    assert advice == {'num_machines': 1, 'required_memory': 32768.0, 'fits': True}
+
+    assert validate_preflight_parameters({'mode': 'set', 'memory_per_machine': 4096}) is None
+    assert 'positive integer' in validate_preflight_parameters({'max_machines': 0})
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Tests for the tools of the retrieve policy and of the compressed retrieved files."""
+import gzip
+import lzma
+import os
+
+from aiida import orm
+import pytest
+
+from aiida_siesta.utils.retrieve_policy import (
+    ParsingFolder,
+    get_compress_command,
+    get_local_path,
+    get_parsing_folder,
+    get_retrieved_names,
+    map_retrieved,
+    open_local,
+    open_retrieved,
+    validate_retrieve_policy,
+)
+
+CONTENT = b'line 1\nline 2\n'
+
+
+def test_validate_retrieve_policy():
+    """
+    Only the known keys and values are accepted.
+    """
+    assert validate_retrieve_policy({'temporary': True, 'compress': 'xz', 'compress_additional': True}) is None
+    assert validate_retrieve_policy({'temporary': ['xml', 'ions']}) is None
+    assert 'Unknown keys' in validate_retrieve_policy({'archive': True})
+    assert 'temporary' in validate_retrieve_policy({'temporary': ['DM']})
+    assert 'compress' in validate_retrieve_policy({'compress': 'zip'})
+    assert 'compress_additional' in validate_retrieve_policy({'compress_additional': 'yes'})
+    assert 'dictionary' in validate_retrieve_policy(['xml'])
+
+
+def test_compress_command():
+    """
+    The command compresses each file (or glob pattern) only if present.
+    """
+    command = get_compress_command(['aiida.out', '*.xyz'], 'gzip')
+    assert command.startswith('for f in aiida.out *.xyz; do')
+    assert 'if [ -f "$f" ]; then gzip -f "$f"; fi' in command
+
+
+def _get_folder(tmp_path):
+    """Return a FolderData with a plain, a gzip and a xz file, and a file stored both plain and compressed."""
+    (tmp_path / 'plain.txt').write_bytes(CONTENT)
+    with gzip.open(tmp_path / 'gzipped.txt.gz', 'wb') as handle:
+        handle.write(CONTENT)
+    with lzma.open(tmp_path / 'sub.txt.xz', 'wb') as handle:
+        handle.write(CONTENT)
+    (tmp_path / 'both.txt').write_bytes(CONTENT)
+    (tmp_path / 'both.txt.gz').write_bytes(b'partial')
+    os.mkdir(tmp_path / 'dir')
+    with gzip.open(tmp_path / 'dir' / 'nested.txt.gz', 'wb') as handle:
+        handle.write(CONTENT)
+
+    folder = orm.FolderData()
+    folder.base.repository.put_object_from_tree(str(tmp_path))
+    return folder
+
+
+def test_open_retrieved(aiida_profile, tmp_path):
+    """
+    Compressed files are read, through their uncompressed name, decompressing them in streaming.
+    """
+    folder = _get_folder(tmp_path)
+
+    assert get_retrieved_names(folder) == {
+        'plain.txt': 'plain.txt',
+        'gzipped.txt': 'gzipped.txt.gz',
+        'sub.txt': 'sub.txt.xz',
+        'both.txt': 'both.txt',
+        'dir/nested.txt': 'dir/nested.txt.gz',
+    }
+
+    for name in get_retrieved_names(folder):
+        with open_retrieved(folder, name) as handle:
+            assert handle.read() == CONTENT
+        with map_retrieved(folder, name) as buffer:
+            assert buffer[:] == CONTENT
+
+    with open_retrieved(folder, 'gzipped.txt') as handle:
+        assert handle.readlines() == [b'line 1\n', b'line 2\n']
+
+    with pytest.raises(FileNotFoundError):
+        with open_retrieved(folder, 'missing.txt'):
+            pass
+
+
+def test_get_parsing_folder(aiida_profile, tmp_path):
+    """
+    The temporary files are found with the retrieved ones, without copies, compressed files are not decompressed.
+    """
+    os.mkdir(tmp_path / 'retrieved')
+    folder = _get_folder(tmp_path / 'retrieved')
+    assert get_parsing_folder(folder) is folder
+    os.mkdir(tmp_path / 'temporary')
+    assert get_parsing_folder(folder, str(tmp_path / 'temporary')) is folder
+
+    with gzip.open(tmp_path / 'temporary' / 'temp.txt.gz', 'wb') as handle:
+        handle.write(CONTENT)
+    parsing_folder = get_parsing_folder(folder, str(tmp_path / 'temporary'))
+
+    assert isinstance(parsing_folder, ParsingFolder)
+    assert get_retrieved_names(parsing_folder)['temp.txt'] == 'temp.txt.gz'
+    assert set(get_retrieved_names(parsing_folder)) == set(get_retrieved_names(folder)) | {'temp.txt'}
+    with open_retrieved(parsing_folder, 'dir/nested.txt') as handle:
+        assert handle.read() == CONTENT
+    with open_retrieved(parsing_folder, 'temp.txt') as handle:
+        assert handle.read() == CONTENT
+
+    # Directories present in both folders are merged
+    os.mkdir(tmp_path / 'temporary' / 'dir')
+    (tmp_path / 'temporary' / 'dir' / 'extra.txt').write_bytes(CONTENT)
+    assert parsing_folder.list_object_names('dir') == ['extra.txt', 'nested.txt.gz']
+    assert get_retrieved_names(parsing_folder)['dir/extra.txt'] == 'dir/extra.txt'
+    with open_retrieved(parsing_folder, 'dir/extra.txt') as handle:
+        assert handle.read() == CONTENT
+    with pytest.raises(FileNotFoundError):
+        parsing_folder.list_object_names('missing')
+
+
+def test_get_local_path(aiida_profile, tmp_path):
+    """
+    The temporary files are read in place, the retrieved ones are copied as they are (possibly compressed).
+    """
+    os.mkdir(tmp_path / 'retrieved')
+    os.mkdir(tmp_path / 'temporary')
+    os.mkdir(tmp_path / 'scratch')
+    scratch = str(tmp_path / 'scratch')
+    folder = _get_folder(tmp_path / 'retrieved')
+    (tmp_path / 'temporary' / 'temp.txt').write_bytes(CONTENT)
+    parsing_folder = get_parsing_folder(folder, str(tmp_path / 'temporary'))
+
+    assert get_local_path(parsing_folder, 'temp.txt', scratch) == str(tmp_path / 'temporary' / 'temp.txt')
+    assert not os.listdir(scratch)
+
+    paths = [get_local_path(parsing_folder, 'gzipped.txt', scratch) for _ in range(2)]
+    assert paths[0] != paths[1]
+    for path in paths:
+        assert os.path.dirname(path) == scratch
+        assert path.endswith('.gz')
+        with open_local(path) as handle:
+            assert handle.read() == CONTENT
+
+
+def test_structure_list_from_retrieved(aiida_profile, tmp_path, generate_structure):
+    """
+    The structures are read from the compressed .xyz files like from the plain ones on disk.
+    """
+    import shutil
+
+    from aiida_siesta.utils.xyz_utils import get_structure_list_from_folder, get_structure_list_from_retrieved
+
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parsers', 'fixtures', 'siesta', 'neb')
+    for name in os.listdir(fixture):
+        with open(os.path.join(fixture, name), 'rb') as source, gzip.open(tmp_path / f'{name}.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+    retrieved = orm.FolderData()
+    retrieved.base.repository.put_object_from_tree(str(tmp_path))
+
+    reference = generate_structure()
+    expected = get_structure_list_from_folder(fixture, reference)
+    structures = get_structure_list_from_retrieved(retrieved, reference)
+
+    assert len(structures) == len(expected) == 4
+    for structure, expected_structure in zip(structures, expected):
+        assert [site.position for site in structure.sites] == [site.position for site in expected_structure.sites]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Tests for the extraction of the scf history from the siesta .out file."""
+import os
+
+import numpy as np
+
+from aiida_siesta.utils.scf_history import parse_scf_history
+
+HEADER = b"        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n"
+
+
+def test_parse_scf_history():
+    """
+    The scf lines of all the geometry steps are collected.
+    """
+    filepath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'parsers', 'fixtures', 'siesta', 'no_geom_conv', 'aiida.out'
+    )
+    with open(filepath, 'rb') as handle:
+        history = parse_scf_history(handle.read())
+
+    assert len(history['iteration']) == 13
+    assert list(history['geometry_step']) == [0] * 4 + [1] * 4 + [2] * 4 + [3]
+    assert list(history['iteration'][:5]) == [1, 2, 3, 4, 1]
+    assert history['energy'][0] == -215.244932
+    assert history['ddmax'][1] == 0.004335
+    assert history['fermi_energy'][2] == -3.726994
+    assert history['dhmax'][3] == 0.000272
+
+
+def test_parse_scf_history_columns():
+    """
+    Missing columns are set to NaN, lines with merged fields and outputs with no scf line are skipped.
+    """
+    old_header = b"        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV)\n"
+    content = (
+        old_header + b"   scf:    1     -216.250309     -215.244932     -215.244932  1.812015 -3.826300\n" +
+        b"   scf:    2-99999216.250309     -215.244932     -215.244932  1.812015 -3.826300\n"
+    )
+    history = parse_scf_history(content)
+
+    assert list(history['iteration']) == [1]
+    assert np.isnan(history['dhmax'][0])
+    assert history['ddmax'][0] == 1.812015
+
+    assert parse_scf_history(HEADER) == {}
+
+
+def _history(ddmax, steps=None, energies=None):
+    """Return a history dictionary with the given dDmax, geometry steps and free energies."""
+    ddmax = np.array(ddmax, dtype=float)
+    return {
+        'geometry_step': np.zeros(len(ddmax), dtype=int) if steps is None else np.array(steps),
+        'ddmax': ddmax,
+        'free_energy': np.zeros(len(ddmax)) if energies is None else np.array(energies, dtype=float),
+        'energy': np.zeros(len(ddmax)),
+    }
+
+
+def test_check_scf_divergence():
+    """
+    A cycle is flagged only after `min_iterations` and if dDmax does not decrease in the last `window` iterations.
+    """
+    from aiida_siesta.utils.scf_history import check_scf_divergence
+
+    converging = _history([1.0 / 2**i for i in range(30)])
+    diverging = _history([1.0 / 2**i for i in range(10)] + [0.01 * 1.2**i for i in range(10)])
+
+    assert check_scf_divergence({}) is None
+    assert check_scf_divergence(converging) is None
+    assert check_scf_divergence(diverging, min_iterations=25) is None
+    assert 'did not decrease in the last 10' in check_scf_divergence(diverging, min_iterations=20)
+
+
+def test_check_geometry_oscillation():
+    """
+    A relaxation is flagged if the energy oscillates without going below the previous minimum.
+    """
+    from aiida_siesta.utils.scf_history import check_geometry_oscillation, get_step_energies
+
+    # Two scf iterations per geometry step, the last step is in progress
+    step_energies = [-1.0, -2.0, -3.0, -2.9, -2.95, -2.9, -2.95, -2.9, -2.95, -2.9, -2.95, -2.9]
+    steps = [step for step in range(len(step_energies)) for _ in range(2)] + [len(step_energies)]
+    energies = [energy for energy in step_energies for _ in range(2)] + [0.0]
+    history = _history(np.ones(len(steps)), steps, energies)
+
+    assert list(get_step_energies(history)) == step_energies
+    assert 'oscillated in the last 8' in check_geometry_oscillation(history, window=8)
+    # Not enough geometry steps
+    assert check_geometry_oscillation(history, window=12) is None
+
+    relaxing = _history(np.ones(len(steps)), steps, sorted(energies, reverse=True))
+    assert check_geometry_oscillation(relaxing, window=8) is None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Tests for the tools on the timing profiles."""
+import numpy as np
+import pytest
+
+from aiida_siesta.utils.timing import aggregate_timing_profiles, flatten_timer_tree, get_timing_scaling
+
+TIMER_TREE = {
+    'global_section': {
+        '_calls': 1, '_time': 10.0, '_%': 100.0,
+        'siesta': {
+            '_calls': 1, '_time': 10.0, '_%': 100.0,
+            'Setup': {'_calls': 1, '_time': 1.0, '_%': 10.0},
+            'IterSCF': {
+                '_calls': 5, '_time': 9.0, '_%': 90.0,
+                'setup_H': {'_calls': 5, '_time': 3.0, '_%': 30.0},
+                'compute_dm': {'_calls': 5, '_time': 6.0, '_%': 60.0},
+            },
+        },
+    }
+}
+
+
+def test_flatten_timer_tree():
+    """
+    All the sections are returned, in the order of the file, with their complete path.
+    """
+    sections = flatten_timer_tree(TIMER_TREE)
+
+    assert [section[0] for section in sections] == [
+        'siesta', 'siesta/Setup', 'siesta/IterSCF', 'siesta/IterSCF/setup_H', 'siesta/IterSCF/compute_dm'
+    ]
+    assert sections[3] == ('siesta/IterSCF/setup_H', 3.0, 5, 30.0)
+
+    with pytest.raises(KeyError):
+        flatten_timer_tree({'siesta': {}})
+
+
+def _store_calculation(computer, no_u, mpiprocs, time):
+    """Store a mock calculation with the `timing_profile` and `output_parameters` outputs."""
+    from aiida import orm
+    from aiida.common import LinkType
+
+    node = orm.CalcJobNode(computer=computer, process_type='aiida.calculations:siesta.siesta')
+    node.set_option('resources', {'num_machines': 1, 'num_mpiprocs_per_machine': mpiprocs})
+    node.set_option('withmpi', True)
+    node.store()
+
+    params = orm.Dict({'no_u': no_u, 'nnz': 10 * no_u, 'mesh': [10, 10, 10]})
+    params.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='output_parameters')
+    params.store()
+
+    profile = orm.ArrayData()
+    profile.set_array('sections', np.array(['siesta', 'siesta/compute_dm']))
+    profile.set_array('time', np.array([time, time / 2]))
+    profile.set_array('calls', np.array([1, 3]))
+    profile.set_array('percentage', np.array([100.0, 50.0]))
+    profile.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label='timing_profile')
+    profile.store()
+
+    return node
+
+
+def test_aggregate_timing_profiles(aiida_profile, fixture_localhost):
+    """
+    The profiles are collected for a group and the scaling exponents are estimated.
+    """
+    from aiida import orm
+
+    group = orm.Group(label='timing_test').store()
+    # time = no_u^3 / mpiprocs
+    for no_u, mpiprocs in [(10, 1), (20, 1), (40, 2)]:
+        group.add_nodes(_store_calculation(fixture_localhost, no_u, mpiprocs, no_u**3 / mpiprocs))
+
+    records = aggregate_timing_profiles('timing_test')
+
+    assert len(records) == 3
+    assert records[2]['no_u'] == 40
+    assert records[2]['nnz'] == 400
+    assert records[2]['mesh'] == 1000
+    assert records[2]['mpi_processes'] == 2
+    assert records[0]['sections']['siesta/compute_dm'] == {'time': 500.0, 'calls': 3, 'percentage': 50.0}
+
+    scaling = get_timing_scaling(records[:2], 'no_u')
+    assert scaling['siesta'][0] == pytest.approx(3.0)
+    assert scaling['siesta/compute_dm'][1] == 2
+
+    # All the calculations have the same mesh, no exponent can be estimated
+    assert get_timing_scaling(records, 'mesh') == {}
+
+    with pytest.raises(ValueError):
+        get_timing_scaling(records, 'natoms')
@@ -0,0 +1,112 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+from aiida import orm
+import pytest
+
+from aiida_siesta.calculations.siesta import SiestaCalculation
+from aiida_siesta.workflows.autotune import SiestaAutotuneWorkChain, get_pilot_parameters
+
+
+@pytest.fixture
+def generate_workchain_autotune(entry_points, generate_psml_data, fixture_code, generate_workchain,
+        generate_structure, generate_param, generate_basis, generate_kpoints_mesh):
+    """Generate an instance of a `SiestaAutotuneWorkChain`."""
+
+    entry_points.add(SiestaAutotuneWorkChain, 'aiida.workflows:siesta.autotune')
+
+    def _generate_workchain_autotune(**extra_inputs):
+
+        psml = generate_psml_data('Si')
+
+        inputs = {
+            'code': fixture_code('siesta.siesta'),
+            'structure': generate_structure(),
+            'kpoints': generate_kpoints_mesh(2),
+            'parameters': generate_param(),
+            'basis': generate_basis(),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1, 'num_mpiprocs_per_machine': 8},
+               'max_wallclock_seconds': 600,
+               })
+        }
+
+        inputs.update(extra_inputs)
+        process = generate_workchain('siesta.autotune', inputs)
+
+        return process
+
+    return _generate_workchain_autotune
+
+
+def test_pilot_parameters():
+    """Test the parameters of a pilot run."""
+
+    parameters = {'MD.TypeOfRun': 'cg', 'md-steps': 10, 'Max.SCF.Iterations': 100, 'mesh-cutoff': '100 Ry'}
+    pilot = get_pilot_parameters(parameters, {'BlockSize': 16}, 2)
+
+    assert pilot == {'max-scf-iterations': 2, 'mesh-cutoff': '100 Ry', 'BlockSize': 16, 'scf-must-converge': False}
+
+
+def test_autotune(aiida_profile, generate_workchain_autotune, generate_parsed_calc_job_node):
+    """Test the candidates of the `SiestaAutotuneWorkChain` and the selection of the fastest one."""
+
+    process = generate_workchain_autotune(
+        tuning_grid=orm.Dict({'blocksize': [8, 32]}),
+        mpi_omp_splits=orm.List([[8, 1], [2, 4]]),
+    )
+    process.setup()
+
+    assert len(process.ctx.candidates) == 4
+    assert process.ctx.candidates[1]['parameters'] == {'blocksize': 8}
+    assert process.ctx.candidates[1]['options']['resources'] == {
+        'num_machines': 1, 'num_mpiprocs_per_machine': 2, 'num_cores_per_mpiproc': 4
+    }
+    assert process.ctx.candidates[1]['options']['environment_variables'] == {'OMP_NUM_THREADS': '4'}
+
+    # The pilot runs: a failed relaxation, a pilot with SCF_NOT_CONV (the expected exit status, synthetic fixture),
+    # a run without timing information and a run with FATAL SCF_NOT_CONV
+    process.ctx.pilots = [
+        generate_parsed_calc_job_node(name) for name in ['no_geom_conv', 'preflight', 'default', 'no_scf_conv']
+    ]
+    assert process.ctx.pilots[1].exit_status == SiestaCalculation.exit_codes.SCF_NOT_CONV.status
+
+    result = process.results()
+
+    assert result is None
+    assert process.outputs['optimal_parameters'].get_dict() == {'blocksize': 8}
+    assert process.outputs['optimal_options']['resources']['num_mpiprocs_per_machine'] == 2
+    timings = process.outputs['pilot_timings'].get_dict()
+    assert timings['fastest'] == 'pilot_1'
+    assert [pilot['scf_time'] for pilot in timings['pilots']] == [None, pytest.approx(0.65), None, pytest.approx(0.65)]
+
+    process.ctx.pilots = [generate_parsed_calc_job_node('no_geom_conv')] * 4
+    assert process.results() == SiestaAutotuneWorkChain.exit_codes.ERROR_PILOTS_FAILED
+
+
+def test_run_pilots(aiida_profile, generate_workchain_autotune, generate_structure):
+    """Test that the pilots are `SiestaCalculation` runs, without analysis and with the settings of the candidates."""
+
+    bandskpoints = orm.KpointsData()
+    bandskpoints.set_cell_from_structure(generate_structure())
+    bandskpoints.set_kpoints([[0., 0., 0.], [0.5, 0., 0.]])
+    process = generate_workchain_autotune(tuning_grid=orm.Dict({'blocksize': [8, 32]}), bandskpoints=bandskpoints)
+    process.setup()
+    process.run_pilots()
+
+    assert len(process.ctx.pilots) == 2
+    pilot = orm.load_node(process.ctx.pilots[1].pk)
+    assert pilot.process_class == SiestaCalculation
+    assert 'bandskpoints' not in pilot.inputs
+    assert pilot.inputs.parameters['blocksize'] == 32
+    assert not pilot.inputs.parameters['scf-must-converge']
+
+
+def test_autotune_validation(aiida_profile, generate_workchain_autotune):
+    """Test the validation of the tuning grid."""
+
+    with pytest.raises(ValueError, match='can not be tuned'):
+        generate_workchain_autotune(tuning_grid=orm.Dict({'system-label': ['a', 'b']}))
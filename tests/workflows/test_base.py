@@ -8,6 +8,7 @@ from plumpy import ProcessState
 import pytest
 
 from aiida_siesta.calculations.siesta import SiestaCalculation
+from aiida_siesta.utils.tkdict import FDFDict
 from aiida_siesta.workflows.base import SiestaBaseWorkChain
 
 #from aiida_siesta.groups.pseudos import PsmlFamily
@@ -30,7 +31,7 @@ def generate_workchain_base(generate_psml_data, fixture_code, fixture_localhost,
     Note that `remove_inp = "one_pseudo" and add_pseudo_fam != None` has a special meaning.
     """
 
-    def _generate_workchain_base(exit_code=None, remove_inp=None, add_pseudo_fam=None):
+    def _generate_workchain_base(exit_code=None, remove_inp=None, add_pseudo_fam=None, extra_inputs=None):
 
         entry_point_wc = 'siesta.base'
         entry_point_code = 'siesta.siesta'
@@ -72,6 +73,9 @@ def generate_workchain_base(generate_psml_data, fixture_code, fixture_localhost,
             else:
                 inputs.pop(remove_inp)
 
+        if extra_inputs is not None:
+            inputs.update(extra_inputs)
+
         process = generate_workchain(entry_point_wc, inputs)
 
         if exit_code is not None:
@@ -109,6 +113,100 @@ def test_prepare_inputs(aiida_profile, generate_workchain_base):
     assert isinstance(process2.ctx.inputs, dict)
 
 
+def test_prepare_inputs_resource_advisor(aiida_profile, generate_workchain_base):
+    """
+    Test that the resource advisor sets the options of the calculation from the reference run.
+    """
+    reference = orm.Dict({
+        'no_u': 2000,
+        'global_time': 1000.0,
+        'timing_decomposition': {'compute_DM': 600.0},
+        'siesta:Nodes': '4'
+    })
+    process = generate_workchain_base(extra_inputs={
+        'resource_advisor': orm.Dict({'cores_per_machine': 16, 'min_walltime': 60}),
+        'resource_reference': reference,
+        'options': orm.Dict({'resources': {'num_machines': 1}, 'max_wallclock_seconds': 1800, 'withmpi': True}),
+    })
+    process.setup()
+    process.prepare_inputs()
+
+    options = process.ctx.inputs.metadata['options']
+    assert options['resources'] == {'num_machines': 2, 'num_mpiprocs_per_machine': 16}
+    assert options['max_wallclock_seconds'] == 318
+    assert options['withmpi']
+
+    # Only reported
+    process = generate_workchain_base(extra_inputs={
+        'resource_advisor': orm.Dict({'mode': 'recommend'}),
+        'resource_reference': reference,
+    })
+    process.setup()
+    process.prepare_inputs()
+
+    assert process.ctx.inputs.metadata['options']['max_wallclock_seconds'] == 1800
+
+    with pytest.raises(ValueError):
+        generate_workchain_base(extra_inputs={'resource_advisor': orm.Dict({'efficiency': 0.5})})
+
+
+def test_memory_preflight(aiida_profile, generate_workchain_base, generate_parsed_calc_job_node):
+    """
+    Test the pre-flight run and the scaling of the machines from its peak memory.
+
+    The pre-flight calculation is the parsing of the synthetic `preflight` fixture: the xml and time.json of
+    `no_scf_conv` with a .out and a MESSAGES reduced to the lines of a single-iteration run with
+    `scf-must-converge F` (two memory reports and the `SCF_NOT_CONV` warning), therefore it ends with `SCF_NOT_CONV`.
+    """
+    from aiida.engine import ExitCode
+
+    options = {
+        'resources': {'num_machines': 1, 'num_mpiprocs_per_machine': 8},
+        'max_wallclock_seconds': 1800,
+        'max_memory_kb': 12 * 1024,
+    }
+    params = {'md-type-of-run': 'cg', 'max-scf-iterations': 100, 'mesh-cutoff': '100 Ry'}
+    process = generate_workchain_base(exit_code=ExitCode(0), extra_inputs={
+        'memory_preflight': orm.Dict({'max_machines': 4}),
+        'options': orm.Dict(options),
+        'parameters': orm.Dict(params),
+    })
+    process.setup()
+    process.prepare_inputs()
+
+    assert process.should_run_preflight()
+    submitted = process.run_preflight()['preflight']
+    assert submitted.inputs.parameters.get_dict() == {
+        'max-scf-iterations': 1, 'mesh-cutoff': '100 Ry', 'scf-must-converge': False
+    }
+
+    # The pre-flight run: 5 MB per process, 8 processes, with 12 MB per machine
+    preflight = generate_parsed_calc_job_node('preflight')
+    assert preflight.exit_status == SiestaCalculation.exit_codes.SCF_NOT_CONV.status
+    assert preflight.outputs.output_parameters['memory_peak'] == 5.0
+    process.ctx.preflight = preflight
+
+    assert process.inspect_preflight() is None
+    assert process.ctx.inputs.metadata['options']['resources'] == {'num_machines': 4, 'num_mpiprocs_per_machine': 8}
+
+    # Not enough machines
+    process = generate_workchain_base(extra_inputs={
+        'memory_preflight': orm.Dict({'max_machines': 2}),
+        'options': orm.Dict(options),
+    })
+    process.setup()
+    process.prepare_inputs()
+    process.ctx.preflight = preflight
+    assert process.inspect_preflight() == SiestaBaseWorkChain.exit_codes.ERROR_MEMORY_PREFLIGHT
+
+    # A real failure of the pre-flight
+    process.ctx.preflight = generate_parsed_calc_job_node('no_geom_conv')
+    assert process.inspect_preflight() == SiestaBaseWorkChain.exit_codes.ERROR_PREFLIGHT_FAILED
+
+    with pytest.raises(ValueError):
+        generate_workchain_base(extra_inputs={'memory_preflight': orm.Dict({'mode': 'estimate'})})
+
+
 def test_postprocess(aiida_profile, generate_workchain_base, generate_ion_data):
     """
     Test `SiestaBaseWorkChain.postprocess`.
@@ -154,6 +252,85 @@ def test_validators(aiida_profile, generate_workchain_base):
     generate_workchain_base(remove_inp="pseudos", add_pseudo_fam="test3")
 
 
+def test_ion_family(aiida_profile, entry_points, generate_workchain_base, generate_ion_data):
+    """
+    Test the `ion_family` input: validation and resolution of the ions in `prepare_inputs`.
+    """
+    from aiida_siesta.groups.ion_family import IonFamily
+
+    entry_points.add(IonFamily, 'aiida.groups:siesta.ion_family')
+    family = IonFamily(label='ion_fam').store()
+    family.add_nodes([generate_ion_data('Si').store()])
+
+    # The family has no ion for the SiDiff kind (the only Si ion is used for both kinds of the structure)
+    process = generate_workchain_base(remove_inp="pseudos", extra_inputs={'ion_family': orm.Str('ion_fam')})
+    process.setup()
+    process.prepare_inputs()
+    assert set(process.ctx.inputs['ions']) == {'Si', 'SiDiff'}
+    assert process.ctx.inputs['ions']['SiDiff'].name == 'Si'
+
+    family.add_nodes([generate_ion_data('SiTris').store()])
+    with pytest.raises(ValueError, match='does not incude all the required ions'):
+        generate_workchain_base(remove_inp="pseudos", extra_inputs={'ion_family': orm.Str('ion_fam')})
+
+    with pytest.raises(ValueError, match='not an `IonFamily`'):
+        generate_workchain_base(
+            remove_inp="pseudos", add_pseudo_fam="test4", extra_inputs={'ion_family': orm.Str('test4')}
+        )
+
+
+def test_basis_cache(aiida_profile, generate_workchain_base, generate_calc_job_node, fixture_localhost,
+        generate_ion_data):
+    """
+    Test the `basis_cache` input: registration of the ion files of a calculation and their reuse.
+    """
+    from aiida.engine import ExitCode
+
+    process = generate_workchain_base(exit_code=ExitCode(0), extra_inputs={'basis_cache': orm.Bool(True)})
+    process.setup()
+    process.prepare_inputs()
+    assert 'ions' not in process.ctx.inputs
+
+    # The calculation generated the basis, its ion files are registered
+    inputs = {key: process.ctx.inputs[key] for key in ['code', 'structure', 'parameters', 'basis', 'pseudos']}
+    node = generate_calc_job_node("siesta.siesta", fixture_localhost, inputs=inputs)
+    ions = {'Si': generate_ion_data('Si'), 'SiDiff': generate_ion_data('SiDiff')}
+    for name, ion in ions.items():
+        ion.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=f'ion_files__{name}')
+        ion.store()
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    process.ctx.children = [node]
+    assert process.inspect_process() is None
+
+    code = process.inputs.code
+    process = generate_workchain_base(extra_inputs={'basis_cache': orm.Bool(True), 'code': code})
+    process.setup()
+    process.prepare_inputs()
+    assert 'pseudos' not in process.ctx.inputs
+    assert {name: ion.uuid for name, ion in process.ctx.inputs['ions'].items()} == {
+        name: ion.uuid for name, ion in ions.items()
+    }
+
+    # Same inputs with another code, no reuse
+    process = generate_workchain_base(extra_inputs={'basis_cache': orm.Bool(True)})
+    process.setup()
+    process.prepare_inputs()
+    assert 'ions' not in process.ctx.inputs
+
+    # Different basis options, no reuse
+    process = generate_workchain_base(
+        extra_inputs={
+            'basis_cache': orm.Bool(True),
+            'code': code,
+            'basis': orm.Dict({'pao-energy-shift': '100 meV'})
+        }
+    )
+    process.setup()
+    process.prepare_inputs()
+    assert 'ions' not in process.ctx.inputs
+
+
 def test_handle_error_geom_not_conv(aiida_profile, generate_workchain_base):
     """
     Test `SiestaBaseWorkChain.handle_error_geom_not_conv`.
@@ -199,6 +376,71 @@ def test_handle_error_scf_not_conv(aiida_profile, generate_workchain_base):
     #assert result == PwBaseWorkChain.exit_codes.ERROR_UNRECOVERABLE_FAILURE
 
 
+def test_handle_error_scf_not_conv_diverging(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_scf_not_conv` when the `scf_history` shows a diverging cycle.
+    """
+    import numpy as np
+
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.SCF_NOT_CONV)
+    process.setup()
+    process.prepare_inputs()
+
+    calculation = process.ctx.children[-1]
+    out_par = orm.Dict(dict={"variable_geometry":False})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+    scf_history = orm.ArrayData()
+    scf_history.set_array('geometry_step', np.zeros(6, dtype=int))
+    scf_history.set_array('ddmax', np.array([1.0, 0.1, 0.05, 0.2, 0.5, 1.2]))
+    scf_history.add_incoming(calculation, link_type=LinkType.CREATE, link_label='scf_history')
+    scf_history.store()
+
+    result = process.handle_error_scf_not_conv(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert FDFDict(process.ctx.inputs["parameters"].get_dict())["dm-mixing-weight"] == 0.15
+
+
+def test_handle_error_scf_diverged(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_scf_diverged`.
+    """
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.SCF_DIVERGED)
+    process.setup()
+    process.prepare_inputs()
+
+    calculation = process.ctx.children[-1]
+    out_par = orm.Dict(dict={"variable_geometry":False})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+
+    result = process.handle_error_scf_diverged(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert FDFDict(process.ctx.inputs["parameters"].get_dict())["dm-mixing-weight"] == 0.15
+    assert process.ctx.inputs["parent_calc_folder"] == calculation.outputs.remote_folder
+
+
+def test_handle_error_geom_oscillating(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_geom_oscillating`.
+    """
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.GEOM_OSCILLATING)
+    process.setup()
+    process.prepare_inputs()
+
+    calculation = process.ctx.children[-1]
+    out_par = orm.Dict(dict={"variable_geometry":False})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+
+    result = process.handle_error_geom_oscillating(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert FDFDict(process.ctx.inputs["parameters"].get_dict())["md-max-displacement"] == "0.1 Bohr"
+
+
 def test_handle_error_basis_pol(aiida_profile, generate_workchain_base):
     """
     Test `SiestaBaseWorkChain.handle_error_basis_pol`.
@@ -245,3 +487,37 @@ def test_handle_error_split_norm(aiida_profile, generate_workchain_base):
     result = process.handle_error_split_norm(calculation)
     assert isinstance(result, ProcessHandlerReport)
     assert result.do_break
+
+
+def test_handle_error_split_norm_diagnostics(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_split_norm` when the minimum split_norm
+    is in the diagnostics of the `output_parameters`.
+    """
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.SPLIT_NORM)
+    process.setup()
+    process.prepare_inputs()
+
+    calculation = process.ctx.children[-1]
+    out_param = orm.Dict(dict={"diagnostics": {"split_norm_error": True, "min_split_norm": 0.2}})
+    out_param.add_incoming(calculation, link_type=LinkType.CREATE, link_label="output_parameters")
+    out_param.store()
+
+    result = process.handle_error_split_norm(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert FDFDict(process.ctx.inputs["basis"].get_dict())["pao-split-tail-norm"]
+
+
+def test_handle_error_memory_allocation(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_memory_allocation`.
+    """
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.MEMORY_ALLOCATION_FAIL)
+    process.setup()
+    process.prepare_inputs()
+
+    result = process.handle_error_memory_allocation(process.ctx.children[-1])
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert result.exit_code == SiestaBaseWorkChain.exit_codes.ERROR_MEMORY_ALLOCATION
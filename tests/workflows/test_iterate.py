@@ -15,7 +15,7 @@ def generate_workchain_iterate(generate_psml_data, fixture_code, generate_workch
         generate_calc_job_node, generate_parser):
     """Generate an instance of a `BandgapWorkChain`."""
 
-    def _generate_workchain_iterate():
+    def _generate_workchain_iterate(bundle=False):
 
         entry_point_wc = 'siesta.iterator'
 
@@ -37,6 +37,8 @@ def generate_workchain_iterate(generate_psml_data, fixture_code, generate_workch
             'iterate_over' : {"pao":[1,2],"mesh":[2,3]},
             'batch_size' : orm.Int(2)
         }
+        if bundle:
+            inputs['bundle'] = orm.Bool(True)
 
         process = generate_workchain(entry_point_wc, inputs)
 
@@ -71,3 +73,28 @@ def test_setup_next_step_smooth_run(aiida_profile, generate_workchain_iterate):
     assert len(process.ctx.used_values) == 2
     assert "structure" in process.ctx.last_inputs
     assert "pao" in process.ctx.last_inputs["basis"].attributes
+
+
+def test_run_batch_bundle(aiida_profile, bundle_entry_points, generate_workchain_iterate):
+    """Test that `run_batch` submits the whole batch as a single `SiestaBundleCalculation`."""
+    from aiida_siesta.calculations.bundle import BundleRun, SiestaBundleCalculation
+
+    process = generate_workchain_iterate(bundle=True)
+    process.initialize()
+    process.next_step()
+    process.run_batch()
+
+    assert len(process.ctx.used_values) == 2
+    assert len(process.ctx.last_step_processes) == 1
+    assert process.ctx.last_step_runs == ['run_0', 'run_1']
+
+    bundle = orm.load_node(process.ctx.last_step_processes[0])
+    assert bundle.process_class is SiestaBundleCalculation
+    runs = bundle.inputs.runs
+    assert runs['run_0']['basis'].get_dict() != runs['run_1']['basis'].get_dict()
+    assert runs['run_0']['parameters'].get_dict() != runs['run_1']['parameters'].get_dict()
+    assert bundle.get_option('max_wallclock_seconds') == 1800
+
+    run = BundleRun(bundle, 'run_1')
+    assert run.outputs == {}
+    assert run.exit_status is None
@@ -15,7 +15,7 @@ def generate_workchain_stm(generate_psml_data, fixture_code, generate_workchain,
         generate_calc_job_node, generate_parser):
     """Generate an instance of a `BandgapWorkChain`."""
 
-    def _generate_workchain_stm():
+    def _generate_workchain_stm(**extra_inputs):
 
         entry_point_code_siesta = 'siesta.siesta'
         entry_point_code = 'siesta.stm'
@@ -51,6 +51,7 @@ def generate_workchain_stm(generate_psml_data, fixture_code, generate_workchain,
                })
         }
 
+        inputs.update(extra_inputs)
         process = generate_workchain(entry_point_wc, inputs)
 
         return process
@@ -189,3 +190,57 @@ def test_outputs(aiida_profile, generate_workchain_stm, generate_wc_job_node,
 
     assert result == ExitCode(0)
     assert isinstance(process.outputs["stm_array"], orm.ArrayData)
+
+
+def test_chain_stm(aiida_profile, generate_workchain_stm, generate_psml_data,
+        generate_wc_job_node, fixture_localhost, fixture_code, generate_structure):
+    """Test `SiestaSTMWorkChain` running plstm in the same job of the siesta calculation producing the LDOS."""
+
+    process = generate_workchain_stm(chain_stm=orm.Bool(True))
+    process.checks()
+
+    assert process.ctx.chain_stm
+
+    psml = generate_psml_data('Si')
+    inputs = AttributeDict({
+        'structure': generate_structure(),
+        'code': fixture_code("siesta.siesta"),
+        'parameters': orm.Dict(dict={"sm":"sm"}),
+        'options': orm.Dict(dict={'resources': {'num_machines': 1  },'max_wallclock_seconds': 1800,'withmpi': False}),
+        'pseudos': {'Si': psml,'SiDiff': psml},
+        })
+    first_basewc = generate_wc_job_node("siesta.base", fixture_localhost, inputs)
+    first_basewc.set_process_state(ProcessState.FINISHED)
+    first_basewc.set_exit_status(ExitCode(0).status)
+    remote_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+    remote_folder.store()
+    remote_folder.add_incoming(first_basewc, link_type=LinkType.RETURN, link_label='remote_folder')
+    out_par = orm.Dict(dict={"E_Fermi":-1, "variable_geometry":False})
+    out_par.store()
+    out_par.add_incoming(first_basewc, link_type=LinkType.RETURN, link_label='output_parameters')
+    process.ctx.workchain_base = first_basewc
+
+    #The plstm run is requested to the siesta calculation producing the LDOS
+    result = process.run_siesta_with_ldos()
+    ldos_inputs = result['siesta_ldos'].inputs
+    assert ldos_inputs.postprocess.stm.mode.value == "constant-height"
+    assert ldos_inputs.postprocess.stm.spin_option.value == "q"
+
+    ldos_basewc = generate_wc_job_node("siesta.base", fixture_localhost)
+    ldos_basewc.set_process_state(ProcessState.FINISHED)
+    ldos_basewc.set_exit_status(ExitCode(0).status)
+    remote_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+    remote_folder.store()
+    remote_folder.add_incoming(ldos_basewc, link_type=LinkType.RETURN, link_label='remote_folder')
+    process.ctx.siesta_ldos = ldos_basewc
+
+    #No other job and, without STM output, failure
+    assert process.run_stm() is None
+    assert process.run_results() == SiestaSTMWorkChain.exit_codes.ERROR_STM_PLUGIN
+
+    stm_array = orm.ArrayData()
+    stm_array.store()
+    stm_array.add_incoming(ldos_basewc, link_type=LinkType.RETURN, link_label='stm_array')
+
+    assert process.run_results() == ExitCode(0)
+    assert process.outputs["stm_array"].uuid == stm_array.uuid